@@ -34,6 +34,23 @@
  * function), so the sender of the original command can match that up with their
  * own local clock; taking into account the round-trip time.
  *
+ * The recorded data can also be relayed back as a sequence of numbered chunks,
+ * each followed by a CRC-32, so that the client can check each one and ask for
+ * any that were corrupted or lost to be sent again.
+ *
+ * The recorded data can also be relayed back in a compact encoding, in which
+ * blocks that are the same as, or differ only slightly from, the block before
+ * are sent in fewer bytes.
+ *
+ * Alternatively, the sampling can stream: the recorded data is relayed back in
+ * frames while sampling continues, until the client sends any byte to stop it.
+ * The duration is then not limited by the memory of the Arduino.
+ *
+ * Or the Arduino can detect the flashes and beeps itself while sampling, using
+ * thresholds sent by the client, and send only the times at which each one
+ * started and ended. No sample data is kept, so the duration is not limited
+ * by the memory of the Arduino or by the speed of the USB connection.
+ *
  */
 
 #define N_INPUTS 4
@@ -93,6 +110,50 @@ int nMilliBlks;
 #define BLKSIZE_PER_PIN 2
 #define NINETY_KB (90 * 1024)
 
+/* the maximum number of bytes of sample data in one chunk of a chunked bulk transfer
+ */
+#define CHUNK_SIZE 512
+
+/* tokens of the compact encoding of sample data. The top two bits of the tag byte
+ * give the kind of token, and the bottom six bits give the number of blocks it covers,
+ * minus one. TOKEN_REPEAT blocks are the same as the block before. TOKEN_DELTA blocks
+ * are each sent as one byte per pin, holding the change (-8 to +7) in the "high" value
+ * in the top four bits and the change in the "low" value in the bottom four bits.
+ * TOKEN_RAW blocks are sent unchanged.
+ */
+#define TOKEN_REPEAT 0x00
+#define TOKEN_DELTA 0x40
+#define TOKEN_RAW 0x80
+#define MAX_RUN 64
+
+/* the number of blocks in one frame of streamed sample data. While streaming,
+ * one half of the sample buffer is filled while the frame in the other half is sent.
+ */
+#define STREAM_FRAME_BLKS 250
+
+/* while detecting, a heartbeat event is sent every HEARTBEAT_MILLIS millisecond periods
+ */
+#define HEARTBEAT_MILLIS 1000
+
+/* detection settings for each pin (indexed the same as enable[]), sent by the client
+ * using the 'D' command. A pin is detected on if detectEnable[i] is true.
+ */
+int detectEnable[4];
+int risingThreshold[4];
+int fallingThreshold[4];
+int minPulseDuration[4];
+int holdCount[4];
+
+/* state of the pulse detection for each active port while detecting (indexed the same
+ * as activePort[]). This is the same state machine as detectPulses() in detect.py.
+ * Times are counted in millisecond periods since detection started.
+ */
+int detectPin[4];
+int pulseIsHi[4];
+int ignoreFirstPulse[4];
+int hiTransitionPeriod[4];
+int latestHiPeriod[4];
+
 /* here's our sample buffer, consisting of a sequence of 2-byte blocks ...
  * One block will hold the high and low values found while continuously sampling
  * a pin over a one millisecond period.  One pin's block is stored in ascending char addresses
@@ -107,6 +168,21 @@ void doinit();
 unsigned int nextMillisBoundary();
 void capture();
 void doBulkTransfer();
+void doChunkedBulkTransfer();
+void sendChunk(int seq);
+void endChunkedBulkTransfer();
+void stream();
+void doCompressedBulkTransfer();
+int encodeBlocks(int send);
+int blockKind(int n);
+int previousValue(int n, int i);
+void sendFrameHeader(char kind, unsigned int seq, unsigned int frameStart, int nBlks);
+void configureDetection();
+void detect();
+void detectPulse(int i, int value, int period, unsigned int startTime);
+void sendEvent(char kind, int pin, unsigned int time1, unsigned int time2);
+unsigned int crc32Update(unsigned int crc, const unsigned char* data, int len);
+int readUShort();
 int setupActivePortsMapping();
 int samePeriod(unsigned int periodStart);
 void initLoHi();
@@ -143,6 +219,7 @@ void doinit() {
     nActivePorts = 0;
     for (int i=0; i<4; i++) {
         enable[i] = 0;
+        detectEnable[i] = 0;
     }
 }
 
@@ -155,6 +232,16 @@ int getCaptureTime() {
   return SerialUSB.read();
 }
 
+/**
+ * wait for the next two bytes of a command (most significant byte first)
+ * and return them as an unsigned value
+**/
+int readUShort() {
+  int hi = getCaptureTime();
+  int lo = getCaptureTime();
+  return (hi << 8) | lo;
+}
+
 void loop() {
   int idx;
   int rcvTime;
@@ -183,6 +270,27 @@ void loop() {
         case 'B':
            	doBulkTransfer();
            	break;
+        case 'C':
+            doChunkedBulkTransfer();
+            break;
+        case 'R':
+            sendChunk(readUShort());
+            break;
+        case 'E':
+            endChunkedBulkTransfer();
+            break;
+        case 'M':
+            stream();
+            break;
+        case 'Z':
+            doCompressedBulkTransfer();
+            break;
+        case 'D':
+            configureDetection();
+            break;
+        case 'V':
+            detect();
+            break;
         case 'T':
         	/* timing command .. handled at top of loop */
            	break;    
@@ -368,6 +476,432 @@ void doBulkTransfer() {
  }
 
 
+/**
+ * send samples back to client as a sequence of chunks, each one
+ * numbered and followed by a CRC-32 of the chunk. The client can ask for any chunk to be
+ * sent again (using the 'R' command) until it ends the transfer (using the 'E' command).
+**/
+void doChunkedBulkTransfer() {
+    int nbytes = nMilliBlks * nActivePorts * BLKSIZE_PER_PIN;
+    int nChunks = (nbytes + CHUNK_SIZE - 1) / CHUNK_SIZE;
+    writeUInt(nbytes);
+    writeUInt(CHUNK_SIZE);
+    for (int seq=0; seq < nChunks; seq++) {
+        sendChunk(seq);
+    }
+    SerialUSB.flush();
+}
+
+
+/**
+ * send one chunk of samples: the sequence number and length of the chunk (2 bytes each),
+ * the samples, then a CRC-32 (the same as zlib's crc32) of all of those bytes.
+ * @param seq sequence number of the chunk (0 is the first chunk)
+**/
+void sendChunk(int seq) {
+    int nbytes = nMilliBlks * nActivePorts * BLKSIZE_PER_PIN;
+    int offs = seq * CHUNK_SIZE;
+    int len = nbytes - offs;
+    if (len > CHUNK_SIZE) {
+        len = CHUNK_SIZE;
+    }
+    if (len < 0) {
+        len = 0;
+    }
+
+    unsigned char header[4];
+    header[0] = (seq >> 8) & 0xff;
+    header[1] = seq & 0xff;
+    header[2] = (len >> 8) & 0xff;
+    header[3] = len & 0xff;
+
+    unsigned int crc = crc32Update(0xffffffff, header, 4);
+    crc = crc32Update(crc, rawData + offs, len);
+
+    SerialUSB.write(header, 4);
+    SerialUSB.write(rawData + offs, len);
+    writeUInt(~crc);
+    SerialUSB.flush();
+}
+
+
+/**
+ * the client has received all chunks, so prepare for any further runs
+**/
+void endChunkedBulkTransfer() {
+    initLoHi();
+    doinit();
+}
+
+
+/**
+ * send samples back to client in the compact encoding: the number of bytes
+ * of encoded data, then the encoded data
+**/
+void doCompressedBulkTransfer() {
+    writeUInt(encodeBlocks(0));
+    encodeBlocks(1);
+    SerialUSB.flush();
+
+    /* prepare for any further runs */
+    initLoHi();
+    doinit();
+}
+
+
+/**
+ * encode the samples as a sequence of tokens (see TOKEN_REPEAT, TOKEN_DELTA and TOKEN_RAW)
+ * each covering a run of up to MAX_RUN blocks that are encoded the same way.
+ * @param send if non-zero, then send the encoded data, else only count its bytes
+ * @return the number of bytes of encoded data
+**/
+int encodeBlocks(int send) {
+    int blkBytes = nActivePorts * BLKSIZE_PER_PIN;
+    int nbytes = 0;
+    int n = 0;
+    while (n < nMilliBlks) {
+        int kind = blockKind(n);
+        int count = 1;
+        while (n + count < nMilliBlks && count < MAX_RUN && blockKind(n + count) == kind) {
+            count++;
+        }
+
+        nbytes++;
+        if (send) {
+            SerialUSB.write((unsigned char)(kind | (count - 1)));
+        }
+        if (kind == TOKEN_RAW) {
+            nbytes += count * blkBytes;
+            if (send) {
+                SerialUSB.write(rawData + n * blkBytes, count * blkBytes);
+            }
+        } else if (kind == TOKEN_DELTA) {
+            nbytes += count * nActivePorts;
+            if (send) {
+                for (int b = n; b < n + count; b++) {
+                    for (int i = 0; i < blkBytes; i += 2) {
+                        int hiDelta = rawData[b * blkBytes + i] - previousValue(b, i);
+                        int loDelta = rawData[b * blkBytes + i + 1] - previousValue(b, i + 1);
+                        SerialUSB.write((unsigned char)(((hiDelta & 0x0f) << 4) | (loDelta & 0x0f)));
+                    }
+                }
+            }
+        }
+        n += count;
+    }
+    return nbytes;
+}
+
+
+/**
+ * @param n which block
+ * @return the kind of token block n is encoded in
+**/
+int blockKind(int n) {
+    int blkBytes = nActivePorts * BLKSIZE_PER_PIN;
+    int kind = TOKEN_REPEAT;
+    for (int i = 0; i < blkBytes; i++) {
+        int delta = rawData[n * blkBytes + i] - previousValue(n, i);
+        if (delta < -8 || delta > 7) {
+            return TOKEN_RAW;
+        }
+        if (delta != 0) {
+            kind = TOKEN_DELTA;
+        }
+    }
+    return kind;
+}
+
+
+/**
+ * @param n which block
+ * @param i which byte within the block
+ * @return the same byte in the block before block n (zero for the first block)
+**/
+int previousValue(int n, int i) {
+    if (n == 0) {
+        return 0;
+    }
+    return rawData[(n - 1) * nActivePorts * BLKSIZE_PER_PIN + i];
+}
+
+
+/**
+ * Sample the ports chosen by client (as capture() does), but without a time limit,
+ * sending the samples back in frames of STREAM_FRAME_BLKS blocks as sampling continues.
+ * Each frame is a header (see sendFrameHeader()) followed by its blocks. The blocks of
+ * a frame are sent a few at a time, at the start of each millisecond period while the
+ * next frame is being sampled, so that sending does not delay the sampling.
+ * Sampling stops at the end of the millisecond period in which any byte is received.
+ * The remaining blocks are sent as a final, shorter, frame, followed by an 'E' frame
+ * carrying the time at which sampling ended.
+**/
+void stream() {
+    nActivePorts = setupActivePortsMapping();
+    if (nActivePorts == 0 || nActivePorts > N_INPUTS) {
+        flashLed(5, 300);
+        reportFailure();
+        return;
+    }
+    writeInt(nActivePorts);
+    writeInt(STREAM_FRAME_BLKS);
+    SerialUSB.flush();
+
+    int blkBytes = nActivePorts * BLKSIZE_PER_PIN;
+    int frameBytes = STREAM_FRAME_BLKS * blkBytes;
+    /* send two blocks of the previous frame per millisecond, so it has all been sent halfway through the next frame */
+    int sliceBytes = 2 * blkBytes;
+
+    nMilliBlks = 2 * STREAM_FRAME_BLKS;
+    initLoHi();
+
+    unsigned int seq = 0;
+    unsigned int startOfCurrentPeriod = micros();
+    unsigned int startOfNextPeriod = startOfCurrentPeriod + 1000;
+    unsigned int frameStart = startOfCurrentPeriod;
+    int half = 0;
+    int period = 0;
+    unsigned char* pending = 0;
+    int pendingBytes = 0;
+    int stopping = 0;
+
+    while (1) {
+        /* send a little of the previous frame */
+        if (pendingBytes > 0) {
+            int n = pendingBytes < sliceBytes ? pendingBytes : sliceBytes;
+            SerialUSB.write(pending, n);
+            pending += n;
+            pendingBytes -= n;
+        }
+
+        /* any byte received means stop (after this period) */
+        if (SerialUSB.available()) {
+            SerialUSB.read();
+            stopping = 1;
+        }
+
+        unsigned int now = micros();
+        while (((startOfNextPeriod - now) & UINT_32_MAX) < UINT_32_NEG) {
+           findHiLo(half * STREAM_FRAME_BLKS + period);
+           now = micros();
+        }
+        startOfCurrentPeriod = startOfNextPeriod;
+        startOfNextPeriod = startOfCurrentPeriod + 1000;
+        period++;
+
+        if (stopping) {
+            break;
+        }
+
+        if (period == STREAM_FRAME_BLKS) {
+            /* the frame in this half is complete, so start sending it, and sample into the other half */
+            if (pendingBytes > 0) {
+                SerialUSB.write(pending, pendingBytes);
+            }
+            sendFrameHeader('D', seq++, frameStart, STREAM_FRAME_BLKS);
+            pending = rawData + half * frameBytes;
+            pendingBytes = frameBytes;
+
+            half = 1 - half;
+            period = 0;
+            frameStart = startOfCurrentPeriod;
+            for (int n=0; n<STREAM_FRAME_BLKS; n++) {
+                initHiLoDetection(half * STREAM_FRAME_BLKS + n);
+            }
+        }
+    }
+
+    unsigned int endTime = startOfCurrentPeriod;
+    if (pendingBytes > 0) {
+        SerialUSB.write(pending, pendingBytes);
+    }
+    sendFrameHeader('D', seq++, frameStart, period);
+    SerialUSB.write(rawData + half * frameBytes, period * blkBytes);
+    sendFrameHeader('E', seq, endTime, 0);
+    SerialUSB.flush();
+
+    /* prepare for any further runs */
+    initLoHi();
+    doinit();
+}
+
+
+/**
+ * send the header of a frame of streamed sample data
+ * @param kind 'D' for a frame of blocks, or 'E' for the end
+ * @param seq sequence number of the frame (0 is the first frame)
+ * @param frameStart time (from micros()) at which the first block in the frame began, or when sampling ended
+ * @param nBlks number of blocks in the frame
+**/
+void sendFrameHeader(char kind, unsigned int seq, unsigned int frameStart, int nBlks) {
+    SerialUSB.write(kind);
+    writeUInt(seq);
+    writeUInt(frameStart);
+    writeUInt(nBlks);
+}
+
+
+/**
+ * read the detection settings for one pin, that follow the 'D' command:
+ * the pin (0 to 3, as for the '0' to '3' commands), the rising and falling thresholds
+ * (one byte each), then the minimum pulse duration and hold count (two bytes each)
+**/
+void configureDetection() {
+    int pin = getCaptureTime();
+    int rising = getCaptureTime();
+    int falling = getCaptureTime();
+    int minPulse = readUShort();
+    int hold = readUShort();
+    if (pin < 0 || pin >= N_INPUTS) {
+        return;
+    }
+    detectEnable[pin] = 1;
+    risingThreshold[pin] = rising;
+    fallingThreshold[pin] = falling;
+    minPulseDuration[pin] = minPulse;
+    holdCount[pin] = hold;
+}
+
+
+/**
+ * Sample the pins configured by the 'D' command, without a time limit, and detect
+ * flashes and beeps as each millisecond period ends (see detectPulse()).
+ * Replies with the number of pins being detected on (zero if none were configured).
+ * Each flash or beep is sent as a 'P' event once it has ended. An 'H' event is sent
+ * every HEARTBEAT_MILLIS periods (starting with the first). Sampling stops at the end of
+ * the millisecond period in which any byte is received, then an 'E' event is sent.
+**/
+void detect() {
+    nActivePorts = 0;
+    for (int i=0; i<4; i++) {
+        if (detectEnable[i]) {
+            activePort[nActivePorts] = pinMap[i];
+            detectPin[nActivePorts] = i;
+            pulseIsHi[nActivePorts] = 1;
+            ignoreFirstPulse[nActivePorts] = 1;
+            hiTransitionPeriod[nActivePorts] = -1;
+            latestHiPeriod[nActivePorts] = -1;
+            nActivePorts++;
+        }
+    }
+    if (nActivePorts == 0) {
+        flashLed(5, 300);
+        doinit();
+        writeInt(0);
+        SerialUSB.flush();
+        return;
+    }
+    writeInt(nActivePorts);
+    SerialUSB.flush();
+
+    /* only one block is needed, and it is reused for every period */
+    unsigned int startTime = micros();
+    unsigned int startOfCurrentPeriod = startTime;
+    unsigned int startOfNextPeriod = startOfCurrentPeriod + 1000;
+    int period = 0;
+    int stopping = 0;
+
+    while (1) {
+        if (period % HEARTBEAT_MILLIS == 0) {
+            sendEvent('H', 0, startTime, startOfCurrentPeriod);
+        }
+
+        /* any byte received means stop (after this period) */
+        if (SerialUSB.available()) {
+            SerialUSB.read();
+            stopping = 1;
+        }
+
+        initHiLoDetection(0);
+        unsigned int now = micros();
+        while (((startOfNextPeriod - now) & UINT_32_MAX) < UINT_32_NEG) {
+           findHiLo(0);
+           now = micros();
+        }
+
+        for (int i = 0; i < nActivePorts; i++) {
+            int hi = rawData[i * BLKSIZE_PER_PIN];
+            int lo = rawData[i * BLKSIZE_PER_PIN + 1];
+            /* for light sensors the high value is used, and for audio inputs the size of the envelope */
+            int isAudio = (detectPin[i] == 1 || detectPin[i] == 3);
+            detectPulse(i, isAudio ? hi - lo : hi, period, startTime);
+        }
+
+        startOfCurrentPeriod = startOfNextPeriod;
+        startOfNextPeriod = startOfCurrentPeriod + 1000;
+        period++;
+
+        if (stopping) {
+            break;
+        }
+    }
+
+    sendEvent('E', 0, startTime, startOfCurrentPeriod);
+    SerialUSB.flush();
+
+    /* prepare for any further runs */
+    doinit();
+}
+
+
+/**
+ * update the pulse detection state machine for one active port with the value from
+ * the millisecond period that has just ended, and send a 'P' event if a pulse has ended.
+ * @param i which active port
+ * @param value the value for the period
+ * @param period which millisecond period (0 is the first)
+ * @param startTime time (from micros()) at which detection started
+**/
+void detectPulse(int i, int value, int period, unsigned int startTime) {
+    int pin = detectPin[i];
+    if (!pulseIsHi[i]) {
+        if (value >= risingThreshold[pin]) {
+            pulseIsHi[i] = 1;
+            hiTransitionPeriod[i] = period;
+            latestHiPeriod[i] = period;
+        }
+    } else if (value > fallingThreshold[pin]) {
+        latestHiPeriod[i] = period;
+    } else if (period - latestHiPeriod[i] > holdCount[pin]) {
+        pulseIsHi[i] = 0;
+        if (!ignoreFirstPulse[i] && latestHiPeriod[i] + 1 - hiTransitionPeriod[i] >= minPulseDuration[pin]) {
+            sendEvent('P', pin, startTime + hiTransitionPeriod[i] * 1000, startTime + (latestHiPeriod[i] + 1) * 1000);
+        }
+        ignoreFirstPulse[i] = 0;
+    }
+}
+
+
+/**
+ * send an event while detecting
+ * @param kind 'P' for a pulse, 'H' for a heartbeat, or 'E' for the end
+ * @param pin which pin the pulse was on (0 to 3), or 0
+ * @param time1 time (from micros()) at which the pulse began, or at which detection started
+ * @param time2 time (from micros()) at which the pulse ended, the current period began, or detection ended
+**/
+void sendEvent(char kind, int pin, unsigned int time1, unsigned int time2) {
+    SerialUSB.write(kind);
+    SerialUSB.write((unsigned char)pin);
+    writeUInt(time1);
+    writeUInt(time2);
+}
+
+
+/**
+ * update a CRC-32 (reflected, polynomial 0xEDB88320) with some more bytes.
+ * Start with 0xffffffff, and invert the result once all bytes have been included.
+**/
+unsigned int crc32Update(unsigned int crc, const unsigned char* data, int len) {
+    for (int i=0; i < len; i++) {
+        crc ^= data[i];
+        for (int bit=0; bit < 8; bit++) {
+            crc = (crc >> 1) ^ (0xEDB88320 & (-(crc & 1)));
+        }
+    }
+    return crc;
+}
+
+
 /* ---------------------------------------------------------------------
    Serial data writing
    ---------------------------------------------------------------------
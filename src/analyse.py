@@ -52,9 +52,40 @@ indicates that the pattern of observed beep/flash timings did not match that
 particular subset of the expected beep/flash timings.
 
 If the pattern for the time differences is sloping, this indicates wall clock drift.
+:func:`fitDrift` fits a straight line to the time differences to measure this drift,
+and :func:`varianceAtEachIndex` can optionally rank each start index by the variance
+that remains once any slope has been removed.
+
+Flashes and beeps in the test sequence happen at the same times, so :func:`correlateJoint`
+can instead merge the observations from all channels and correlate them just once.
+
+Computing the variance separately for every start index is O(N*M). :func:`correlateFast`
+instead calculates the variance at every start index at once from running sums of the
+expected times (and their squares) plus a single cross-correlation of expected against
+observed. It only builds the list of time differences for the best match.
+:func:`doComparison` uses this faster approach.
+
+:class:`IncrementalCorrelator` keeps the running sums of time differences for every start
+index as observations arrive one at a time, so the best match (and how certain it is)
+is always available, without waiting for the capture to finish.
+
+The test sequence encodes a maximal-length sequence of bits as one pulse (a 0 bit) or
+two pulses (a 1 bit) each second, so any window of consecutive bits of the pattern
+window length is unique. A :class:`MlsWindowIndex` maps each window of bits to where it
+occurs in the expected times. The observed timings can then be decoded back into bits
+and located directly (:func:`correlateWithIndex`), with the brute force search only
+used as a fallback.
+
+All of the above assume observed event i corresponds to expected event index+i, so a
+single missed or spurious detection spoils the match for every later event.
+:func:`alignRobust` instead estimates a single time offset (by letting short runs of
+consecutive observations vote for one) and then pairs each observed event with the
+nearest expected event, reporting any events that could not be paired.
 
 """
 
+import numpy
+
 
 
 def variance(dataset):
@@ -158,8 +189,609 @@ def correlate(expected, observed):
 
 
 
+# above this many multiply-accumulate operations the cross-correlation is done via FFT
+FFT_CROSS_CORRELATION_THRESHOLD = 2000000
+
+
+def crossCorrelate(expected, observed):
+    """\
+    Calculate, for every start index j into expected, the sum of expected[j+i] * observed[i]
+    over all i in observed.
+
+    :param expected: numpy array of N values
+    :param observed: numpy array of M values, where M <= N
+    :returns: numpy array of N-M+1 sums
+    """
+    N = len(expected)
+    M = len(observed)
+    if N * M <= FFT_CROSS_CORRELATION_THRESHOLD:
+        return numpy.correlate(expected, observed, mode="valid")
+
+    size = 1
+    while size < N + M:
+        size *= 2
+    spectrum = numpy.fft.rfft(expected, size) * numpy.fft.rfft(observed[::-1], size)
+    return numpy.fft.irfft(spectrum, size)[M-1:N]
+
+
+def varianceAtEachIndex(expected, observed, detrend=False):
+    """\
+    Calculate the variance in time differences between the observed times and the expected
+    times, for every possible start index into the expected times.
+
+    Gives the same result as calling :func:`varianceInTimesWithObservedComparedAgainstExpectedAtIndex`
+    for every start index, but works from running sums of expected and expected squared values, so
+    only the cross-correlation term depends on both the expected and observed times.
+
+    :param expected: list of expected times in units of sync time line clock
+    :param observed: list of tuples of (detected centre flash/pulse time, err bounds), in units of sync time line clock
+    :param detrend: if True, then calculate the variance of the residuals after a least squares straight line
+        fit of time difference against expected time (see :func:`fitDrift`) instead. A slope caused by clock drift
+        then does not count against the match.
+
+    :returns: numpy array of len(expected) - len(observed) + 1 variances, where entry j is the
+        variance when observed[0] is compared against expected[j]
+    """
+    e = numpy.asarray(expected, dtype=numpy.float64)
+    o = numpy.asarray([t for (t, err) in observed], dtype=numpy.float64)
+    M = len(o)
+
+    # Remove the same per-index trend (and then the mean) from both expected and observed.
+    # For any start index this only shifts every difference by a constant, so the variance
+    # is unchanged, but it keeps the running sums small enough to not lose precision.
+    gradient = 0.0
+    if len(e) > 1:
+        gradient = (e[-1] - e[0]) / (len(e) - 1)
+        trend = gradient * numpy.arange(len(e))
+        e = e - trend
+        o = o - trend[:M]
+    e = e - e.mean()
+    o = o - o.mean()
+
+    runningSum = numpy.concatenate(([0.0], numpy.cumsum(e)))
+    runningSumSquares = numpy.concatenate(([0.0], numpy.cumsum(e * e)))
+    sumE  = runningSum[M:] - runningSum[:-M]
+    sumE2 = runningSumSquares[M:] - runningSumSquares[:-M]
+    sumEO = crossCorrelate(e, o)
+
+    # sum of diffs and sum of squared diffs for each start index, where diff = e - o
+    sumDiffs = sumE - o.sum()
+    sumDiffsSquared = sumE2 - 2.0 * sumEO + numpy.dot(o, o)
+
+    meanDiff = sumDiffs / M
+    variances = numpy.maximum(sumDiffsSquared / M - meanDiff * meanDiff, 0.0)
+    if not detrend:
+        return variances
+
+    # Within the window starting at index j, the expected time for observation i is
+    # (give or take a constant) e[j+i] + gradient*i, so the sums needed for the straight
+    # line fit also come from running sums, this time of e[k]*k
+    i = numpy.arange(M, dtype=numpy.float64)
+    start = numpy.arange(len(sumE), dtype=numpy.float64)
+    runningSumIndexed = numpy.concatenate(([0.0], numpy.cumsum(e * numpy.arange(len(e)))))
+    sumEI = runningSumIndexed[M:] - runningSumIndexed[:-M] - start * sumE
+    sumX  = sumE + gradient * i.sum()
+    sumXX = sumE2 + 2.0 * gradient * sumEI + gradient * gradient * numpy.dot(i, i)
+    sumXD = sumE2 - sumEO + gradient * (sumEI - numpy.dot(o, i))
+
+    meanX = sumX / M
+    varX = sumXX / M - meanX * meanX
+    covXD = sumXD / M - meanX * meanDiff
+    slopeVariance = numpy.where(varX > 0, covXD * covXD / numpy.where(varX > 0, varX, 1.0), 0.0)
+    return numpy.maximum(variances - slopeVariance, 0.0)
+
+
+def correlateFast(expected, observed, detrend=False):
+    """\
+    Perform the same correlation as :func:`correlate`, but calculate the variances
+    for all start indices together (see :func:`varianceAtEachIndex`) and only build
+    the list of time differences for the best match.
+
+    :param expected: list of expected times in units of sync time line clock
+    :param observed: list of tuples of (detected centre flash/pulse time, err bounds), in units of sync time line clock
+    :param detrend: if True, rank each start index by the variance remaining after removing any slope (see :func:`varianceAtEachIndex`)
+
+    :returns (index, timeDifferences): A tuple containing the index in the expected
+        timings corresponding to the first observation, and a list of (diff, err) tuples
+        for each individual observed and expected flash/beep for that match.
+
+        If there are more detected flashes/beeps than expected (or none at all) then
+        we return a tuple (-1, None)
+    """
+    if len(observed) == 0 or len(observed) > len(expected):
+        return (-1, None)
+
+    variances = varianceAtEachIndex(expected, observed, detrend)
+    index = int(numpy.argmin(variances))
+    variance, diffsAndErrors = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(index, expected, observed)
+    return (index, diffsAndErrors)
+
+
+
+
+class IncrementalCorrelator(object):
+    """\
+    Performs the same correlation as :func:`correlateFast`, but with observed timings supplied
+    one at a time (or a few at a time) as they are detected.
+
+    The sum of time differences, and sum of squared time differences, is kept for every
+    possible start index into the expected times. Adding an observation updates all of them in
+    a single vectorised step, so the current best match is available at any time.
+
+    Every possible start index gets a new time difference from each observation, so the work
+    per observation is O(N) for N expected times (as is finding the best match), not O(1).
+    It is a single numpy operation rather than repeating the whole correlation.
+
+    To keep precision, each start index accumulates its time differences relative to
+    the time difference for the first observation at that start index.
+    """
+
+    def __init__(self, expected):
+        """\
+        :param expected: list of expected times in units of sync time line clock
+        """
+        self.expected = expected
+        self._e = numpy.asarray(expected, dtype=numpy.float64)
+        self.observed = []
+        self._sumDeviations = numpy.zeros(len(expected))
+        self._sumDeviationsSquared = numpy.zeros(len(expected))
+
+    def addObservation(self, observation):
+        """\
+        :param observation: tuple of (detected centre flash/pulse time, err bounds), in units of sync time line clock.
+            Observations must be added in the order they were observed.
+        """
+        k = len(self.observed)
+        self.observed.append(observation)
+        N = len(self._e)
+        if k >= N:
+            return
+
+        t = float(observation[0])
+        if k == 0:
+            self._firstObserved = t
+        # time difference at start index j is e[j+k] - t. Relative to that of the first observation (e[j] - t0) it is:
+        deviations = (self._e[k:] - self._e[:N-k]) - (t - self._firstObserved)
+        self._sumDeviations[:N-k] += deviations
+        self._sumDeviationsSquared[:N-k] += deviations * deviations
+
+    def addObservations(self, observed):
+        """\
+        :param observed: list of tuples of (detected centre flash/pulse time, err bounds), in units of sync time line clock.
+        """
+        for observation in observed:
+            self.addObservation(observation)
+
+    def variances(self):
+        """\
+        :returns: numpy array of the variance in time differences at every possible start index into the expected times
+            for the observations added so far (see :func:`varianceAtEachIndex`). Empty if there are no
+            observations, or more observations than expected times.
+        """
+        M = len(self.observed)
+        if M == 0 or M > len(self._e):
+            return numpy.zeros(0)
+        n = len(self._e) - M + 1
+        meanDeviation = self._sumDeviations[:n] / M
+        return numpy.maximum(self._sumDeviationsSquared[:n] / M - meanDeviation * meanDeviation, 0.0)
+
+    def bestMatch(self):
+        """\
+        :returns (index, timeDifferences): the same as :func:`correlateFast` would for the observations added so far.
+        """
+        variances = self.variances()
+        if len(variances) == 0:
+            return (-1, None)
+        index = int(numpy.argmin(variances))
+        variance, diffsAndErrors = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(index, self.expected, self.observed)
+        return (index, diffsAndErrors)
+
+    def confidence(self):
+        """\
+        :returns: a value between 0 and 1 measuring how much better the best match is than the next best:
+            1 minus the ratio of the lowest variance to the second lowest. It is 1 if there is only one possible
+            start index and 0 if there are no observations or the best match is not better than the next best.
+        """
+        variances = self.variances()
+        if len(variances) == 0:
+            return 0.0
+        if len(variances) == 1:
+            return 1.0
+        best, secondBest = numpy.partition(variances, 1)[:2]
+        if secondBest <= 0:
+            return 0.0
+        return float(1.0 - best / secondBest)
+
+    def offset(self):
+        """\
+        :returns: the mean time difference (expected - observed) for the best match, in units of sync time line clock,
+            or None if there is no match.
+        """
+        variances = self.variances()
+        if len(variances) == 0:
+            return None
+        index = int(numpy.argmin(variances))
+        M = len(self.observed)
+        return float(self._e[index] - self._firstObserved + self._sumDeviations[index] / M)
+
+
+
+
+class MlsWindowIndex(object):
+
+    def __init__(self, eventCentreTimes, windowLength=None, bitInterval=1.0):
+        """\
+        Index that maps each window of consecutive bits in the test sequence to the index
+        of the first expected event for that window.
+
+        The bits are decoded from the expected event times. Every bit occupies one bit interval
+        and is represented by the pattern of events during that interval. Test sequences from the
+        generator use one event for a 0 bit and two for a 1 bit, but any encoding where the gaps
+        between events within a bit are shorter than the gaps between bits will work.
+
+        :param eventCentreTimes: list of expected times (in seconds), e.g. "eventCentreTimes" from the metadata
+        :param windowLength: number of bits in a window (e.g. "patternWindowLength" from the metadata),
+            or None to use the shortest window length for which every window is unique.
+        :param bitInterval: the duration of each bit (in seconds)
+
+        :raises ValueError: if the expected times cannot be decoded into bits, or windows of the
+            specified length are not unique.
+        """
+        super(MlsWindowIndex, self).__init__()
+
+        groups = []
+        self.firstEventIndexOfBit = []
+        interBitGaps = []
+        for i in range(0, len(eventCentreTimes)):
+            t = eventCentreTimes[i]
+            bitNum = int(t // bitInterval)
+            if i > 0 and bitNum == int(eventCentreTimes[i-1] // bitInterval):
+                groups[-1].append(t)
+            else:
+                if bitNum != len(groups):
+                    raise ValueError("Bit interval with no events found.")
+                if i > 0:
+                    interBitGaps.append(t - eventCentreTimes[i-1])
+                groups.append([t])
+                self.firstEventIndexOfBit.append(i)
+
+        # the events of the final bit might have been cut short by the end of the sequence, so it is not used
+        del groups[-1]
+        del self.firstEventIndexOfBit[-1]
+        gapPatterns = [ self._gaps(group) for group in groups ]
+        intraBitGaps = sum(gapPatterns, ())
+        if len(groups) == 0 or len(interBitGaps) == 0:
+            raise ValueError("Not enough events to determine how bits are encoded.")
+        if len(intraBitGaps) > 0 and max(intraBitGaps) >= min(interBitGaps):
+            raise ValueError("Cannot distinguish events within a bit from events in different bits.")
+
+        # gaps shorter than this (in seconds) are between two events within the same bit
+        if len(intraBitGaps) > 0:
+            self.intraBitGapThreshold = (max(intraBitGaps) + min(interBitGaps)) / 2.0
+        else:
+            self.intraBitGapThreshold = min(interBitGaps) / 2.0
+        self.minEventGap = min(intraBitGaps + tuple(interBitGaps))
+
+        # each different pattern of gaps is a different symbol (different bit value)
+        self.symbolGaps = sorted(set( tuple(round(g, 3) for g in gaps) for gaps in gapPatterns ))
+        bits = [ self._classify(gaps) for gaps in gapPatterns ]
+
+        if windowLength is None:
+            for windowLength in range(1, len(bits)+1):
+                if len(set(self._windows(bits, windowLength))) == len(bits) - windowLength + 1:
+                    break
+
+        self.windowLength = windowLength
+        self.index = {}
+        n = 0
+        for window in self._windows(bits, windowLength):
+            if window in self.index:
+                raise ValueError("Windows of "+str(windowLength)+" bits do not uniquely identify a position in the sequence.")
+            self.index[window] = n
+            n += 1
+
+
+    @classmethod
+    def fromMetadata(cls, metadata):
+        """\
+        :param metadata: dict of metadata read from the JSON metadata file generated with the test sequence
+        :returns: :class:`MlsWindowIndex` for the "eventCentreTimes" using the "patternWindowLength" of the metadata
+        """
+        return cls(metadata["eventCentreTimes"], metadata.get("patternWindowLength", None))
+
+
+    @staticmethod
+    def _gaps(times):
+        return tuple(times[i] - times[i-1] for i in range(1, len(times)))
+
+
+    @staticmethod
+    def _windows(bits, windowLength):
+        for n in range(0, len(bits) - windowLength + 1):
+            yield tuple(bits[n:n+windowLength])
+
+
+    def _classify(self, gaps):
+        """\
+        :param gaps: tuple of gaps (in seconds) between the events within one bit
+        :returns: the bit value (index into self.symbolGaps) with the closest matching gaps, or None if there is no pattern with this number of events
+        """
+        bestBit = None
+        bestError = None
+        for bit in range(0, len(self.symbolGaps)):
+            symbol = self.symbolGaps[bit]
+            if len(symbol) == len(gaps):
+                error = max([0] + [ abs(a-b) for (a,b) in zip(symbol, gaps) ])
+                if bestError is None or error < bestError:
+                    bestBit, bestError = bit, error
+        return bestBit
+
+
+    def decodeBits(self, observedTimes, tickRate):
+        """\
+        Decode observed event times back into the bits they encode.
+
+        Decoding begins at the first event that definitely starts a bit (the gap before it is
+        too long for it to be within the same bit as the previous event). The final bit is not
+        decoded, because some of its events could have occurred after capture finished.
+
+        :param observedTimes: list of observed times in units of sync time line clock
+        :param tickRate: the number of ticks per second for the sync time line
+        :returns: tuple (bits, startIndices) of the decoded bits (None where an unrecognised pattern
+            of events was seen) and the index into observedTimes of the first event of each bit
+        """
+        threshold = self.intraBitGapThreshold * tickRate
+        bitStarts = [ k for k in range(1, len(observedTimes)) if observedTimes[k] - observedTimes[k-1] >= threshold ]
+        bits = []
+        for n in range(0, len(bitStarts)-1):
+            times = observedTimes[bitStarts[n]:bitStarts[n+1]]
+            bits.append(self._classify( tuple(g / float(tickRate) for g in self._gaps(times)) ))
+        return bits, bitStarts[:len(bits)]
+
+
+    def locate(self, observedTimes, tickRate, maxCandidates=3):
+        """\
+        Find candidate indices into the expected times corresponding to the first observed event,
+        by decoding windows of bits from the observed times and looking them up in this index.
+
+        :param observedTimes: list of observed times in units of sync time line clock
+        :param tickRate: the number of ticks per second for the sync time line
+        :param maxCandidates: the maximum number of different candidates to find
+        :returns: list of candidate indices into the expected times (in the order they were found, without duplicates)
+        """
+        bits, startIndices = self.decodeBits(observedTimes, tickRate)
+        candidates = []
+        for n in range(0, len(bits) - self.windowLength + 1):
+            bitNum = self.index.get(tuple(bits[n:n+self.windowLength]), None)
+            if bitNum is not None:
+                candidate = self.firstEventIndexOfBit[bitNum] - startIndices[n]
+                if candidate not in candidates:
+                    candidates.append(candidate)
+                    if len(candidates) >= maxCandidates:
+                        break
+        return candidates
+
+
+
+def correlateWithIndex(expected, observed, windowIndex, tickRate, detrend=False):
+    """\
+    Perform the same correlation as :func:`correlateFast`, but first try to locate the
+    observed timings directly using a :class:`MlsWindowIndex`.
+
+    A candidate index found using the index is accepted if the standard deviation of the
+    time differences is less than a quarter of the shortest gap between expected events.
+    If no candidate is accepted, then :func:`correlateFast` is used instead.
+
+    If detrend is True, then the standard deviation is that of the residuals after removing
+    any slope (see :func:`fitDrift`), so that a candidate is not rejected because of clock drift.
+
+    :param expected: list of expected times in units of sync time line clock
+    :param observed: list of tuples of (detected centre flash/pulse time, err bounds), in units of sync time line clock
+    :param windowIndex: :class:`MlsWindowIndex` for the expected times
+    :param tickRate: the number of ticks per second for the sync time line
+    :param detrend: if True, judge candidates (and rank matches when searching) by the variance remaining after removing any slope
+
+    :returns (index, timeDifferences): as for :func:`correlateFast`
+    """
+    if len(observed) == 0 or len(observed) > len(expected):
+        return (-1, None)
+
+    maxStdDev = windowIndex.minEventGap * tickRate / 4.0
+    lastPossible = len(expected) - len(observed)
+
+    observedTimes = [t for (t, err) in observed]
+    for candidate in windowIndex.locate(observedTimes, tickRate):
+        if 0 <= candidate <= lastPossible:
+            v, diffsAndErrors = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(candidate, expected, observed)
+            if detrend:
+                stdDev = fitDrift(expected[candidate:candidate+len(observed)], diffsAndErrors)["residualStdDev"]
+            else:
+                stdDev = v**0.5
+            if stdDev < maxStdDev:
+                return (candidate, diffsAndErrors)
+
+    return correlateFast(expected, observed, detrend)
+
+
+
+def fitDrift(expectedTimes, diffsAndErrors, weighted=False):
+    """\
+    Fit a straight line (using least squares) to time differences plotted against the expected
+    times they were measured at. The gradient of the line is the rate at which the observed
+    timing drifts relative to the expected timing.
+
+    :param expectedTimes: list of the expected times corresponding to each time difference
+    :param diffsAndErrors: list of tuples (diff, err) of the time difference (expected - observed) and its error bound
+    :param weighted: if True, weight each time difference by the inverse square of its error bound
+
+    :returns: dict { "offset": time difference at the centre time,
+                     "driftPpm": change in time difference per unit of expected time, in parts per million,
+                     "residualStdDev": standard deviation of the time differences from the fitted line,
+                     "centreTime": the (weighted) mean expected time }
+
+    The offset, residual standard deviation and centre time are in the same units as the time differences.
+    A positive drift means that observations are becoming increasingly early compared to the expected times.
+
+    :raises ValueError: if weighted is True but an error bound is not greater than zero
+    """
+    x = numpy.asarray(expectedTimes, dtype=numpy.float64)
+    y = numpy.asarray([d for (d, err) in diffsAndErrors], dtype=numpy.float64)
+    if weighted:
+        errs = numpy.asarray([err for (d, err) in diffsAndErrors], dtype=numpy.float64)
+        if numpy.any(errs <= 0):
+            raise ValueError("Cannot weight by error bound because not all error bounds are greater than zero.")
+        w = 1.0 / (errs * errs)
+    else:
+        w = numpy.ones(len(x))
+
+    centreTime = numpy.average(x, weights=w)
+    offset = numpy.average(y, weights=w)
+    xc = x - centreTime
+    sxx = numpy.sum(w * xc * xc)
+    if sxx > 0:
+        gradient = numpy.sum(w * xc * (y - offset)) / sxx
+    else:
+        gradient = 0.0
+
+    residuals = y - offset - gradient * xc
+    residualStdDev = numpy.average(residuals * residuals, weights=w) ** 0.5
+
+    return { "offset": float(offset),
+             "driftPpm": float(gradient * 1000000.0),
+             "residualStdDev": float(residualStdDev),
+             "centreTime": float(centreTime) }
 
-def doComparison(test, startSyncTime, tickRate):
+
+
+def pairWithNearest(expected, observedTimes, offset, tolerance):
+    """\
+    Pair each observed time (shifted by an offset) with the nearest expected time.
+
+    Pairs further apart than the tolerance are rejected. If more than one observed time
+    is nearest to the same expected time, only the closest of them is paired.
+
+    :param expected: numpy array of expected times (ascending order)
+    :param observedTimes: numpy array of observed times
+    :param offset: amount added to each observed time before pairing
+    :param tolerance: the largest difference allowed between a paired expected and shifted observed time
+
+    :returns: numpy array containing, for each observed time, the index of the expected time it is paired with, or -1 if it is unpaired
+    """
+    shifted = observedTimes + offset
+    if len(expected) == 1:
+        nearest = numpy.zeros(len(shifted), dtype=int)
+    else:
+        after = numpy.clip(numpy.searchsorted(expected, shifted), 1, len(expected)-1)
+        before = after - 1
+        nearest = numpy.where(numpy.abs(expected[before] - shifted) <= numpy.abs(expected[after] - shifted), before, after)
+    distance = numpy.abs(expected[nearest] - shifted)
+    paired = numpy.where(distance <= tolerance, nearest, -1)
+
+    # resolve more than one observation paired with the same expected time
+    order = numpy.lexsort((distance, paired))
+    duplicate = numpy.zeros(len(order), dtype=bool)
+    duplicate[1:] = (paired[order][1:] == paired[order][:-1]) & (paired[order][1:] >= 0)
+    paired[order[duplicate]] = -1
+    return paired
+
+
+def alignRobust(expected, observed, tolerance=None, chunkLength=16, maxChunks=8, windowIndex=None, tickRate=None):
+    """\
+    Match observed timings against expected timings, tolerating missed and spurious detections.
+
+    Runs of consecutive observations (chunks) are each correlated against the expected timings
+    (as per :func:`correlateFast` or, if a window index is provided, :func:`correlateWithIndex`)
+    to produce candidate time offsets. A chunk containing a missed or spurious detection will
+    give a wrong candidate, so each candidate is scored by how many observations it pairs with
+    an expected timing (see :func:`pairWithNearest`) and the best one wins.
+
+    The offset is then refined to the mean difference of the paired observations and they
+    are paired again.
+
+    :param expected: list of expected times in units of sync time line clock
+    :param observed: list of tuples of (detected centre flash/pulse time, err bounds), in units of sync time line clock
+    :param tolerance: the largest difference between expected and observed times (after removing the offset)
+        for them to be paired. Default is a quarter of the smallest gap between consecutive expected times.
+    :param chunkLength: number of consecutive observations in each chunk
+    :param maxChunks: maximum number of chunks (spread evenly across the observations) to take candidate offsets from
+    :param windowIndex: (optional) :class:`MlsWindowIndex` to use to locate each chunk
+    :param tickRate: the number of ticks per second for the sync time line (required if windowIndex is provided)
+
+    :returns: tuple (index, diffsAndErrors, pairedExpectedIndices, unmatchedObserved, missedExpected)
+     * index is the index into the expected times paired with the first paired observation, or -1 if nothing could be paired
+     * diffsAndErrors is a list of (diff, err) for each paired observation
+     * pairedExpectedIndices is a list of the index into the expected times paired with each entry in diffsAndErrors
+     * unmatchedObserved is a list of indices into the observed times for observations that were not paired
+     * missedExpected is a list of indices into the expected times (between the first and last paired) that no observation was paired with
+    """
+    if len(observed) == 0 or len(expected) == 0:
+        return (-1, [], [], range(0, len(observed)), [])
+
+    e = numpy.asarray(expected, dtype=numpy.float64)
+    o = numpy.asarray([t for (t, err) in observed], dtype=numpy.float64)
+
+    if tolerance is None:
+        if len(e) > 1:
+            tolerance = numpy.min(numpy.diff(e)) / 4.0
+        else:
+            tolerance = numpy.inf
+
+    # gather candidate offsets, one from each chunk
+    chunkLength = min(chunkLength, len(observed), len(expected))
+    numChunks = len(observed) // chunkLength
+    chunkStarts = sorted(set( (c * numChunks // maxChunks) * chunkLength for c in range(0, maxChunks) ))
+    candidates = []
+    for start in chunkStarts:
+        chunk = observed[start:start+chunkLength]
+        if windowIndex is not None:
+            index, diffsAndErrors = correlateWithIndex(expected, chunk, windowIndex, tickRate)
+        else:
+            index, diffsAndErrors = correlateFast(expected, chunk)
+        if index >= 0:
+            candidates.append(sum(d for (d, err) in diffsAndErrors) / len(diffsAndErrors))
+
+    # score each candidate by how many observations it pairs up
+    best = None
+    for offset in candidates:
+        paired = pairWithNearest(e, o, offset, tolerance)
+        isPaired = paired >= 0
+        numPaired = numpy.count_nonzero(isPaired)
+        if numPaired > 0:
+            spread = numpy.var(e[paired[isPaired]] - o[isPaired])
+            if best is None or (-numPaired, spread) < (-best[0], best[1]):
+                best = (numPaired, spread, paired)
+
+    if best is None:
+        return (-1, [], [], range(0, len(observed)), [])
+
+    # refine the offset and pair again
+    paired = best[2]
+    isPaired = paired >= 0
+    offset = numpy.mean(e[paired[isPaired]] - o[isPaired])
+    paired = pairWithNearest(e, o, offset, tolerance)
+
+    diffsAndErrors = []
+    pairedExpectedIndices = []
+    unmatchedObserved = []
+    for i in range(0, len(observed)):
+        j = int(paired[i])
+        if j >= 0:
+            diffsAndErrors.append( (expected[j] - observed[i][0], observed[i][1]) )
+            pairedExpectedIndices.append(j)
+        else:
+            unmatchedObserved.append(i)
+
+    if len(pairedExpectedIndices) == 0:
+        return (-1, [], [], unmatchedObserved, [])
+
+    pairedSet = set(pairedExpectedIndices)
+    missedExpected = [ j for j in range(min(pairedSet), max(pairedSet)+1) if j not in pairedSet ]
+
+    return (pairedExpectedIndices[0], diffsAndErrors, pairedExpectedIndices, unmatchedObserved, missedExpected)
+
+
+
+def doComparison(test, startSyncTime, tickRate, windowIndex=None, detrend=False, withDrift=False, weighted=False):
  
     """\
     Each activated pin results in a test set: the observed and expected times.
@@ -169,25 +801,286 @@ def doComparison(test, startSyncTime, tickRate):
         ( list of tuples of (observed times (sync time line units), error bounds), list of expected timings (seconds) )
     :param startSyncTime: the start value used for the sync time line offered to the client device
     :param tickRate: the number of ticks per second for the sync time line offered to the client device
+    :param windowIndex: (optional) :class:`MlsWindowIndex` for the expected timings, used to locate the observed timings without searching
+    :param detrend: if True, then rank matches by the variance remaining after removing any slope (due to drift)
+    :param withDrift: if True, then also fit a line to the time differences to measure drift (see :func:`fitDrift`)
+    :param weighted: if True, then weight the fit for drift by the error bounds
 
     :returns tuple summary of results of analysis.
                 (index into expected times for video at which strongest correlation (lowest variance) is found, 
                 list of expected times for video, 
                 list of (diff, err) for the best match, corresponding to the individual time differences and each one's error bound) 
             
+        If withDrift is True, then the tuple has a fourth item: the dict returned by :func:`fitDrift`
+        (in units of sync time line ticks).
     """
     observed, expectedTimesSecs = test
     
     # convert to be on the sync timeline
     expected = [ startSyncTime + tickRate * t for t in expectedTimesSecs ]
     
-    matchIndex, allTimeDifferencesAndErrors = correlate(expected, observed)
-    timeDifferencesAndErrorsForMatch = allTimeDifferencesAndErrors[matchIndex]
+    if windowIndex is None:
+        matchIndex, timeDifferencesAndErrorsForMatch = correlateFast(expected, observed, detrend)
+    else:
+        matchIndex, timeDifferencesAndErrorsForMatch = correlateWithIndex(expected, observed, windowIndex, tickRate, detrend)
     
+    if withDrift:
+        pairedExpected = expected[matchIndex:matchIndex+len(timeDifferencesAndErrorsForMatch)]
+        drift = fitDrift(pairedExpected, timeDifferencesAndErrorsForMatch, weighted)
+        return (matchIndex, expected, timeDifferencesAndErrorsForMatch, drift)
+
     return (matchIndex, expected, timeDifferencesAndErrorsForMatch)
 
 
 
+def doRobustComparison(test, startSyncTime, tickRate, windowIndex=None, withDrift=False, weighted=False):
+    """\
+    Same as :func:`doComparison` but uses :func:`alignRobust` so that missed and spurious
+    detections do not spoil the comparison.
+
+    :param test: tuple ( list of tuples of (observed times (sync time line units), error bounds), list of expected timings (seconds) )
+    :param startSyncTime: the start value used for the sync time line offered to the client device
+    :param tickRate: the number of ticks per second for the sync time line offered to the client device
+    :param windowIndex: (optional) :class:`MlsWindowIndex` for the expected timings
+    :param withDrift: if True, then also fit a line to the time differences to measure drift (see :func:`fitDrift`)
+    :param weighted: if True, then weight the fit for drift by the error bounds
+
+    :returns tuple summary of results of analysis.
+                (index into expected times for video of the first paired observation,
+                list of expected times for video,
+                list of (diff, err) for each paired observation,
+                list of indices of observations that were not paired with an expected time,
+                list of indices of expected times that were missed,
+                list of the index into the expected times paired with each entry in the list of (diff, err),
+                list of the index of the observation paired with each entry in the list of (diff, err))
+
+        If withDrift is True, then the tuple has an eighth item: the dict returned by :func:`fitDrift`
+        (in units of sync time line ticks), or None if nothing was paired.
+    """
+    observed, expectedTimesSecs = test
+
+    # convert to be on the sync timeline
+    expected = [ startSyncTime + tickRate * t for t in expectedTimesSecs ]
+
+    matchIndex, diffsAndErrors, pairedExpectedIndices, unmatchedObserved, missedExpected = \
+        alignRobust(expected, observed, windowIndex=windowIndex, tickRate=tickRate)
+
+    unmatchedSet = set(unmatchedObserved)
+    pairedObservedIndices = [ i for i in range(0, len(observed)) if i not in unmatchedSet ]
+
+    if withDrift:
+        drift = None
+        if len(diffsAndErrors) > 0:
+            drift = fitDrift([ expected[j] for j in pairedExpectedIndices ], diffsAndErrors, weighted)
+        return (matchIndex, expected, diffsAndErrors, unmatchedObserved, missedExpected, pairedExpectedIndices, pairedObservedIndices, drift)
+
+    return (matchIndex, expected, diffsAndErrors, unmatchedObserved, missedExpected, pairedExpectedIndices, pairedObservedIndices)
+
+
+
+
+
+def _estimateSkew(referenceTimes, times, maxGap, maxSkew, numBins=3):
+    """\
+    Estimate how much later times are than referenceTimes (up to maxSkew), for :func:`mergeChannels`.
+
+    The differences between each time and the reference times within maxSkew of it are put in
+    bins maxGap wide. Only the numBins busiest pairs of neighbouring bins are then tried
+    with :func:`pairWithNearest`, so the cost grows with the number of differences, not their square.
+
+    :param referenceTimes: numpy array of reference times (ascending order)
+    :param times: numpy array of times
+    :param maxGap: the furthest apart two times can be to be paired, once the skew is removed
+    :param maxSkew: the largest skew to look for
+    :param numBins: the number of candidate skews to try
+
+    :returns: the skew, or 0.0 if there are no differences within maxSkew
+    """
+    lo = numpy.searchsorted(referenceTimes, times - maxSkew, side="left")
+    hi = numpy.searchsorted(referenceTimes, times + maxSkew, side="right")
+    counts = hi - lo
+    total = int(numpy.sum(counts))
+    if total == 0:
+        return 0.0
+
+    # every difference within maxSkew, without forming all of them
+    starts = numpy.cumsum(counts) - counts
+    refIndices = numpy.repeat(lo, counts) + (numpy.arange(total) - numpy.repeat(starts, counts))
+    diffs = numpy.repeat(times, counts) - referenceTimes[refIndices]
+
+    binWidth = maxGap if maxGap > 0 else maxSkew
+    bins = numpy.floor((diffs + maxSkew) / binWidth).astype(int)
+    histogram = numpy.bincount(bins)
+
+    # the true skew can fall either side of a bin edge, so score neighbouring bins together
+    paired = histogram.copy()
+    paired[:-1] += histogram[1:]
+
+    bestCount, bestSkew = -1, 0.0
+    for b in numpy.argsort(-paired, kind="mergesort")[:numBins]:
+        inBins = diffs[(bins == b) | (bins == b+1)]
+        candidate = float(numpy.median(inBins))
+        count = numpy.count_nonzero(pairWithNearest(referenceTimes, times, -candidate, maxGap) >= 0)
+        if count > bestCount or (count == bestCount and abs(candidate) < abs(bestSkew)):
+            bestCount, bestSkew = count, candidate
+    return bestSkew
+
+
+
+def mergeChannels(observedLists, maxGap, maxSkew=None):
+    """\
+    Merge the observed timings from several channels (e.g. a light sensor and an audio input watching
+    the same test sequence, where flashes and beeps happen at the same times) into a single list of
+    observed timings.
+
+    First the skew between each channel and the channel with the most observations is estimated
+    (if maxSkew is larger than maxGap), by making a histogram of the differences (up to maxSkew) between
+    observations in the two channels and choosing, from the few most common differences, the one that
+    pairs the most observations to within maxGap (see :func:`pairWithNearest`).
+    Once each channel is shifted by its skew, observations from different channels that are within maxGap
+    of each other are treated as being the same event. The skew is then refined, and removed before the
+    times for the same event are averaged.
+
+    A skew larger than maxSkew is not found. Nor is one that is the same as the time between events,
+    because the channels then line up just as well one event apart. So maxSkew should be less than
+    the time between events, unless the events are irregularly spaced (as in the test sequences).
+
+    :param observedLists: list (one per channel) of lists of tuples of (observed time, err bounds)
+    :param maxGap: the furthest apart two observations of the same event can be, once the skew is removed
+    :param maxSkew: None, or the largest skew between channels to look for (default is maxGap)
+
+    :returns: tuple (merged, eventIndices, skews)
+        merged is a list of tuples of (observed time, err bounds), one per event, in time order.
+        eventIndices is a list (one per channel) of lists (one per observation) of the index into merged of the event it was observed as part of.
+        skews is a list (one per channel) of the amount that channel's observations were later than those of the channel with the most observations.
+    """
+    if maxSkew is None:
+        maxSkew = maxGap
+
+    lengths = [ len(observed) for observed in observedLists ]
+    reference = lengths.index(max(lengths))
+    referenceTimes = numpy.sort(numpy.asarray([ t for (t, err) in observedLists[reference] ], dtype=numpy.float64))
+
+    # estimate the skew of each channel, so that observations of the same event are clustered together
+    coarseSkews = [ 0.0 ] * len(observedLists)
+    for c in range(0, len(observedLists)):
+        if c != reference and lengths[c] > 0 and maxSkew > maxGap:
+            times = numpy.asarray([ t for (t, err) in observedLists[c] ], dtype=numpy.float64)
+            coarseSkews[c] = _estimateSkew(referenceTimes, times, maxGap, maxSkew)
+
+    events = sorted( (t - coarseSkews[c], t, err, c, k) for c, observed in enumerate(observedLists) for k, (t, err) in enumerate(observed) )
+
+    clusters = []
+    eventIndices = [ [None] * len(observed) for observed in observedLists ]
+    for (shifted, t, err, c, k) in events:
+        if len(clusters) == 0 or shifted - clusters[-1]["start"] > maxGap or c in clusters[-1]["members"]:
+            clusters.append( { "start": shifted, "members": {} } )
+        clusters[-1]["members"][c] = (t, err)
+        eventIndices[c][k] = len(clusters) - 1
+
+    skews = [ 0.0 ] * len(observedLists)
+    for c in range(0, len(observedLists)):
+        if c != reference:
+            shared = [ cluster["members"][c][0] - cluster["members"][reference][0] for cluster in clusters \
+                       if c in cluster["members"] and reference in cluster["members"] ]
+            if len(shared) > 0:
+                skews[c] = float(numpy.median(shared))
+
+    merged = []
+    for cluster in clusters:
+        members = cluster["members"]
+        t = sum( members[c][0] - skews[c] for c in members ) / len(members)
+        err = max( members[c][1] for c in members )
+        merged.append( (t, err) )
+
+    return merged, eventIndices, skews
+
+
+
+def correlateJoint(expected, observedLists, windowIndex=None, tickRate=None, maxSkew=None):
+    """\
+    Find a single match for the observed timings from several channels at once, where every channel
+    is expected to observe the same expected timings. This does the correlation once instead of once per
+    channel, and a channel with few or noisy observations is matched using the evidence of the others.
+
+    The channels are merged using :func:`mergeChannels` (treating observations that are within half of
+    the smallest gap between expected times, once the skew between channels is removed, as the same event)
+    and the merged timings are then correlated using :func:`correlateFast` (or :func:`correlateWithIndex`
+    if a windowIndex is provided).
+
+    :param expected: list of expected times in units of sync time line clock
+    :param observedLists: list (one per channel) of lists of tuples of (observed time, err bounds) in units of sync time line clock
+    :param windowIndex: (optional) :class:`MlsWindowIndex` for the expected timings
+    :param tickRate: the number of ticks per second for the sync time line (needed if a windowIndex is provided)
+    :param maxSkew: None, or the largest skew between channels (in units of sync time line clock) to look for
+        (see :func:`mergeChannels`). The default is half of the smallest gap between expected times.
+
+    :returns: tuple (index, channelResults)
+        index is the index into expected times of the first merged event (or -1 if no match is possible).
+        channelResults is a list (one per channel) of either a tuple (index into expected times of that channel's first observation,
+        list of (diff, err) for each of that channel's observations) or None if that channel has no observations or no match was possible.
+    """
+    if len(expected) > 1:
+        maxGap = float(numpy.min(numpy.diff(expected))) / 2
+    else:
+        maxGap = 0.0
+
+    merged, eventIndices, skews = mergeChannels(observedLists, maxGap, maxSkew)
+
+    noResults = [ None ] * len(observedLists)
+    if len(merged) == 0:
+        return -1, noResults
+
+    if windowIndex is None:
+        index, diffsAndErrors = correlateFast(expected, merged)
+    else:
+        index, diffsAndErrors = correlateWithIndex(expected, merged, windowIndex, tickRate)
+    if index < 0:
+        return -1, noResults
+
+    channelResults = []
+    for observed, indices in zip(observedLists, eventIndices):
+        if len(observed) == 0:
+            channelResults.append(None)
+        else:
+            diffs = [ (expected[index + i] - t, err) for (t, err), i in zip(observed, indices) ]
+            channelResults.append( (index + indices[0], diffs) )
+
+    return index, channelResults
+
+
+
+def doJointComparison(tests, startSyncTime, tickRate, windowIndex=None, maxSkewSecs=None):
+    """\
+    Same as :func:`doComparison`, but for several channels that all have the same expected timings.
+    The match is found jointly using :func:`correlateJoint`.
+
+    :param tests: list (one per channel) of tuples ( list of tuples of (observed times (sync time line units), error bounds), list of expected timings (seconds) )
+    :param startSyncTime: the start value used for the sync time line offered to the client device
+    :param tickRate: the number of ticks per second for the sync time line offered to the client device
+    :param windowIndex: (optional) :class:`MlsWindowIndex` for the expected timings
+    :param maxSkewSecs: None, or the largest skew between channels (in seconds) to look for (see :func:`correlateJoint`)
+
+    :returns tuple summary of results of analysis.
+                (index into expected times for video of the first event observed on any channel,
+                list of expected times for video,
+                list (one per channel) of results for that channel, as returned by :func:`correlateJoint`)
+
+    :raises ValueError: if the channels do not all have the same expected timings
+    """
+    expectedTimesSecs = tests[0][1]
+    for observed, channelExpectedTimesSecs in tests:
+        if list(channelExpectedTimesSecs) != list(expectedTimesSecs):
+            raise ValueError("Cannot compare channels jointly because they do not all have the same expected timings.")
+
+    # convert to be on the sync timeline
+    expected = [ startSyncTime + tickRate * t for t in expectedTimesSecs ]
+
+    maxSkew = None if maxSkewSecs is None else maxSkewSecs * tickRate
+    matchIndex, channelResults = correlateJoint(expected, [ observed for (observed, e) in tests ], windowIndex, tickRate, maxSkew)
+
+    return (matchIndex, expected, channelResults)
+
 
 
 def runDetection(detector, channels, dueStartTimeUsecs, dueFinishTimeUsecs):
@@ -202,6 +1095,8 @@ def runDetection(detector, channels, dueStartTimeUsecs, dueFinishTimeUsecs):
             A dictionary is { "pinName": pin name, "isAudio": true or false, 
                 "min": list of sampled minimum values for that pin (each value is the minimum over a millisecond period)
                 "max": list of sampled maximum values for that pin (each value is the maximum over same millisecond period) }
+            If the flashes or beeps were detected by the Arduino, then the dictionary instead has a "pulseEvents" entry,
+            listing the Arduino clock times (start, end) of each one (see :class:`measurer.PulseEventCaptureSource`), and no "min" or "max".
     :param dueStartTimeUsecs
     :param dueFinishTimeUsecs
     :return the detected timings 
@@ -213,6 +1108,13 @@ def runDetection(detector, channels, dueStartTimeUsecs, dueFinishTimeUsecs):
     """
     timings = []
     for channel in channels:
+        try:
+            pulseEvents = channel["pulseEvents"]
+        except KeyError:
+            pulseEvents = None
+        if pulseEvents is not None:
+            timings.append({"pinName": channel["pinName"], "observed": detector.pulseEventsToTimings(pulseEvents)})
+            continue
         isAudio = channel["isAudio"]
         if isAudio:
             func = detector.samplesToBeepTimings
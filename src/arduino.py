@@ -27,7 +27,8 @@ Usage
 -----
 
 The :func:`connect` function returns a handle to a file object for communicating with
-the Arduino.
+the Arduino. It can instead be pointed at the pseudo-terminal of an emulated Arduino
+(see :mod:`arduinoemulator`).
 
 The following functions are then used to control the Arduino:
 
@@ -35,6 +36,24 @@ The following functions are then used to control the Arduino:
 * :func:`prepareToCapture`       ... query the arduino to find out how much data will be captured
 * :func:`capture`                ... initiate sampling of the enabled input pins
 * :func:`bulkTransfer`           ... retrieve captured data
+* :func:`bulkTransferInto`       ... retrieve captured data into a (reusable) buffer
+* :func:`chunkedBulkTransferInto`... retrieve captured data as checksummed chunks, re-requesting any that are corrupted or lost
+* :func:`compressedBulkTransferInto`... retrieve captured data in a compact encoding (see :mod:`blockcodec`)
+
+Alternatively, the Arduino can send the sample data while it is sampling, so that the
+duration of a capture is not limited by the Arduino's memory:
+
+* :func:`startStreaming`         ... start sampling the enabled input pins, sending the sample data as it goes
+* :func:`readStreamFrame`        ... retrieve the next frame of sample data
+* :func:`stopStreaming`          ... ask the Arduino to stop sampling
+
+Or the Arduino can detect the flashes and beeps itself while it is sampling, and send only the
+times at which each one started and ended:
+
+* :func:`configureDetection`     ... enable detection on one of the input pins, with its thresholds
+* :func:`startDetecting`         ... start sampling and detecting on the configured input pins
+* :func:`readEventFrame`         ... retrieve the next detected flash or beep (or other event)
+* :func:`stopDetecting`          ... ask the Arduino to stop sampling
 
 Once you have finished communicating with the Arduino, just close the file
 handle.
@@ -56,6 +75,14 @@ Some constants are defined that contain the string to be sent to
 give the Arduino a particular command.
 
 * CMD_BULK
+* CMD_CHUNKED_BULK
+* CMD_COMPRESSED_BULK
+* CMD_RESEND_CHUNK
+* CMD_END_CHUNKED_BULK
+* CMD_STREAM
+* CMD_STOP_STREAM
+* CMD_CONFIGURE_DETECTION
+* CMD_DETECT
 * CMD_CAPTURE
 * CMD_PREPARE_TO_CAPTURE
 * CMD_TIMEONLY
@@ -64,12 +91,29 @@ Various functions in this module will parse bytes received via the file handle
 appropriate to the particular command used. Some functions will also send
 the command. See individual documentation for each.
 
+The replies from the Arduino are fixed size, so each one is read using as few reads
+as possible (see :func:`readFrame`) and decoded using a precompiled struct:
+
+* REPLY_TIME
+* REPLY_PREPARE_TO_CAPTURE
+* REPLY_BULK
+* REPLY_CHUNKED_BULK
+* CAPTURE_RESULT
+* CHUNK_HEADER and CHUNK_CRC
+* REPLY_STREAM and STREAM_FRAME_HEADER
+* REPLY_DETECT and EVENT_FRAME
+
 
 
 """
 
 import sys
 import re
+import struct
+import time
+import zlib
+
+import blockcodec
 
 try:
     import serial
@@ -92,6 +136,14 @@ except ImportError:
 
 
 CMD_BULK = "B"
+CMD_CHUNKED_BULK = "C"
+CMD_RESEND_CHUNK = "R"
+CMD_END_CHUNKED_BULK = "E"
+CMD_COMPRESSED_BULK = "Z"
+CMD_STREAM = "M"
+CMD_STOP_STREAM = "X"
+CMD_CONFIGURE_DETECTION = "D"
+CMD_DETECT = "V"
 CMD_CAPTURE = "S"
 CMD_PREPARE_TO_CAPTURE = "4"
 CMD_TIMEONLY = "T"
@@ -103,6 +155,36 @@ CMDS_ENABLE_PIN = [ '0', '1', '2', '3' ]
 BLK_SIZE_PER_PIN = 2
 NINETY_KB = (90 * 1024)
 
+# ----- REPLY FRAMES ----------------------------------------------------------
+# the fixed size replies sent by the Arduino, all made of 32-bit unsigned integers (most significant byte first)
+# The first integer of a reply to a command is always the Arduino time when the command was received.
+
+REPLY_TIME = struct.Struct(">I")                  # arduino time
+REPLY_PREPARE_TO_CAPTURE = struct.Struct(">III")  # arduino time, number of active pins, number of millisecond blocks
+REPLY_BULK = struct.Struct(">II")                 # arduino time, number of bytes of sample data that follow
+REPLY_CHUNKED_BULK = struct.Struct(">III")        # arduino time, number of bytes of sample data, chunk size
+CAPTURE_RESULT = struct.Struct(">III")            # sent once capturing has finished: start time, finish time, number of millisecond blocks
+
+# a chunk of sample data is a header, then the data, then a CRC-32 (as calculated by zlib.crc32) of the header and data
+CHUNK_HEADER = struct.Struct(">HH")               # sequence number, number of bytes of data that follow
+CHUNK_CRC = struct.Struct(">I")
+CHUNK_SEQ = struct.Struct(">H")                   # sent after CMD_RESEND_CHUNK
+
+REPLY_STREAM = struct.Struct(">III")              # arduino time, number of active pins, number of millisecond blocks per frame
+# while streaming, each frame of sample data is a header followed by the millisecond blocks
+STREAM_FRAME_HEADER = struct.Struct(">cIII")      # kind of frame, sequence number, arduino time, number of millisecond blocks that follow
+STREAM_FRAME_DATA = "D"                           # arduino time is when the first millisecond block began
+STREAM_FRAME_END = "E"                            # arduino time is when sampling finished (no blocks follow)
+
+DETECTION_CONFIG = struct.Struct(">BBBHH")        # sent after CMD_CONFIGURE_DETECTION: pin, rising threshold, falling threshold, min pulse duration, hold count
+REPLY_DETECT = struct.Struct(">II")               # arduino time, number of pins being detected on
+# while detecting, each event is sent as a fixed size frame
+EVENT_FRAME = struct.Struct(">cBII")              # kind of event, pin, two arduino times
+EVENT_PULSE = "P"                                 # a flash or beep on the pin: times are when its first sample period began and its last one ended
+EVENT_HEARTBEAT = "H"                             # sent every second: times are when sampling started and when the current sample period began
+EVENT_END = "E"                                   # sent after sampling stops: times are when sampling started and finished
+HEARTBEAT_MILLIS = 1000
+
 # -----------------------------------------------------------------------------
 
 def checkCaptureTimeAchievable(captureTimeSecs, nPinsRequested):
@@ -127,6 +209,37 @@ def checkCaptureTimeAchievable(captureTimeSecs, nPinsRequested):
     return -1
 
 
+def readFrame(f, frame, clock=None):
+    """\
+    Read a fixed size reply sent by the Arduino, and decode it.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param frame: a struct.Struct describing the reply (e.g. :data:`REPLY_PREPARE_TO_CAPTURE`)
+    :param clock: None, or a :class:`dvbcss.clock` clock object
+
+    If no clock is supplied, the whole reply is read at once. Otherwise the first byte is read on its own,
+    so that the clock can be read as soon as the reply starts to arrive, then the rest is read at once.
+
+    :returns: the tuple of values decoded from the reply, or, if a clock was supplied, a tuple (values, ticks)
+        where ticks is the tick value of the clock when the first byte of the reply was received.
+
+    :raises IOError: if the Arduino stops sending before the whole reply has been received
+    """
+    if clock is None:
+        data = f.read(frame.size)
+    else:
+        data = f.read(1)
+        ticks = clock.ticks
+        if frame.size > 1 and len(data) == 1:
+            data += f.read(frame.size - 1)
+    if len(data) < frame.size:
+        raise IOError("Arduino stopped sending after "+str(len(data))+" of "+str(frame.size)+" bytes of a reply.")
+    values = frame.unpack(data)
+    if clock is None:
+        return values
+    return values, ticks
+
+
 def getInt(f):
     """\
     Read a 4 byte integer sent by the Arduino
@@ -135,24 +248,46 @@ def getInt(f):
 
     :returns value: 32-bit unsigned integer (read as 4 bytes, most significant byte first)
     """
-    n=f.read(4)
-    v = (ord(n[0])<<24) + (ord(n[1])<<16) + (ord(n[2])<<8) + ord(n[3])
-    return v
+    return readFrame(f, REPLY_TIME)[0]
 
 
 def getIntWithTime(f, clock):
     """\
-    Read a 4 byte integer sent by the Arduino and report the clock tick valueat which the read completed.
+    Read a 4 byte integer sent by the Arduino and report the clock tick value at which it began to arrive.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+
+    :returns (value, ticks): A tuple containing the read 32-bit unsigned integer (see :func:`getInt`) and the tick value of the supplied clock object
+    """
+    values, t4 = readFrame(f, REPLY_TIME, clock)
+    return values[0], t4
+
+
+def writeCmdAndReadFrame(f, clock, cmd, frame, captureTime=None):
+    """\
+    Send a command byte to the Arduino, and read its whole (fixed size) reply, measuring the round trip
+    as for :func:`writeCmdAndTimeRoundTrip`.
 
     :param f: file handle for the serial connection to the Arduino Due
     :param clock: a :class:`dvbcss.clock` clock object
+    :param cmd: The command to send to the Arduino.
+    :param frame: a struct.Struct describing the reply, whose first value is the arduino time (e.g. :data:`REPLY_BULK`)
+    :param captureTime: if this is the command to prepare for capture, then here is the time in seconds
+        otherwise this is None
 
-    :returns (value, ticks): A tuple containing the read 32-bit unsigned integer (see :func:`getInf`) and the tick value of the supplied clock object
+    :returns (timingData, values): the timing data (t1,t2,t3,t4) (see :func:`writeCmdAndTimeRoundTrip`)
+        and a tuple of the rest of the values in the reply.
     """
-    n=f.read(4)
-    t4 = clock.ticks
-    v = (ord(n[0])<<24) + (ord(n[1])<<16) + (ord(n[2])<<8) + ord(n[3])
-    return v, t4
+    t1 = clock.ticks
+    if captureTime != None:
+        # concatenate and send as one string to reduce wait for the value of capture time on arduino
+        cmd = cmd + chr(captureTime)
+    f.write(cmd)
+    values, t4 = readFrame(f, frame, clock)
+    # convert to nanosecs
+    arduinoArrivalTime = values[0] * 1000
+    return [t1, arduinoArrivalTime, arduinoArrivalTime, t4], values[1:]
 
 
 def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None):
@@ -171,26 +306,18 @@ def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None):
     the serial USB port. It immediately sends that time back, flushing the serial USB port, then reads
     the command byte.
 
-    We read that time value sent by the arduino, and immediately read the supplied clock object again.
+    We read the supplied clock object again as soon as the first byte of that time value arrives, then read the rest of it.
 
     :returns (t1,t2,t3,t4): Where t1 and t4 are in terms of the supplied clock object and t2 and t3 are from the Arduino.
 
     Where:
     * t1 is the clock.ticks value from just before the command was sent
     * t2 and t3 are the arduino micros() time value from when the comand was received
-    * t4 is the clock.ticks value from just after the response was received from the Arduino.
+    * t4 is the clock.ticks value from when the response began to arrive from the Arduino.
 
     All returned Ardinio time values are in units of nanoseconds. The clock object times are in units of ticks of that clock.
     """
-    t1 = clock.ticks
-    if captureTime != None:
-        # concatenate and send as one string to reduce wait for the value of capture time on arduino
-        cmd = cmd + chr(captureTime)
-    f.write(cmd)
-    arduinoArrivalTime, t4 = getIntWithTime(f, clock)
-    # convert to nanosecs
-    arduinoArrivalTime *= 1000
-    return [t1, arduinoArrivalTime, arduinoArrivalTime, t4]
+    return writeCmdAndReadFrame(f, clock, cmd, REPLY_TIME, captureTime)[0]
 
 
 # -----------------------------------------------------------------------------
@@ -198,14 +325,20 @@ def writeCmdAndTimeRoundTrip(f, clock, cmd, captureTime=None):
 # -----------------------------------------------------------------------------
 
 
-def connect():
+def connect(port=None):
     """\
     Connect to Arduino via serial and return a file handle for communicating with it.
 
+    :param port: None, or the name of the serial port to use (e.g. the pseudo-terminal of an :mod:`arduinoemulator`).
+        If None, then the serial port that the Arduino Due is plugged into is found automatically.
+
     :returns: file handle for the serial connection
 
     :raises RuntimeError: if unable to detect a connected Arduino Due
     """
+    if port is not None:
+        return serial.Serial(port, 115200, timeout=60)
+
     for (COMMS_CHANNEL, NAME, deviceId) in serial.tools.list_ports.comports():
         if re.match(r"^\s*USB VID:PID=0*2341:0*3e\b", deviceId, re.I):
             f = serial.Serial(COMMS_CHANNEL, 115200, timeout=60)
@@ -246,9 +379,7 @@ def prepareToCapture(f, clock, captureSecs):
 
     """
     # send the cmd "4" ... chr(4 + 48)
-    timeData = writeCmdAndTimeRoundTrip(f, clock, CMD_PREPARE_TO_CAPTURE, captureSecs)
-    nActivePorts = getInt(f)
-    nMilliBlocks = getInt(f)
+    timeData, (nActivePorts, nMilliBlocks) = writeCmdAndReadFrame(f, clock, CMD_PREPARE_TO_CAPTURE, REPLY_PREPARE_TO_CAPTURE, captureSecs)
     return nActivePorts, nMilliBlocks, timeData
 
 
@@ -328,15 +459,33 @@ def capture(f, clock):
 
     timeDataPre = writeCmdAndTimeRoundTrip(f, clock, CMD_CAPTURE)
 
-    # retrieve the times the Arduino says it started and finished sampling
-    # and normalise to nanoseconds (from microseconds)
-    dueStartBoundary = getInt(f) * 1000
-    dueFinished = getInt(f) * 1000
+    # retrieve the times the Arduino says it started and finished sampling, and the count
+    # of the number of millisecond blocks the Arduino says it sampled
+    dueStartBoundary, dueFinished, nMilliBlocks = readFrame(f, CAPTURE_RESULT)
 
-    # retrieve the count of the number of millisecond blocks the Arduino says it sampled
-    nMilliBlocks = getInt(f)
     timeDataPost = writeCmdAndTimeRoundTrip(f, clock, CMD_TIMEONLY)
 
+    return unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost)
+
+
+
+def unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost):
+    """\
+    Convert the times the Arduino reports that it started and finished sampling to nanoseconds, and undo any wrapping
+    of the Arduino clock during a capture (see :func:`capture`).
+
+    :param dueStartBoundary: Arduino clock time (in microseconds) when sampling commenced, as sent by the Arduino
+    :param dueFinished: Arduino clock time (in microseconds) when sampling ended, as sent by the Arduino
+    :param nMilliBlocks: The number of millisecond of data sampled
+    :param timeDataPre: The round-trip the timing data (t1,t2,t3,t4) when capture command was sent to the Arduino. Modified in place.
+    :param timeDataPost: The round-trip the timing data (t1,t2,t3,t4) just after the sampling finished. Modified in place.
+
+    :returns: tuple (startTime, finishTime, nMilliblocks, preStartTimingData, postFinshTimingData) as for :func:`capture`
+    """
+    # normalise to nanoseconds (from microseconds)
+    dueStartBoundary *= 1000
+    dueFinished *= 1000
+
     # watch out for any wrapping of the arduino clock ... unlikely but possible
     if timeDataPre[2] < timeDataPre[1]:
         timeDataPre[2] += (1000 * (2 ** 32))
@@ -357,6 +506,176 @@ def capture(f, clock):
 
 
 
+def unwrapTime(arduinoTime, previousTime):
+    """\
+    Undo the wrapping of the Arduino clock (every 2**32 microseconds), given an earlier time.
+
+    :param arduinoTime: Arduino clock time (in nanoseconds) as reported by the Arduino
+    :param previousTime: an unwrapped Arduino clock time (in nanoseconds) from less than one wrap earlier
+    :returns: arduinoTime, unwrapped so that it is not earlier than previousTime
+    """
+    wrap = 1000 * (2 ** 32)
+    arduinoTime = previousTime - (previousTime % wrap) + (arduinoTime % wrap)
+    if arduinoTime < previousTime:
+        arduinoTime += wrap
+    return arduinoTime
+
+
+
+def startStreaming(f, clock):
+    """\
+    Instruct the arduino to start sampling the enabled pins (see :func:`samplePinDuringCapture`), sending
+    the sample data in frames as it goes, until asked to stop (see :func:`stopStreaming`).
+
+    The Arduino fills one half of its buffer while sending the other, so the duration is not
+    limited by the Arduino's memory. Each frame contains the millisecond blocks (see :func:`capture` for their format)
+    sampled since the previous frame. Read each frame using :func:`readStreamFrame`.
+
+    Afterwards, the Arduino forgets which pins were enabled.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+
+    :returns: tuple (nActivePorts, nMilliBlocksPerFrame, timingData). If there is a problem
+        (such as no pins being enabled) then nActivePorts and nMilliBlocksPerFrame are zero, and the Arduino is not sampling.
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+    """
+    timeData, (nActivePorts, nMilliBlocksPerFrame) = writeCmdAndReadFrame(f, clock, CMD_STREAM, REPLY_STREAM)
+    return nActivePorts, nMilliBlocksPerFrame, timeData
+
+
+
+def readStreamFrame(f, nActivePorts):
+    """\
+    Read the next frame of sample data sent by the Arduino while streaming (see :func:`startStreaming`).
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param nActivePorts: the number of pins being sampled (as returned by :func:`startStreaming`)
+
+    :returns: tuple (kind, seq, arduinoTime, nMilliBlocks, samples) where:
+        * kind is STREAM_FRAME_DATA, or STREAM_FRAME_END if this is the last frame (sent after the Arduino stops sampling)
+        * seq is the sequence number of the frame (counting from 0)
+        * arduinoTime is the time (in nanoseconds, but not unwrapped, see :func:`unwrapTime`) at which the first
+          millisecond block in the frame began, or (for the last frame) when sampling finished
+        * nMilliBlocks is the number of millisecond blocks in the frame
+        * samples is a bytearray containing the millisecond blocks
+
+    :raises IOError: if the Arduino stops sending before the whole frame has been received, or the frame is not recognised
+    """
+    kind, seq, arduinoTime, nMilliBlocks = readFrame(f, STREAM_FRAME_HEADER)
+    if kind not in (STREAM_FRAME_DATA, STREAM_FRAME_END):
+        raise IOError("Unrecognised frame of streamed sample data: "+repr(kind))
+    n = nMilliBlocks * nActivePorts * BLK_SIZE_PER_PIN
+    samples = bytearray(n)
+    view = memoryview(samples)
+    received = 0
+    while received < n:
+        numRead = f.readinto(view[received:n])
+        if not numRead:
+            raise IOError("Arduino stopped sending a frame of sample data after "+str(received)+" of "+str(n)+" bytes.")
+        received += numRead
+    return kind, seq, arduinoTime * 1000, nMilliBlocks, samples
+
+
+
+def stopStreaming(f):
+    """\
+    Ask the Arduino to stop sampling while streaming (see :func:`startStreaming`).
+
+    It completes the millisecond block it is currently sampling, then sends a frame containing
+    the remaining sample data, followed by a STREAM_FRAME_END frame. Unlike other commands,
+    the Arduino does not reply with its time (this would be mixed up with the frames of sample data).
+
+    :param f: file handle for the serial connection to the Arduino Due
+    """
+    f.write(CMD_STOP_STREAM)
+
+
+
+def configureDetection(f, clock, pin, risingThreshold, fallingThreshold, minPulseDuration, holdCount):
+    """\
+    Configure the Arduino to detect flashes or beeps on one of the input pins when :func:`startDetecting` is called.
+
+    For a light sensor input, the high value seen during each millisecond is compared against the thresholds.
+    For an audio input, the difference between the high and low values is compared against them.
+    The detection is the same as :func:`detect.detectPulses` (see :class:`detect.DevicePulseDetector`).
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param pin: the pin (see :func:`samplePinDuringCapture` for values)
+    :param risingThreshold: threshold for low to high transition (0 to 255)
+    :param fallingThreshold: threshold for high to low transition (0 to 255)
+    :param minPulseDuration: the minimum number of millisecond sample periods a flash or beep must last for
+    :param holdCount: number of millisecond sample periods to hold a high state for
+
+    Use :func:`detect.deviceThresholds` to convert thresholds (e.g. from :func:`detect.calcFlashThresholds`) to whole numbers,
+    and :func:`detect.detectionCounts` for the minimum pulse duration and hold count.
+
+    :returns: (t1,t2,t3,t4) measuring the specified clock object and arduino clock, as per :func`writeCmdAndTimeRoundTrip`
+    """
+    cmd = CMD_CONFIGURE_DETECTION + DETECTION_CONFIG.pack(pin, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
+    return writeCmdAndTimeRoundTrip(f, clock, cmd)
+
+
+
+def startDetecting(f, clock):
+    """\
+    Instruct the arduino to start sampling the pins configured by :func:`configureDetection`, detecting flashes
+    and beeps as it goes, until asked to stop (see :func:`stopDetecting`). Sample data is not kept or sent, so the
+    duration is not limited by the Arduino's memory or by the USB throughput.
+
+    Each flash or beep is sent as an EVENT_PULSE frame once it has ended. An EVENT_HEARTBEAT frame is sent as
+    sampling starts, then every second. Read each frame using :func:`readEventFrame`.
+
+    Afterwards, the Arduino forgets which pins were configured.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+
+    :returns: tuple (nActivePorts, timingData). If there is a problem (such as no pins being configured)
+        then nActivePorts is zero, and the Arduino is not sampling.
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+    """
+    timeData, (nActivePorts,) = writeCmdAndReadFrame(f, clock, CMD_DETECT, REPLY_DETECT)
+    return nActivePorts, timeData
+
+
+
+def readEventFrame(f):
+    """\
+    Read the next event sent by the Arduino while detecting (see :func:`startDetecting`).
+
+    :param f: file handle for the serial connection to the Arduino Due
+
+    :returns: tuple (kind, pin, arduinoTime1, arduinoTime2) where kind is EVENT_PULSE, EVENT_HEARTBEAT or EVENT_END
+        and the arduino times are in nanoseconds, but not unwrapped (see :func:`unwrapTime`). For EVENT_PULSE, they are
+        the times at which the first millisecond sample period of the flash or beep began and its last one ended.
+        For the others, the first time is when sampling started.
+
+    :raises IOError: if the Arduino stops sending before the whole frame has been received, or the frame is not recognised
+    """
+    kind, pin, arduinoTime1, arduinoTime2 = readFrame(f, EVENT_FRAME)
+    if kind not in (EVENT_PULSE, EVENT_HEARTBEAT, EVENT_END):
+        raise IOError("Unrecognised event frame: "+repr(kind))
+    return kind, pin, arduinoTime1 * 1000, arduinoTime2 * 1000
+
+
+
+def stopDetecting(f):
+    """\
+    Ask the Arduino to stop sampling while detecting (see :func:`startDetecting`).
+
+    It completes the millisecond sample period it is currently sampling, sends any flash or beep
+    that has ended, then sends an EVENT_END frame. As for :func:`stopStreaming`, the Arduino does not reply with its time.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    """
+    f.write(CMD_STOP_STREAM)
+
+
+
 def bulkTransfer(f, clock):
     """\
     Request the Arduino send the captured sample data blocks and return them.
@@ -373,13 +692,214 @@ def bulkTransfer(f, clock):
     See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
 
     """
-    timeData = writeCmdAndTimeRoundTrip(f, clock, CMD_BULK)
-    n = getInt(f)
+    timeData, (n,) = writeCmdAndReadFrame(f, clock, CMD_BULK, REPLY_BULK)
     samples = f.read(n)
     return samples, timeData
 
 
 
+def bulkTransferInto(f, clock, buffer=None):
+    """\
+    Request the Arduino send the captured sample data blocks, and read them directly into a buffer,
+    without creating an intermediate string.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param buffer: None, or a bytearray to read the sample data into. If None, or too small, then a new bytearray is allocated.
+        Reusing the same buffer for each capture avoids allocating a new one each time.
+
+    :returns tuple (buffer, numBytes, timingData) where the first numBytes bytes of buffer are the raw bytes of sample data.
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+
+    :raises IOError: if the Arduino stops sending before all the sample data has been received
+    """
+    return _readSampleData(f, clock, CMD_BULK, buffer)
+
+
+
+def _readSampleData(f, clock, cmd, buffer):
+    """\
+    Send a command to which the Arduino replies with a number of bytes, followed by that many bytes,
+    and read them into a buffer (see :func:`bulkTransferInto`).
+    If buffer is None then a new bytearray of exactly the right size is allocated.
+    """
+    timeData, (n,) = writeCmdAndReadFrame(f, clock, cmd, REPLY_BULK)
+    if buffer is None or len(buffer) < n:
+        buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        numRead = f.readinto(view[received:n])
+        if not numRead:
+            raise IOError("Arduino stopped sending sample data after "+str(received)+" of "+str(n)+" bytes.")
+        received += numRead
+    return buffer, n, timeData
+
+
+
+def compressedBulkTransferInto(f, clock, nActivePorts, nMilliBlocks, buffer=None):
+    """\
+    Request the Arduino send the captured sample data blocks in a compact encoding (see :mod:`blockcodec`),
+    and decode them into a buffer. This takes less time than :func:`bulkTransferInto` when the sample
+    data is mostly quiet.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param nActivePorts: the number of pins that were sampled (see :func:`prepareToCapture`)
+    :param nMilliBlocks: the number of millisecond blocks that were captured (see :func:`capture`)
+    :param buffer: None, or a bytearray to decode the sample data into. If None, or too small, then a new bytearray is allocated.
+
+    :returns tuple (buffer, numBytes, timingData, numEncodedBytes) where the first numBytes bytes of buffer are the raw bytes of
+        sample data (the same as would be received by :func:`bulkTransferInto`), and numEncodedBytes is the number of bytes actually received.
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+
+    :raises IOError: if the Arduino stops sending before all the encoded sample data has been received
+    :raises ValueError: if the encoded sample data is not valid
+    """
+    encoded, numEncodedBytes, timeData = _readSampleData(f, clock, CMD_COMPRESSED_BULK, None)
+    buffer, numBytes = blockcodec.decodeBlocks(encoded, nActivePorts, nMilliBlocks, buffer)
+    return buffer, numBytes, timeData, numEncodedBytes
+
+
+
+def transferStats(numBytes, secs, numChunks=1, numResent=0, numEncodedBytes=None):
+    """\
+    :param numBytes: number of bytes of sample data transferred
+    :param secs: time taken for the transfer, in seconds
+    :param numChunks: number of chunks the sample data was transferred in
+    :param numResent: number of chunks that had to be sent again
+    :param numEncodedBytes: None, or the number of bytes actually sent if the sample data was encoded (see :func:`compressedBulkTransferInto`)
+    :returns: dict describing a transfer of sample data, that can be serialised as JSON:
+        { "numBytes", "secs", "bytesPerSec", "numChunks", "numResent" }, where bytesPerSec is the rate at which
+        sample data was received. If numEncodedBytes is not None, then the dict also contains "numEncodedBytes" and "compressionRatio".
+    """
+    stats = { "numBytes": numBytes,
+              "secs": secs,
+              "bytesPerSec": numBytes / secs if secs > 0 else None,
+              "numChunks": numChunks,
+              "numResent": numResent }
+    if numEncodedBytes is not None:
+        stats["numEncodedBytes"] = numEncodedBytes
+        stats["compressionRatio"] = float(numBytes) / numEncodedBytes if numEncodedBytes > 0 else None
+    return stats
+
+
+CHUNK_OK, CHUNK_CORRUPTED, CHUNK_LOST = range(0, 3)
+
+
+def _readChunk(f, view, seq, offset, length):
+    """\
+    Read a chunk of sample data, and check it.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param view: memoryview of the buffer that sample data is read into
+    :param seq: the sequence number of the chunk that is expected
+    :param offset: where in the buffer this chunk belongs
+    :param length: the number of bytes of sample data that this chunk should contain
+
+    :returns: CHUNK_OK, CHUNK_CORRUPTED if the CRC did not match, or CHUNK_LOST if the chunk was not
+        completely received, or had the wrong sequence number or length (so whatever follows it cannot be trusted)
+    """
+    header = f.read(CHUNK_HEADER.size)
+    if len(header) < CHUNK_HEADER.size or CHUNK_HEADER.unpack(header) != (seq, length):
+        return CHUNK_LOST
+    received = 0
+    while received < length:
+        numRead = f.readinto(view[offset+received:offset+length])
+        if not numRead:
+            return CHUNK_LOST
+        received += numRead
+    crc = f.read(CHUNK_CRC.size)
+    if len(crc) < CHUNK_CRC.size:
+        return CHUNK_LOST
+    if CHUNK_CRC.unpack(crc)[0] != zlib.crc32(view[offset:offset+length].tobytes(), zlib.crc32(header)) & 0xffffffff:
+        return CHUNK_CORRUPTED
+    return CHUNK_OK
+
+
+def _discardInput(f, quietSecs):
+    """\
+    Read and discard anything received until nothing more arrives for a while.
+    """
+    timeout = f.timeout
+    f.timeout = quietSecs
+    try:
+        while len(f.read(4096)) > 0:
+            pass
+    finally:
+        f.timeout = timeout
+
+
+def chunkedBulkTransferInto(f, clock, buffer=None, chunkTimeoutSecs=2.0, maxAttempts=3):
+    """\
+    Request the Arduino send the captured sample data blocks as a sequence of checksummed chunks,
+    and read them directly into a buffer. Any chunks that are corrupted, or lost because the transfer
+    stalled, are requested again individually, instead of needing to wait for the whole transfer to time out.
+
+    :param f: file handle for the serial connection to the Arduino Due
+    :param clock: a :class:`dvbcss.clock` clock object
+    :param buffer: None, or a bytearray to read the sample data into (see :func:`bulkTransferInto`).
+    :param chunkTimeoutSecs: how long to wait (in seconds) for each chunk before treating the transfer as stalled
+    :param maxAttempts: the number of times to request a chunk again before giving up
+
+    After receiving all of the chunks correctly, the Arduino is told that the transfer is complete
+    (and forgets which pins were enabled, as it does after :func:`bulkTransfer`).
+
+    :returns tuple (buffer, numBytes, timingData, stats) where the first numBytes bytes of buffer are the raw bytes of sample data,
+        and stats describes the transfer (see :func:`transferStats`).
+
+    See :func:`writeAndTimeRoundTrip` for details of the meaning of the returned round-trip timing data
+
+    :raises IOError: if a chunk could not be received correctly after maxAttempts requests
+    """
+    startTime = time.time()
+    timeData, (n, chunkSize) = writeCmdAndReadFrame(f, clock, CMD_CHUNKED_BULK, REPLY_CHUNKED_BULK)
+    if buffer is None or len(buffer) < n:
+        buffer = bytearray(n)
+    view = memoryview(buffer)
+    numChunks = (n + chunkSize - 1) // chunkSize
+
+    def chunk(seq):
+        offset = seq * chunkSize
+        return offset, min(chunkSize, n - offset)
+
+    timeout = f.timeout
+    f.timeout = chunkTimeoutSecs
+    try:
+        badChunks = []
+        for seq in range(0, numChunks):
+            status = _readChunk(f, view, seq, *chunk(seq))
+            if status == CHUNK_CORRUPTED:
+                badChunks.append(seq)
+            elif status == CHUNK_LOST:
+                # the rest of the transfer cannot be trusted, so ask for all of it again
+                badChunks.extend(range(seq, numChunks))
+                _discardInput(f, 0.1)
+                break
+
+        numResent = 0
+        for seq in badChunks:
+            for attempt in range(0, maxAttempts):
+                numResent += 1
+                writeCmdAndReadFrame(f, clock, CMD_RESEND_CHUNK + CHUNK_SEQ.pack(seq), REPLY_TIME)
+                status = _readChunk(f, view, seq, *chunk(seq))
+                if status == CHUNK_OK:
+                    break
+                elif status == CHUNK_LOST:
+                    _discardInput(f, 0.1)
+            else:
+                raise IOError("Could not receive chunk "+str(seq)+" of sample data after "+str(maxAttempts)+" attempts.")
+
+        writeCmdAndTimeRoundTrip(f, clock, CMD_END_CHUNKED_BULK)
+    finally:
+        f.timeout = timeout
+
+    return buffer, n, timeData, transferStats(n, time.time() - startTime, numChunks, numResent)
+
+
+
 if __name__=="__main__":
     print "This is a library of functions for communicating with the arduino"
     print "for timing reference-point calibration for video and audio."
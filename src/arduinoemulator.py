@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Software emulator of the Arduino sampling firmware
+===================================================
+
+Purpose and Usage
+-----------------
+
+This emulates an Arduino Due running the code in the "hardware" directory of this
+project. It serves exactly the same protocol (see :mod:`arduino`) on a pseudo-terminal,
+so that the whole of the measurement system can be run, load tested or benchmarked
+without any hardware.
+
+Instead of sampling light sensors and audio inputs, the emulator generates the
+high and low values for each millisecond block from the JSON metadata file describing
+a test video sequence. Flashes and beeps occur at the times listed in the metadata,
+and the sequence repeats (if the metadata gives its duration). The latency and jitter
+of the USB connection, the noise on the inputs and the USB throughput can all be set.
+
+It is a command line tool that prints the name of the pseudo-terminal, then serves
+commands until interrupted. Use `--help` at the command line for information on arguments.
+
+For example:
+
+    $ python arduinoemulator.py --startDelay 5 metadata.json
+    Arduino emulator serving on /dev/pts/4
+
+    $ python exampleTVTester.py --arduinoPort /dev/pts/4 --light0 metadata.json ...
+
+It can also be used from python:
+
+.. code-block:: python
+
+    emulator = ArduinoEmulator(metadata, sequenceStartSecs=5.0)
+    emulator.start()
+    f = arduino.connect(emulator.port)
+    ...
+    emulator.stop()
+
+'''
+
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+import zlib
+
+import numpy
+
+import blockcodec
+import detect
+
+
+# the same limits as the Arduino sampling code
+
+N_INPUTS = 4
+BLK_SIZE_PER_PIN = 2
+NINETY_KB = (90 * 1024)
+CHUNK_SIZE = 512
+STREAM_FRAME_BLKS = 250
+DETECT_BATCH_BLKS = 20
+HEARTBEAT_MILLIS = 1000
+
+LIGHT_PINS = [0, 2]
+
+UINT32 = struct.Struct(">I")
+CHUNK_HEADER = struct.Struct(">HH")
+CHUNK_SEQ = struct.Struct(">H")
+STREAM_FRAME_HEADER = struct.Struct(">cIII")
+DETECTION_CONFIG = struct.Struct(">BBBHH")
+EVENT_FRAME = struct.Struct(">cBII")
+
+
+class ArduinoEmulator(object):
+
+    def __init__(self, metadata, sequenceStartSecs=0.0, latencySecs=0.0002, jitterSecs=0.0, noise=2.0, maxBytesPerSec=None, microsOffset=0, seed=None, \
+                 corruptChunks=(), stallAtChunk=None):
+        """\
+
+        Emulates an Arduino running the sampling code, serving the same protocol on a pseudo-terminal.
+
+        :param metadata: dict of metadata describing the test video sequence (as loaded from the JSON metadata file).
+            Must contain "eventCentreTimes", "approxFlashDurationSecs" and "approxBeepDurationSecs".
+            If it also contains "durationSecs" then the sequence repeats with that period.
+        :param sequenceStartSecs: the number of seconds, after :func:`start` is called, at which the sequence begins.
+        :param latencySecs: one-way latency (in seconds) of the USB connection, in each direction.
+        :param jitterSecs: maximum extra one-way latency (in seconds), chosen at random for each direction of each command.
+        :param noise: standard deviation of the noise added to every sampled high and low value.
+        :param maxBytesPerSec: None, or the maximum rate (in bytes per second) at which sample data is sent by a bulk transfer.
+        :param microsOffset: the value of the emulated micros() clock when :func:`start` is called. Set close to 2**32 to test wrapping of the clock.
+        :param seed: None, or the seed for the random number generator (for latency jitter and noise)
+        :param corruptChunks: sequence numbers of chunks of sample data that are corrupted the first time they are sent by a chunked bulk transfer
+        :param stallAtChunk: None, or the sequence number of a chunk at which the first chunked bulk transfer stops sending
+
+        """
+        super(ArduinoEmulator, self).__init__()
+        self.eventCentreTimes = numpy.array(sorted(metadata["eventCentreTimes"]), dtype=numpy.float64)
+        self.flashDurationSecs = metadata["approxFlashDurationSecs"]
+        self.beepDurationSecs = metadata["approxBeepDurationSecs"]
+        self.sequenceDurationSecs = metadata.get("durationSecs", None)
+        self.sequenceStartSecs = sequenceStartSecs
+        self.latencySecs = latencySecs
+        self.jitterSecs = jitterSecs
+        self.noise = noise
+        self.maxBytesPerSec = maxBytesPerSec
+        self.microsOffset = microsOffset
+        self.random = random.Random(seed)
+        self.numpyRandom = numpy.random.RandomState(seed)
+        self.corruptChunks = set(corruptChunks)
+        self.stallAtChunk = stallAtChunk
+
+        self.port = None
+        self.masterFd = None
+        self.slaveFd = None
+        self.thread = None
+        self.running = False
+        self.epoch = None
+        self.doinit()
+        self.nMilliBlks = 0
+        self.rawData = bytearray()
+
+
+    def start(self):
+        """\
+
+        Open the pseudo-terminal, start the emulated micros() clock and start serving commands in a background thread.
+        Once started, the `port` attribute is the name of the pseudo-terminal to pass to :func:`arduino.connect`.
+
+        """
+        self.masterFd, self.slaveFd = pty.openpty()
+        tty.setraw(self.slaveFd)
+        self.port = os.ttyname(self.slaveFd)
+        self.epoch = time.time()
+        self.running = True
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        """\
+
+        Stop serving commands and close the pseudo-terminal.
+
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for fd in [self.masterFd, self.slaveFd]:
+            if fd is not None:
+                os.close(fd)
+        self.masterFd = self.slaveFd = None
+
+
+    def microsUnwrapped(self):
+        """\
+        :returns: the emulated micros() clock, without wrapping at 2**32
+        """
+        return int((time.time() - self.epoch) * 1000000) + self.microsOffset
+
+
+    def micros(self):
+        """\
+        :returns: the emulated micros() clock, which wraps at 2**32 like the Arduino's
+        """
+        return self.microsUnwrapped() & 0xffffffff
+
+
+    def doinit(self):
+        self.enable = [0] * N_INPUTS
+        self.nActivePorts = 0
+        self.detection = {}
+
+
+    def _read(self, n):
+        """\
+        :returns: n bytes read from the pseudo-terminal, or None if the emulator was stopped first
+        """
+        data = ""
+        while len(data) < n:
+            if not self.running:
+                return None
+            readable, _, _ = select.select([self.masterFd], [], [], 0.1)
+            if readable:
+                try:
+                    data += os.read(self.masterFd, n - len(data))
+                except OSError:
+                    return None
+        return data
+
+
+    def _write(self, data):
+        data = buffer(data)
+        while len(data) > 0:
+            numWritten = os.write(self.masterFd, data)
+            data = data[numWritten:]
+
+
+    def _writeInt(self, x):
+        self._write(UINT32.pack(x & 0xffffffff))
+
+
+    def _oneWayDelay(self):
+        delay = self.latencySecs + self.random.uniform(0.0, self.jitterSecs)
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def _serve(self):
+        while self.running:
+            opcode = self._read(1)
+            if opcode is None:
+                break
+
+            # respond to any command immediately with a local time measurement (after the command has travelled over USB)
+            self._oneWayDelay()
+            rcvTime = self.micros()
+            self._oneWayDelay()
+            self._writeInt(rcvTime)
+
+            if opcode in "0123":
+                self.enable[ord(opcode) - ord("0")] = 1
+            elif opcode == "4":
+                nSecs = self._read(1)
+                if nSecs is None:
+                    break
+                self._prepareToCapture(ord(nSecs))
+            elif opcode == "S":
+                self._capture()
+            elif opcode == "B":
+                self._bulkTransfer()
+            elif opcode == "C":
+                self._chunkedBulkTransfer()
+            elif opcode == "R":
+                seq = self._read(CHUNK_SEQ.size)
+                if seq is None:
+                    break
+                self._sendChunk(CHUNK_SEQ.unpack(seq)[0])
+            elif opcode == "E":
+                self.rawData = bytearray()
+                self.doinit()
+            elif opcode == "M":
+                self._stream()
+            elif opcode == "Z":
+                self._compressedBulkTransfer()
+            elif opcode == "D":
+                config = self._read(DETECTION_CONFIG.size)
+                if config is None:
+                    break
+                pin, rising, falling, minPulseDuration, holdCount = DETECTION_CONFIG.unpack(config)
+                if pin < N_INPUTS:
+                    self.detection[pin] = (rising, falling, minPulseDuration, holdCount)
+            elif opcode == "V":
+                self._detect()
+            # 'T' (timing only) and unrecognised commands are handled by the time measurement above
+
+
+    def _prepareToCapture(self, nSeconds):
+        self.nActivePorts = sum(self.enable)
+        if self.nActivePorts == 0 or self.nActivePorts > N_INPUTS or nSeconds <= 0:
+            self._reportFailure()
+            return
+
+        self.nMilliBlks = nSeconds * 1000
+        if self.nMilliBlks * self.nActivePorts * BLK_SIZE_PER_PIN > NINETY_KB:
+            self._reportFailure()
+            return
+
+        self._writeInt(self.nActivePorts)
+        self._writeInt(self.nMilliBlks)
+
+
+    def _reportFailure(self):
+        self.doinit()
+        self._writeInt(0)
+        self._writeInt(0)
+
+
+    def _capture(self):
+        startTime = self.microsUnwrapped()
+        time.sleep(max(0.0, (startTime + self.nMilliBlks * 1000 - self.microsUnwrapped()) / 1000000.0))
+        endTime = self.microsUnwrapped()
+
+        self.rawData = self.generateBlocks(startTime, self.nMilliBlks)
+        self._writeInt(startTime)
+        self._writeInt(endTime)
+        self._writeInt(self.nMilliBlks)
+
+
+    def _writeSampleData(self, data):
+        if self.maxBytesPerSec is None:
+            self._write(data)
+        else:
+            chunkSize = max(1, int(self.maxBytesPerSec / 100))
+            startTime = time.time()
+            for i in range(0, len(data), chunkSize):
+                time.sleep(max(0.0, startTime + float(i) / self.maxBytesPerSec - time.time()))
+                self._write(data[i:i+chunkSize])
+
+
+    def _bulkTransfer(self):
+        data = self.rawData[:self.nMilliBlks * self.nActivePorts * BLK_SIZE_PER_PIN]
+        self._writeInt(len(data))
+        self._writeSampleData(data)
+        self.rawData = bytearray()
+        self.doinit()
+
+
+    def _compressedBulkTransfer(self):
+        data = self.rawData[:self.nMilliBlks * self.nActivePorts * BLK_SIZE_PER_PIN]
+        encoded = blockcodec.encodeBlocks(data, self.nActivePorts, self.nMilliBlks)
+        self._writeInt(len(encoded))
+        self._writeSampleData(encoded)
+        self.rawData = bytearray()
+        self.doinit()
+
+
+    def _chunkedBulkTransfer(self):
+        nBytes = self.nMilliBlks * self.nActivePorts * BLK_SIZE_PER_PIN
+        self._writeInt(nBytes)
+        self._writeInt(CHUNK_SIZE)
+        for seq in range(0, (nBytes + CHUNK_SIZE - 1) // CHUNK_SIZE):
+            if seq == self.stallAtChunk:
+                self.stallAtChunk = None
+                return
+            self._sendChunk(seq, corrupt=seq in self.corruptChunks)
+            self.corruptChunks.discard(seq)
+
+
+    def _sendChunk(self, seq, corrupt=False):
+        nBytes = self.nMilliBlks * self.nActivePorts * BLK_SIZE_PER_PIN
+        offset = seq * CHUNK_SIZE
+        data = self.rawData[offset:min(nBytes, offset + CHUNK_SIZE)]
+        header = CHUNK_HEADER.pack(seq, len(data))
+        crc = zlib.crc32(str(data), zlib.crc32(header)) & 0xffffffff
+        if corrupt:
+            data = bytearray(data)
+            data[0] ^= 0xff
+        self._write(header)
+        self._writeSampleData(data)
+        self._writeInt(crc)
+
+
+    def _stream(self):
+        self.nActivePorts = sum(self.enable)
+        if self.nActivePorts == 0 or self.nActivePorts > N_INPUTS:
+            self._reportFailure()
+            return
+        self._writeInt(self.nActivePorts)
+        self._writeInt(STREAM_FRAME_BLKS)
+
+        frameStart = self.microsUnwrapped()
+        seq = 0
+        stopping = False
+        while not stopping:
+            # sample until the frame is full, or until any byte is received (asking to stop)
+            frameEnd = frameStart + STREAM_FRAME_BLKS * 1000
+            nBlocks = STREAM_FRAME_BLKS
+            while True:
+                remainingSecs = (frameEnd - self.microsUnwrapped()) / 1000000.0
+                if remainingSecs <= 0:
+                    break
+                readable, _, _ = select.select([self.masterFd], [], [], remainingSecs)
+                if readable:
+                    if self._read(1) is None:
+                        return
+                    stopping = True
+                    # complete the millisecond block currently being sampled
+                    nBlocks = min(STREAM_FRAME_BLKS, (self.microsUnwrapped() - frameStart) // 1000 + 1)
+                    time.sleep(max(0.0, (frameStart + nBlocks * 1000 - self.microsUnwrapped()) / 1000000.0))
+                    break
+            if not self.running:
+                return
+
+            self._write(STREAM_FRAME_HEADER.pack("D", seq, frameStart & 0xffffffff, nBlocks))
+            self._writeSampleData(self.generateBlocks(frameStart, nBlocks))
+            seq += 1
+            frameStart += nBlocks * 1000
+
+        self._write(STREAM_FRAME_HEADER.pack("E", seq, frameStart & 0xffffffff, 0))
+        self.doinit()
+
+
+    def _detect(self):
+        pins = sorted(self.detection)
+        if len(pins) == 0:
+            self.doinit()
+            self._writeInt(0)
+            return
+        self._writeInt(len(pins))
+
+        # the pulse detector for each pin is the same as the one running on the Arduino
+        self.enable = [ 1 if pin in self.detection else 0 for pin in range(0, N_INPUTS) ]
+        detectors = [ detect.DevicePulseDetector(*self.detection[pin]) for pin in pins ]
+        startTime = self.microsUnwrapped()
+        nBlocks = 0
+        stopping = False
+        while not stopping:
+            # sample until the next batch of millisecond blocks is complete, or until any byte is received (asking to stop)
+            n = DETECT_BATCH_BLKS
+            remainingSecs = (startTime + (nBlocks + n) * 1000 - self.microsUnwrapped()) / 1000000.0
+            if remainingSecs > 0:
+                readable, _, _ = select.select([self.masterFd], [], [], remainingSecs)
+                if readable:
+                    if self._read(1) is None:
+                        return
+                    stopping = True
+                    # complete the millisecond block currently being sampled
+                    n = min(n, (self.microsUnwrapped() - startTime) // 1000 + 1 - nBlocks)
+                    time.sleep(max(0.0, (startTime + (nBlocks + n) * 1000 - self.microsUnwrapped()) / 1000000.0))
+            if not self.running:
+                return
+
+            blocks = numpy.frombuffer(self.generateBlocks(startTime + nBlocks * 1000, n), dtype=numpy.uint8).reshape(n, len(pins), 2).tolist()
+            for i in range(0, n):
+                period = nBlocks + i
+                if period % HEARTBEAT_MILLIS == 0:
+                    self._write(EVENT_FRAME.pack("H", 0, startTime & 0xffffffff, (startTime + period * 1000) & 0xffffffff))
+                for j, pin in enumerate(pins):
+                    hi, lo = blocks[i][j]
+                    pulse = detectors[j].addSample(hi if pin in LIGHT_PINS else hi - lo)
+                    if pulse is not None:
+                        start, end = pulse
+                        self._write(EVENT_FRAME.pack("P", pin, (startTime + start * 1000) & 0xffffffff, (startTime + end * 1000) & 0xffffffff))
+            nBlocks += n
+
+        self._write(EVENT_FRAME.pack("E", 0, startTime & 0xffffffff, (startTime + nBlocks * 1000) & 0xffffffff))
+        self.doinit()
+
+
+    def eventsDuring(self, startSecs, numBlocks, durationSecs):
+        """\
+
+        :param startSecs: time (in seconds since the sequence began) of the start of the first millisecond block
+        :param numBlocks: the number of millisecond blocks
+        :param durationSecs: the duration of a flash or beep, in seconds
+
+        :returns: numpy array of booleans, one per millisecond block, that are True if a flash or beep overlaps the middle of that block
+
+        """
+        t = startSecs + (numpy.arange(numBlocks) + 0.5) / 1000.0
+        if self.sequenceDurationSecs:
+            t = numpy.mod(t, self.sequenceDurationSecs)
+        if len(self.eventCentreTimes) == 0:
+            return numpy.zeros(numBlocks, dtype=bool)
+        after = numpy.clip(numpy.searchsorted(self.eventCentreTimes, t), 0, len(self.eventCentreTimes)-1)
+        before = numpy.clip(after - 1, 0, len(self.eventCentreTimes)-1)
+        nearest = numpy.minimum(numpy.abs(self.eventCentreTimes[after] - t), numpy.abs(self.eventCentreTimes[before] - t))
+        return nearest < durationSecs / 2.0
+
+
+    def generateBlocks(self, startMicros, numBlocks):
+        """\
+
+        Generate the sample data that the Arduino would capture, for the currently enabled pins.
+
+        :param startMicros: the (unwrapped) emulated micros() clock time at which the capture started
+        :param numBlocks: the number of millisecond blocks
+
+        :returns: bytearray of the millisecond blocks, in the same format as sent by the Arduino (see :func:`arduino.capture`)
+
+        """
+        startSecs = (startMicros - self.microsOffset) / 1000000.0 - self.sequenceStartSecs
+        pins = [ pin for pin in range(0, N_INPUTS) if self.enable[pin] ]
+        blocks = numpy.zeros((numBlocks, len(pins), 2), dtype=numpy.float64)
+        for i, pin in enumerate(pins):
+            if pin in LIGHT_PINS:
+                bright = self.eventsDuring(startSecs, numBlocks, self.flashDurationSecs)
+                blocks[:, i, 0] = numpy.where(bright, 200.0, 10.0)
+                blocks[:, i, 1] = blocks[:, i, 0]
+            else:
+                beep = self.eventsDuring(startSecs, numBlocks, self.beepDurationSecs)
+                blocks[:, i, 0] = numpy.where(beep, 230.0, 128.0)
+                blocks[:, i, 1] = numpy.where(beep, 26.0, 128.0)
+        if self.noise > 0:
+            blocks += self.numpyRandom.normal(0.0, self.noise, blocks.shape)
+        blocks = numpy.clip(numpy.round(blocks), 0, 255).astype(numpy.uint8)
+        # high value first, then low value
+        hi = numpy.maximum(blocks[:, :, 0], blocks[:, :, 1])
+        lo = numpy.minimum(blocks[:, :, 0], blocks[:, :, 1])
+        return bytearray(numpy.dstack((hi, lo)).tostring())
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Emulate an Arduino running the sampling code, on a pseudo-terminal, generating flashes and beeps from a test sequence metadata file.")
+    parser.add_argument("metadataFile", type=str, help="JSON metadata file describing the test video sequence.")
+    parser.add_argument("--startDelay", dest="sequenceStartSecs", type=float, default=0.0, help="Number of seconds after the emulator starts at which the test sequence begins (default 0).")
+    parser.add_argument("--latency", dest="latencyMillis", type=float, default=0.2, help="One-way USB latency in milliseconds (default 0.2).")
+    parser.add_argument("--jitter", dest="jitterMillis", type=float, default=0.0, help="Maximum extra random one-way USB latency in milliseconds (default 0).")
+    parser.add_argument("--noise", dest="noise", type=float, default=2.0, help="Standard deviation of noise added to sampled values (default 2.0).")
+    parser.add_argument("--maxBytesPerSec", dest="maxBytesPerSec", type=int, default=None, help="Limit the rate at which sample data is transferred (default is no limit).")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="Seed for the random number generator.")
+    args = parser.parse_args()
+
+    f = open(args.metadataFile)
+    metadata = json.load(f)
+    f.close()
+
+    emulator = ArduinoEmulator(metadata, args.sequenceStartSecs, args.latencyMillis / 1000.0, args.jitterMillis / 1000.0, \
+                               args.noise, args.maxBytesPerSec, seed=args.seed)
+    emulator.start()
+    print "Arduino emulator serving on", emulator.port
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
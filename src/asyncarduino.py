@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""\
+This python library communicates with the Arduino Due in the same way as :mod:`arduino`,
+but from an event loop instead of blocking the calling thread. Capturing, monitoring of
+the CSS protocols and publishing of results can then all be done in the one event loop.
+
+Requires 'trollius' (the python 2 version of asyncio) and 'pyserial' (both can be installed
+from the python package index using PIP).
+
+
+Usage
+-----
+
+:func:`connect` returns an :class:`AsyncArduino` that reads replies from the Arduino (or
+from the pseudo-terminal of an emulated Arduino, see :mod:`arduinoemulator`) whenever they
+arrive, using the event loop. Its methods are coroutines that do the same as the functions
+of the same names in :mod:`arduino`:
+
+.. code-block:: python
+
+    @trollius.coroutine
+    def captureOnce(device):
+        yield From(device.samplePinDuringCapture(0))
+        nActivePorts, nMilliBlocks, timeData = yield From(device.prepareToCapture(5))
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = yield From(device.capture())
+        samples, numBytes, timeData = yield From(device.bulkTransferInto())
+        raise Return(samples)
+
+    loop = trollius.get_event_loop()
+    device = asyncarduino.connect(wallClock, loop=loop)
+    samples = loop.run_until_complete(captureOnce(device))
+    device.close()
+
+Each reply must arrive within the timeout (in seconds) passed to :func:`connect`. If it does not,
+then trollius.TimeoutError is raised. A capture can take longer: its result is waited for
+for the duration of the capture plus the timeout. Any of the coroutines can also be cancelled.
+
+After a timeout or cancellation, the reply may still arrive later. Call :func:`AsyncArduino.resynchronise`
+to discard it before sending the next command. Sending a command while unread data is buffered raises IOError,
+because the reply could not be told apart from the unread data.
+
+The round trip times are measured in the same way as :func:`arduino.writeCmdAndTimeRoundTrip`, except that
+the time a reply arrived is read when the event loop is told there is data to read, so it also includes
+any delay in the event loop getting round to it.
+"""
+
+import collections
+import os
+import sys
+
+import arduino
+
+try:
+    import trollius
+    from trollius import From, Return
+except ImportError:
+    sys.stderr.write("Needs trollius library. Install with PIP, e.g.:\n\n")
+    sys.stderr.write("    sudo pip install trollius\n\n")
+    sys.exit(1)
+
+
+DEFAULT_TIMEOUT_SECS = 60
+
+
+def connect(clock, port=None, timeout=DEFAULT_TIMEOUT_SECS, loop=None):
+    """\
+    Connect to the Arduino (see :func:`arduino.connect`) and return an :class:`AsyncArduino` for communicating with it.
+
+    :param clock: a :class:`dvbcss.clock` clock object, used to take the round-trip timings for every command
+    :param port: None, or the name of the serial port to use (e.g. the pseudo-terminal of an :mod:`arduinoemulator`).
+    :param timeout: the time (in seconds) within which each reply must arrive
+    :param loop: None, or the event loop to use (default is the current event loop)
+
+    :raises RuntimeError: if unable to detect a connected Arduino Due
+    """
+    return AsyncArduino(arduino.connect(port), clock, timeout, loop)
+
+
+class AsyncArduino(object):
+
+    def __init__(self, f, clock, timeout=DEFAULT_TIMEOUT_SECS, loop=None):
+        """\
+        Communicate with the Arduino using an event loop. Replies are read as soon as they arrive, and
+        buffered until a coroutine waiting for them collects them.
+
+        :param f: file handle for the serial connection to the Arduino Due (see :func:`arduino.connect`). It must have a fileno() method.
+        :param clock: a :class:`dvbcss.clock` clock object
+        :param timeout: the time (in seconds) within which each reply must arrive
+        :param loop: None, or the event loop to use (default is the current event loop)
+        """
+        super(AsyncArduino, self).__init__()
+        self.f = f
+        self.clock = clock
+        self.timeout = timeout
+        self.loop = loop if loop is not None else trollius.get_event_loop()
+        self.received = bytearray()
+        self.arrivals = collections.deque()    # [number of bytes, clock ticks when they arrived] for each read of the received data
+        self.error = None
+        self.waiter = None
+        self.numWanted = 0
+        self.lastReceived = None
+        self.nMilliBlocks = 0
+        self.fd = f.fileno()
+        self.loop.add_reader(self.fd, self._onReadable)
+
+
+    def close(self):
+        """\
+        Stop reading from the Arduino and close the file handle.
+        """
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+            self.f.close()
+
+
+    def _onReadable(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            data = None
+            self.error = IOError("Error reading from the Arduino: "+str(e))
+        if not data:
+            # the connection has gone, so wake up anything waiting for a reply
+            if self.error is None:
+                self.error = IOError("Connection to the Arduino was closed.")
+            self.loop.remove_reader(self.fd)
+        else:
+            self.arrivals.append([len(data), self.clock.ticks])
+            self.received.extend(data)
+            self.lastReceived = self.loop.time()
+        if self.waiter is not None and not self.waiter.done() and (self.error is not None or len(self.received) >= self.numWanted):
+            self.waiter.set_result(None)
+
+
+    @trollius.coroutine
+    def _readBytes(self, n, timeout):
+        """\
+        :param n: the number of bytes to read
+        :param timeout: the time (in seconds) within which they must all arrive
+        :returns: tuple (data, ticks) where data is a bytearray and ticks is the tick value of the clock
+            when the first byte arrived
+        :raises trollius.TimeoutError: if they do not all arrive in time
+        :raises IOError: if the connection to the Arduino fails first
+        """
+        if len(self.received) < n:
+            if self.error is not None:
+                raise self.error
+            self.waiter = trollius.Future(loop=self.loop)
+            self.numWanted = n
+            try:
+                yield From(trollius.wait_for(self.waiter, timeout, loop=self.loop))
+            finally:
+                self.waiter = None
+            if len(self.received) < n:
+                raise self.error
+        ticks = self.arrivals[0][1]
+        remaining = n
+        while remaining > 0:
+            if self.arrivals[0][0] <= remaining:
+                remaining -= self.arrivals.popleft()[0]
+            else:
+                self.arrivals[0][0] -= remaining
+                remaining = 0
+        data = self.received[:n]
+        del self.received[:n]
+        raise Return((data, ticks))
+
+
+    @trollius.coroutine
+    def readFrame(self, frame, timeout=None):
+        """\
+        Read a fixed size reply sent by the Arduino, and decode it (see :func:`arduino.readFrame`).
+
+        :param frame: a struct.Struct describing the reply (e.g. :data:`arduino.REPLY_PREPARE_TO_CAPTURE`)
+        :param timeout: None, or the time (in seconds) within which the reply must arrive (default is the timeout passed to the constructor)
+        :returns: tuple (values, ticks) where ticks is the tick value of the clock when the first byte of the reply arrived
+        """
+        if timeout is None:
+            timeout = self.timeout
+        data, ticks = yield From(self._readBytes(frame.size, timeout))
+        raise Return((frame.unpack(str(data)), ticks))
+
+
+    @trollius.coroutine
+    def writeCmdAndReadFrame(self, cmd, frame, timeout=None):
+        """\
+        Send a command to the Arduino, and read its whole (fixed size) reply (see :func:`arduino.writeCmdAndReadFrame`).
+
+        :param cmd: The command to send to the Arduino (including any bytes that follow the command byte).
+        :param frame: a struct.Struct describing the reply, whose first value is the arduino time (e.g. :data:`arduino.REPLY_BULK`)
+        :param timeout: None, or the time (in seconds) within which the reply must arrive (default is the timeout passed to the constructor)
+        :returns (timingData, values): the timing data (t1,t2,t3,t4) and a tuple of the rest of the values in the reply.
+        :raises IOError: if data that has not been read is still buffered (see :func:`resynchronise`)
+        """
+        if len(self.received) > 0:
+            raise IOError("Unread data from the Arduino is still buffered. Call resynchronise() before sending the next command.")
+        t1 = self.clock.ticks
+        self.f.write(cmd)
+        values, t4 = yield From(self.readFrame(frame, timeout))
+        # convert to nanosecs
+        arduinoArrivalTime = values[0] * 1000
+        raise Return(([t1, arduinoArrivalTime, arduinoArrivalTime, t4], values[1:]))
+
+
+    @trollius.coroutine
+    def writeCmdAndTimeRoundTrip(self, cmd):
+        """\
+        Send a command to the Arduino, and return the round trip timing data (t1,t2,t3,t4) (see :func:`arduino.writeCmdAndTimeRoundTrip`).
+        """
+        timeData, values = yield From(self.writeCmdAndReadFrame(cmd, arduino.REPLY_TIME))
+        raise Return(timeData)
+
+
+    @trollius.coroutine
+    def samplePinDuringCapture(self, pin):
+        """\
+        Enable sampling of one of the pins (see :func:`arduino.samplePinDuringCapture`).
+
+        :returns: the round trip timing data (t1,t2,t3,t4)
+        """
+        timeData = yield From(self.writeCmdAndTimeRoundTrip(arduino.CMDS_ENABLE_PIN[pin]))
+        raise Return(timeData)
+
+
+    @trollius.coroutine
+    def prepareToCapture(self, captureSecs):
+        """\
+        Retrieve information from the arduino on what will be captured (see :func:`arduino.prepareToCapture`).
+
+        :returns: tuple (nActivePorts, nMilliBlocks, timingData)
+        """
+        timeData, (nActivePorts, nMilliBlocks) = yield From(self.writeCmdAndReadFrame(arduino.CMD_PREPARE_TO_CAPTURE + chr(captureSecs), arduino.REPLY_PREPARE_TO_CAPTURE))
+        self.nMilliBlocks = nMilliBlocks
+        raise Return((nActivePorts, nMilliBlocks, timeData))
+
+
+    @trollius.coroutine
+    def capture(self):
+        """\
+        Instruct the arduino to capture sample data, and wait for it to finish (see :func:`arduino.capture`).
+        The result is waited for for the duration of the capture plus the timeout.
+
+        :returns: tuple (startTime, finishTime, nMilliblocks, preStartTimingData, postFinshTimingData)
+        """
+        timeDataPre = yield From(self.writeCmdAndTimeRoundTrip(arduino.CMD_CAPTURE))
+        captureSecs = self.nMilliBlocks / 1000.0
+        (dueStartBoundary, dueFinished, nMilliBlocks), ticks = yield From(self.readFrame(arduino.CAPTURE_RESULT, captureSecs + self.timeout))
+        timeDataPost = yield From(self.writeCmdAndTimeRoundTrip(arduino.CMD_TIMEONLY))
+        raise Return(arduino.unwrapCaptureTimes(dueStartBoundary, dueFinished, nMilliBlocks, timeDataPre, timeDataPost))
+
+
+    @trollius.coroutine
+    def bulkTransferInto(self, buffer=None):
+        """\
+        Retrieve the captured sample data into a buffer (see :func:`arduino.bulkTransferInto`).
+        All of the sample data must arrive within the timeout.
+
+        :param buffer: None, or a bytearray to reuse. If it is too small, then a new one is allocated.
+        :returns: tuple (buffer, numBytes, timingData)
+        """
+        start = self.loop.time()
+        timeData, (numBytes,) = yield From(self.writeCmdAndReadFrame(arduino.CMD_BULK, arduino.REPLY_BULK))
+        data, ticks = yield From(self._readBytes(numBytes, max(0, start + self.timeout - self.loop.time())))
+        if buffer is None or len(buffer) < numBytes:
+            buffer = bytearray(numBytes)
+        buffer[:numBytes] = data
+        raise Return((buffer, numBytes, timeData))
+
+
+    @trollius.coroutine
+    def resynchronise(self, quietSecs=0.5):
+        """\
+        Wait until nothing has been received from the Arduino for quietSecs, and discard anything that was.
+        Use this after a timeout or cancellation, before sending the next command. If a capture was cancelled,
+        then quietSecs must be longer than the rest of the capture.
+
+        :param quietSecs: the time (in seconds) for which nothing must be received
+        """
+        start = self.loop.time()
+        while True:
+            quietSince = start if self.lastReceived is None else max(start, self.lastReceived)
+            remainingSecs = quietSince + quietSecs - self.loop.time()
+            if remainingSecs <= 0:
+                break
+            yield From(trollius.sleep(remainingSecs, loop=self.loop))
+        del self.received[:]
+        self.arrivals.clear()
+
+
+
+if __name__ == '__main__':
+    # unit tests in:
+    #    ../tests/test_asyncarduino.py
+    pass
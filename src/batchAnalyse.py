@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Batch analysis of saved captures
+================================
+
+Purpose and Usage
+-----------------
+
+This is a command line tool that repeats the detection and analysis of flashes/beeps
+for every capture saved (using the `--saveCapture` option of the example testers)
+or archived (see the `--archiveDir` option) in a directory. This allows previously taken measurements to be re-analysed, for
+example with a different tolerance, without needing to capture them again.
+
+The captures are shared out between a pool of worker processes. One JSON result
+file is written for each capture, alongside it (or in a different directory if
+specified). Progress, and an estimate of the time remaining, is printed as the
+captures are analysed.
+
+Use `--help` at the command line for information on arguments.
+
+For example:
+
+    $ python batchAnalyse.py --toleranceTest 10 captures/
+
+'''
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import capturearchive
+import capturestore
+
+
+def resultFilenameFor(captureFilename, outputDir):
+    """\
+    :param captureFilename: name of a saved capture file
+    :param outputDir: directory that results are written to, or None for the same directory as the capture file
+    :returns: name of the file that results for the capture are written to
+    """
+    name = os.path.basename(captureFilename)
+    if name.endswith(".json"):
+        name = name[:-len(".json")]
+    if outputDir is None:
+        outputDir = os.path.dirname(captureFilename)
+    return os.path.join(outputDir, name + ".result.json")
+
+
+def analyseCaptureFile(job):
+    """\
+    Analyse one saved capture file and write the results. This is run in a worker process.
+
+    :param job: tuple (capture filename, result filename, tolerance in seconds or None, True if robust matching is to be used,
+        duration in seconds of the window for adaptive detection thresholds or None, True if matches are to be ranked after removing drift,
+        hold count in samples or None, minimum pulse duration in samples or None)
+    :returns: tuple (capture filename, None if successful, or a string describing why it failed)
+    """
+    captureFilename, resultFilename, toleranceSecs, robustMatch, thresholdWindowSecs, detrend, holdCount, minPulseDuration = job
+    try:
+        record = capturestore.loadCapture(captureFilename)
+        results = capturestore.analyseCapture(record, toleranceSecs, robustMatch, thresholdWindowSecs, detrend, holdCount, minPulseDuration)
+        f = open(resultFilename, "wb")
+        try:
+            json.dump({ "capture": captureFilename, "results": results }, f, indent=4)
+        finally:
+            f.close()
+    except Exception, e:
+        return captureFilename, "%s: %s" % (e.__class__.__name__, str(e))
+    return captureFilename, None
+
+
+def runBatch(jobs, numProcesses=None, out=sys.stderr):
+    """\
+    Analyse saved capture files using a pool of worker processes, printing progress as each is completed.
+
+    :param jobs: list of jobs (see :func:`analyseCaptureFile`)
+    :param numProcesses: number of worker processes (default is the number of CPUs)
+    :param out: file object that progress is printed to
+    :returns: list of tuples (capture filename, description of failure) for each capture that failed
+    """
+    failures = []
+    startTime = time.time()
+    pool = multiprocessing.Pool(numProcesses)
+    try:
+        numDone = 0
+        for captureFilename, failure in pool.imap_unordered(analyseCaptureFile, jobs):
+            numDone += 1
+            if failure is not None:
+                failures.append( (captureFilename, failure) )
+            elapsed = time.time() - startTime
+            rate = numDone / elapsed if elapsed > 0 else 0.0
+            remaining = (len(jobs) - numDone) / rate if rate > 0 else 0.0
+            out.write("[%d/%d] %s %s  (%.2f captures/sec, about %d secs remaining)\n" % \
+                      (numDone, len(jobs), "FAILED" if failure else "done  ", captureFilename, rate, remaining))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return failures
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Repeat the detection and analysis for a directory of captures saved by the example testers.")
+    parser.add_argument("captureDir", type=str, help="Directory containing saved capture files.")
+    parser.add_argument("--pattern", dest="patterns", type=str, nargs="+", default=["*.json", "*"+capturearchive.ARCHIVE_EXTENSION], help="Filename patterns matching the saved capture files and capture archives in the directory (default \"*.json *"+capturearchive.ARCHIVE_EXTENSION+"\"). Result files are never treated as captures.")
+    parser.add_argument("--outputDir", dest="outputDir", type=str, default=None, help="Directory to write result files to (default is the same directory as the captures).")
+    parser.add_argument("--toleranceTest", dest="toleranceMillis", type=float, action="store", default=None, help="Do a pass/fail test on whether sync is accurate to within this specified tolerance, in milliseconds.")
+    parser.add_argument("--robustMatch", dest="robustMatch", action="store_true", default=False, help="Match observed flashes/beeps to expected ones in a way that tolerates missed or spurious detections.")
+    parser.add_argument("--adaptiveThresholds", dest="thresholdWindowSecs", type=float, default=None, help="Adapt flash/beep detection thresholds to changes in light or audio level, using a window of this many seconds (must always include at least one flash/beep).")
+    parser.add_argument("--detrend", dest="detrend", action="store_true", default=False, help="When matching observed flashes/beeps to expected ones, ignore any steady drift between them, so that drift does not count against a match.")
+    parser.add_argument("--holdCount", dest="holdCount", type=int, default=None, help="Number of samples (milliseconds) to hold the high state for when detecting flashes/beeps (default is chosen from the flash/beep duration).")
+    parser.add_argument("--minPulseDuration", dest="minPulseDuration", type=int, default=None, help="Minimum number of samples (milliseconds) a flash/beep must last for to be detected (default is chosen from the flash/beep duration).")
+    parser.add_argument("--processes", dest="numProcesses", type=int, default=None, help="Number of worker processes (default is the number of CPUs).")
+    args = parser.parse_args()
+
+    captureFilenames = set()
+    for pattern in args.patterns:
+        captureFilenames.update( f for f in glob.glob(os.path.join(args.captureDir, pattern)) if not f.endswith(".result.json") )
+    captureFilenames = sorted(captureFilenames)
+    if len(captureFilenames) == 0:
+        sys.stderr.write("\nNo saved captures found in %s\n\n" % args.captureDir)
+        sys.exit(1)
+
+    toleranceSecs = None
+    if args.toleranceMillis is not None:
+        toleranceSecs = args.toleranceMillis / 1000.0
+
+    jobs = [ (f, resultFilenameFor(f, args.outputDir), toleranceSecs, args.robustMatch, args.thresholdWindowSecs, \
+              args.detrend, args.holdCount, args.minPulseDuration) for f in captureFilenames ]
+
+    try:
+        failures = runBatch(jobs, args.numProcesses)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    print
+    print "Analysed %d captures. %d failed." % (len(jobs), len(failures))
+    for captureFilename, failure in failures:
+        print "    %s : %s" % (captureFilename, failure)
+
+    sys.exit(0 if len(failures) == 0 else 1)
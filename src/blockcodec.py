@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Compact encoding of sample data
+===============================
+
+Purpose and Usage
+-----------------
+
+Most millisecond blocks of sample data are quiet: the light level between flashes,
+or silence between beeps, barely changes from one block to the next. This module
+encodes the millisecond blocks (see :func:`arduino.capture` for their format) so
+that they can be transferred from the Arduino in fewer bytes (see
+:func:`arduino.compressedBulkTransferInto`), and decodes them again.
+
+The encoded data is a sequence of tokens. Each starts with a tag byte whose top
+two bits give the kind of token, and whose bottom six bits give the number of
+millisecond blocks it covers, minus one (so up to 64 blocks):
+
+* TOKEN_REPEAT ... the blocks are the same as the block before them. Nothing follows the tag.
+* TOKEN_DELTA  ... each high and low value differs from the one in the block before by -8 to +7.
+  One byte follows per pin per block: the change in the high value in the top four bits,
+  and the change in the low value in the bottom four bits (both two's complement).
+* TOKEN_RAW    ... the blocks follow unchanged.
+
+The block before the first block is taken to be all zeros.
+
+:func:`encodeBlocks` is the reference encoder (the Arduino sampling code, and
+:mod:`arduinoemulator`, encode in the same way). :func:`decodeBlocks` decodes
+back into the same layout that the Arduino sends for an ordinary bulk transfer,
+which can be passed straight to :func:`measurer.repackageSamples`.
+
+It is also a command line tool that benchmarks the encoding on synthetic sample
+data. Use `--help` at the command line for information on arguments.
+
+For example:
+
+    $ python blockcodec.py --pins 4 --secs 11
+
+'''
+
+import numpy
+
+
+BLK_SIZE_PER_PIN = 2
+
+TOKEN_REPEAT = 0x00
+TOKEN_DELTA  = 0x40
+TOKEN_RAW    = 0x80
+
+TOKEN_KIND_MASK = 0xc0
+MAX_RUN = 64
+
+DELTA_MIN = -8
+DELTA_MAX = 7
+
+
+def _blocksAndDeltas(samples, nActivePorts, nMilliBlocks):
+    stride = nActivePorts * BLK_SIZE_PER_PIN
+    blocks = numpy.frombuffer(samples, dtype=numpy.uint8, count=nMilliBlocks * stride).reshape(nMilliBlocks, stride)
+    previous = numpy.zeros((nMilliBlocks, stride), dtype=numpy.int16)
+    previous[1:] = blocks[:-1]
+    deltas = blocks.astype(numpy.int16) - previous
+    return blocks, deltas
+
+
+def classifyBlocks(samples, nActivePorts, nMilliBlocks):
+    """\
+    :param samples: the millisecond blocks of sample data (a string, bytearray or buffer)
+    :param nActivePorts: the number of pins sampled
+    :param nMilliBlocks: the number of millisecond blocks
+
+    :returns: numpy array with, for each millisecond block, the kind of token (TOKEN_REPEAT, TOKEN_DELTA or TOKEN_RAW)
+        that it is encoded in.
+    """
+    blocks, deltas = _blocksAndDeltas(samples, nActivePorts, nMilliBlocks)
+    isRepeat = numpy.all(deltas == 0, axis=1)
+    isDelta = numpy.all((deltas >= DELTA_MIN) & (deltas <= DELTA_MAX), axis=1)
+    return numpy.where(isRepeat, TOKEN_REPEAT, numpy.where(isDelta, TOKEN_DELTA, TOKEN_RAW))
+
+
+def encodeBlocks(samples, nActivePorts, nMilliBlocks):
+    """\
+    Encode millisecond blocks of sample data (see the description of the encoding above).
+
+    :param samples: the millisecond blocks of sample data (a string, bytearray or buffer)
+    :param nActivePorts: the number of pins sampled
+    :param nMilliBlocks: the number of millisecond blocks
+
+    :returns: bytearray containing the encoded sample data
+    """
+    encoded = bytearray()
+    if nMilliBlocks == 0:
+        return encoded
+
+    blocks, deltas = _blocksAndDeltas(samples, nActivePorts, nMilliBlocks)
+    kinds = classifyBlocks(samples, nActivePorts, nMilliBlocks)
+
+    # find each run of blocks that are encoded the same way
+    runStarts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(kinds)) + 1))
+    runEnds = numpy.concatenate((runStarts[1:], [nMilliBlocks]))
+
+    for runStart, runEnd in zip(runStarts, runEnds):
+        kind = int(kinds[runStart])
+        for start in range(runStart, runEnd, MAX_RUN):
+            end = min(runEnd, start + MAX_RUN)
+            encoded.append(kind | (end - start - 1))
+            if kind == TOKEN_RAW:
+                encoded.extend(blocks[start:end].tostring())
+            elif kind == TOKEN_DELTA:
+                nibbles = deltas[start:end] & 0x0f
+                encoded.extend(((nibbles[:, 0::2] << 4) | nibbles[:, 1::2]).astype(numpy.uint8).tostring())
+    return encoded
+
+
+def decodeBlocks(encoded, nActivePorts, nMilliBlocks, buffer=None):
+    """\
+    Decode encoded sample data back into millisecond blocks.
+
+    :param encoded: the encoded sample data (a string, bytearray or buffer), e.g. from :func:`encodeBlocks`
+    :param nActivePorts: the number of pins sampled
+    :param nMilliBlocks: the number of millisecond blocks
+    :param buffer: None, or a bytearray to decode the sample data into. If None, or too small, then a new bytearray is allocated.
+
+    :returns: tuple (buffer, numBytes) where the first numBytes bytes of buffer are the millisecond blocks of sample data,
+        in the same form as sent by the Arduino for an ordinary bulk transfer (see :func:`arduino.bulkTransferInto`)
+
+    :raises ValueError: if the encoded data is not valid, or does not contain exactly nMilliBlocks blocks
+    """
+    stride = nActivePorts * BLK_SIZE_PER_PIN
+    numBytes = nMilliBlocks * stride
+    if buffer is None or len(buffer) < numBytes:
+        buffer = bytearray(numBytes)
+    if nMilliBlocks == 0:
+        if len(encoded) > 0:
+            raise ValueError("Encoded sample data continues after the last block.")
+        return buffer, numBytes
+    data = numpy.frombuffer(encoded, dtype=numpy.uint8)
+
+    # first, unpack each block either as raw values, or as (wrapping) changes from the block before
+    values = numpy.zeros((nMilliBlocks, stride), dtype=numpy.uint8)
+    isRaw = numpy.zeros(nMilliBlocks, dtype=bool)
+    pos = 0
+    block = 0
+    while block < nMilliBlocks:
+        if pos >= len(data):
+            raise ValueError("Encoded sample data ends after "+str(block)+" of "+str(nMilliBlocks)+" blocks.")
+        tag = int(data[pos])
+        kind = tag & TOKEN_KIND_MASK
+        count = (tag & ~TOKEN_KIND_MASK) + 1
+        pos += 1
+        if block + count > nMilliBlocks:
+            raise ValueError("Encoded sample data contains more than "+str(nMilliBlocks)+" blocks.")
+
+        if kind == TOKEN_RAW:
+            size = count * stride
+            if pos + size > len(data):
+                raise ValueError("Encoded sample data ends part way through a token.")
+            values[block:block+count] = data[pos:pos+size].reshape(count, stride)
+            isRaw[block:block+count] = True
+        elif kind == TOKEN_DELTA:
+            size = count * nActivePorts
+            if pos + size > len(data):
+                raise ValueError("Encoded sample data ends part way through a token.")
+            packed = data[pos:pos+size].reshape(count, nActivePorts)
+            # sign extend each four bit change, wrapping to eight bits
+            values[block:block+count, 0::2] = ((packed >> 4) ^ 8) - 8
+            values[block:block+count, 1::2] = ((packed & 0x0f) ^ 8) - 8
+        elif kind == TOKEN_REPEAT:
+            size = 0
+        else:
+            raise ValueError("Unrecognised token in encoded sample data: "+hex(tag))
+        pos += size
+        block += count
+
+    if pos != len(data):
+        raise ValueError("Encoded sample data continues after the last block.")
+
+    # then accumulate the changes since the most recent raw block (or since the start)
+    changes = numpy.where(isRaw[:, numpy.newaxis], 0, values).astype(numpy.uint8)
+    cumulative = numpy.cumsum(changes, axis=0, dtype=numpy.uint8)
+    latestRaw = numpy.maximum.accumulate(numpy.where(isRaw, numpy.arange(nMilliBlocks), -1))
+    hasRaw = (latestRaw >= 0)[:, numpy.newaxis]
+    latestRaw = numpy.maximum(latestRaw, 0)
+    base = numpy.where(hasRaw, values[latestRaw], 0).astype(numpy.uint8) - numpy.where(hasRaw, cumulative[latestRaw], 0).astype(numpy.uint8)
+    decoded = (base + cumulative).astype(numpy.uint8)
+
+    buffer[:numBytes] = decoded.tostring()
+    return buffer, numBytes
+
+
+
+def syntheticBlocks(nActivePorts, nMilliBlocks, noise=2.0, eventIntervalSecs=1.0, eventDurationSecs=0.02, seed=None):
+    """\
+    Generate sample data like that captured while watching a test video sequence:
+    flat levels, with a flash or beep (a large change) at regular intervals.
+
+    :param nActivePorts: the number of pins sampled
+    :param nMilliBlocks: the number of millisecond blocks
+    :param noise: standard deviation of the noise added to every high and low value
+    :param eventIntervalSecs: time between the start of each flash or beep, in seconds
+    :param eventDurationSecs: duration of each flash or beep, in seconds
+    :param seed: None, or the seed for the random number generator
+
+    :returns: bytearray of millisecond blocks
+    """
+    random = numpy.random.RandomState(seed)
+    t = numpy.arange(nMilliBlocks) / 1000.0
+    during = numpy.mod(t, eventIntervalSecs) < eventDurationSecs
+    blocks = numpy.zeros((nMilliBlocks, nActivePorts, 2), dtype=numpy.float64)
+    for pin in range(0, nActivePorts):
+        if pin % 2 == 0:
+            blocks[:, pin, 0] = blocks[:, pin, 1] = numpy.where(during, 200.0, 10.0)
+        else:
+            blocks[:, pin, 0] = numpy.where(during, 230.0, 128.0)
+            blocks[:, pin, 1] = numpy.where(during, 26.0, 128.0)
+    if noise > 0:
+        blocks += random.normal(0.0, noise, blocks.shape)
+    blocks = numpy.clip(numpy.round(blocks), 0, 255).astype(numpy.uint8)
+    hi = numpy.maximum(blocks[:, :, 0], blocks[:, :, 1])
+    lo = numpy.minimum(blocks[:, :, 0], blocks[:, :, 1])
+    return bytearray(numpy.dstack((hi, lo)).tostring())
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Benchmark the compact encoding of sample data, using synthetic sample data.")
+    parser.add_argument("--pins", dest="nActivePorts", type=int, default=4, help="Number of pins sampled (default 4).")
+    parser.add_argument("--secs", dest="secs", type=int, default=11, help="Duration of the sample data in seconds (default 11).")
+    parser.add_argument("--linkBytesPerSec", dest="linkBytesPerSec", type=float, default=100000.0, help="Throughput of the connection to the Arduino, used to estimate transfer times (default 100000).")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=5, help="Number of times to encode and decode, to time them (default 5).")
+    args = parser.parse_args()
+
+    nMilliBlocks = args.secs * 1000
+    print "%d pins, %d seconds, %d bytes of sample data\n" % (args.nActivePorts, args.secs, nMilliBlocks * args.nActivePorts * BLK_SIZE_PER_PIN)
+    print "%-10s %10s %7s %14s %14s %12s %12s" % ("noise", "encoded", "ratio", "encode MB/s", "decode MB/s", "raw xfer s", "enc xfer s")
+    for noise in [0.0, 1.0, 2.0, 4.0, 8.0]:
+        samples = syntheticBlocks(args.nActivePorts, nMilliBlocks, noise, seed=1)
+
+        startTime = time.time()
+        for i in range(0, args.repeats):
+            encoded = encodeBlocks(samples, args.nActivePorts, nMilliBlocks)
+        encodeSecs = (time.time() - startTime) / args.repeats
+
+        startTime = time.time()
+        for i in range(0, args.repeats):
+            decoded, numBytes = decodeBlocks(encoded, args.nActivePorts, nMilliBlocks)
+        decodeSecs = (time.time() - startTime) / args.repeats
+
+        assert decoded[:numBytes] == samples
+        print "%-10.1f %10d %7.2f %14.1f %14.1f %12.3f %12.3f" % (noise, len(encoded), float(len(samples)) / len(encoded),
+                                                           len(samples) / encodeSecs / 1000000, len(samples) / decodeSecs / 1000000,
+                                                           len(samples) / args.linkBytesPerSec, len(encoded) / args.linkBytesPerSec)
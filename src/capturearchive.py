@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+A compact binary file format for archiving captures: the raw sample data exactly as
+received from the Arduino, plus all of the timing information needed to repeat the
+detection and analysis later (see :mod:`capturestore`).
+
+The sample data is memory mapped when an archive is read, and each pin's data is
+a numpy view onto it, so it is only read from disk when (and if) it is used.
+
+File layout
+-----------
+
+All values are little-endian.
+
+* Header (fixed size of :data:`HEADER_SIZE` bytes), see :data:`HEADER`:
+  magic string ("DVBCSSCA"), format version, number of active pins, number of
+  millisecond blocks, the Arduino times (nanos) at which sampling started and
+  finished, and the offset and size of each of the sections that follow.
+* Sample data: nMilliBlocks millisecond blocks, each containing a high then a low
+  byte for each active pin (the same as sent by the Arduino, see :func:`arduino.capture`).
+* Wall clock / Arduino clock request-response timings: 8 x int64 (t1, t2, t3, t4 for "pre", then for "post").
+* Wall clock to sync timeline correlations: table of :data:`CORRELATION_DTYPE`.
+* Dispersion history: table of :data:`DISPERSION_DTYPE`.
+* Metadata: JSON object with everything else in a capture record (role, expected timings,
+  tick rate, the pin name of each channel in the order they appear in the sample data,
+  how the sample data was transferred from the Arduino, etc).
+
+Usage:
+
+.. code-block:: python
+
+    capturearchive.writeArchive("capture.dvbcap", record, samples, nMilliBlocks)
+
+    archive = capturearchive.CaptureArchive("capture.dvbcap")
+    record = archive.record()
+    print archive.channel("LIGHT_0")["max"][:10]
+
+"""
+
+import json
+import mmap
+import struct
+
+import numpy
+
+
+ARCHIVE_EXTENSION = ".dvbcap"
+
+MAGIC = "DVBCSSCA"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHHIIqqQQQQQQQQQ")
+HEADER_SIZE = 128
+
+REQ_RESP_DTYPE = numpy.dtype("<i8")
+CORRELATION_DTYPE = numpy.dtype([ ("when", "<i8"), ("wcTime", "<i8"), ("stTime", "<f8"), ("speed", "<f8") ])
+DISPERSION_DTYPE = numpy.dtype([ ("when", "<i8"), ("adjustment", "<f8"), ("oldDispersion", "<f8"), ("newDispersion", "<f8"), ("growthRate", "<f8") ])
+
+BLK_SIZE_PER_PIN = 2     # same as arduino.BLK_SIZE_PER_PIN
+
+
+def _int64(value):
+    if int(value) != value:
+        raise ValueError("Expected a whole number (of nanoseconds or ticks) but got "+repr(value))
+    return int(value)
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+def isArchive(filename):
+    """\
+    :param filename: name of a file
+    :returns: True if the file is a capture archive (starts with the magic string)
+    """
+    f = open(filename, "rb")
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.close()
+
+
+def writeArchive(filename, record, samples, nMilliBlocks):
+    """\
+    Write a capture to an archive file.
+
+    :param filename: name of the file to write to
+    :param record: the capture record (see :func:`measurer.Measurer.getCaptureRecord`). The channels need only
+        have "pinName", "isAudio" and "eventDuration" entries, and must be in the order the pins appear in the sample data.
+        If the flashes and beeps were detected by the Arduino, then each channel's "pulseEvents" are kept too (and there is no sample data).
+    :param samples: the raw sample data (a string, bytearray or numpy array of bytes) as received from the Arduino
+    :param nMilliBlocks: the number of millisecond blocks in the sample data
+    """
+    nActivePins = len(record["channels"])
+    payload = numpy.frombuffer(samples, dtype=numpy.uint8, count=nMilliBlocks * nActivePins * BLK_SIZE_PER_PIN)
+
+    reqResp = numpy.array([ _int64(t) for t in list(record["wcAcReqResp"]["pre"]) + list(record["wcAcReqResp"]["post"]) ], dtype=REQ_RESP_DTYPE)
+    correlations = numpy.array([ (_int64(when), _int64(wcTime), stTime, speed) for when, (wcTime, stTime, speed) in record["wcSyncTimeCorrelations"] ], dtype=CORRELATION_DTYPE)
+    dispersions = numpy.array([ (_int64(when), adjustment, old, new, rate) for when, adjustment, old, new, rate in record["dispersionHistory"] ], dtype=DISPERSION_DTYPE)
+
+    metadata = {}
+    for key in ("role", "pinsToMeasure", "expectedTimings", "eventDurations", "videoStartTicks", "syncTimelineTickRate", "wcPrecisionNanos", "acPrecisionNanos"):
+        metadata[key] = record[key]
+    metadata["channels"] = [ { "pinName": c["pinName"], "isAudio": c["isAudio"], "eventDuration": c["eventDuration"] } for c in record["channels"] ]
+    for channel, c in zip(metadata["channels"], record["channels"]):
+        if c.get("pulseEvents", None) is not None:
+            channel["pulseEvents"] = [ (_int64(start), _int64(end)) for start, end in c["pulseEvents"] ]
+    if "bulkTransfer" in record:
+        metadata["bulkTransfer"] = record["bulkTransfer"]
+    if "patternWindowLengths" in record:
+        metadata["patternWindowLengths"] = record["patternWindowLengths"]
+    if record.get("compiledConversion", None) is not None:
+        metadata["compiledConversion"] = record["compiledConversion"]
+    metadata = json.dumps(metadata)
+
+    payloadOffset = HEADER_SIZE
+    reqRespOffset = _align(payloadOffset + payload.nbytes)
+    correlationsOffset = _align(reqRespOffset + reqResp.nbytes)
+    dispersionOffset = _align(correlationsOffset + correlations.nbytes)
+    metadataOffset = _align(dispersionOffset + dispersions.nbytes)
+
+    header = HEADER.pack(MAGIC, VERSION, nActivePins, nMilliBlocks, 0,
+                         _int64(record["dueStartTimeUsecs"]), _int64(record["dueFinishTimeUsecs"]),
+                         payloadOffset, payload.nbytes,
+                         reqRespOffset,
+                         correlationsOffset, len(correlations),
+                         dispersionOffset, len(dispersions),
+                         metadataOffset, len(metadata))
+
+    f = open(filename, "wb")
+    try:
+        for offset, data in [ (0, header), (payloadOffset, payload.tostring()), (reqRespOffset, reqResp.tostring()),
+                              (correlationsOffset, correlations.tostring()), (dispersionOffset, dispersions.tostring()),
+                              (metadataOffset, metadata) ]:
+            f.write("\0" * (offset - f.tell()))
+            f.write(data)
+    finally:
+        f.close()
+
+
+class CaptureArchive(object):
+
+    def __init__(self, filename):
+        """\
+        Open a capture archive file for reading. The timing information is read immediately.
+        The sample data is memory mapped, and is only read when it is used.
+
+        The file is unmapped once this object, and all of the sample data arrays obtained from it, are no longer used.
+
+        :param filename: name of the archive file
+        :throws ValueError: if the file is not a capture archive, or is a version that is not supported
+        """
+        super(CaptureArchive, self).__init__()
+        f = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if len(self._map) < HEADER_SIZE:
+            raise ValueError("File is too short to be a capture archive: "+filename)
+        (magic, version, self.nActivePins, self.nMilliBlocks, reserved,
+         self.dueStartTimeNanos, self.dueFinishTimeNanos,
+         payloadOffset, payloadLength,
+         reqRespOffset,
+         correlationsOffset, numCorrelations,
+         dispersionOffset, numDispersions,
+         metadataOffset, metadataLength) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a capture archive: "+filename)
+        if version != VERSION:
+            raise ValueError("Unsupported capture archive version "+str(version)+": "+filename)
+
+        self._payloadOffset = payloadOffset
+        self._payloadLength = payloadLength
+
+        reqResp = numpy.frombuffer(self._map, dtype=REQ_RESP_DTYPE, count=8, offset=reqRespOffset).tolist()
+        self.wcAcReqResp = { "pre": tuple(reqResp[0:4]), "post": tuple(reqResp[4:8]) }
+
+        correlations = numpy.frombuffer(self._map, dtype=CORRELATION_DTYPE, count=numCorrelations, offset=correlationsOffset)
+        self.wcSyncTimeCorrelations = [ (when, (wcTime, stTime, speed)) for when, wcTime, stTime, speed in correlations.tolist() ]
+
+        dispersions = numpy.frombuffer(self._map, dtype=DISPERSION_DTYPE, count=numDispersions, offset=dispersionOffset)
+        self.dispersionHistory = dispersions.tolist()
+
+        self.metadata = json.loads(self._map[metadataOffset:metadataOffset+metadataLength])
+
+    def channel(self, pinName):
+        """\
+        :param pinName: one of "LIGHT_0", "AUDIO_0", "LIGHT_1", "AUDIO_1"
+        :returns: dict { "pinName", "isAudio", "eventDuration", "min", "max" } where min and max are numpy arrays
+            that are views onto the memory mapped sample data. If the flashes or beeps were detected by the Arduino,
+            then the dict instead has "pulseEvents" (see :func:`analyse.runDetection`) and no "min" or "max".
+        :throws KeyError: if the pin was not captured
+        """
+        stride = self.nActivePins * BLK_SIZE_PER_PIN
+        for i, channel in enumerate(self.metadata["channels"]):
+            if channel["pinName"] == pinName and "pulseEvents" in channel:
+                channel = dict(channel)
+                channel["pulseEvents"] = [ tuple(event) for event in channel["pulseEvents"] ]
+                return channel
+            if channel["pinName"] == pinName:
+                data = numpy.frombuffer(self._map, dtype=numpy.uint8, count=self._payloadLength, offset=self._payloadOffset)
+                channel = dict(channel)
+                channel["max"] = data[i*BLK_SIZE_PER_PIN::stride]
+                channel["min"] = data[i*BLK_SIZE_PER_PIN+1::stride]
+                return channel
+        raise KeyError(pinName)
+
+    def record(self, pinNames=None):
+        """\
+        :param pinNames: None, or a list of the names of the pins to include (default is all of them)
+        :returns: a capture record (see :func:`measurer.Measurer.getCaptureRecord`), except that the
+            sample data for each channel is a numpy array (see :func:`channel`) instead of a list
+        """
+        if pinNames is None:
+            pinNames = [ channel["pinName"] for channel in self.metadata["channels"] ]
+        record = dict(self.metadata)
+        record["channels"] = [ self.channel(pinName) for pinName in pinNames ]
+        record["dueStartTimeUsecs"] = self.dueStartTimeNanos
+        record["dueFinishTimeUsecs"] = self.dueFinishTimeNanos
+        record["wcAcReqResp"] = self.wcAcReqResp
+        record["wcSyncTimeCorrelations"] = self.wcSyncTimeCorrelations
+        record["dispersionHistory"] = self.dispersionHistory
+        return record
+
+
+
+if __name__ == '__main__':
+    # unit tests in:
+    #    ../tests/test_capturestore.py
+    pass
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""\
+Functions to save captures to, and load captures from, JSON files, and to repeat the
+detection and analysis of a saved capture without the Arduino.
+
+A capture record is the dict returned by :func:`measurer.Measurer.getCaptureRecord`.
+It contains the sampled data for each pin, the expected timings, and the clock
+correlations and dispersions needed to convert sample times to sync timeline times.
+
+Usage:
+
+.. code-block:: python
+
+    record = capturestore.loadCapture("capture.json")
+    for result in capturestore.analyseCapture(record, toleranceSecs=0.010):
+        print result["pinName"], result["stats"]["meanOffset"]
+
+"""
+
+import json
+
+import analyse
+import capturearchive
+import detect
+import stats
+from dispersion import dispersionAtFromHistory
+
+
+def saveCapture(filename, record):
+    """\
+    Save a capture record to a JSON file.
+
+    :param filename: name of the file to write to
+    :param record: the capture record (see :func:`measurer.Measurer.getCaptureRecord`)
+    """
+    f = open(filename, "wb")
+    try:
+        json.dump(record, f)
+    finally:
+        f.close()
+
+
+def loadCapture(filename):
+    """\
+    Load a capture record from a JSON file, or from a capture archive file (see :mod:`capturearchive`).
+
+    :param filename: name of the file to read from
+    :returns: the capture record (see :func:`measurer.Measurer.getCaptureRecord`). If loaded from a capture
+        archive, then the sample data for each channel is a numpy array instead of a list.
+    """
+    if capturearchive.isArchive(filename):
+        return capturearchive.CaptureArchive(filename).record()
+
+    f = open(filename, "rb")
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def _buildDetector(record, thresholdWindowSecs=None, holdCount=None, minPulseDuration=None):
+    def dispersionFunc(wcTime):
+        return dispersionAtFromHistory(record["dispersionHistory"], wcTime)
+
+    return detect.BeepFlashDetector(record["wcAcReqResp"], record["syncTimelineTickRate"], \
+                                    record["wcSyncTimeCorrelations"], dispersionFunc, \
+                                    record["wcPrecisionNanos"], record["acPrecisionNanos"], \
+                                    thresholdWindowSecs=thresholdWindowSecs, holdCount=holdCount, \
+                                    minPulseDuration=minPulseDuration)
+
+
+def compileConversion(record):
+    """\
+    Compile the conversion from arduino time to sync timeline time for a capture (see :func:`detect.ArduinoToSyncTimelineTime.compile`),
+    so that it can be saved in the capture record (as "compiledConversion", see :func:`detect.CompiledArduinoToSyncTimelineTime.toDict`).
+
+    :param record: the capture record (see :func:`measurer.Measurer.getCaptureRecord`)
+    :returns: a :class:`detect.CompiledArduinoToSyncTimelineTime`, or None if the conversion cannot be compiled
+    """
+    try:
+        return _buildDetector(record).compileConversion(record["dueStartTimeUsecs"], record["dueFinishTimeUsecs"], \
+                                                        [ changeInfo[0] for changeInfo in record["dispersionHistory"] ])
+    except ValueError:
+        return None
+
+
+def detectorForCapture(record, thresholdWindowSecs=None, holdCount=None, minPulseDuration=None):
+    """\
+    Create a detector for the flashes/beeps in a capture. If the capture record contains a compiled conversion
+    from arduino time to sync timeline time ("compiledConversion") then that is used. Otherwise the conversion is
+    built from the clock correlations and dispersions in the record, and compiled if possible.
+
+    :param record: the capture record (see :func:`measurer.Measurer.getCaptureRecord`)
+    :param thresholdWindowSecs: None, or the duration (in seconds) of a window over which detection thresholds adapt (see :class:`detect.BeepFlashDetector`)
+    :param holdCount: None, or the number of samples to hold a high state for during pulse detection (see :class:`detect.BeepFlashDetector`)
+    :param minPulseDuration: None, or the minimum number of samples a pulse must last for (see :class:`detect.BeepFlashDetector`)
+    :returns: a :class:`detect.BeepFlashDetector`
+    """
+    if record.get("compiledConversion", None) is not None:
+        ac2st = detect.CompiledArduinoToSyncTimelineTime.fromDict(record["compiledConversion"])
+        return detect.BeepFlashDetector(None, record["syncTimelineTickRate"], None, None, None, None, \
+                                        thresholdWindowSecs=thresholdWindowSecs, ac2st=ac2st, \
+                                        holdCount=holdCount, minPulseDuration=minPulseDuration)
+
+    detector = _buildDetector(record, thresholdWindowSecs, holdCount, minPulseDuration)
+    try:
+        detector.compileConversion(record["dueStartTimeUsecs"], record["dueFinishTimeUsecs"], \
+                                   [ changeInfo[0] for changeInfo in record["dispersionHistory"] ])
+    except ValueError:
+        # cannot be compiled to straight line segments, so convert using the uncompiled conversion
+        pass
+    return detector
+
+
+def analyseCapture(record, toleranceSecs=None, robustMatch=False, thresholdWindowSecs=None, detrend=False, holdCount=None, minPulseDuration=None):
+    """\
+    Repeat the detection of flashes/beeps for a saved capture, and compare them against
+    the expected timings, in the same way as the example testers do.
+
+    :param record: the capture record (see :func:`measurer.Measurer.getCaptureRecord`)
+    :param toleranceSecs: None, or a tolerance (in seconds) for a pass/fail judgement (see :func:`stats.calcStats`)
+    :param robustMatch: if True, match using :func:`analyse.doRobustComparison` instead of :func:`analyse.doComparison`
+    :param thresholdWindowSecs: None, or the duration (in seconds) of a window over which detection thresholds adapt to the local light or audio level (see :func:`detect.calcFlashThresholds`)
+    :param detrend: if True (and robustMatch is False), rank matches by the variance remaining after removing any slope due to drift (see :func:`analyse.doComparison`)
+    :param holdCount: None, or the number of samples to hold a high state for during pulse detection, instead of the one chosen from the flash/beep duration
+    :param minPulseDuration: None, or the minimum number of samples a flash/beep must last for, instead of the one chosen from the flash/beep duration
+        (holdCount and minPulseDuration have no effect on flashes/beeps that were detected by the Arduino during the capture)
+
+    :returns: a list with one dict per pin, that can be serialised as JSON.
+        The dict is { "pinName": pin name, "numObserved": number of flashes/beeps detected,
+        "error": None, or a description of why the pin could not be measured,
+        "matchIndex", "stats" (see :func:`stats.calcStats`), "drift" (see :func:`analyse.fitDrift`),
+        "unmatchedObserved", "missedExpected", "pairedExpectedIndices" and "pairedObservedIndices"
+        (only if robustMatch is True) }.
+        Units are seconds since the start of the test video sequence.
+    """
+    tickRate = record["syncTimelineTickRate"]
+    videoStartTicks = record["videoStartTicks"]
+
+    detector = detectorForCapture(record, thresholdWindowSecs, holdCount, minPulseDuration)
+    observedTimings = analyse.runDetection(detector, record["channels"], record["dueStartTimeUsecs"], record["dueFinishTimeUsecs"])
+
+    results = []
+    for timing in observedTimings:
+        pinName = timing["pinName"]
+        observed = timing["observed"]
+        expectedTimesSecs = record["expectedTimings"][pinName]
+        result = { "pinName": pinName, "numObserved": len(observed), "error": None }
+        results.append(result)
+
+        if len(observed) == 0 or (not robustMatch and len(observed) > len(expectedTimesSecs)):
+            result["error"] = "poor data or no data"
+            continue
+
+        try:
+            windowIndex = analyse.MlsWindowIndex(expectedTimesSecs, record.get("patternWindowLengths", {}).get(pinName, None))
+        except ValueError:
+            windowIndex = None
+
+        test = (observed, expectedTimesSecs)
+        if robustMatch:
+            matchIndex, expected, diffsAndErrors, unmatched, missed, pairedExpected, pairedObserved, drift = \
+                analyse.doRobustComparison(test, videoStartTicks, tickRate, windowIndex, withDrift=True)
+            result["unmatchedObserved"] = unmatched
+            result["missedExpected"] = missed
+            result["pairedExpectedIndices"] = pairedExpected
+            result["pairedObservedIndices"] = pairedObserved
+            if matchIndex < 0:
+                result["error"] = "poor data"
+                continue
+        else:
+            matchIndex, expected, diffsAndErrors, drift = \
+                analyse.doComparison(test, videoStartTicks, tickRate, windowIndex, detrend=detrend, withDrift=True)
+
+        # convert everything to units of seconds
+        expectedSecs = [ ((e-videoStartTicks) / tickRate) for e in expected ]
+        diffsAndErrorsSecs = [ (d/tickRate, e/tickRate) for (d,e) in diffsAndErrors ]
+
+        result["matchIndex"] = matchIndex
+        result["stats"] = stats.calcStats(matchIndex, expectedSecs, diffsAndErrorsSecs, toleranceSecs)
+        result["drift"] = { "offset": drift["offset"] / tickRate,
+                            "driftPpm": drift["driftPpm"],
+                            "residualStdDev": drift["residualStdDev"] / tickRate,
+                            "centreTime": (drift["centreTime"] - videoStartTicks) / tickRate }
+
+    return results
+
+
+
+if __name__ == '__main__':
+    # unit tests in:
+    #    ../tests/test_capturestore.py
+    pass
@@ -202,6 +202,10 @@ each in units of ticks of the synchronisation timeline.
 
 """
 
+import bisect
+import math
+import numpy
+
 # ---------------------------------------------------------------------------
 
 
@@ -245,9 +249,16 @@ class ConvertAtoB(object):
         super(ConvertAtoB, self).__init__()
         self.a1, self.b1 = (a1, b1)
         self.a2, self.b2 = (a2, b2)
+        self.slope = float(self.b2-self.b1) / (self.a2-self.a1)
     
     def __call__(self, a):
-        return (float(a) - self.a1) * (self.b2-self.b1) / (self.a2-self.a1) + self.b1
+        """\
+        :param a: Value in reference frame A, or a numpy array of values
+        :returns: Corresponding value in reference frame B, or a numpy array of values
+        """
+        if isinstance(a, numpy.ndarray):
+            return (a.astype(numpy.float64) - self.a1) * self.slope + self.b1
+        return (float(a) - self.a1) * self.slope + self.b1
     
 
 
@@ -260,6 +271,8 @@ class ErrorBoundInterpolator(object):
         
         
         Will not work outside the bounds    
+
+        Can be called with a single value, or a numpy array of values (returning a numpy array of error bounds).
         """
         super(ErrorBoundInterpolator,self).__init__()
         if v1 >= v2:
@@ -269,7 +282,11 @@ class ErrorBoundInterpolator(object):
         self._a2b = ConvertAtoB( (v1, abs(e1)), (v2, abs(e2)) )
         
     def __call__(self, v):
-        if v<self.lo or v>self.hi:
+        if isinstance(v, numpy.ndarray):
+            outside = (v < self.lo) | (v > self.hi)
+            if numpy.any(outside):
+                raise ValueError("Cannot extrapolate error for values at indices "+str(numpy.flatnonzero(outside).tolist())+" because they are outside of the range from "+str(self.lo)+" to "+str(self.hi)+" covered by the interpolator.")
+        elif v<self.lo or v>self.hi:
             raise ValueError("Cannot extrapolate error for "+str(v)+" because it is outside of the range from "+str(self.lo)+" to "+str(self.hi)+" covered by the interpolator.")
         return self._a2b(v)
 
@@ -319,7 +336,22 @@ class TimelineReconstructor(object):
         self.parentTickRate = float(parentTickRate)
         self.childTickRate = float(childTickRate)
         self.interpolate = interpolate
-        
+
+        # segment table: the times at which each control timestamp arrived (for bisect lookup)
+        # and, for each, whether conversions between it and the next are to be interpolated
+        self._whens = [ when for when, cT in self.controlTimestamps ]
+        self._interpolates = []
+        for i in range(0, len(self.controlTimestamps)):
+            hasNext = i+1 < len(self.controlTimestamps)
+            self._interpolates.append(self.interpolate and hasNext and self.controlTimestamps[i][1][2] == self.controlTimestamps[i+1][1][2])
+
+        # the same segment table, as numpy arrays, for :func:`convert`
+        self._whenArray    = numpy.asarray(self._whens)
+        self._parentArray  = numpy.asarray([ cT[0] for when, cT in self.controlTimestamps ])
+        self._childArray   = numpy.asarray([ cT[1] for when, cT in self.controlTimestamps ])
+        self._speedArray   = numpy.asarray([ cT[2] for when, cT in self.controlTimestamps ])
+        self._interpolateArray = numpy.asarray(self._interpolates, dtype=bool)
+
     def __call__(self, parentTime, at=None):
         """\
         :param v: Time on the parent timeline to be converted
@@ -332,27 +364,16 @@ class TimelineReconstructor(object):
         
         # first find the control timestamp "most recent" and the one after
         # (if there is one)
-        controlTimestamp = None
-        nextControlTimestamp = None
-        for when, cT in self.controlTimestamps:
-            if when <= at:
-                controlTimestamp = when, cT
-            else:
-                nextControlTimestamp = when, cT
-                break
+        i = bisect.bisect_right(self._whens, at) - 1
             
-        if controlTimestamp is None:
+        if i < 0:
             raise ValueError("Asked for a conversion at a time at which no control timestamps had yet arrived.")
 
-        tWhen, (tParent, tChild, tSpeed) = controlTimestamp
-        
-        if nextControlTimestamp is not None:
-            nWhen, (nParent, nChild, nSpeed) = nextControlTimestamp
-        else:
-            nWhen, (nParent, nChild, nSpeed) = None, (None,None,None)
+        tWhen, (tParent, tChild, tSpeed) = self.controlTimestamps[i]
         
         # if there is a next control timestamp and speed matches, then try to interpolate
-        if self.interpolate and nextControlTimestamp is not None and tSpeed == nSpeed:
+        if self._interpolates[i]:
+            nWhen, (nParent, nChild, nSpeed) = self.controlTimestamps[i+1]
 
             # calc what time would be using the most recent (tXXX) and next (nXXX)
             # control timestamps
@@ -366,6 +387,48 @@ class TimelineReconstructor(object):
         else:
             # else perform by extrapolation, ignoring the next control timestamp 
             return (parentTime - tParent) * tSpeed / self.parentTickRate * self.childTickRate + tChild
+
+    def breakpoints(self):
+        """\
+        :returns: list of the parent timeline times at which control timestamps arrived. Between consecutive
+            values (if at is not specified), the conversion is a straight line (see :func:`ArduinoToSyncTimelineTime.compile`).
+        """
+        return list(self._whens)
+
+    def convert(self, parentTimes, at=None):
+        """\
+        Convert several parent timeline times at once. Gives exactly the same results
+        as calling this object for each.
+
+        :param parentTimes: list or numpy array of times on the parent timeline to be converted
+        :param at: None, or a time, or list or numpy array of times (one per parent time) on the parent timeline at which to make each conversion
+        :returns: numpy array of corresponding times on the reconstructed timeline
+        """
+        parentTimes = numpy.asarray(parentTimes)
+        if at is None:
+            at = parentTimes
+        parentTimes, at = numpy.broadcast_arrays(parentTimes, numpy.asarray(at))
+
+        i = numpy.searchsorted(self._whenArray, at, side="right") - 1
+        if numpy.any(i < 0):
+            raise ValueError("Asked for a conversion at a time at which no control timestamps had yet arrived. Indices: "+str(numpy.flatnonzero(i < 0).tolist()))
+
+        t = (parentTimes - self._parentArray[i]) * self._speedArray[i] / self.parentTickRate * self.childTickRate + self._childArray[i]
+
+        interpolate = self._interpolateArray[i]
+        if not numpy.any(interpolate):
+            return t
+
+        # interpolate towards the conversion using the next control timestamp, where appropriate
+        k = i[interpolate]
+        p = parentTimes[interpolate]
+        tWhen = self._whenArray[k]
+        nWhen = self._whenArray[k+1]
+        n = (p - self._parentArray[k+1]) * self._speedArray[k+1] / self.parentTickRate * self.childTickRate + self._childArray[k+1]
+        tk = t[interpolate]
+        result = numpy.array(t, dtype=numpy.float64)
+        result[interpolate] = (at[interpolate].astype(numpy.float64) - tWhen) * ((n - tk) / (nWhen - tWhen)) + tk
+        return result
         
 
 # ---------------------------------------------------------------------------
@@ -406,54 +469,296 @@ class ArduinoToSyncTimelineTime(object):
 
         return (stTicks, errorTicks)
 
+    def convertArray(self, aNanos):
+        """\
+        Convert several arduino clock times (in nanos) at once. Equivalent to calling this object for each.
+
+        If the conversion functions are :class:`ConvertAtoB`, :class:`ErrorBoundInterpolator` and
+        :class:`TimelineReconstructor` objects, then they convert the whole array in one go.
+        Otherwise they are called once per arduino time.
+
+        :param aNanos: list or numpy array of arduino times (in nanos)
+        :returns: tuple (<syncTimelineTicks>, <errorBoundTicks>) of numpy arrays, with one value for each arduino time
+        """
+        aNanos = numpy.asarray(aNanos, dtype=numpy.float64)
+        if isinstance(self.convAcWc, ConvertAtoB) and isinstance(self.calcAcErr, (ConvertAtoB, ErrorBoundInterpolator)) and isinstance(self.convWcSt, TimelineReconstructor):
+            wcNanos = self.convAcWc(aNanos)
+            stTicks = self.convWcSt.convert(wcNanos)
+            wcDisps = numpy.array([ self.wcDispCalc(wcTime) for wcTime in wcNanos.tolist() ], dtype=numpy.float64)
+            errorNanos = self.calcAcErr(aNanos) + wcDisps
+            errorTicks = errorNanos * self.stTickRate / 1000000000.0
+            errorTicks = errorTicks + 1.0
+            return stTicks, errorTicks
+
+        stTicks = numpy.empty(len(aNanos))
+        errorTicks = numpy.empty(len(aNanos))
+        for i, aTime in enumerate(aNanos.tolist()):
+            stTicks[i], errorTicks[i] = self(aTime)
+        return stTicks, errorTicks
+
+    def compile(self, acStartNanos, acEndNanos, wcBreakpoints=()):
+        """\
+        Fold the conversion functions into a single table of straight line segments (see
+        :class:`CompiledArduinoToSyncTimelineTime`) covering a range of arduino times, that
+        converts many arduino times in one pass.
+
+        Within the range, all of the conversion functions are straight lines, except at
+        the times at which control timestamps arrived or the wall clock was adjusted. These
+        breakpoints are obtained from the `breakpoints` method of the functions (if they have one)
+        and from the wcBreakpoints argument. Each segment is checked by comparing against this
+        object near both of its ends and at its midpoint, allowing for float64 rounding (which grows
+        with the magnitude of the clock values).
+
+        :param acStartNanos: arduino time (nanos) of the start of the range
+        :param acEndNanos: arduino time (nanos) of the end of the range
+        :param wcBreakpoints: list of additional wall clock times (nanos) at which the conversion or
+            the dispersion may change gradient (e.g. the times of changes in dispersion recorded by
+            :class:`dispersion.DispersionRecorder`)
+        :returns: a :class:`CompiledArduinoToSyncTimelineTime`
+        :throws ValueError: if the range is empty, or the conversion is not a straight line between the breakpoints
+        """
+        if not acStartNanos < acEndNanos:
+            raise ValueError("Start of range must be before the end.")
+
+        wcStart = self.convAcWc(acStartNanos)
+        wcEnd = self.convAcWc(acEndNanos)
+
+        wcBreakpoints = list(wcBreakpoints)
+        for func in (self.convWcSt, self.wcDispCalc):
+            if hasattr(func, "breakpoints"):
+                wcBreakpoints.extend(func.breakpoints())
+
+        acBreakpoints = [ acStartNanos, acEndNanos ]
+        if hasattr(self.calcAcErr, "breakpoints"):
+            acBreakpoints.extend(self.calcAcErr.breakpoints())
+        for wcTime in wcBreakpoints:
+            acBreakpoints.append(acStartNanos + (wcTime - wcStart) * float(acEndNanos - acStartNanos) / (wcEnd - wcStart))
+        breakpoints = numpy.unique([ float(b) for b in acBreakpoints if acStartNanos <= b <= acEndNanos ])
+
+        stIntercepts, stSlopes, errIntercepts, errSlopes = [], [], [], []
+        for segStart, segEnd in zip(breakpoints[:-1], breakpoints[1:]):
+            length = segEnd - segStart
+            x1, x2 = segStart + length / 3.0, segStart + length * 2.0 / 3.0
+            (st1, err1), (st2, err2) = self(x1), self(x2)
+
+            stSlope = (st2 - st1) / (x2 - x1)
+            errSlope = (err2 - err1) / (x2 - x1)
+            stIntercept = st1 - stSlope * (x1 - segStart)
+            errIntercept = err1 - errSlope * (x1 - segStart)
+
+            # check near both ends, as well as the middle, so that a missing breakpoint anywhere in the segment is noticed.
+            # The ends are checked just inside the segment, because breakpoints converted from wall clock times are
+            # only accurate to within float64 rounding, and the conversion can jump at a breakpoint.
+            inset = min(length / 1000.0, 1000.0)
+            for x in (segStart + inset, segStart + length / 2.0, segEnd - inset):
+                st, err = self(x)
+                stFitted = stIntercept + stSlope * (x - segStart)
+                errFitted = errIntercept + errSlope * (x - segStart)
+
+                # the conversion is calculated via wall clock times, which are large (nanos since the epoch), so
+                # float64 rounding alone causes deviations that grow with the size of the values being compared
+                magnitude = abs(self.convAcWc(x)) + abs(x) + length
+                stTolerance = 16 * numpy.finfo(numpy.float64).eps * (max(abs(st), abs(stIntercept)) + abs(stSlope) * magnitude)
+                errTolerance = 16 * numpy.finfo(numpy.float64).eps * (max(abs(err), abs(errIntercept)) + abs(errSlope) * magnitude)
+                if abs(stFitted - st) > stTolerance or abs(errFitted - err) > errTolerance:
+                    raise ValueError("Conversion is not a straight line between arduino times "+str(segStart)+" and "+str(segEnd)+". Breakpoints are missing.")
+
+            stIntercepts.append(stIntercept)
+            stSlopes.append(stSlope)
+            errIntercepts.append(errIntercept)
+            errSlopes.append(errSlope)
+
+        return CompiledArduinoToSyncTimelineTime(breakpoints.tolist(), stIntercepts, stSlopes, errIntercepts, errSlopes)
+
+
+class CompiledArduinoToSyncTimelineTime(object):
+    def __init__(self, breakpoints, stIntercepts, stSlopes, errIntercepts, errSlopes):
+        """\
+        Converts arduino times (in nanos) to sync timeline times and error bounds (both in units of
+        sync timeline ticks), in the same way as :class:`ArduinoToSyncTimelineTime`, using a table of
+        straight line segments. Usually created using :func:`ArduinoToSyncTimelineTime.compile`.
+
+        Segment k covers arduino times from breakpoints[k] to breakpoints[k+1]. For an arduino time aNanos in
+        that segment, the sync timeline time is stIntercepts[k] + stSlopes[k] * (aNanos - breakpoints[k])
+        and the error bound is errIntercepts[k] + errSlopes[k] * (aNanos - breakpoints[k]).
+
+        :param breakpoints: list of arduino times (nanos), in ascending order
+        :param stIntercepts: list of sync timeline times (ticks) at the start of each segment
+        :param stSlopes: list of the rate of change of sync timeline time (ticks per nanosecond) during each segment
+        :param errIntercepts: list of error bounds (ticks) at the start of each segment
+        :param errSlopes: list of the rate of change of error bound (ticks per nanosecond) during each segment
+        """
+        super(CompiledArduinoToSyncTimelineTime, self).__init__()
+        self.breakpoints = numpy.asarray(breakpoints, dtype=numpy.float64)
+        self.stIntercepts = numpy.asarray(stIntercepts, dtype=numpy.float64)
+        self.stSlopes = numpy.asarray(stSlopes, dtype=numpy.float64)
+        self.errIntercepts = numpy.asarray(errIntercepts, dtype=numpy.float64)
+        self.errSlopes = numpy.asarray(errSlopes, dtype=numpy.float64)
+        if len(self.breakpoints) < 2 or not len(self.stIntercepts) == len(self.stSlopes) == len(self.errIntercepts) == len(self.errSlopes) == len(self.breakpoints) - 1:
+            raise ValueError("There must be at least two breakpoints, and one intercept and slope per segment between them.")
+
+    def __call__(self, aNanos):
+        """\
+        :param aNanos: arduino time (in nanos)
+        :returns: tuple (<syncTimelineTicks>, <errorBoundTicks>)
+        """
+        stTicks, errorTicks = self.convertArray([aNanos])
+        return (float(stTicks[0]), float(errorTicks[0]))
 
+    def convertArray(self, aNanos):
+        """\
+        :param aNanos: list or numpy array of arduino times (in nanos)
+        :returns: tuple (<syncTimelineTicks>, <errorBoundTicks>) of numpy arrays, with one value for each arduino time
+        :throws ValueError: if any of the arduino times are outside of the range covered by the breakpoints
+        """
+        aNanos = numpy.asarray(aNanos, dtype=numpy.float64)
+        outside = (aNanos < self.breakpoints[0]) | (aNanos > self.breakpoints[-1])
+        if numpy.any(outside):
+            raise ValueError("Cannot convert arduino times at indices "+str(numpy.flatnonzero(outside).tolist())+" because they are outside of the range from "+str(self.breakpoints[0])+" to "+str(self.breakpoints[-1])+".")
+
+        k = numpy.clip(numpy.searchsorted(self.breakpoints, aNanos, side="right") - 1, 0, len(self.stSlopes) - 1)
+        offset = aNanos - self.breakpoints[k]
+        return (self.stIntercepts[k] + self.stSlopes[k] * offset, self.errIntercepts[k] + self.errSlopes[k] * offset)
 
-def timesForSamples(numSamples, acToStFunc, acFirstSampleStart, acLastSampleEnd):
+    def toDict(self):
+        """\
+        :returns: the table of segments, as a dict that can be serialised as JSON, and recreated using :func:`fromDict`
+        """
+        return { "breakpoints": self.breakpoints.tolist(),
+                 "stIntercepts": self.stIntercepts.tolist(),
+                 "stSlopes": self.stSlopes.tolist(),
+                 "errIntercepts": self.errIntercepts.tolist(),
+                 "errSlopes": self.errSlopes.tolist() }
+
+    @classmethod
+    def fromDict(cls, d):
+        """\
+        :param d: a dict returned by :func:`toDict`
+        :returns: a :class:`CompiledArduinoToSyncTimelineTime`
+        """
+        return cls(d["breakpoints"], d["stIntercepts"], d["stSlopes"], d["errIntercepts"], d["errSlopes"])
+
+
+
+def timesForSamples(numSamples, acToStFunc, acFirstSampleStart, acLastSampleEnd, indices=None):
     """\
-    Calculates the sync timeline times corresponding 
+    Calculates the sync timeline times corresponding to the boundaries between samples.
     
     :param numSamples: number of samples over the period
-    :param acToStFunc: function that converts arduino time (nanos) to sync timeline ticks and error bound tick tuples
+    :param acToStFunc: function that converts arduino time (nanos) to sync timeline ticks and error bound tick tuples.
+        If it has a `convertArray` method (see :func:`ArduinoToSyncTimelineTime.convertArray`) then that is used
+        to convert all the times needed in one call.
     :param acFirstSampleStart: arduino time (nanos) of the beginning of the first sample period 
     :param acLastSampleEnd: arduino time (nanos) of the end of the last sample period 
+    :param indices: None, or a list (or numpy array) of the indices of the sample boundaries to calculate times for.
+        Index i is the start of sample i (or end of sample i-1).
 
-    :returns: list of tuples of sync timeline time (ticks) and error bound (ticks) corresponding to start of each sample (or end of previous)
+    :returns: list of tuples of sync timeline time (ticks) and error bound (ticks) corresponding to start of each sample (or end of previous).
+        If indices is not None, then the list contains only the tuples for those indices, in the same order.
     """
-    stTimesErrs = []
-    for i in range(0,numSamples+1):
-        acTime = acFirstSampleStart + float(acLastSampleEnd - acFirstSampleStart) * i / numSamples
-        (tTicks, errTicks) = acToStFunc(acTime)
-        stTimesErrs.append( (tTicks, errTicks) )
-        
-    return stTimesErrs
+    if indices is None:
+        indices = range(0,numSamples+1)
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+
+    acTimes = acFirstSampleStart + float(acLastSampleEnd - acFirstSampleStart) * indices / numSamples
+
+    if hasattr(acToStFunc, "convertArray"):
+        stTimes, errs = acToStFunc.convertArray(acTimes)
+        return zip(stTimes.tolist(), errs.tolist())
+    else:
+        return [ acToStFunc(acTime) for acTime in acTimes.tolist() ]
 
 
 
 
-def calcFlashThresholds(loSampleData, hiSampleData):
+def _slidingExtreme(sampleData, windowLength, accumulate, padValue):
+    """\
+    Sliding window maximum or minimum in O(n) time, using the van Herk/Gil-Werman algorithm:
+    the data is split into blocks of the window length, and the running maximum (or minimum) is
+    calculated forwards and backwards within each block. Any window then spans at most two blocks,
+    and its maximum (or minimum) is that of the backwards running value at its start and the forwards
+    running value at its end.
+
+    :param sampleData: list of sample values
+    :param windowLength: number of samples in the window. The window is centred on each sample, so an even length is rounded up to the next odd length.
+    :param accumulate: numpy.maximum or numpy.minimum
+    :param padValue: value that never affects the result (-inf for maximum, +inf for minimum)
+    :returns: numpy array, with one value for each sample: the maximum (or minimum) over the window centred on that sample.
+        Windows near the start and end are truncated.
+    """
+    v = numpy.asarray(sampleData, dtype=numpy.float64)
+    n = len(v)
+    half = max(int(windowLength) // 2, 0)
+    w = 2 * half + 1
+
+    numBlocks = (n + 2 * half + w - 1) // w
+    padded = numpy.empty(numBlocks * w)
+    padded.fill(padValue)
+    padded[half:half+n] = v
+
+    blocks = padded.reshape(numBlocks, w)
+    forwards = accumulate.accumulate(blocks, axis=1).ravel()
+    backwards = accumulate.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return accumulate(backwards[:n], forwards[w-1:w-1+n])
+
+
+def slidingMax(sampleData, windowLength):
+    """\
+    :param sampleData: list of sample values
+    :param windowLength: number of samples in the window (centred on each sample, and rounded up to an odd number)
+    :returns: numpy array of the maximum over the window centred on each sample. Calculated in O(n) time.
+    """
+    return _slidingExtreme(sampleData, windowLength, numpy.maximum, -numpy.inf)
+
+
+def slidingMin(sampleData, windowLength):
+    """\
+    :param sampleData: list of sample values
+    :param windowLength: number of samples in the window (centred on each sample, and rounded up to an odd number)
+    :returns: numpy array of the minimum over the window centred on each sample. Calculated in O(n) time.
+    """
+    return _slidingExtreme(sampleData, windowLength, numpy.minimum, numpy.inf)
+
+
+def calcFlashThresholds(loSampleData, hiSampleData, windowLength=None):
     """\
     Analyses light sensor sample data and returns suggestions for the thresholds needed to detect the flashes.
     
     :param loSampleData: list of sample values, where each value is the lowest seen during that sampling period
     :param loSampleData: list of sample values, where each value is the highest seen during that sampling period
+    :param windowLength: None, or the number of samples in a window over which to calculate local thresholds (see below)
     :returns: tuple (rising, falling) consisting of suggested rising-edge and falling-edge detection thresholds for use in the pulse detection code.
+
+    If windowLength is None, the thresholds are based on the lowest and highest values in the whole of the sample data.
+    Otherwise, the thresholds adapt to changes in light level (e.g. a TV dimming its backlight), by being based
+    on the lowest and highest values within a window centred on each sample. They are then numpy arrays, with one
+    value per sample. The window must be long enough to always include at least one flash.
     """
-    lo = min(loSampleData)
-    hi = max(hiSampleData)
+    if windowLength is None:
+        lo = min(loSampleData)
+        hi = max(hiSampleData)
+    else:
+        lo = slidingMin(loSampleData, windowLength)
+        hi = slidingMax(hiSampleData, windowLength)
     risingThreshold  = (lo + 2*hi) / 3.0
     fallingThreshold = (lo*2 + hi) / 3.0
     return risingThreshold, fallingThreshold
     
-def calcBeepThresholds(envelopeSampleData):
+def calcBeepThresholds(envelopeSampleData, windowLength=None):
     """\
     Analyses audio sample data and returns suggestions for the thresholds needed to detect the beeps.
     
     :param loSampleData: list of sample values, where each value is the lowest seen during that sampling period
     :param loSampleData: list of sample values, where each value is the highest seen during that sampling period
+    :param windowLength: None, or the number of samples in a window over which to calculate local thresholds (see :func:`calcFlashThresholds`)
     :returns: tuple (rising, falling) consisting of suggested rising-edge and falling-edge detection thresholds for use in the pulse detection code.
     """
-    lo = min(envelopeSampleData)
-    hi = max(envelopeSampleData)
+    if windowLength is None:
+        lo = min(envelopeSampleData)
+        hi = max(envelopeSampleData)
+    else:
+        lo = slidingMin(envelopeSampleData, windowLength)
+        hi = slidingMax(envelopeSampleData, windowLength)
     risingThreshold  = (lo + 2*hi) / 3.0
     fallingThreshold = (lo*2 + hi) / 3.0
     return risingThreshold, fallingThreshold
@@ -464,8 +769,8 @@ def detectPulses(hiSampleData, risingThreshold, fallingThreshold, minPulseDurati
     data provided for the centre points of the detected pulses.
     
     :param sampleData: list of sample values
-    :param risingThreshold: threshold for low to high transition
-    :param fallingTreshold: threshold for high to low transition
+    :param risingThreshold: threshold for low to high transition (or a list of thresholds, one per sample)
+    :param fallingTreshold: threshold for high to low transition (or a list of thresholds, one per sample)
     :param minPulseDuration: the minimum number of samples a pulse must last for for it to be considered
     :param holdCount: number of samples to hold a high state for
     
@@ -475,6 +780,9 @@ def detectPulses(hiSampleData, risingThreshold, fallingThreshold, minPulseDurati
     
     :returns: list of indices of the centre times of each pulse that is detected. Values are all floating point and may include 'halfway' indices, e.g. 14.5
     """
+    risingThresholds  = numpy.broadcast_to(risingThreshold, (len(hiSampleData),)).tolist()
+    fallingThresholds = numpy.broadcast_to(fallingThreshold, (len(hiSampleData),)).tolist()
+
     pulseIntervals = []
     
     LO = 0
@@ -487,16 +795,16 @@ def detectPulses(hiSampleData, risingThreshold, fallingThreshold, minPulseDurati
     for i in range(0, len(hiSampleData)):
         v = hiSampleData[i]
         if state == LO:
-            if v >= risingThreshold:
+            if v >= risingThresholds[i]:
                 state = HI
                 hiTransitionIndex = i
                 latestHi = i
                 
         elif state == HI:
-            if v > fallingThreshold:
+            if v > fallingThresholds[i]:
                 latestHi = i
             else:
-                if v <= fallingThreshold:
+                if v <= fallingThresholds[i]:
                     if i - latestHi > holdCount:
                         state = LO
                         if not ignoreFirstPulse:
@@ -516,6 +824,310 @@ def detectPulses(hiSampleData, risingThreshold, fallingThreshold, minPulseDurati
     return pulseIndices
 
 
+def detectPulsesVectorised(hiSampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount):
+    """\
+    Does the same as :func:`detectPulses`, giving exactly the same results, but uses numpy to
+    examine all the samples at once instead of stepping through them one at a time.
+
+    :param sampleData: list (or numpy array) of sample values
+    :param risingThreshold: threshold for low to high transition (or an array of thresholds, one per sample)
+    :param fallingTreshold: threshold for high to low transition (or an array of thresholds, one per sample)
+    :param minPulseDuration: the minimum number of samples a pulse must last for for it to be considered
+    :param holdCount: number of samples to hold a high state for
+
+    The state machine goes high at the first sample (after going low) at or above the rising threshold.
+    It goes low again at the first sample where that sample, and the holdCount samples before it,
+    are all at or below the falling threshold (and which is more than holdCount samples after it went high).
+    Both can be found for every sample at once, so the only loop is over the pulses.
+
+    :returns: list of indices of the centre times of each pulse that is detected. Values are all floating point and may include 'halfway' indices, e.g. 14.5
+    """
+    pulseIntervals = _hysteresisScan(hiSampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount, _HysteresisState())
+
+    # list currently contains intervals, convert to indices of the centre point (which might be at a halfway)
+    # the end values are the positions where it went back to low, therefore the last high is end-1
+    return [ (start+(end-1))/2.0 for (start, end) in pulseIntervals ]
+
+
+class _HysteresisState(object):
+    """\
+    State of the pulse detection state machine, carried from one block of samples to the next
+    by :func:`_hysteresisScan`. Indices are counted from the first sample of the first block.
+    """
+
+    def __init__(self):
+        self.offset = 0                 # index of the first sample of the next block
+        self.isHi = True                # initially in the HI state, as if it went high just before the first sample
+        self.hiTransitionIndex = -1
+        self.loTransitionIndex = -1
+        self.ignoreFirstPulse = True
+        self.lowRunLength = 0           # number of consecutive samples at or below the falling threshold at the end of the previous block
+
+
+def _hysteresisScan(hiSampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount, state):
+    """\
+    Runs the pulse detection state machine (see :func:`detectPulsesVectorised`) over a block of samples,
+    continuing from (and updating) the state left by the previous block.
+
+    :param hiSampleData: list (or numpy array) of sample values for this block
+    :param risingThreshold: threshold for low to high transition (or an array of thresholds, one per sample)
+    :param fallingTreshold: threshold for high to low transition (or an array of thresholds, one per sample)
+    :param minPulseDuration: the minimum number of samples a pulse must last for for it to be considered
+    :param holdCount: number of samples to hold a high state for
+    :param state: a :class:`_HysteresisState`
+
+    :returns: list of (start, end) intervals of pulses that ended in this block. start is the index of the first
+        high sample and end is the index after the last high sample.
+    """
+    v = numpy.asarray(hiSampleData)
+    windowLength = holdCount + 1
+    offset = state.offset
+
+    # indices of samples that could cause a transition to the HI state
+    risingIndices = numpy.flatnonzero(v >= risingThreshold) + offset
+
+    # indices of samples that end a run of at least holdCount+1 samples all at or below the falling threshold,
+    # so could cause a transition to the LO state. The run can start in the previous block.
+    low = v <= fallingThreshold
+    carried = min(state.lowRunLength, holdCount)
+    runningLowCount = numpy.concatenate((numpy.arange(carried + 1), numpy.cumsum(low) + carried))
+    lowRuns = runningLowCount[windowLength:] - runningLowCount[:-windowLength] == windowLength
+    fallingIndices = numpy.flatnonzero(lowRuns) + holdCount - carried + offset
+
+    pulseIntervals = []
+
+    while True:
+        if state.isHi:
+            k = numpy.searchsorted(fallingIndices, state.hiTransitionIndex + holdCount + 1)
+            if k == len(fallingIndices):
+                break
+            state.isHi = False
+            state.loTransitionIndex = int(fallingIndices[k])
+            if not state.ignoreFirstPulse:
+                pulseStart    = state.hiTransitionIndex
+                pulseEnd      = state.loTransitionIndex - holdCount
+                pulseDuration = pulseEnd - pulseStart
+                if pulseDuration >= minPulseDuration:
+                    pulseIntervals.append((pulseStart, pulseEnd))
+            state.ignoreFirstPulse = False
+        else:
+            k = numpy.searchsorted(risingIndices, state.loTransitionIndex, side="right")
+            if k == len(risingIndices):
+                break
+            state.isHi = True
+            state.hiTransitionIndex = int(risingIndices[k])
+
+    notLow = numpy.flatnonzero(~low)
+    if len(notLow) == 0:
+        state.lowRunLength += len(v)
+    else:
+        state.lowRunLength = len(v) - 1 - int(notLow[-1])
+    state.offset += len(v)
+
+    return pulseIntervals
+
+
+class StreamingPulseDetector(object):
+    """\
+    Detects flashes or beeps in sample data that is supplied a block at a time (e.g. as it
+    is captured, or read from a file), instead of all at once.
+
+    The state of the pulse detection state machine is carried from one block to the next,
+    so only a bounded amount of sample data is kept, and the centre index of each pulse
+    is returned as soon as the pulse has ended.
+
+    The detection thresholds are either fixed, or estimated from the data. When estimated,
+    the first warmUpSamples samples are kept until the thresholds can be calculated from them
+    (in the same way as :func:`calcFlashThresholds` or :func:`calcBeepThresholds`). After that,
+    if runningThresholds is True, the thresholds continue to be based on the lowest and highest
+    values seen so far; otherwise they stay as they were at the end of the warm-up.
+
+    Once all the sample data has been supplied, the pulses found are the same as
+    :func:`detectFlashes` or :func:`detectBeeps` would find (and are the same as :func:`detectPulses`
+    when the thresholds are fixed), provided the warm-up samples included the lowest and highest values.
+
+    Usage:
+
+    .. code-block:: python
+
+        detector = StreamingPulseDetector(minPulseDuration, holdCount, isAudio=False)
+        for (loSampleData, hiSampleData) in blocks:
+            for index in detector.addSamples(loSampleData, hiSampleData):
+                print "Flash centred at sample index", index
+        for index in detector.flush():
+            print "Flash centred at sample index", index
+    """
+
+    def __init__(self, minPulseDuration, holdCount, isAudio=False, risingThreshold=None, fallingThreshold=None, warmUpSamples=5000, runningThresholds=True):
+        """\
+        :param minPulseDuration: the minimum number of samples a pulse must last for
+        :param holdCount: the high-value hold duration (in units of a whole number of sampling periods)
+        :param isAudio: True if detecting beeps in audio sample data, or False if detecting flashes in light sensor sample data
+        :param risingThreshold: None, or a fixed threshold for low to high transition
+        :param fallingThreshold: None, or a fixed threshold for high to low transition
+        :param warmUpSamples: if thresholds are not fixed, the number of samples from which the thresholds are first calculated
+        :param runningThresholds: if thresholds are not fixed, then True if they are to keep adapting after the warm-up
+        """
+        super(StreamingPulseDetector, self).__init__()
+        self.minPulseDuration = minPulseDuration
+        self.holdCount = holdCount
+        self.isAudio = isAudio
+        self.fixedThresholds = risingThreshold is not None and fallingThreshold is not None
+        self.risingThreshold = risingThreshold
+        self.fallingThreshold = fallingThreshold
+        self.warmUpSamples = warmUpSamples
+        self.runningThresholds = runningThresholds
+        self.state = _HysteresisState()
+        self.warmUpBlocks = []
+        self.numWarmUpSamples = 0
+        self.lo = None
+        self.hi = None
+
+    def addSamples(self, loSampleData, hiSampleData):
+        """\
+        :param loSampleData: list of sample values, where each value is the lowest seen during that sampling period
+        :param hiSampleData: list of sample values, where each value is the highest seen during that sampling period
+        :returns: list of sample indices (counted from the first sample supplied) corresponding to the centre of each
+            pulse that has ended. Values are floating point and may be midway between indices.
+        """
+        lo = numpy.asarray(loSampleData, dtype=numpy.float64)
+        hi = numpy.asarray(hiSampleData, dtype=numpy.float64)
+        if self.isAudio:
+            lo, hi = hi - lo, hi - lo
+
+        if self.fixedThresholds:
+            return self._scan(hi, self.risingThreshold, self.fallingThreshold)
+
+        if self.lo is None:
+            self.warmUpBlocks.append((lo, hi))
+            self.numWarmUpSamples += len(hi)
+            if self.numWarmUpSamples < self.warmUpSamples:
+                return []
+            return self.flush()
+
+        if self.runningThresholds and len(hi) > 0:
+            lo = numpy.minimum.accumulate(numpy.concatenate(([self.lo], lo)))
+            hi2 = numpy.maximum.accumulate(numpy.concatenate(([self.hi], hi)))
+            self.lo, self.hi = lo[-1], hi2[-1]
+            rising = (lo[1:] + 2*hi2[1:]) / 3.0
+            falling = (lo[1:]*2 + hi2[1:]) / 3.0
+            return self._scan(hi, rising, falling)
+
+        return self._scan(hi, self.risingThreshold, self.fallingThreshold)
+
+    def flush(self):
+        """\
+        Finish the warm-up, even if fewer than warmUpSamples samples have been supplied, so that those samples are examined.
+
+        :returns: list of sample indices corresponding to the centre of each pulse that has ended (see :func:`addSamples`)
+        """
+        if self.fixedThresholds or self.lo is not None or self.numWarmUpSamples == 0:
+            return []
+        lo = numpy.concatenate([ l for (l, h) in self.warmUpBlocks ])
+        hi = numpy.concatenate([ h for (l, h) in self.warmUpBlocks ])
+        self.warmUpBlocks = []
+        self.lo, self.hi = lo.min(), hi.max()
+        self.risingThreshold  = (self.lo + 2*self.hi) / 3.0
+        self.fallingThreshold = (self.lo*2 + self.hi) / 3.0
+        return self._scan(hi, self.risingThreshold, self.fallingThreshold)
+
+    def _scan(self, hi, risingThreshold, fallingThreshold):
+        pulseIntervals = _hysteresisScan(hi, risingThreshold, fallingThreshold, self.minPulseDuration, self.holdCount, self.state)
+        return [ (start+(end-1))/2.0 for (start, end) in pulseIntervals ]
+
+
+def deviceThresholds(risingThreshold, fallingThreshold):
+    """\
+    Convert detection thresholds to the whole numbers used by the pulse detector that runs on the Arduino (see :class:`DevicePulseDetector`).
+
+    Sample values are whole numbers, so a value is at or above risingThreshold exactly when it is at or above
+    risingThreshold rounded up, and is at or below fallingThreshold exactly when it is at or below fallingThreshold
+    rounded down. The detector gives the same results with either. (Thresholds calculated from sample data,
+    by :func:`calcFlashThresholds` or :func:`calcBeepThresholds`, always lie within the range of sample values.)
+
+    :param risingThreshold: threshold for low to high transition (e.g. from :func:`calcFlashThresholds` or :func:`calcBeepThresholds`)
+    :param fallingThreshold: threshold for high to low transition
+    :returns: tuple (rising, falling) of whole number thresholds, from 0 to 255
+    """
+    rising = int(math.ceil(risingThreshold))
+    falling = int(math.floor(fallingThreshold))
+    return max(0, min(255, rising)), max(0, min(255, falling))
+
+
+class DevicePulseDetector(object):
+    """\
+    Reference model of the pulse detector that runs on the Arduino while it samples
+    (see :func:`arduino.startDetecting`). It is the same state machine as :func:`detectPulses`, stepped
+    one sample at a time, with whole number thresholds (see :func:`deviceThresholds`), and it gives
+    the same results.
+
+    It is used by :mod:`arduinoemulator`, and to check the Arduino sampling code without hardware.
+
+    Usage:
+
+    .. code-block:: python
+
+        detector = DevicePulseDetector(risingThreshold, fallingThreshold, minPulseDuration, holdCount)
+        for value in hiSampleData:
+            pulse = detector.addSample(value)
+            if pulse is not None:
+                print "Pulse from sample", pulse[0], "up to (but not including) sample", pulse[1]
+    """
+
+    def __init__(self, risingThreshold, fallingThreshold, minPulseDuration, holdCount):
+        """\
+        :param risingThreshold: whole number threshold for low to high transition
+        :param fallingThreshold: whole number threshold for high to low transition
+        :param minPulseDuration: the minimum number of samples a pulse must last for
+        :param holdCount: number of samples to hold a high state for
+        """
+        super(DevicePulseDetector, self).__init__()
+        self.risingThreshold = risingThreshold
+        self.fallingThreshold = fallingThreshold
+        self.minPulseDuration = minPulseDuration
+        self.holdCount = holdCount
+        self.index = 0
+        self.isHi = True
+        self.ignoreFirstPulse = True
+        self.hiTransitionIndex = -1
+        self.latestHi = -1
+
+    def addSample(self, v):
+        """\
+        :param v: the next sample value (the high value for a light sensor, or the high value minus the low value for an audio input)
+        :returns: None, or tuple (start, end) if a pulse has just ended, where start is the index of its first
+            high sample, and end is the index after its last high sample
+        """
+        i = self.index
+        self.index += 1
+        pulse = None
+        if not self.isHi:
+            if v >= self.risingThreshold:
+                self.isHi = True
+                self.hiTransitionIndex = i
+                self.latestHi = i
+        elif v > self.fallingThreshold:
+            self.latestHi = i
+        elif i - self.latestHi > self.holdCount:
+            self.isHi = False
+            if not self.ignoreFirstPulse and self.latestHi + 1 - self.hiTransitionIndex >= self.minPulseDuration:
+                pulse = (self.hiTransitionIndex, self.latestHi + 1)
+            self.ignoreFirstPulse = False
+        return pulse
+
+    def addSamples(self, sampleData):
+        """\
+        :param sampleData: list of sample values
+        :returns: list of tuples (start, end) for each pulse that ended (see :func:`addSample`)
+        """
+        pulses = []
+        for v in sampleData:
+            pulse = self.addSample(v)
+            if pulse is not None:
+                pulses.append(pulse)
+        return pulses
+
+
 def minMaxDataToEnvelopeData(loSampleData, hiSampleData):
     """\
     Takes sample data representing the lo and high values seen during each sample
@@ -528,7 +1140,7 @@ def minMaxDataToEnvelopeData(loSampleData, hiSampleData):
     return map(lambda lo, hi: hi-lo, loSampleData, hiSampleData)
 
 
-def detectFlashes(loSampleData, hiSampleData, minFlashDuration, holdCount):
+def detectFlashes(loSampleData, hiSampleData, minFlashDuration, holdCount, pulseDetector=detectPulsesVectorised, thresholdWindow=None):
     """\
     Takes light sensor sample data and returns the indices of the centre times of
     light flashes. Calibrates the detection process against the data itself.
@@ -537,13 +1149,15 @@ def detectFlashes(loSampleData, hiSampleData, minFlashDuration, holdCount):
     :param loSampleData: list of sample values, where each value is the highest seen during that sampling period
     :param minFlashDuration: the minimum number of samples a flash must last for
     :param holdCount: the high-value hold duration (in units of a whole number of sampling periods)
+    :param pulseDetector: the pulse detection function to use: :func:`detectPulsesVectorised` (the default) or :func:`detectPulses`
+    :param thresholdWindow: None, or the number of samples over which to adapt the detection thresholds to the local light level (see :func:`calcFlashThresholds`)
     :returns: list of sample indices corresponding to the centre of each detected flash. Values are floating point and may be midway between indices.
     """
-    risingThreshold, fallingThreshold = calcFlashThresholds(loSampleData, hiSampleData)
-    return detectPulses(hiSampleData, risingThreshold, fallingThreshold, minFlashDuration, holdCount)
+    risingThreshold, fallingThreshold = calcFlashThresholds(loSampleData, hiSampleData, thresholdWindow)
+    return pulseDetector(hiSampleData, risingThreshold, fallingThreshold, minFlashDuration, holdCount)
 
 
-def detectBeeps(loSampleData, hiSampleData, minBeepDuration, holdCount):
+def detectBeeps(loSampleData, hiSampleData, minBeepDuration, holdCount, pulseDetector=detectPulsesVectorised, thresholdWindow=None):
     """\
     Takes audio sample data and returns the indices of the centre times of
     beeps. Calibrates the detection process against the data itself.
@@ -552,16 +1166,36 @@ def detectBeeps(loSampleData, hiSampleData, minBeepDuration, holdCount):
     :param loSampleData: list of sample values, where each value is the highest seen during that sampling period
     :param minBeepDuration: the minimum number of samples a beep must last for
     :param holdCount: the high-value hold duration (in units of a whole number of sampling periods)
+    :param pulseDetector: the pulse detection function to use: :func:`detectPulsesVectorised` (the default) or :func:`detectPulses`
+    :param thresholdWindow: None, or the number of samples over which to adapt the detection thresholds to the local audio level (see :func:`calcBeepThresholds`)
     :returns: list of sample indices corresponding to the centre of each detected beep. Values are floating point and may be midway between indices.
     """
     envelopeSampleData = minMaxDataToEnvelopeData(loSampleData, hiSampleData)
-    risingThreshold, fallingThreshold = calcBeepThresholds(envelopeSampleData)
-    return detectPulses(envelopeSampleData, risingThreshold, fallingThreshold, minBeepDuration, holdCount)
+    risingThreshold, fallingThreshold = calcBeepThresholds(envelopeSampleData, thresholdWindow)
+    return pulseDetector(envelopeSampleData, risingThreshold, fallingThreshold, minBeepDuration, holdCount)
 
 
-# ---------------------------------------------------------------------------
+def detectionCounts(eventDurationSecs, isAudio):
+    """\
+    Determine the parameters for pulse detection from the approximate duration of a flash or beep.
 
-import math
+    The hold time is set quite long (half the duration) to cope with backlight flicker
+    and badly shaped audio waveforms. A flash must last at least half its duration,
+    and a beep at least three quarters of its duration.
+
+    :param eventDurationSecs: the approximate duration (in seconds) of a flash or beep
+    :param isAudio: True if detecting beeps, or False if detecting flashes
+    :returns: tuple (minimum number of samples a pulse must last for, hold count), where one sample is one millisecond
+    """
+    holdCount = int(eventDurationSecs * 0.5 * 1000)
+    if isAudio:
+        minPulseCount = int(eventDurationSecs * 0.75 * 1000)
+    else:
+        minPulseCount = int(eventDurationSecs * 0.5 * 1000)
+    return minPulseCount, holdCount
+
+
+# ---------------------------------------------------------------------------
 
 
 class BeepFlashDetector(object):
@@ -573,7 +1207,7 @@ class BeepFlashDetector(object):
     
     """
 
-    def __init__(self, wcAcReqResp, syncTimelineTickRate, wcSyncTimeCorrelations, wcDispersions, wcPrecisionNanos, acPrecisionNanos, interpolateWc2St=True):
+    def __init__(self, wcAcReqResp, syncTimelineTickRate, wcSyncTimeCorrelations, wcDispersions, wcPrecisionNanos, acPrecisionNanos, interpolateWc2St=True, pulseDetector=detectPulsesVectorised, thresholdWindowSecs=None, ac2st=None, holdCount=None, minPulseDuration=None):
         """
         :param wcAcReqResp: Dict containing "pre" and "post" sampling period clock sync request and response timings
         between the Wall Clock and Arduino clock (both in nanos).
@@ -602,9 +1236,37 @@ class BeepFlashDetector(object):
         :param acPrecisionNanos: The precision with which the Arduino clock was measured by the Arduino (in nanoseconds) when synchronising it with the Wall Clock
         
         :param interpolateWc2St: (Default True). If True, then conversions between wallclock and sync timeline times will, where possible, be done via interpolation. 
+
+        :param pulseDetector: (Default :func:`detectPulsesVectorised`). The pulse detection function to use. :func:`detectPulses` gives the same results, but more slowly.
+
+        :param thresholdWindowSecs: (Default None). If not None, then the detection thresholds adapt to changes in light or audio level,
+        being based on the levels within a window of this many seconds around each sample (see :func:`calcFlashThresholds`).
+
+        :param ac2st: (Default None). If not None, then the conversion from arduino time to sync timeline time to use (e.g. a
+        :class:`CompiledArduinoToSyncTimelineTime` recreated using :func:`CompiledArduinoToSyncTimelineTime.fromDict`).
+        The conversion is then not built from wcAcReqResp, wcSyncTimeCorrelations, wcDispersions, wcPrecisionNanos and
+        acPrecisionNanos, so they can be None.
+
+        :param holdCount: (Default None). If not None, then the number of samples to hold a high state for during pulse detection,
+        instead of the one chosen from the flash/beep duration (see :func:`detectionCounts`).
+
+        :param minPulseDuration: (Default None). If not None, then the minimum number of samples a pulse must last for,
+        instead of the one chosen from the flash/beep duration (see :func:`detectionCounts`).
         """
         
         super(BeepFlashDetector, self).__init__()
+
+        self.pulseDetector = pulseDetector
+        if thresholdWindowSecs is None:
+            self.thresholdWindow = None
+        else:
+            self.thresholdWindow = int(thresholdWindowSecs * 1000)     # one sample = 1 millisecond
+        self.holdCount = holdCount
+        self.minPulseDuration = minPulseDuration
+
+        if ac2st is not None:
+            self.ac2st = ac2st
+            return
         
         # generate correlations and error bounds for the two points at which
         # the wall clock and arduino clock are synchronised ("pre" and "post"
@@ -636,6 +1298,21 @@ class BeepFlashDetector(object):
         
         # create object that can convert from arduino time to sync timeline time
         self.ac2st = ArduinoToSyncTimelineTime(ac2wc, ac2acErr, wc2st, wc2wcDisp, syncTimelineTickRate)
+
+
+    def compileConversion(self, acStartNanos, acEndNanos, wcBreakpoints=()):
+        """\
+        Replace the conversion from arduino time to sync timeline time with one compiled to a table
+        of straight line segments (see :func:`ArduinoToSyncTimelineTime.compile`), so that detected
+        flash/beep times are converted in a single pass.
+
+        :param acStartNanos: the Arduino clock time at which the first sampling period began (in nanoseconds)
+        :param acEndNanos: the Arduino clock time at which the last sampling period ended (in nanoseconds)
+        :param wcBreakpoints: list of wall clock times (nanos) at which the dispersion changed gradient (e.g. the times in the changeHistory of a :class:`dispersion.DispersionRecorder`)
+        :returns: the :class:`CompiledArduinoToSyncTimelineTime` that is now used
+        """
+        self.ac2st = self.ac2st.compile(acStartNanos, acEndNanos, wcBreakpoints)
+        return self.ac2st
     
 
 
@@ -657,11 +1334,7 @@ class BeepFlashDetector(object):
         
         """
         # calculate a hold time for the flash detection process based on the hint about flash duration
-        # set it quite long to cope with backlight flicker issues
-        holdTime = flashDurationSecs * 0.5    # half of the flash duration
-        holdCount = int(holdTime * 1000)     # one sample = 1 millisecond
-	minFlashDuration = flashDurationSecs * 0.5
-        minFlashCount = int(minFlashDuration * 1000)
+        minFlashCount, holdCount = detectionCounts(flashDurationSecs, isAudio=False)
         
         # run the detection
         detectFunc = detectFlashes
@@ -685,12 +1358,8 @@ class BeepFlashDetector(object):
         middle of the beep, with an uncertainty of +/- errorBound. 
         
         """
-        # calculate a hold time for the flash detection process based on the hint about beep duration
-        # set it quite long to cope with badly shaped waveforms
-        holdTime = beepDurationSecs * 0.5    # half of the beep duration
-        holdCount = int(holdTime * 1000)     # one sample = 1 millisecond
-	minBeepDuration = beepDurationSecs * 0.75
-        minBeepCount = int(minBeepDuration * 1000)
+        # calculate a hold time for the beep detection process based on the hint about beep duration
+        minBeepCount, holdCount = detectionCounts(beepDurationSecs, isAudio=True)
         
         # run the detection
         detectFunc = detectBeeps
@@ -698,49 +1367,94 @@ class BeepFlashDetector(object):
 
         
     def convertSamplesToDetectionTimings(self, loSampleData, hiSampleData, acStartNanos, acEndNanos, detectFunc, minPulseDuration, holdCount):
+
+        # settings given when the detector was created take precedence over those chosen from the flash/beep duration
+        if self.minPulseDuration is not None:
+            minPulseDuration = self.minPulseDuration
+        if self.holdCount is not None:
+            holdCount = self.holdCount
         
         # determine indexes in the sample data corresponding to centre time of each pulse
-        pulseIndices = detectFunc(loSampleData, hiSampleData, minPulseDuration, holdCount)
+        pulseIndices = detectFunc(loSampleData, hiSampleData, minPulseDuration, holdCount, self.pulseDetector, self.thresholdWindow)
         
-        # generate list of timings corresponding to start time of each sample
-        stTimesAndErrors = timesForSamples(
+        # detect pulse function assumed indices correspond to the centre of each
+        # we are about to use to calculate using times where the index corresponds
+        # to the beginning of the sample, so adjust
+        indices = numpy.asarray(pulseIndices, dtype=numpy.float64) + 0.5
+
+        # index is fractional, so we interpolate between the times and errors
+        # of the neighbouring sample boundaries
+        floorIndices = numpy.floor(indices).astype(numpy.int64)
+        fracIndices = indices - floorIndices
+        nextIndices = floorIndices + 1
+
+        # only calculate timings for the sample boundaries that are needed, which
+        # is far fewer than for every sample in the capture
+        boundaryIndices = numpy.unique(numpy.concatenate((floorIndices, nextIndices)))
+        stTimesAndErrors = numpy.array(timesForSamples(
             numSamples=len(loSampleData),
             acToStFunc=self.ac2st,
             acFirstSampleStart=acStartNanos,
-            acLastSampleEnd=acEndNanos
-        )
-        
-        timings = []
-        
-        for index in pulseIndices:
-        
-            # detect pulse function assumed indices correspond to the centre of each
-            # we are about to use to calculate using times where the index corresponds
-            # to the beginning of the sample, so adjust
-            index=index+0.5
+            acLastSampleEnd=acEndNanos,
+            indices=boundaryIndices
+        ), dtype=numpy.float64).reshape(-1, 2)
 
-            # index is fractional, so we interpolate between the times and errors
-            # of the neighbouring sample boundaries
-            floorIndex = int(math.floor(index))
-            fracIndex = index-floorIndex
-            nextIndex = floorIndex + 1
-            
-            time1, err1 = stTimesAndErrors[floorIndex]
-            time2, err2 = stTimesAndErrors[nextIndex]
-            
-            time = fracIndex * time2 + (1.0-fracIndex) * time1
-            err  = fracIndex * err2  + (1.0-fracIndex) * err1
-            
-            errDueToSampleDuration = (time2 - time1 ) / 2.0
-            
-            totalErr = err + errDueToSampleDuration
-            
-            pulseTimeAndError = (time,totalErr)
-            
-            timings.append(pulseTimeAndError)
-            
-        return timings
-        
+        time1, err1 = stTimesAndErrors[numpy.searchsorted(boundaryIndices, floorIndices)].T
+        time2, err2 = stTimesAndErrors[numpy.searchsorted(boundaryIndices, nextIndices)].T
+
+        return _interpolateTimings(fracIndices, time1, err1, time2, err2)
+
+
+    def pulseEventsToTimings(self, pulseEvents, samplePeriodNanos=1000000):
+        """\
+        Takes the flashes or beeps detected by the arduino while it was sampling (see :func:`arduino.startDetecting`)
+        and translates them to times on the synchronisation timeline (including error bounds)
+        so that they can be compared to the expected timings of the flashes or beeps.
+
+        The results are the same as from :func:`samplesToFlashTimings` or :func:`samplesToBeepTimings`
+        for the same pulses, because the start and end of each pulse are sample boundaries.
+
+        :param pulseEvents: list of tuples (acStartNanos, acEndNanos) giving the Arduino clock times
+            at which the first sample period of each pulse began and the last one ended (in nanoseconds)
+        :param samplePeriodNanos: (Default 1000000) the duration of one sample period (in nanoseconds)
+
+        :returns: a list of tuples. Each tuple represents a detected flash or beep.
+        The tuple contains (time, errorBound) representing the time of the
+        middle of the flash or beep, with an uncertainty of +/- errorBound.
+        """
+        if len(pulseEvents) == 0:
+            return []
+
+        starts, ends = numpy.asarray(pulseEvents, dtype=numpy.float64).reshape(-1, 2).T
+        centres = (starts + ends) / 2.0
+
+        # the centre is a fraction of the way through a sample period, so we interpolate
+        # between the times and errors of the sample boundaries either side of it
+        floorTimes = starts + numpy.floor((centres - starts) / samplePeriodNanos) * samplePeriodNanos
+        fracs = (centres - floorTimes) / samplePeriodNanos
+        nextTimes = floorTimes + samplePeriodNanos
+
+        time1, err1 = self.ac2st.convertArray(floorTimes)
+        time2, err2 = self.ac2st.convertArray(nextTimes)
+
+        return _interpolateTimings(fracs, time1, err1, time2, err2)
+
+
+def _interpolateTimings(fracs, time1, err1, time2, err2):
+    """\
+    :param fracs: numpy array of how far through each sample period each pulse centre is (0 to 1)
+    :param time1, err1: numpy arrays of the sync timeline times and error bounds of the start of each of those sample periods
+    :param time2, err2: numpy arrays of the sync timeline times and error bounds of the end of each of those sample periods
+    :returns: list of tuples (time, errorBound) for each pulse centre, including the error due to the duration of a sample period
+    """
+    time = fracs * time2 + (1.0-fracs) * time1
+    err  = fracs * err2  + (1.0-fracs) * err1
+
+    errDueToSampleDuration = (time2 - time1 ) / 2.0
+
+    totalErr = err + errDueToSampleDuration
+
+    return zip(time.tolist(), totalErr.tolist())
     
     
 if __name__ == '__main__':
@@ -101,30 +101,52 @@ class DispersionRecorder(object):
         :param wcTime: time of the wall clock
         :returns: dispersion (in nanoseconds) when the wall clock had the time specified
         """
-        
-        changeInfo = None
-        for ci in self.changeHistory:
-            when = ci[0]
-            if when <= wcTime:
-                changeInfo = ci
-            else:
-                pass # don't abort immediately but instead
-                # keep looking through because, due to clock adjustment we
-                # might get a later recorded history entry that covers the
-                # same range of wall clock values (because the clock could jump
-                # backwards when adjusted)
-        
-        if changeInfo is None:
-            raise ValueError("History did not contain any entries early enough to give dispersion at time "+str(wcTime))
-        
-        # unpack    
-        when, adjustment, oldDispersionNanos, newDispersionNanos, dispersionGrowthRate = changeInfo
-        
-        # 'when' is before 'wcTime'
-        # so we extrapolate the newDispersion
-        timeDiff = wcTime - when
-        dispersion = newDispersionNanos + dispersionGrowthRate * timeDiff
-        
-        return dispersion
+        return dispersionAtFromHistory(self.changeHistory, wcTime)
+
+
+
+def dispersionAtFromHistory(changeHistory, wcTime):
+    """\
+    Calculate the dispersion at a given wall clock time, using a recorded history of changes in dispersion.
+
+    This allows the dispersion to be calculated from a history that was recorded by a :class:`DispersionRecorder`
+    and saved (e.g. as part of a saved capture) for analysis later.
+
+    :param changeHistory: list of tuples (timeAfterAdjustment, adjustment, oldDispersionNanos, newDispersionNanos, dispersionGrowthRate)
+        as recorded by :class:`DispersionRecorder` in its changeHistory attribute.
+    :param wcTime: time of the wall clock
+    :returns: dispersion (in nanoseconds) when the wall clock had the time specified
+    """
+    changeInfo = None
+    for ci in changeHistory:
+        when = ci[0]
+        if when <= wcTime:
+            changeInfo = ci
+        else:
+            pass # don't abort immediately but instead
+            # keep looking through because, due to clock adjustment we
+            # might get a later recorded history entry that covers the
+            # same range of wall clock values (because the clock could jump
+            # backwards when adjusted)
+    
+    if changeInfo is None:
+        raise ValueError("History did not contain any entries early enough to give dispersion at time "+str(wcTime))
+    
+    # unpack    
+    when, adjustment, oldDispersionNanos, newDispersionNanos, dispersionGrowthRate = changeInfo
+    
+    # 'when' is before 'wcTime'
+    # so we extrapolate the newDispersion
+    timeDiff = wcTime - when
+    dispersion = newDispersionNanos + dispersionGrowthRate * timeDiff
+    
+    return dispersion
 
 
+def constantDispersionHistory(dispersionNanos):
+    """\
+    :param dispersionNanos: a dispersion (in nanoseconds)
+    :returns: a history of changes in dispersion (as used by :func:`dispersionAtFromHistory`) that gives the
+        same dispersion at any (non negative) wall clock time.
+    """
+    return [ (0, 0, dispersionNanos, dispersionNanos, 0) ]
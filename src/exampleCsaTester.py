@@ -122,6 +122,8 @@ from dvbcss.protocol.server.ts import TSServer, SimpleClockTimelineSource
 from measurer import Measurer
 from measurer import DubiousInput
 import stats
+import capturestore
+from dispersion import constantDispersionHistory
 
 
 
@@ -377,7 +379,13 @@ if __name__ == "__main__":
                             syncClockTickRate, \
                             wcPrecisionNanos, \
                             acPrecisionNanos, \
-                            cmdParser.measurerTime)
+                            cmdParser.measurerTime, \
+                            arduinoPort=cmdParser.args.arduinoPort, \
+                            chunkedTransfer=cmdParser.args.chunkedTransfer, \
+                            streaming=cmdParser.args.stream, \
+                            compressedTransfer=cmdParser.args.compressedTransfer, \
+                            detectOnDevice=cmdParser.args.detectOnDevice, \
+                            windowLengths=cmdParser.pinWindowLengths)
 
         print
         raw_input("Press RETURN once CSA is connected and synchronising to this 'TV Device' server")
@@ -404,22 +412,59 @@ if __name__ == "__main__":
         def dispersionFunc(wcTime):
             return worstCaseDispersion
 
-        measurer.detectBeepsAndFlashes(dispersionFunc = dispersionFunc)
+        if cmdParser.args.saveCaptureFilename is not None:
+            capturestore.saveCapture(cmdParser.args.saveCaptureFilename[0], measurer.getCaptureRecord(constantDispersionHistory(worstCaseDispersion)))
 
-        for channel in measurer.getComparisonChannels():
+        if cmdParser.args.archiveDir is not None:
+            print "Capture archived to", measurer.archiveCapture(cmdParser.args.archiveDir, constantDispersionHistory(worstCaseDispersion))
+
+        measurer.detectBeepsAndFlashes(dispersionFunc = dispersionFunc, thresholdWindowSecs = cmdParser.args.thresholdWindowSecs[0])
+        measurer.releaseSamples()
+
+        if cmdParser.args.jointMatch:
             try:
-                index, expected, timeDifferencesAndErrors = measurer.doComparison(channel)
+                expected, results, avSkew = measurer.doJointComparison(measurer.getComparisonChannels(), cmdParser.args.maxAvSkewSecs[0])
 
-                print
-                print "Results for channel: %s" % channel["pinName"]
-                print "----------------------------"
-                stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
+                for channel in measurer.getComparisonChannels():
+                    print
+                    print "Results for channel: %s" % channel["pinName"]
+                    print "----------------------------"
+                    if channel["pinName"] in results:
+                        index, timeDifferencesAndErrors = results[channel["pinName"]]
+                        stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
+                    else:
+                        print "Nothing detected on pin: %s" % channel["pinName"]
+                        print "Is input plugged into pin?  Is the input level is too low?"
+
+                stats.printAvSkew(avSkew)
 
             except DubiousInput:
 
                 print
-                print "Cannot reliably measure on pin: %s" % channel["pinName"]
-                print "Is input plugged into pin?  Is the input level is too low?"
+                print "Cannot reliably measure on any pin."
+                print "Are inputs plugged into pins?  Are the input levels too low?"
+
+        else:
+            for channel in measurer.getComparisonChannels():
+                try:
+                    if cmdParser.args.robustMatch:
+                        index, expected, timeDifferencesAndErrors, unmatched, missed, pairedExpected, pairedObserved, drift = measurer.doRobustComparison(channel, withDrift=True)
+                    else:
+                        index, expected, timeDifferencesAndErrors, drift = measurer.doComparison(channel, withDrift=True, detrend=cmdParser.args.detrend)
+                        unmatched, missed, pairedExpected, pairedObserved = [], [], None, None
+
+                    print
+                    print "Results for channel: %s" % channel["pinName"]
+                    print "----------------------------"
+                    stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0], pairedExpected, pairedObserved)
+                    stats.printDrift(drift)
+                    stats.printUnmatched(unmatched, missed, expected)
+
+                except DubiousInput:
+
+                    print
+                    print "Cannot reliably measure on pin: %s" % channel["pinName"]
+                    print "Is input plugged into pin?  Is the input level is too low?"
 
     except KeyboardInterrupt:
         pass
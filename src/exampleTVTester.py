@@ -142,6 +142,7 @@ The overall process is:
 '''
 
 
+import functools
 import sys
 import time
 
@@ -155,8 +156,10 @@ from dvbcss.protocol.client.ts import TSClientClockController
 
 from measurer import Measurer
 from measurer import DubiousInput
+from measurer import pipelinedCaptures
 from dispersion import DispersionRecorder
 import stats
+import capturestore
 
 
 
@@ -201,6 +204,50 @@ def startCSSClients(wallClockClient, tsClientClockController):
     tsClientClockController.connect()
 
 
+def measureRepeatedly(measurer, cmdParser, dispRecorder, syncTimelineClockController):
+    """\
+
+    Take captures back to back, analysing each one while the next is being captured
+    (see :func:`measurer.pipelinedCaptures`), and print a summary of the results of each.
+    Captures taken while the connection to CSS-TS was lost, or the timeline was unavailable,
+    are not analysed.
+
+    """
+    args = cmdParser.args
+    analyseFunc = functools.partial(capturestore.analyseCapture, toleranceSecs=args.toleranceSecs[0], \
+                                    robustMatch=args.robustMatch, thresholdWindowSecs=args.thresholdWindowSecs[0], \
+                                    detrend=args.detrend)
+
+    def checkCapture():
+        return syncTimelineClockController.connected and syncTimelineClockController.timelineAvailable
+
+    def onCapture(index, record):
+        print "Capture %d of %d taken" % (index+1, args.numCaptures)
+        if args.archiveDir is not None:
+            print "Capture archived to", measurer.archiveCapture(args.archiveDir, record["dispersionHistory"])
+
+    for index, record, results in pipelinedCaptures(measurer, args.numCaptures, lambda : dispRecorder.changeHistory, analyseFunc, onCapture, checkCapture=checkCapture):
+        print
+        print "Results for capture %d:" % (index+1)
+        if results is None:
+            print "   Not analysed: lost connection to CSS-TS or timeline became unavailable during the capture."
+            print
+            continue
+        for result in results:
+            if result["error"] is not None:
+                print "   %s : %s" % (result["pinName"], result["error"])
+            else:
+                passed = ""
+                if result["stats"]["passed"] is not None:
+                    passed = "  PASSED" if result["stats"]["passed"] else "  FAILED"
+                print "   %s : mean offset %9.3f milliseconds %s, drift %.1f ppm%s" % \
+                      (result["pinName"], result["stats"]["meanOffset"] * 1000.0, stats.earlyLateString(result["stats"]["meanOffset"]), \
+                       result["drift"]["driftPpm"], passed)
+        print
+
+    measurer.releaseSamples()
+
+
 
 
 
@@ -245,7 +292,13 @@ if __name__ == "__main__":
                             syncClockTickRate, \
                             wcPrecisionNanos, \
                             acPrecisionNanos, \
-                            cmdParser.measurerTime)
+                            cmdParser.measurerTime, \
+                            arduinoPort=cmdParser.args.arduinoPort, \
+                            chunkedTransfer=cmdParser.args.chunkedTransfer, \
+                            streaming=cmdParser.args.stream, \
+                            compressedTransfer=cmdParser.args.compressedTransfer, \
+                            detectOnDevice=cmdParser.args.detectOnDevice, \
+                            windowLengths=cmdParser.pinWindowLengths)
 
         measurer.setSyncTimeLinelockController(syncTimelineClockController)
 
@@ -283,6 +336,12 @@ if __name__ == "__main__":
             sys.exit(1)
 
 
+        if cmdParser.args.numCaptures > 1:
+            print
+            print "Beginning to measure repeatedly"
+            measureRepeatedly(measurer, cmdParser, dispRecorder, syncTimelineClockController)
+            sys.exit(0)
+
         print
         print "Beginning to measure"
         measurer.capture()
@@ -292,22 +351,60 @@ if __name__ == "__main__":
             sys.write("\n\nLost connection to CSS-TS or timeline became unavailable. Aborting.\n\n")
             sys.exit(1)
 
-        measurer.detectBeepsAndFlashes(dispersionFunc = dispRecorder.dispersionAt)
+        if cmdParser.args.saveCaptureFilename is not None:
+            capturestore.saveCapture(cmdParser.args.saveCaptureFilename[0], measurer.getCaptureRecord(dispRecorder.changeHistory))
 
-        for channel in measurer.getComparisonChannels():
+        if cmdParser.args.archiveDir is not None:
+            print "Capture archived to", measurer.archiveCapture(cmdParser.args.archiveDir, dispRecorder.changeHistory)
+
+        measurer.detectBeepsAndFlashes(dispersionFunc = dispRecorder.dispersionAt, thresholdWindowSecs = cmdParser.args.thresholdWindowSecs[0], \
+                                       wcBreakpoints = [ changeInfo[0] for changeInfo in dispRecorder.changeHistory ])
+        measurer.releaseSamples()
+
+        if cmdParser.args.jointMatch:
             try:
-                index, expected, timeDifferencesAndErrors = measurer.doComparison(channel)
+                expected, results, avSkew = measurer.doJointComparison(measurer.getComparisonChannels(), cmdParser.args.maxAvSkewSecs[0])
 
-                print
-                print "Results for channel: %s" % channel["pinName"]
-                print "----------------------------"
-                stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
+                for channel in measurer.getComparisonChannels():
+                    print
+                    print "Results for channel: %s" % channel["pinName"]
+                    print "----------------------------"
+                    if channel["pinName"] in results:
+                        index, timeDifferencesAndErrors = results[channel["pinName"]]
+                        stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0])
+                    else:
+                        print "Nothing detected on pin: %s" % channel["pinName"]
+                        print "Is input plugged into pin?  Is the input level is too low?"
+
+                stats.printAvSkew(avSkew)
 
             except DubiousInput:
 
                 print
-                print "Cannot reliably measure on pin: %s" % channel["pinName"]
-                print "Is input plugged into pin?  Is the input level is too low?"
+                print "Cannot reliably measure on any pin."
+                print "Are inputs plugged into pins?  Are the input levels too low?"
+
+        else:
+            for channel in measurer.getComparisonChannels():
+                try:
+                    if cmdParser.args.robustMatch:
+                        index, expected, timeDifferencesAndErrors, unmatched, missed, pairedExpected, pairedObserved, drift = measurer.doRobustComparison(channel, withDrift=True)
+                    else:
+                        index, expected, timeDifferencesAndErrors, drift = measurer.doComparison(channel, withDrift=True, detrend=cmdParser.args.detrend)
+                        unmatched, missed, pairedExpected, pairedObserved = [], [], None, None
+
+                    print
+                    print "Results for channel: %s" % channel["pinName"]
+                    print "----------------------------"
+                    stats.calcAndPrintStats(index, expected, timeDifferencesAndErrors, cmdParser.args.toleranceSecs[0], pairedExpected, pairedObserved)
+                    stats.printDrift(drift)
+                    stats.printUnmatched(unmatched, missed, expected)
+
+                except DubiousInput:
+
+                    print
+                    print "Cannot reliably measure on pin: %s" % channel["pinName"]
+                    print "Is input plugged into pin?  Is the input level is too low?"
 
     except KeyboardInterrupt:
         pass
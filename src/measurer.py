@@ -20,9 +20,19 @@ from an arduino and analyse them.
 
 '''
 
+import mmap
+import multiprocessing
+import multiprocessing.pool
+import numpy
+import tempfile
+import threading
+
 import arduino
+import capturearchive
+import capturestore
 import detect
 import analyse
+import os
 import time
 import sys
 
@@ -34,11 +44,11 @@ class DubiousInput(Exception):
 
 class Measurer:
 
-    def __init__(self, role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs):
+    def __init__(self, role, pinsToMeasure, expectedTimings, eventDurations, videoStartTicks, wallClock, syncTimelineClock, syncTimelineTickRate, wcPrecisionNanos, acPrecisionNanos, captureSecs, captureSource=None, arduinoPort=None, chunkedTransfer=False, streaming=False, compressedTransfer=False, detectOnDevice=False, windowLengths=None):
         """\
 
         connect with the arduino and send commands on which pins are to be read during
-        data capture.
+        data capture (unless a different capture source is supplied).
 
         :param role "master" or "client" which role the measurement system is acting in
         :param pinsToMeasure a list of pin names that are to be measured.
@@ -54,6 +64,17 @@ class Measurer:
         :param wcPrecisionNanos the wall clock precision in nanoseconds
         :param acPrecisionNanos the arduino clock's precision in nanoseconds
         :param captureSecs length of the capture to be taken on arduino in seconds
+        :param captureSource None, or the source of captures (see :class:`ArduinoCaptureSource` and :class:`RecordedCaptureSource`).
+        :param arduinoPort None, or the name of the serial port the Arduino is connected to, if captureSource is None (see :func:`arduino.connect`).
+        :param chunkedTransfer if True, and captureSource is None, then sample data is transferred from the Arduino in checksummed chunks (see :func:`arduino.chunkedBulkTransferInto`).
+                If None, then an :class:`ArduinoCaptureSource` is created, to capture using the Arduino.
+        :param streaming if True, and captureSource is None, then the Arduino sends the sample data while it is sampling, so captureSecs
+                is not limited by the Arduino's memory (see :class:`StreamingCaptureSource`).
+        :param compressedTransfer if True, and captureSource is None, then sample data is transferred from the Arduino in a compact encoding (see :func:`arduino.compressedBulkTransferInto`).
+        :param detectOnDevice if True, and captureSource is None, then the Arduino detects the flashes and beeps itself and sends only when each one
+                started and ended, so captureSecs is not limited by the Arduino's memory (see :class:`PulseEventCaptureSource`).
+        :param windowLengths None, or a dict mapping pin names to the number of bits in each uniquely identifiable window of the test sequence
+                ("patternWindowLength" read from the json metadata file). For pins with no entry, the shortest unique window length is used.
         """
 
         self.role = role
@@ -66,11 +87,20 @@ class Measurer:
         self.syncClockTickRate = syncTimelineTickRate
         self.wcPrecisionNanos = wcPrecisionNanos
         self.acPrecisionNanos = acPrecisionNanos
+        self.windowLengths = dict(windowLengths or {})
+        self.windowIndices = makeWindowIndices(expectedTimings, self.windowLengths)
 
-        self.f = arduino.connect()
-        self.pinMap = {"LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3}
-        self.activatePinReading()
-        self.nActivePins  = arduino.prepareToCapture(self.f, wallClock, captureSecs)[0]
+        self.samples = None
+
+        self.pinMap = PIN_MAP
+        if captureSource is None and detectOnDevice:
+            captureSource = PulseEventCaptureSource(pinsToMeasure, self.pinMap, wallClock, eventDurations, maxCaptureSecs=captureSecs, port=arduinoPort)
+        elif captureSource is None and streaming:
+            captureSource = StreamingCaptureSource(pinsToMeasure, self.pinMap, wallClock, eventDurations, captureSecs, arduinoPort)
+        elif captureSource is None:
+            captureSource = ArduinoCaptureSource(pinsToMeasure, self.pinMap, wallClock, captureSecs, arduinoPort, chunkedTransfer, compressedTransfer)
+        self.captureSource = captureSource
+        self.nActivePins = captureSource.nActivePins
 
         if self.nActivePins != len(self.pinsToMeasure) :
             raise ValueError("# activated pins mismatches request: ")
@@ -118,25 +148,6 @@ class Measurer:
 
 
 
-    def activatePinReading(self):
-        """\
-
-        Activate each of the pins mentioned in the input array for reading
-        during the Arduino capture phase
-
-        :param pinsToMeasure a list of pin names that are to be measured.
-                    a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
-        :param pinMap dictionary that maps from pin name to pin number
-        :param f: the file handle for serial communication with the Arduino
-        :param wallClock: the wall clock providing times for the CSS_WC protocol
-         (wall clock protocol)
-
-        """
-
-        for pin in self.pinsToMeasure:
-             arduino.samplePinDuringCapture(self.f, self.pinMap[pin], self.wallClock)
-
-
     def snapShot(self):
         """\
 
@@ -168,21 +179,118 @@ class Measurer:
         or use snapshots of the timeline being published by the measurement when it is acting
         as a server
 
+        The raw sample data of any previous capture is released first (see :func:`releaseSamples`).
+
         """
+        self.releaseSamples()
         if self.nActivePins > 0:
-            if self.role == "master":
+            recordedCorrelations = self.captureSource.wcSyncTimeCorrelations
+            if self.role == "master" and recordedCorrelations is None:
                 correlationPre = self.snapShot()
-            (self.channels, self.dueStartTimeUsecs, self.dueFinishTimeUsecs, timeDataPre, timeDataPost) = \
-                                        captureAndPackageIntoChannels(self.f, self.pinsToMeasure, self.pinMap, self.wallClock)
+            (self.channels, self.dueStartTimeUsecs, self.dueFinishTimeUsecs, timeDataPre, timeDataPost, self.samples, self.nMilliBlocks, self.bulkTransfer) = \
+                                        self.captureSource.capture()
             self.wcAcReqResp = {"pre":timeDataPre, "post":timeDataPost}
-            if self.role == "master":
+            if recordedCorrelations is not None:
+                self.wcSyncTimeCorrelations = recordedCorrelations
+            elif self.role == "master":
                  correlationPost = self.snapShot()
                  self.wcSyncTimeCorrelations = [correlationPre, correlationPost]
             elif self.role == "client":
                 self.wcSyncTimeCorrelations = self.timestampedReceivedControlTimeStamps
 
 
-    def detectBeepsAndFlashes(self, dispersionFunc):
+    def releaseSamples(self):
+        """\
+
+        Release the raw sample data of the most recent capture, and the channels that are views onto it.
+        If the sample data is memory mapped (see :class:`StreamingCaptureSource`) then the mapping is closed.
+        Call this once flashes/beeps have been detected and the capture has been saved or archived.
+        The results of detection (see :func:`getComparisonChannels`) are kept.
+
+        """
+        samples = self.samples
+        self.samples = None
+        self.channels = None
+        if isinstance(samples, mmap.mmap):
+            samples.close()
+
+
+    def getCaptureRecord(self, dispersionHistory, includeSamples=True):
+        """\
+
+        Package up everything needed to repeat the detection and analysis of the most recent capture
+        later, without the Arduino, so that it can be saved (see :mod:`capturestore`).
+
+        :param dispersionHistory: history of changes in wall clock dispersion during the capture, in the form recorded
+            by :class:`dispersion.DispersionRecorder` (see also :func:`dispersion.constantDispersionHistory`)
+        :param includeSamples: if False, then the channels do not include the sample data ("min" and "max")
+        :returns: dict that can be serialised as JSON. If it is known how the sample data was transferred from the Arduino,
+            then this is described by the "bulkTransfer" entry (see :func:`arduino.transferStats`). If the conversion from
+            arduino time to sync timeline time can be compiled, then the compiled table is in the "compiledConversion"
+            entry (see :func:`capturestore.compileConversion`), so it need not be rebuilt when the capture is analysed again.
+
+        """
+        channels = []
+        for channel in self.channels:
+            if channel is not None:
+                channel = channel.toDict()
+                channel["eventDuration"] = self.eventDurations[channel["pinName"]]
+                if not includeSamples:
+                    channel.pop("min", None)
+                    channel.pop("max", None)
+                channels.append(channel)
+
+        record = { "role": self.role,
+                   "pinsToMeasure": self.pinsToMeasure,
+                   "expectedTimings": self.expectedTimings,
+                   "eventDurations": self.eventDurations,
+                   "patternWindowLengths": self.windowLengths,
+                   "videoStartTicks": self.videoStartTicks,
+                   "syncTimelineTickRate": self.syncClockTickRate,
+                   "wcPrecisionNanos": self.wcPrecisionNanos,
+                   "acPrecisionNanos": self.acPrecisionNanos,
+                   "channels": channels,
+                   "dueStartTimeUsecs": self.dueStartTimeUsecs,
+                   "dueFinishTimeUsecs": self.dueFinishTimeUsecs,
+                   "wcAcReqResp": self.wcAcReqResp,
+                   "wcSyncTimeCorrelations": list(self.wcSyncTimeCorrelations),
+                   "dispersionHistory": list(dispersionHistory) }
+        if self.bulkTransfer is not None:
+            record["bulkTransfer"] = self.bulkTransfer
+        conversion = capturestore.compileConversion(record)
+        if conversion is not None:
+            record["compiledConversion"] = conversion.toDict()
+        return record
+
+
+
+    def archiveCapture(self, archiveDir, dispersionHistory):
+        """\
+
+        Write the most recent capture, including the raw sample data exactly as received from the Arduino,
+        to a new capture archive file (see :mod:`capturearchive`) in a directory. The file is named after
+        the time at which the capture was archived.
+
+        :param archiveDir: directory to write the archive file to. It is created if it does not exist.
+        :param dispersionHistory: history of changes in wall clock dispersion during the capture (see :func:`getCaptureRecord`)
+        :returns: the name of the archive file
+
+        """
+        if not os.path.isdir(archiveDir):
+            os.makedirs(archiveDir)
+        name = time.strftime("capture-%Y%m%d-%H%M%S")
+        filename = os.path.join(archiveDir, name + capturearchive.ARCHIVE_EXTENSION)
+        n = 1
+        while os.path.exists(filename):
+            n += 1
+            filename = os.path.join(archiveDir, name + "-" + str(n) + capturearchive.ARCHIVE_EXTENSION)
+        capturearchive.writeArchive(filename, self.getCaptureRecord(dispersionHistory, includeSamples=False), self.samples, self.nMilliBlocks)
+        return filename
+
+
+
+
+    def detectBeepsAndFlashes(self, dispersionFunc, thresholdWindowSecs=None, wcBreakpoints=()):
         """\
 
         Uses the detect module to detect any flashes or beeps
@@ -193,10 +301,16 @@ class Measurer:
             corresponding to that time. When testing a CSA, this should be the dispersion
             measured by the CSA. When testing a TV, it should be the dispersion
             reported by the local wall clock client algorithm in the measuring system.
+        :param thresholdWindowSecs: None, or the duration (in seconds) of a window over which detection thresholds
+            adapt to the local light or audio level (see :func:`detect.calcFlashThresholds`)
+        :param wcBreakpoints: list of wall clock times (nanos) at which the dispersion changed gradient (e.g. the times in the
+            changeHistory of a :class:`dispersion.DispersionRecorder`). They are needed to compile the conversion from arduino
+            time to sync timeline time (see :func:`detect.BeepFlashDetector.compileConversion`). If it cannot be compiled, then
+            the uncompiled conversion is used.
         """
         # add hint about duration of flashes/beeps to self.channels
         for pinName in self.eventDurations:
-            self.channels[self.pinMap[pinName]]["eventDuration"] = self.eventDurations[pinName]
+            self.channels[self.pinMap[pinName]].eventDuration = self.eventDurations[pinName]
 
         # copy self.channels, but only the entries that are not 'None'
         measuredChannels = []
@@ -207,7 +321,12 @@ class Measurer:
         # run detection process
         detector = detect.BeepFlashDetector(self.wcAcReqResp, self.syncClockTickRate, \
                                             self.wcSyncTimeCorrelations, dispersionFunc, \
-                                            self.wcPrecisionNanos, self.acPrecisionNanos)
+                                            self.wcPrecisionNanos, self.acPrecisionNanos, \
+                                            thresholdWindowSecs=thresholdWindowSecs)
+        try:
+            detector.compileConversion(self.dueStartTimeUsecs, self.dueFinishTimeUsecs, wcBreakpoints)
+        except ValueError:
+            pass
         self.observedTimings = analyse.runDetection(detector, measuredChannels, self.dueStartTimeUsecs, self.dueFinishTimeUsecs)
 
         self.testPackage = []
@@ -229,17 +348,22 @@ class Measurer:
 
 
 
-    def doComparison(self, channel):
+    def doComparison(self, channel, withDrift=False, weighted=False, detrend=False):
         """\
 
         run a comparison of observed and expected times for a given pin (represented by the channel input)
 
         :param channel a tuple
             { "pinName":pinName,  "observed": list of observed times,  "expected": list of expected times }
+        :param withDrift if True, also measure drift by fitting a line to the time differences (see :func:`analyse.fitDrift`)
+        :param weighted if True, weight the fit by the error bound of each time difference
+        :param detrend if True, rank matches by the variance remaining after removing any slope due to drift (see :func:`analyse.doComparison`)
         :returns tuple summary of results of analysis.
             (index into expected times for video at which strongest correlation (lowest variance) is found,
             list of expected times for video,
             list of (diff, err) for the best match, corresponding to the individual time differences and each one's error bound)
+            If withDrift is True, the tuple has a fourth item: a dict with the "offset", "driftPpm",
+            "residualStdDev" and "centreTime" of the fitted line.
         :raise DubiousInput exception if the observed data is longer than the expected data
 
         Results are normalised to be in units of seconds since start of the test video sequence.
@@ -249,14 +373,670 @@ class Measurer:
             raise DubiousInput("poor data or no data")
 
         test = (channel["observed"], channel["expected"])
-        matchIndex, expected, diffsAndErrors = analyse.doComparison(test, self.videoStartTicks, self.syncClockTickRate)
+        windowIndex = self.windowIndices.get(channel["pinName"], None)
+        results = analyse.doComparison(test, self.videoStartTicks, self.syncClockTickRate, windowIndex, detrend=detrend, withDrift=withDrift, weighted=weighted)
+        matchIndex, expected, diffsAndErrors = results[:3]
 
         # convert everything to units of seconds
         expectedSecs = [ ((e-self.videoStartTicks) / self.syncClockTickRate) for e in expected ]
         diffsAndErrorsSecs = [ (d/self.syncClockTickRate, e/self.syncClockTickRate) for (d,e) in diffsAndErrors ]
 
+        if withDrift:
+            return matchIndex, expectedSecs, diffsAndErrorsSecs, self.driftInSecs(results[3])
         return matchIndex, expectedSecs, diffsAndErrorsSecs
 
+
+    def doRobustComparison(self, channel, withDrift=False, weighted=False):
+        """\
+
+        run a comparison of observed and expected times for a given pin (represented by the channel input)
+        that tolerates missed or spurious flashes/beeps. See :func:`analyse.alignRobust`
+
+        :param channel a tuple
+            { "pinName":pinName,  "observed": list of observed times,  "expected": list of expected times }
+        :param withDrift if True, also measure drift by fitting a line to the time differences (see :func:`analyse.fitDrift`)
+        :param weighted if True, weight the fit by the error bound of each time difference
+        :returns tuple summary of results of analysis.
+            (index into expected times for video of the first observation that was matched,
+            list of expected times for video,
+            list of (diff, err) for each matched observation,
+            list of indices of observations that could not be matched to an expected time,
+            list of indices of expected times that were not observed,
+            list of the index into the expected times paired with each entry in the list of (diff, err),
+            list of the index of the observation paired with each entry in the list of (diff, err))
+            If withDrift is True, the tuple has an eighth item: the drift (as for :func:`doComparison`)
+        :raise DubiousInput exception if there is no data, or none of it could be matched
+
+        Results are normalised to be in units of seconds since start of the test video sequence.
+
+        """
+        if len(channel["observed"]) == 0:
+            raise DubiousInput("no data")
+
+        test = (channel["observed"], channel["expected"])
+        windowIndex = self.windowIndices.get(channel["pinName"], None)
+        results = analyse.doRobustComparison(test, self.videoStartTicks, self.syncClockTickRate, windowIndex, withDrift=withDrift, weighted=weighted)
+        matchIndex, expected, diffsAndErrors, unmatchedObserved, missedExpected, pairedExpected, pairedObserved = results[:7]
+
+        if matchIndex < 0:
+            raise DubiousInput("poor data")
+
+        # convert everything to units of seconds
+        expectedSecs = [ ((e-self.videoStartTicks) / self.syncClockTickRate) for e in expected ]
+        diffsAndErrorsSecs = [ (d/self.syncClockTickRate, e/self.syncClockTickRate) for (d,e) in diffsAndErrors ]
+
+        if withDrift:
+            return matchIndex, expectedSecs, diffsAndErrorsSecs, unmatchedObserved, missedExpected, pairedExpected, pairedObserved, self.driftInSecs(results[7])
+        return matchIndex, expectedSecs, diffsAndErrorsSecs, unmatchedObserved, missedExpected, pairedExpected, pairedObserved
+
+
+    def doJointComparison(self, channels, maxSkewSecs=None):
+        """\
+
+        run a comparison of observed and expected times for several pins at once (see :func:`analyse.correlateJoint`).
+        All the pins must have the same expected times.
+
+        :param channels a list of tuples
+            { "pinName":pinName,  "observed": list of observed times,  "expected": list of expected times }
+        :param maxSkewSecs None, or the largest audio-video skew (in seconds) to look for. The default is half of the
+            smallest gap between expected times; a larger skew is not found, and its observations are treated as separate events.
+        :returns tuple summary of results of analysis.
+            (list of expected times for video,
+            dict mapping pin name to a tuple (index into expected times of the pin's first observation, list of (diff, err) for each observation),
+            audio-video skew, or None if there were not both audio and video observations)
+            Pins with no observations have no entry in the dict.
+            The audio-video skew is the mean time difference for the audio pins minus that for the video pins.
+            It is positive if audio is ahead of video.
+        :raise DubiousInput exception if there is no data, the observed data is longer than the expected data,
+            or the pins do not have the same expected times
+
+        Results are normalised to be in units of seconds since start of the test video sequence.
+
+        """
+        if len(channels) == 0 or sum(len(channel["observed"]) for channel in channels) == 0:
+            raise DubiousInput("no data")
+
+        tests = [ (channel["observed"], channel["expected"]) for channel in channels ]
+        windowIndex = self.windowIndices.get(channels[0]["pinName"], None)
+        try:
+            matchIndex, expected, channelResults = analyse.doJointComparison(tests, self.videoStartTicks, self.syncClockTickRate, windowIndex, maxSkewSecs)
+        except ValueError:
+            raise DubiousInput("pins do not have the same expected times")
+
+        if matchIndex < 0:
+            raise DubiousInput("poor data")
+
+        # convert everything to units of seconds
+        expectedSecs = [ ((e-self.videoStartTicks) / self.syncClockTickRate) for e in expected ]
+
+        results = {}
+        meanOffsets = { True: [], False: [] }
+        for channel, channelResult in zip(channels, channelResults):
+            if channelResult is not None:
+                index, diffsAndErrors = channelResult
+                diffsAndErrorsSecs = [ (d/self.syncClockTickRate, e/self.syncClockTickRate) for (d,e) in diffsAndErrors ]
+                results[channel["pinName"]] = (index, diffsAndErrorsSecs)
+                meanOffsets[isAudio(channel["pinName"])].append( sum(d for (d,e) in diffsAndErrorsSecs) / len(diffsAndErrorsSecs) )
+
+        avSkew = None
+        if len(meanOffsets[True]) > 0 and len(meanOffsets[False]) > 0:
+            avSkew = sum(meanOffsets[True]) / len(meanOffsets[True]) - sum(meanOffsets[False]) / len(meanOffsets[False])
+
+        return expectedSecs, results, avSkew
+
+
+    def driftInSecs(self, drift):
+        """\
+
+        :param drift: dict describing drift (see :func:`analyse.fitDrift`) in units of sync time line ticks
+        :returns: the same, but with the offset, residual standard deviation and centre time in units of seconds
+            (the centre time is seconds since start of the test video sequence)
+
+        """
+        return { "offset": drift["offset"] / self.syncClockTickRate,
+                 "driftPpm": drift["driftPpm"],
+                 "residualStdDev": drift["residualStdDev"] / self.syncClockTickRate,
+                 "centreTime": (drift["centreTime"] - self.videoStartTicks) / self.syncClockTickRate }
+
+def makeWindowIndices(expectedTimings, windowLengths=None):
+    """\
+
+    Build an index for locating observed timings within the expected timings for each pin
+
+    :param expectedTimings: dict mapping pin names to lists of expected flash/beep times
+    :param windowLengths: None, or a dict mapping pin names to the number of bits in a window ("patternWindowLength" from the metadata).
+        For pins with no entry, the shortest window length for which every window is unique is used.
+    :returns: dict mapping pin names to a :class:`analyse.MlsWindowIndex`. Pins whose expected
+        timings cannot be indexed have no entry (matching will search instead).
+
+    """
+    windowIndices = {}
+    for pinName in expectedTimings:
+        try:
+            windowIndices[pinName] = analyse.MlsWindowIndex(expectedTimings[pinName], (windowLengths or {}).get(pinName, None))
+        except ValueError:
+            pass
+    return windowIndices
+
+
+PIN_MAP = {"LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3}
+
+
+
+class ArduinoCaptureSource(object):
+
+    def __init__(self, pinsToMeasure, pinMap, wallClock, captureSecs, port=None, chunked=False, compressed=False):
+        """\
+
+        A source of captures (for :class:`Measurer`) that captures using the Arduino.
+
+        Connects to the Arduino, and prepares it to capture the requested pins.
+        After each capture, the Arduino forgets which pins were requested, so they are
+        requested again before the next capture.
+
+        :param pinsToMeasure a list of pin names that are to be measured.
+                a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
+        :param pinMap dictionary that maps from pin name to pin number
+        :param wallClock the wall clock, used to take time snapshots when communicating with the Arduino
+        :param captureSecs length of the capture to be taken on arduino in seconds
+        :param port None, or the name of the serial port the Arduino is connected to (see :func:`arduino.connect`)
+        :param chunked if True, then sample data is transferred in checksummed chunks (see :func:`arduino.chunkedBulkTransferInto`)
+        :param compressed if True, then sample data is transferred in a compact encoding (see :func:`arduino.compressedBulkTransferInto`)
+
+        """
+        super(ArduinoCaptureSource, self).__init__()
+        self.pinsToMeasure = pinsToMeasure
+        self.pinMap = pinMap
+        self.wallClock = wallClock
+        self.captureSecs = captureSecs
+        self.chunked = chunked
+        self.compressed = compressed
+        self.wcSyncTimeCorrelations = None
+        self.f = arduino.connect(port)
+        self.prepare()
+
+
+    def activatePinReading(self):
+        """\
+
+        Activate each of the pins to be measured for reading
+        during the Arduino capture phase
+
+        """
+        for pin in self.pinsToMeasure:
+             arduino.samplePinDuringCapture(self.f, self.pinMap[pin], self.wallClock)
+
+
+    def prepare(self):
+        """\
+
+        Request the pins to be read, and prepare the Arduino to capture.
+        Sets the nActivePins attribute to the number of pins that the Arduino will read.
+
+        """
+        self.activatePinReading()
+        self.nActivePins = arduino.prepareToCapture(self.f, self.wallClock, self.captureSecs)[0]
+        self.prepared = True
+
+
+    def capture(self):
+        """\
+
+        :returns: the captured data (see :func:`captureAndPackageIntoChannels`)
+
+        """
+        if not self.prepared:
+            self.prepare()
+        self.prepared = False
+        return captureAndPackageIntoChannels(self.f, self.pinsToMeasure, self.pinMap, self.wallClock, self.chunked, self.compressed)
+
+
+
+class _StoppableCaptureSource(object):
+    """\
+    Base for capture sources where the Arduino samples until it is asked to stop. Subclasses set the
+    streaming attribute (while holding the lock) whenever the Arduino is sampling, and provide :func:`_writeStop`.
+    """
+
+    def __init__(self, maxCaptureSecs):
+        super(_StoppableCaptureSource, self).__init__()
+        self.maxCaptureSecs = maxCaptureSecs
+        self.stopRequested = False
+        self.streaming = False
+        self.stopSent = False
+        self.lock = threading.Lock()
+
+
+    def stop(self):
+        """\
+
+        Stop the capture in progress (e.g. when called from a different thread), or the next capture as soon as it starts.
+
+        """
+        with self.lock:
+            self.stopRequested = True
+        self._sendStop()
+
+
+    def _sendStop(self):
+        # ask the Arduino to stop sampling, once only, and only if it is currently sampling
+        with self.lock:
+            if self.streaming and not self.stopSent:
+                self._writeStop()
+                self.stopSent = True
+
+
+    def _started(self):
+        # the Arduino has started sampling: stop it straight away if asked to already, and start a timer to stop it after maxCaptureSecs
+        with self.lock:
+            self.streaming = True
+            self.stopSent = False
+        if self.stopRequested:
+            self._sendStop()
+        timer = None
+        if self.maxCaptureSecs is not None:
+            timer = threading.Timer(self.maxCaptureSecs, self._sendStop)
+            timer.start()
+        return timer
+
+
+    def _stopped(self, timer):
+        with self.lock:
+            self.streaming = False
+            self.stopRequested = False
+        if timer is not None:
+            timer.cancel()
+
+
+
+class StreamingCaptureSource(_StoppableCaptureSource):
+
+    def __init__(self, pinsToMeasure, pinMap, wallClock, eventDurations, maxCaptureSecs=None, port=None, onPulse=None, spoolDir=None):
+        """\
+
+        A source of captures (for :class:`Measurer`) that captures using the Arduino, with the Arduino sending
+        the sample data while it is sampling (see :func:`arduino.startStreaming`). The duration of a capture is
+        therefore not limited by the Arduino's memory. The sample data is spooled to a temporary file.
+
+        As each frame of sample data arrives, flashes and beeps are detected in it (see :class:`detect.StreamingPulseDetector`)
+        and reported, so progress can be followed during a long capture. A capture lasts until maxCaptureSecs have passed,
+        or until :func:`stop` is called.
+
+        :param pinsToMeasure a list of pin names that are to be measured.
+                a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
+        :param pinMap dictionary that maps from pin name to pin number
+        :param wallClock the wall clock, used to take time snapshots when communicating with the Arduino
+        :param eventDurations dict mapping pin names to the expected duration of the flash/beep in seconds
+        :param maxCaptureSecs None, or the number of seconds after which a capture is stopped
+        :param port None, or the name of the serial port the Arduino is connected to (see :func:`arduino.connect`)
+        :param onPulse None, or a function that is called with the pin name and the Arduino clock time (in nanoseconds) of the
+                centre of each flash or beep, as soon as it has been detected.
+        :param spoolDir None, or the directory in which to create the temporary file for the sample data (default is the system's temporary directory)
+
+        """
+        super(StreamingCaptureSource, self).__init__(maxCaptureSecs)
+        self.pinsToMeasure = pinsToMeasure
+        self.pinMap = pinMap
+        self.wallClock = wallClock
+        self.eventDurations = eventDurations
+        self.onPulse = onPulse
+        self.spoolDir = spoolDir
+        self.wcSyncTimeCorrelations = None
+        self.nActivePins = len(pinsToMeasure)
+        self.pulses = []
+        self.f = arduino.connect(port)
+
+
+    def _writeStop(self):
+        arduino.stopStreaming(self.f)
+
+
+    def activatePinReading(self):
+        """\
+
+        Activate each of the pins to be measured for reading while streaming
+
+        """
+        for pin in self.pinsToMeasure:
+             arduino.samplePinDuringCapture(self.f, self.pinMap[pin], self.wallClock)
+
+
+    def capture(self):
+        """\
+
+        Also sets the pulses attribute to a list of tuples (pin name, sample index) for each flash or beep detected while capturing.
+
+        :returns: the captured data (in the same form as :func:`captureAndPackageIntoChannels`). The raw sample data is memory mapped from
+            the temporary file. The caller owns the mapping, and must close it once it has finished with the sample data and the channels
+            (which are views onto it). :class:`Measurer` does this in :func:`Measurer.releaseSamples`.
+
+        :raises RuntimeError: if the Arduino does not start sampling all of the pins
+
+        """
+        self.activatePinReading()
+        nActivePorts, nMilliBlocksPerFrame, timeDataPre = arduino.startStreaming(self.f, self.wallClock)
+        startTime = time.time()
+        if nActivePorts != self.nActivePins:
+            raise RuntimeError("Arduino did not start streaming the requested pins.")
+        timer = self._started()
+
+        detectors = {}
+        for pinName in self.pinsToMeasure:
+            minPulseCount, holdCount = detect.detectionCounts(self.eventDurations[pinName], isAudio(pinName))
+            detectors[pinName] = detect.StreamingPulseDetector(minPulseCount, holdCount, isAudio(pinName))
+        self.pulses = []
+
+        spool = tempfile.TemporaryFile(dir=self.spoolDir)
+        try:
+            try:
+                dueStartTimeUsecs = None
+                nMilliBlocks = 0
+                while True:
+                    kind, seq, arduinoTime, nBlocks, samples = arduino.readStreamFrame(self.f, nActivePorts)
+                    if kind == arduino.STREAM_FRAME_END:
+                        dueFinishTimeUsecs = arduino.unwrapTime(arduinoTime, timeDataPre[2] if dueStartTimeUsecs is None else dueStartTimeUsecs)
+                        break
+                    if dueStartTimeUsecs is None:
+                        dueStartTimeUsecs = arduino.unwrapTime(arduinoTime, timeDataPre[2])
+                    spool.write(samples)
+
+                    for channel in repackageSamples(self.pinsToMeasure, self.pinMap, nBlocks, samples):
+                        if channel is not None:
+                            indices = detectors[channel.pinName].addSamples(channel.min, channel.max)
+                            self._reportPulses(channel.pinName, indices, dueStartTimeUsecs)
+                    nMilliBlocks += nBlocks
+            finally:
+                self._stopped(timer)
+
+            for pinName in self.pinsToMeasure:
+                self._reportPulses(pinName, detectors[pinName].flush(), dueStartTimeUsecs)
+
+            timeDataPost = arduino.writeCmdAndTimeRoundTrip(self.f, self.wallClock, arduino.CMD_TIMEONLY)
+            timeDataPost[1] = timeDataPost[2] = arduino.unwrapTime(timeDataPost[1], dueFinishTimeUsecs)
+            if dueStartTimeUsecs is None:
+                dueStartTimeUsecs = dueFinishTimeUsecs
+
+            numBytes = spool.tell()
+            spool.flush()
+            if numBytes > 0:
+                samples = mmap.mmap(spool.fileno(), numBytes, access=mmap.ACCESS_READ)
+            else:
+                samples = bytearray()
+        finally:
+            spool.close()
+
+        transfer = arduino.transferStats(numBytes, time.time() - startTime)
+        channels = repackageSamples(self.pinsToMeasure, self.pinMap, nMilliBlocks, samples)
+        return (channels, dueStartTimeUsecs, dueFinishTimeUsecs, timeDataPre, timeDataPost, samples, nMilliBlocks, transfer)
+
+
+    def _reportPulses(self, pinName, indices, dueStartTimeUsecs):
+        for index in indices:
+            self.pulses.append( (pinName, index) )
+            if self.onPulse is not None:
+                self.onPulse(pinName, dueStartTimeUsecs + (index + 0.5) * 1000000)
+
+
+
+class PulseEventCaptureSource(_StoppableCaptureSource):
+
+    def __init__(self, pinsToMeasure, pinMap, wallClock, eventDurations, thresholds=None, maxCaptureSecs=None, port=None, onPulse=None, calibrationSecs=2):
+        """\
+
+        A source of captures (for :class:`Measurer`) where the Arduino detects the flashes and beeps itself while it is
+        sampling (see :func:`arduino.startDetecting`), and sends only the times at which each one started and ended.
+        No sample data is kept or transferred, so the duration of a capture is not limited by the Arduino's memory.
+        A capture lasts until maxCaptureSecs have passed, or until :func:`stop` is called.
+
+        The Arduino needs detection thresholds for each pin. If they are not supplied, then they are calculated
+        (see :func:`detect.calcFlashThresholds` and :func:`detect.calcBeepThresholds`) from an ordinary capture of calibrationSecs
+        taken before the first capture (see :func:`calibrate`).
+
+        :param pinsToMeasure a list of pin names that are to be measured.
+                a name must be one of "LIGHT_0", "LIGHT_1", "AUDIO_0" or "AUDIO_1"
+        :param pinMap dictionary that maps from pin name to pin number
+        :param wallClock the wall clock, used to take time snapshots when communicating with the Arduino
+        :param eventDurations dict mapping pin names to the expected duration of the flash/beep in seconds
+        :param thresholds None, or a dict mapping pin names to a tuple (risingThreshold, fallingThreshold)
+        :param maxCaptureSecs None, or the number of seconds after which a capture is stopped
+        :param port None, or the name of the serial port the Arduino is connected to (see :func:`arduino.connect`)
+        :param onPulse None, or a function that is called with the pin name and the Arduino clock time (in nanoseconds) of the
+                centre of each flash or beep, as soon as it has been detected.
+        :param calibrationSecs the duration (in seconds) of the capture used to calculate thresholds. It must include at least one flash or beep on every pin.
+
+        """
+        super(PulseEventCaptureSource, self).__init__(maxCaptureSecs)
+        self.pinsToMeasure = pinsToMeasure
+        self.pinMap = pinMap
+        self.wallClock = wallClock
+        self.eventDurations = eventDurations
+        self.thresholds = thresholds
+        self.onPulse = onPulse
+        self.calibrationSecs = calibrationSecs
+        self.wcSyncTimeCorrelations = None
+        self.nActivePins = len(pinsToMeasure)
+        self.f = arduino.connect(port)
+
+
+    def _writeStop(self):
+        arduino.stopDetecting(self.f)
+
+
+    def calibrate(self):
+        """\
+
+        Take an ordinary capture of calibrationSecs, and set the thresholds attribute to the detection thresholds calculated from it.
+
+        :raises RuntimeError: if the Arduino cannot capture all of the pins
+
+        """
+        for pin in self.pinsToMeasure:
+             arduino.samplePinDuringCapture(self.f, self.pinMap[pin], self.wallClock)
+        if arduino.prepareToCapture(self.f, self.wallClock, self.calibrationSecs)[0] != self.nActivePins:
+            raise RuntimeError("Arduino could not capture the requested pins to calibrate detection.")
+        channels = captureAndPackageIntoChannels(self.f, self.pinsToMeasure, self.pinMap, self.wallClock)[0]
+
+        self.thresholds = {}
+        for channel in channels:
+            if channel is not None:
+                if channel.isAudio:
+                    self.thresholds[channel.pinName] = detect.calcBeepThresholds(detect.minMaxDataToEnvelopeData(channel.min, channel.max))
+                else:
+                    self.thresholds[channel.pinName] = detect.calcFlashThresholds(channel.min, channel.max)
+
+
+    def capture(self):
+        """\
+
+        :returns: the captured data (in the same form as :func:`captureAndPackageIntoChannels`). Each channel has no sample data
+            (its min and max are None), but has the times of each flash or beep (see :class:`SampleChannel`).
+            There is no raw sample data, and the number of millisecond blocks is zero.
+
+        :raises RuntimeError: if the Arduino does not start detecting on all of the pins
+
+        """
+        if self.thresholds is None:
+            self.calibrate()
+        for pinName in self.pinsToMeasure:
+            minPulseCount, holdCount = detect.detectionCounts(self.eventDurations[pinName], isAudio(pinName))
+            rising, falling = detect.deviceThresholds(*self.thresholds[pinName])
+            arduino.configureDetection(self.f, self.wallClock, self.pinMap[pinName], rising, falling, minPulseCount, holdCount)
+
+        nActivePorts, timeDataPre = arduino.startDetecting(self.f, self.wallClock)
+        startTime = time.time()
+        if nActivePorts != self.nActivePins:
+            raise RuntimeError("Arduino did not start detecting on the requested pins.")
+        timer = self._started()
+
+        pinNames = dict( (self.pinMap[pinName], pinName) for pinName in self.pinsToMeasure )
+        pulseEvents = dict( (pinName, []) for pinName in self.pinsToMeasure )
+        halfWrap = 1000 * (2 ** 31)
+        try:
+            dueStartTimeUsecs = None
+            latestTime = timeDataPre[2]
+            numBytes = 0
+            while True:
+                kind, pin, arduinoTime1, arduinoTime2 = arduino.readEventFrame(self.f)
+                numBytes += arduino.EVENT_FRAME.size
+                if kind == arduino.EVENT_PULSE:
+                    # a pulse may have started before the latest time received, so unwrap to the nearest time
+                    start = arduino.unwrapTime(arduinoTime1, latestTime - halfWrap)
+                    end = arduino.unwrapTime(arduinoTime2, start)
+                    latestTime = max(latestTime, end)
+                    pulseEvents[pinNames[pin]].append( (start, end) )
+                    if self.onPulse is not None:
+                        self.onPulse(pinNames[pin], (start + end) / 2.0)
+                else:
+                    if dueStartTimeUsecs is None:
+                        dueStartTimeUsecs = arduino.unwrapTime(arduinoTime1, timeDataPre[2])
+                    latestTime = arduino.unwrapTime(arduinoTime2, max(latestTime, dueStartTimeUsecs))
+                    if kind == arduino.EVENT_END:
+                        dueFinishTimeUsecs = latestTime
+                        break
+        finally:
+            self._stopped(timer)
+
+        timeDataPost = arduino.writeCmdAndTimeRoundTrip(self.f, self.wallClock, arduino.CMD_TIMEONLY)
+        timeDataPost[1] = timeDataPost[2] = arduino.unwrapTime(timeDataPost[1], dueFinishTimeUsecs)
+
+        transfer = arduino.transferStats(numBytes, time.time() - startTime)
+        channels = [None, None, None, None]
+        for pinName in self.pinsToMeasure:
+            channels[self.pinMap[pinName]] = SampleChannel(pinName, isAudio(pinName), None, None, pulseEvents=pulseEvents[pinName])
+        return (channels, dueStartTimeUsecs, dueFinishTimeUsecs, timeDataPre, timeDataPost, bytearray(), 0, transfer)
+
+
+
+class RecordedCaptureSource(object):
+
+    def __init__(self, record, pinMap=PIN_MAP):
+        """\
+
+        A source of captures (for :class:`Measurer`) that replays a capture that was recorded earlier,
+        so that the detection and analysis can be run without an Arduino.
+
+        The wall clock to sync timeline correlations (or control timestamps) are also replayed from the recording.
+
+        :param record: the capture record (see :func:`Measurer.getCaptureRecord`), e.g. loaded using :func:`capturestore.loadCapture`
+        :param pinMap dictionary that maps from pin name to pin number
+
+        """
+        super(RecordedCaptureSource, self).__init__()
+        self.record = record
+        self.pinMap = pinMap
+        self.pinsToMeasure = [ channel["pinName"] for channel in record["channels"] ]
+        self.nActivePins = len(self.pinsToMeasure)
+        self.wcSyncTimeCorrelations = [ (when, tuple(correlation)) for when, correlation in record["wcSyncTimeCorrelations"] ]
+
+
+    def capture(self):
+        """\
+
+        :returns: the recorded data, in the same form as :func:`captureAndPackageIntoChannels`
+
+        """
+        record = self.record
+        if self.nActivePins > 0 and "pulseEvents" in record["channels"][0]:
+            channels = [None, None, None, None]
+            for channel in record["channels"]:
+                pulseEvents = [ tuple(event) for event in channel["pulseEvents"] ]
+                channels[self.pinMap[channel["pinName"]]] = SampleChannel(channel["pinName"], channel["isAudio"], None, None, pulseEvents=pulseEvents)
+            return (channels, record["dueStartTimeUsecs"], record["dueFinishTimeUsecs"],
+                    list(record["wcAcReqResp"]["pre"]), list(record["wcAcReqResp"]["post"]),
+                    bytearray(), 0, record.get("bulkTransfer", None))
+
+        nMilliBlocks = len(record["channels"][0]["min"]) if self.nActivePins > 0 else 0
+
+        # interleave the sample data in the same way the Arduino does
+        channels = sorted(record["channels"], key=lambda channel: self.pinMap[channel["pinName"]])
+        blocks = numpy.empty((nMilliBlocks, self.nActivePins * arduino.BLK_SIZE_PER_PIN), dtype=numpy.uint8)
+        for i, channel in enumerate(channels):
+            blocks[:, i*arduino.BLK_SIZE_PER_PIN] = channel["max"]
+            blocks[:, i*arduino.BLK_SIZE_PER_PIN + 1] = channel["min"]
+        samples = bytearray(blocks.tostring())
+
+        return (repackageSamples(self.pinsToMeasure, self.pinMap, nMilliBlocks, samples),
+                record["dueStartTimeUsecs"], record["dueFinishTimeUsecs"],
+                list(record["wcAcReqResp"]["pre"]), list(record["wcAcReqResp"]["post"]),
+                samples, nMilliBlocks, record.get("bulkTransfer", None))
+
+
+
+def measurerForRecordedCapture(record):
+    """\
+
+    Create a :class:`Measurer` that replays a recorded capture instead of using the Arduino.
+
+    :param record: the capture record (see :func:`Measurer.getCaptureRecord`), e.g. loaded using :func:`capturestore.loadCapture`
+    :returns: a :class:`Measurer`. Call its capture() method, then detectBeepsAndFlashes() etc as usual.
+
+    """
+    source = RecordedCaptureSource(record)
+    return Measurer(record["role"], source.pinsToMeasure, record["expectedTimings"], record["eventDurations"], \
+                    record["videoStartTicks"], None, None, record["syncTimelineTickRate"], \
+                    record["wcPrecisionNanos"], record["acPrecisionNanos"], None, captureSource=source, \
+                    windowLengths=record.get("patternWindowLengths", None))
+
+
+
+def pipelinedCaptures(measurer, numCaptures, dispersionHistoryFunc, analyseFunc, onCapture=None, useProcess=False, checkCapture=None):
+    """\
+
+    Take captures back to back, analysing each one in the background while the next one is being captured.
+    Each capture begins as soon as the sample data for the previous one has been transferred from the Arduino,
+    instead of waiting for its flashes/beeps to be detected and compared.
+
+    :param measurer: the :class:`Measurer` to capture with
+    :param numCaptures: the number of captures to take
+    :param dispersionHistoryFunc: function that is called, with no arguments, after each capture and returns the
+        history of changes in wall clock dispersion to put in its capture record (see :func:`Measurer.getCaptureRecord`)
+    :param analyseFunc: function that is passed a capture record and returns the results of analysing it,
+        e.g. :func:`capturestore.analyseCapture`. If useProcess is True then it must be possible to pickle it
+        (e.g. a function defined at the top level of a module, or a functools.partial of one).
+    :param onCapture: None, or a function that is called with the index and capture record as soon as each capture
+        has been taken (before the next one begins). It can, for example, archive the capture (see :func:`Measurer.archiveCapture`).
+    :param useProcess: if True, then analysis is done in a worker process, instead of a worker thread.
+    :param checkCapture: None, or a function that is called, with no arguments, as soon as each capture has been taken
+        and returns False if the capture must not be analysed (e.g. because the sync timeline became unavailable during it).
+
+    :returns: generator that yields a tuple (index, capture record, results of analysis) for each capture, in the order they
+        were taken, as soon as the analysis of that capture has finished. If analysing a capture raised an exception,
+        then it is raised again when that capture's results would have been yielded. The results are None for a capture
+        that checkCapture rejected.
+
+    """
+    if useProcess:
+        pool = multiprocessing.Pool(1)
+    else:
+        pool = multiprocessing.pool.ThreadPool(1)
+
+    try:
+        pending = []
+        for index in range(0, numCaptures):
+            measurer.capture()
+            valid = checkCapture is None or checkCapture()
+            record = measurer.getCaptureRecord(dispersionHistoryFunc())
+            if onCapture is not None:
+                onCapture(index, record)
+            if valid:
+                pending.append( (index, record, pool.apply_async(analyseFunc, (record,))) )
+            else:
+                pending.append( (index, record, None) )
+
+            # pass on the results of any analysis that has finished, while the next capture is taken
+            while len(pending) > 0 and (pending[0][2] is None or pending[0][2].ready()):
+                index, record, result = pending.pop(0)
+                yield index, record, (result.get() if result is not None else None)
+
+        for index, record, result in pending:
+            yield index, record, (result.get() if result is not None else None)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+
 def isAudio(pinName):
     """\
 
@@ -277,49 +1057,106 @@ def isAudio(pinName):
 
 
 
+class SampleChannel(object):
+    """\
+    The sample data captured for one pin.
+
+    Attributes are:
+
+    * pinName ... one of "LIGHT_0", "AUDIO_0", "LIGHT_1", "AUDIO_1"
+    * isAudio ... True if the pin is an audio input, and False if it is a light sensor input
+    * min ... sampled minimum values for that pin (each value is the minimum over a millisecond period)
+    * max ... sampled maximum values for that pin (each value is the maximum over same millisecond period)
+    * eventDuration ... None, or the approximate duration (in seconds) of a flash or beep
+    * pulseEvents ... None, or a list of tuples (start, end) of the Arduino clock times (in nanoseconds) at which each
+      flash or beep detected by the Arduino started and ended (see :class:`PulseEventCaptureSource`). There is then no sample data
+      (min and max are None).
+
+    The min and max values are usually numpy arrays that are views onto the buffer of sample data
+    received from the Arduino (see :func:`repackageSamples`).
+
+    The attributes can also be accessed by indexing (e.g. `channel["min"]`), so that a SampleChannel
+    can be used wherever a channel dictionary (e.g. from a saved capture) is expected.
+    """
+
+    __slots__ = ("pinName", "isAudio", "min", "max", "eventDuration", "pulseEvents")
+
+    def __init__(self, pinName, isAudio, minSamples, maxSamples, eventDuration=None, pulseEvents=None):
+        super(SampleChannel, self).__init__()
+        self.pinName = pinName
+        self.isAudio = isAudio
+        self.min = minSamples
+        self.max = maxSamples
+        self.eventDuration = eventDuration
+        self.pulseEvents = pulseEvents
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def toDict(self):
+        """\
+        :returns: the channel as a dictionary that can be serialised as JSON
+        """
+        d = { "pinName": self.pinName,
+              "isAudio": self.isAudio,
+              "eventDuration": self.eventDuration }
+        if self.min is not None:
+            d["min"] = [ int(v) for v in self.min ]
+            d["max"] = [ int(v) for v in self.max ]
+        if self.pulseEvents is not None:
+            d["pulseEvents"] = [ (int(start), int(end)) for start, end in self.pulseEvents ]
+        return d
+
+
+
 def repackageSamples(pinsToMeasure, pinMap, nMilliBlocks, samples):
     """\
 
-    reformat the sample data into separate data channels that can be passed to
-    the detect module
+    separate the sample data into data channels that can be passed to
+    the detect module. The data is not copied: each channel's minimum and maximum
+    values are numpy arrays that are strided views onto the sample data.
 
     :param pinsToMeasure: string array of pin names to be read  during capture.  An entry is one of:
         "LIGHT_0", "LIGHT_1", "AUDIO_0" and "AUDIO_1".
     :param pinMap dictionary to map from pin names to arduino pin numbers
 
     :param nMilliBlocks number of millisecond blocks in the sample data
-    :param samples the arduino sample data.  Each millisecond block holds data
-    for each activated pin, where that data are the high and low values observed
+    :param samples the arduino sample data (a string or bytearray, e.g. from :func:`arduino.bulkTransferInto`).
+    Each millisecond block holds data for each activated pin, where that data are the high and low values observed
     on that pin over a millisecond
     :returns: the data channels for the sample data separated out per pin.  This is a
-    list of dictionaries or None, one per sampled pin. It will be 'None' if nothing was sampled for that pin.
-        A dictionary is { "pin": pin name, "isAudio": true or false,
-            "min": list of sampled minimum values for that pin (each value is the minimum over a millisecond period)
-            "max": list of sampled maximum values for that pin (each value is the maximum over same millisecond period) }
+    list of :class:`SampleChannel` objects or None, one per sampled pin. It will be 'None' if nothing was sampled for that pin.
 
     """
 
     channels = [None, None, None, None]
     for pinName in pinsToMeasure:
-        channels[pinMap[pinName]] = ( { "pinName": pinName, "isAudio": isAudio(pinName), "min": [], "max": [] } )
-
-    i = 0
-    for blk in range(0, nMilliBlocks):
-        for channel in channels:
-            if channel != None:
-                channel["max"].append(ord(samples[i]))
-                i += 1
-                channel["min"].append(ord(samples[i]))
-                i += 1
-
-    return channels
+        channels[pinMap[pinName]] = pinName
 
+    nActivePins = len(pinsToMeasure)
+    stride = nActivePins * arduino.BLK_SIZE_PER_PIN
+    data = numpy.frombuffer(samples, dtype=numpy.uint8, count=nMilliBlocks * stride)
 
+    # within each millisecond block, pins are in order of pin number, each as a high value then a low value
+    offset = 0
+    for i in range(0, len(channels)):
+        pinName = channels[i]
+        if pinName is not None:
+            channels[i] = SampleChannel(pinName, isAudio(pinName), data[offset+1::stride], data[offset::stride])
+            offset += arduino.BLK_SIZE_PER_PIN
 
+    return channels
 
 
 
-def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock):
+def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock, chunked=False, compressed=False):
     """\
 
     capture the data on the arduino, transfer it, and repackage
@@ -329,15 +1166,29 @@ def captureAndPackageIntoChannels(f, pinsToMeasure, pinMap, wallClock):
         LIGHT_0, LIGHT_1, AUDIO_0 and AUDIO_1.
     :param pinMap: dictionary that maps from pin name to arduino pin number
     :param wallClock: the wall clock providing times for the CSS_WC protocol (wall clock protocol)
+    :param chunked: if True, then transfer the sample data using :func:`arduino.chunkedBulkTransferInto`, else :func:`arduino.bulkTransferInto`
+    :param compressed: if True, then transfer the sample data using :func:`arduino.compressedBulkTransferInto` instead
     :returns a tuple: (data channels (see repackageSamples() ),
         nanosecond time when sampling commenced,
         nanosecond time when sampling ended,
         round trip timing data taken just before sampling started
-        round trip timing data taken just after sampling finished )
+        round trip timing data taken just after sampling finished,
+        the raw sample data (a bytearray),
+        number of millisecond blocks in the sample data,
+        description of the transfer of the sample data (see :func:`arduino.transferStats`) )
 
     """
 
     dueStartTimeUsecs, dueFinishTimeUsecs, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, wallClock)
-    samples = arduino.bulkTransfer(f, wallClock)[0]
+    if compressed:
+        startTime = time.time()
+        samples, numBytes, timeData, numEncodedBytes = arduino.compressedBulkTransferInto(f, wallClock, len(pinsToMeasure), nMilliBlocks)
+        transfer = arduino.transferStats(numBytes, time.time() - startTime, numEncodedBytes=numEncodedBytes)
+    elif chunked:
+        samples, numBytes, timeData, transfer = arduino.chunkedBulkTransferInto(f, wallClock)
+    else:
+        startTime = time.time()
+        samples, numBytes, timeData = arduino.bulkTransferInto(f, wallClock)
+        transfer = arduino.transferStats(numBytes, time.time() - startTime)
     channels = repackageSamples(pinsToMeasure, pinMap, nMilliBlocks, samples)
-    return (channels, dueStartTimeUsecs, dueFinishTimeUsecs, timeDataPre, timeDataPost)
+    return (channels, dueStartTimeUsecs, dueFinishTimeUsecs, timeDataPre, timeDataPost, samples, nMilliBlocks, transfer)
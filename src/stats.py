@@ -26,7 +26,7 @@ must be in seconds.
 """
 
 
-def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
+def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None, pairedExpectedIndices=None, pairedObservedIndices=None):
     """\
     Prints out statistics about the observed timings.
 
@@ -37,6 +37,10 @@ def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSec
         error bound of measurement for that difference (also in units of secs)
     :param toleranceSecs: None, or a tolerance (in seconds) to be used in
         making a PASS/FAIL judgement on whether the observations were in sync.
+    :param pairedExpectedIndices: None, or a list of the index into allExpectedTimes for each
+        entry in diffsAndErrors. If None, they are assumed to be consecutive starting at matchIndex.
+    :param pairedObservedIndices: None, or a list of the index of the observation for each
+        entry in diffsAndErrors. If None, they are assumed to be consecutive starting at zero.
         
     Offsets (difference values) are expected to be positive when the observation
     was early with respect to the expected time, and negative when it is late.
@@ -91,15 +95,114 @@ def calcAndPrintStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSec
             print "    FAILED ... %d of %d observations outside the tolerance interval" % (numFails, len(diffs))
             print "               (taking into account measurement error bounds)"
             print ""
-            i=0
-            for e in exceeds:
-                i=i+1
+            if pairedExpectedIndices is None:
+                pairedExpectedIndices = range(matchIndex, matchIndex+len(diffs))
+            if pairedObservedIndices is None:
+                pairedObservedIndices = range(0, len(diffs))
+            for e, i, j in zip(exceeds, pairedObservedIndices, pairedExpectedIndices):
                 if e != 0:
                     eMillis = e*1000.0
                     earlyLate = earlyLateString(eMillis)
-                    print "        Observation %d was outside tolerance and error margin by %.3f milliseconds %s" % (i, eMillis, earlyLate)
+                    print "        Observation %d (expected at %.3f seconds) was outside tolerance and error margin by %.3f milliseconds %s" % (i+1, allExpectedTimes[j], eMillis, earlyLate)
         print ""
 
+def calcStats(matchIndex, allExpectedTimes, diffsAndErrors, toleranceSecs=None):
+    """\
+    Calculates the same statistics about the observed timings as :func:`calcAndPrintStats` prints out.
+
+    :param matchIndex: Index into allExpectedTimes that the first observation matched up with
+    :param allExpectedTimes: List of all expected times (units of seconds)
+    :param diffsAndErrors: List of tuples (diff, err) where diff is the
+        offset between expected and observed (units of secs), and err is the
+        error bound of measurement for that difference (also in units of secs)
+    :param toleranceSecs: None, or a tolerance (in seconds) to be used in
+        making a PASS/FAIL judgement on whether the observations were in sync.
+
+    :returns: dict of statistics (units of seconds) that can be serialised as JSON:
+        { "firstExpectedTime", "numReadings", "meanOffset", "stdDevOffset", "minOffset", "maxOffset",
+          "meanErrorBound", "minErrorBound", "maxErrorBound", "toleranceSecs", "passed", "numOutsideTolerance" }
+        "passed" and "numOutsideTolerance" are None if toleranceSecs is None.
+    """
+    diffs       = [diff for diff,err in diffsAndErrors]
+    errorBounds = [err  for diff,err in diffsAndErrors]
+
+    passed, numOutsideTolerance = None, None
+    if toleranceSecs is not None:
+        passed, exceeds = determineWithinTolerance(diffsAndErrors, toleranceSecs)
+        numOutsideTolerance = len([e for e in exceeds if e != 0])
+
+    return { "firstExpectedTime": allExpectedTimes[matchIndex],
+             "numReadings": len(diffs),
+             "meanOffset": calcMean(diffs),
+             "stdDevOffset": calcVariance(diffs)**0.5,
+             "minOffset": min(diffs),
+             "maxOffset": max(diffs),
+             "meanErrorBound": calcMean(errorBounds),
+             "minErrorBound": min(errorBounds),
+             "maxErrorBound": max(errorBounds),
+             "toleranceSecs": toleranceSecs,
+             "passed": passed,
+             "numOutsideTolerance": numOutsideTolerance }
+
+
+def printUnmatched(unmatchedObserved, missedExpected, allExpectedTimes):
+    """\
+    Prints out which observations could not be matched to an expected time, and which expected
+    times were not observed.
+
+    :param unmatchedObserved: List of indices of observations that were not matched
+    :param missedExpected: List of indices into allExpectedTimes that were not observed
+    :param allExpectedTimes: List of all expected times (units of seconds)
+
+    :returns: Nothing. Output is printed to standard output.
+    """
+    if len(unmatchedObserved) == 0 and len(missedExpected) == 0:
+        return
+
+    print ""
+    print "%d observations did not match any expected flash/beep and were ignored." % len(unmatchedObserved)
+    for i in unmatchedObserved:
+        print "    Observation %d" % (i+1)
+    print "%d expected flashes/beeps were not observed." % len(missedExpected)
+    for j in missedExpected:
+        print "    Expected at %.3f seconds into the test video sequence" % allExpectedTimes[j]
+
+
+def printDrift(drift):
+    """\
+    Prints out the drift measured by fitting a line to the offsets between observed and expected.
+
+    :param drift: dict with "offset", "driftPpm", "residualStdDev" and "centreTime" (see :func:`analyse.fitDrift`).
+        Units are seconds (except for the drift, which is in parts per million).
+
+    :returns: Nothing. Output is printed to standard output.
+    """
+    offsetMillis = drift["offset"] * 1000.0
+    print ""
+    print "Straight line fitted to offsets between observed and expected:"
+    print "    Offset        : %9.3f milliseconds %s (at %.3f seconds into the test video sequence)" % (offsetMillis, earlyLateString(offsetMillis), drift["centreTime"])
+    print "    Drift         : %9.3f ppm" % drift["driftPpm"]
+    print "    Std. deviation: %9.3f milliseconds (of offsets from the fitted line)" % (drift["residualStdDev"] * 1000.0)
+
+
+def printAvSkew(avSkew):
+    """\
+    Prints out the skew between audio and video.
+
+    :param avSkew: the mean offset of the audio inputs minus the mean offset of the light sensor inputs (in seconds),
+        or None if there were not both audio and light sensor inputs.
+
+    :returns: Nothing. Output is printed to standard output.
+    """
+    print ""
+    if avSkew is None:
+        print "Audio-video skew cannot be measured (needs both audio and light sensor inputs)."
+    elif avSkew >= 0:
+        print "Audio is ahead of video by %.3f milliseconds" % (avSkew * 1000.0)
+    else:
+        print "Audio is behind video by %.3f milliseconds" % (-avSkew * 1000.0)
+
+
 def calcMean(data):
     """\
     Calculates statistical mean.
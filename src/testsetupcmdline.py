@@ -101,6 +101,19 @@ class BaseCmdLineParser(object):
                         "--maxfreqerror", dest="maxFreqError",  type=int, action="store",default=self.PPM,help="Set the maximum frequency error for the local wall clock in ppm (default="+str(self.PPM)+")")
 
         self.parser.add_argument("--toleranceTest",dest="toleranceSecs",type=ToleranceOrNone, action="store", nargs=1,help="Do a pass/fail test on whether sync is accurate to within this specified tolerance, in milliseconds. Test is not performed if this is not specified.",default=[self.TOLERANCE])
+        self.parser.add_argument("--robustMatch", dest="robustMatch", action="store_true", default=False, help="Match observed flashes/beeps to expected ones in a way that tolerates missed or spurious detections, instead of requiring every flash/beep to be detected.")
+        self.parser.add_argument("--detrend", dest="detrend", action="store_true", default=False, help="When matching observed flashes/beeps to expected ones, ignore any steady drift between them, so that drift does not count against a match.")
+        self.parser.add_argument("--jointMatch", dest="jointMatch", action="store_true", default=False, help="Match the flashes/beeps observed on all inputs at once (they happen at the same times) and report the skew between audio and video.")
+        self.parser.add_argument("--maxAvSkew", dest="maxAvSkewSecs", type=float, nargs=1, default=[None], help="With --jointMatch, the largest audio-video skew (in seconds) to look for. Default is half of the smallest gap between flashes/beeps, and larger skews are not measured.")
+        self.parser.add_argument("--saveCapture", dest="saveCaptureFilename", type=str, nargs=1, default=None, help="Save the captured samples (and everything else needed to analyse them) to the named file, so that they can be analysed again later (see batchAnalyse.py).")
+        self.parser.add_argument("--archiveDir", dest="archiveDir", type=str, action="store", default="captures", help="Directory in which every capture is archived (the raw samples and all timing information), so it can be analysed again later (see batchAnalyse.py). Default is \"captures\".")
+        self.parser.add_argument("--noArchive", dest="archiveDir", action="store_const", const=None, help="Do not archive captures.")
+        self.parser.add_argument("--arduinoPort", dest="arduinoPort", type=str, action="store", default=None, help="Serial port the Arduino is connected to, such as the pseudo-terminal of an emulated Arduino (see arduinoemulator.py). Default is to find the Arduino Due automatically.")
+        self.parser.add_argument("--chunkedTransfer", dest="chunkedTransfer", action="store_true", default=False, help="Transfer sample data from the Arduino in checksummed chunks, re-requesting any that are corrupted or lost. Needs the Arduino to be running the latest sampling code.")
+        self.parser.add_argument("--compressedTransfer", dest="compressedTransfer", action="store_true", default=False, help="Transfer sample data from the Arduino in a compact encoding, which is quicker when the light and audio levels are mostly steady. Needs the Arduino to be running the latest sampling code.")
+        self.parser.add_argument("--stream", dest="stream", action="store_true", default=False, help="Have the Arduino send sample data while it is sampling, so that the measurement period (which must be given using --measureSecs) is not limited by the Arduino's memory. Needs the Arduino to be running the latest sampling code.")
+        self.parser.add_argument("--detectOnDevice", dest="detectOnDevice", action="store_true", default=False, help="Have the Arduino detect the flashes/beeps itself and send only when each one started and ended, so that the measurement period (which must be given using --measureSecs) is not limited by the Arduino's memory. Detection thresholds are calculated from a short capture taken first. Needs the Arduino to be running the latest sampling code.")
+        self.parser.add_argument("--adaptiveThresholds", dest="thresholdWindowSecs", type=float, nargs=1, default=[None], help="Adapt flash/beep detection thresholds to changes in light or audio level, using a window of this many seconds (must always include at least one flash/beep).")
 
 
     def parseArguments(self, args=None):
@@ -126,13 +139,21 @@ class BaseCmdLineParser(object):
         }
 
         # load in the expected times for each pin being sampled, and also build a list of which pins are being sampled
-        self.pinExpectedTimes, self.pinEventDurations = _loadExpectedTimeMetadata(self.pinMetadataFilenames)
+        self.pinExpectedTimes, self.pinEventDurations, self.pinWindowLengths = _loadExpectedTimeMetadata(self.pinMetadataFilenames)
         self.pinsToMeasure = self.pinExpectedTimes.keys()
 
         if len(self.pinsToMeasure) == 0:
           sys.stderr.write("\nAborting. No light sensor or audio inputs have been specified.\n\n")
           sys.exit(1)
 
+        if self.args.stream or self.args.detectOnDevice:
+            # when streaming or detecting on the Arduino, the duration is not limited by the Arduino's memory, but there is no maximum to default to
+            self.measurerTime = self.args.measureSecs[0]
+            if self.measurerTime <= 0:
+                sys.stderr.write("\nAborting.  The measurement period must be specified (using --measureSecs) when streaming or detecting on the Arduino.\n\n")
+                sys.exit(1)
+            return
+
         # see if the requested time for measuring can be accomodated by the system
         self.measurerTime = arduino.checkCaptureTimeAchievable(self.args.measureSecs[0], len(self.pinsToMeasure))
         if self.measurerTime < 0:
@@ -144,18 +165,23 @@ def _loadExpectedTimeMetadata(pinMetadataFilenames):
 
     Given an input dictionary mapping pin names to filename, load the
     expected flash/beep times data from the filename and return a dict mapping
-    pin names to the expected timing list.
+    pin names to the expected timing list, a dict mapping pin names to the expected
+    flash/beep durations, and a dict mapping pin names to the pattern window lengths.
 
     :param pinMetadataFilenames: dict mapping pin names to either None or a list
        containing a single string which is the filename of the metadata json to load from.
 
-    :returns: dict mapping pin names to lists containing expected flash/beep times
-    read from the metadata file. For pins that have a None value, there will be
-    no entry in the dict.
+    :returns: tuple (pinExpectedTimes, pinEventDurations, pinWindowLengths) of dicts
+    mapping pin names to lists containing expected flash/beep times, to the approximate
+    flash/beep durations, and to the number of bits in each uniquely identifiable window of the
+    test sequence, all read from the metadata file. For pins that have a None value, there will be
+    no entry in the dicts. If the metadata has no "patternWindowLength", then the pin has no entry
+    in pinWindowLengths.
 
     """
     pinExpectedTimes = {}
     pinEventDurations = {}
+    pinWindowLengths = {}
     try:
         for pinName in pinMetadataFilenames:
             argValue = pinMetadataFilenames[pinName]
@@ -165,6 +191,8 @@ def _loadExpectedTimeMetadata(pinMetadataFilenames):
                 metadata = json.load(f)
                 f.close()
                 pinExpectedTimes[pinName] = metadata["eventCentreTimes"]
+                if "patternWindowLength" in metadata:
+                    pinWindowLengths[pinName] = metadata["patternWindowLength"]
                 if "AUDIO" in pinName:
                     pinEventDurations[pinName] = metadata["approxBeepDurationSecs"]
                 elif "LIGHT" in pinName:
@@ -177,7 +205,7 @@ def _loadExpectedTimeMetadata(pinMetadataFilenames):
     except ValueError:
         sys.stderr.write("\nError parsing contents of one of the JSON metadata files. Is it correct JSON?\n\n")
         sys.exit(1)
-    return pinExpectedTimes, pinEventDurations
+    return pinExpectedTimes, pinEventDurations, pinWindowLengths
 
 
 
@@ -214,6 +242,7 @@ class TVTesterCmdLineParser(BaseCmdLineParser):
         self.parser.add_argument("wcUrl", action="store", type=dvbcss.util.udpUrl_str, nargs=1, help="udp://<host>:<port> URL of TV's CSS-WC end point")
         self.parser.add_argument("wcBindAddr",action="store", type=dvbcss.util.iphost_str, nargs="?",help="IP address or host name to bind WC client to (default="+str(self.DEFAULT_WC_BIND[0])+")",default=self.DEFAULT_WC_BIND[0])
         self.parser.add_argument("wcBindPort",action="store", type=dvbcss.util.port_int_or_random,   nargs="?",help="Port number to bind WC client to (default="+str(self.DEFAULT_WC_BIND[1])+")",default=self.DEFAULT_WC_BIND[1])
+        self.parser.add_argument("--repeat", dest="numCaptures", type=int, action="store", default=1, help="Take this many captures back to back, analysing each one while the next is being captured, and print a summary of the results for each (default 1). --jointMatch and --saveCapture are ignored when repeating.")
 
 
     def parseArguments(self, args=None):
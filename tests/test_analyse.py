@@ -31,7 +31,25 @@ import json
 import math
 
 from analyse import correlate
+from analyse import correlateFast
+from analyse import varianceAtEachIndex
+from analyse import varianceInTimesWithObservedComparedAgainstExpectedAtIndex
+from analyse import doComparison
+from analyse import MlsWindowIndex
+from analyse import correlateWithIndex
+from analyse import alignRobust
+from analyse import pairWithNearest
+from analyse import doRobustComparison
+from analyse import fitDrift
+from analyse import mergeChannels
+from analyse import correlateJoint
+from analyse import doJointComparison
+from analyse import IncrementalCorrelator
 
+import analyse
+import numpy
+
+import random
 
 
 class Test_DoComparison(unittest.TestCase):
@@ -256,9 +274,420 @@ class Test_DoComparison(unittest.TestCase):
         self.assertEquals(index,10)
         
         
-        
-    
-    
+    def test_correlateFastMatchesCorrelate(self):
+        """Check the fast correlation finds the same index as the exhaustive
+        correlation, and returns the time differences for that match only."""
+
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        expected = [ startSyncTime + tickRate * t for t in metadata["eventCentreTimes"] ]
+
+        for observed, correctIndex in [ (Test_DoComparison.fakeObservationData, 30),
+                                        (Test_DoComparison.fakeObservationData2, 10) ]:
+            index, allDiffsAndErrors = correlate(expected, observed)
+            fastIndex, diffsAndErrors = correlateFast(expected, observed)
+
+            self.assertEquals(fastIndex, correctIndex)
+            self.assertEquals(diffsAndErrors, allDiffsAndErrors[correctIndex])
+
+
+    def test_varianceAtEachIndex(self):
+        """Check the variances calculated from running sums agree with those
+        calculated directly at every index."""
+
+        rand = random.Random(1)
+        expected = []
+        t = 1000000.0
+        for i in range(0, 300):
+            t += rand.choice([21600, 68400, 90000])
+            expected.append(t)
+        observed = [ (e - 4321.5 + rand.uniform(-20, 20), 100.0) for e in expected[117:167] ]
+
+        variances = varianceAtEachIndex(expected, observed)
+        self.assertEquals(len(variances), len(expected) - len(observed) + 1)
+        for j in range(0, len(variances)):
+            v, diffs = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(j, expected, observed)
+            self.assertAlmostEqual(variances[j] / (v+1.0), v / (v+1.0), places=6)
+
+        self.assertEquals(correlateFast(expected, observed)[0], 117)
+
+
+    def test_varianceAtEachIndexDetrended(self):
+        """Check the detrended variances agree with the variance of residuals from
+        a straight line fitted directly at every index, and that a strong drift
+        still matches at the right index."""
+
+        rand = random.Random(2)
+        expected = []
+        t = 1000000.0
+        for i in range(0, 300):
+            t += rand.choice([21600, 68400, 90000])
+            expected.append(t)
+        observed = [ (e - 4321.5 - 0.002 * (e - expected[117]) + rand.uniform(-20, 20), 100.0) for e in expected[117:167] ]
+
+        variances = varianceAtEachIndex(expected, observed, detrend=True)
+        self.assertEquals(len(variances), len(expected) - len(observed) + 1)
+        for j in range(0, len(variances)):
+            v, diffs = varianceInTimesWithObservedComparedAgainstExpectedAtIndex(j, expected, observed)
+            x = numpy.array(expected[j:j+len(observed)])
+            d = numpy.array([ diff for (diff, err) in diffs ])
+            residuals = d - numpy.polyval(numpy.polyfit(x, d, 1), x)
+            r = numpy.var(residuals)
+            self.assertAlmostEqual(variances[j] / (r+1.0), r / (r+1.0), places=6)
+
+        self.assertEquals(correlateFast(expected, observed, detrend=True)[0], 117)
+
+
+    def test_fitDrift(self):
+        """A line fitted to time differences recovers the offset and drift"""
+        times = [ 1000.0 + 10.0 * i for i in range(0, 20) ]
+        diffsAndErrors = [ (0.25 + 50e-6 * (t - 1095.0), 0.001) for t in times ]
+
+        drift = fitDrift(times, diffsAndErrors)
+        self.assertAlmostEqual(drift["centreTime"], 1095.0)
+        self.assertAlmostEqual(drift["offset"], 0.25)
+        self.assertAlmostEqual(drift["driftPpm"], 50.0, places=6)
+        self.assertAlmostEqual(drift["residualStdDev"], 0.0)
+
+        # an outlier with a large error bound barely affects a weighted fit
+        diffsAndErrors[3] = (diffsAndErrors[3][0] + 0.1, 1000.0)
+        self.assertAlmostEqual(fitDrift(times, diffsAndErrors, weighted=True)["driftPpm"], 50.0, places=3)
+        self.assertNotAlmostEqual(fitDrift(times, diffsAndErrors)["driftPpm"], 50.0, places=3)
+
+        # a single time difference has no drift
+        self.assertEquals(fitDrift([5.0], [(0.5, 0.1)]), { "offset":0.5, "driftPpm":0.0, "residualStdDev":0.0, "centreTime":5.0 })
+
+        self.assertRaises(ValueError, fitDrift, [1.0, 2.0], [(0.5, 0.1), (0.5, 0.0)], True)
+
+
+    def test_incrementalCorrelator(self):
+        """Adding observations one at a time gives the same match as correlating them all at once,
+        and the confidence in the match grows as observations are added."""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        expected = [ startSyncTime + tickRate * t for t in metadata["eventCentreTimes"] ]
+        observed = Test_DoComparison.fakeObservationData
+
+        correlator = IncrementalCorrelator(expected)
+        self.assertEquals(correlator.bestMatch(), (-1, None))
+        self.assertEquals(correlator.confidence(), 0.0)
+        self.assertEquals(correlator.offset(), None)
+
+        confidences = []
+        for observation in observed:
+            correlator.addObservation(observation)
+            confidences.append(correlator.confidence())
+            self.assertEquals(correlator.bestMatch(), correlateFast(expected, correlator.observed))
+
+        correctIndex, allDiffsAndErrors = correlate(expected, observed)
+        self.assertEquals(correlator.bestMatch(), (correctIndex, allDiffsAndErrors[correctIndex]))
+        self.assertTrue(confidences[-1] > 0.99)
+        self.assertTrue(confidences[-1] >= confidences[len(confidences)/2] >= confidences[1])
+
+        index, diffsAndErrors = correlator.bestMatch()
+        meanDiff = sum(d for (d, err) in diffsAndErrors) / len(diffsAndErrors)
+        self.assertAlmostEqual(correlator.offset() / tickRate, meanDiff / tickRate)
+
+        # adding observations in batches gives the same result
+        batched = IncrementalCorrelator(expected)
+        batched.addObservations(observed[:10])
+        batched.addObservations(observed[10:])
+        self.assertEquals(batched.bestMatch(), correlator.bestMatch())
+
+        # too many observations
+        tooMany = IncrementalCorrelator(expected[:3])
+        tooMany.addObservations(observed[:4])
+        self.assertEquals(tooMany.bestMatch(), (-1, None))
+
+
+    def test_correlateFastTooManyObserved(self):
+        """More observed than expected timings is reported as index -1"""
+        self.assertEquals(correlateFast([1, 2, 3], [(1,0), (2,0), (3,0), (4,0)]), (-1, None))
+
+
+    def test_windowIndexLocatesObservations(self):
+        """The MLS window index locates the observed timings directly, without searching."""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        windowIndex = MlsWindowIndex.fromMetadata(metadata)
+        self.assertEquals(windowIndex.windowLength, 7)
+
+        for observed, correctIndex in [ (Test_DoComparison.fakeObservationData, 30),
+                                        (Test_DoComparison.fakeObservationData2, 10) ]:
+            observedTimes = [t for (t, err) in observed]
+            self.assertEquals(windowIndex.locate(observedTimes, tickRate)[0], correctIndex)
+
+
+    def test_windowIndexOneOrTwoEventsPerBit(self):
+        """Test sequences from the generator encode a 0 bit as one event and a 1 bit as two."""
+        bits = [ int(b) for b in "1001011001111100011011101010000" ]   # 5 bit MLS
+        bits.append(1)
+        times = []
+        for n in range(0, len(bits)):
+            times.append(n + 0.14)
+            if bits[n]:
+                times.append(n + 0.38)
+
+        windowIndex = MlsWindowIndex(times, windowLength=5)
+        self.assertEquals(windowIndex.symbolGaps, [ (), (0.24,) ])
+
+        tickRate = 1000
+        expected = [ 5000 + tickRate * t for t in times ]
+        observed = [ (e - 37, 2) for e in expected[9:37] ]
+        self.assertEquals(windowIndex.locate([t for (t, err) in observed], tickRate)[0], 9)
+        self.assertEquals(correlateWithIndex(expected, observed, windowIndex, tickRate)[0], 9)
+
+
+    def test_windowIndexDetrend(self):
+        """With detrend, a candidate found using the index is accepted despite drift, instead of falling back to searching"""
+        bits = [ int(b) for b in "1001011001111100011011101010000" ]   # 5 bit MLS
+        bits.append(1)
+        times = []
+        for n in range(0, len(bits)):
+            times.append(n + 0.14)
+            if bits[n]:
+                times.append(n + 0.38)
+        windowIndex = MlsWindowIndex(times, windowLength=5)
+
+        tickRate = 1000
+        expected = [ 5000 + tickRate * t for t in times ]
+        observed = [ (e - 37 + 0.02 * (e - expected[9]), 2) for e in expected[9:37] ]   # drifts 2%
+
+        searches = []
+        def correlateFastSpy(expected, observed, detrend=False):
+            searches.append(detrend)
+            return correlateFast(expected, observed, detrend)
+
+        analyse.correlateFast = correlateFastSpy
+        try:
+            self.assertEquals(correlateWithIndex(expected, observed, windowIndex, tickRate, detrend=True)[0], 9)
+            self.assertEquals(searches, [])
+            self.assertEquals(correlateWithIndex(expected, observed, windowIndex, tickRate)[0], 9)
+            self.assertEquals(searches, [False])
+        finally:
+            analyse.correlateFast = correlateFast
+
+        test = (observed, [ (e - 5000) / float(tickRate) for e in expected ])
+        self.assertEquals(doComparison(test, 5000, tickRate, windowIndex, detrend=True)[0], 9)
+
+
+    def test_windowIndexChoosesWindowLength(self):
+        """If no window length is given, the shortest one that uniquely locates every window is used"""
+        windowIndex = MlsWindowIndex(Test_DoComparison.fakeMetadata["eventCentreTimes"])
+        self.assertTrue(windowIndex.windowLength <= 7)
+        self.assertEquals(len(windowIndex.index), 127 - windowIndex.windowLength + 1)
+
+
+    def test_windowIndexRejectsUnsuitableTimings(self):
+        """Expected timings that cannot be decoded into bits cannot be indexed"""
+        # events in one bit are further apart than events in different bits
+        self.assertRaises(ValueError, MlsWindowIndex, [0.1, 0.9, 1.1, 2.1, 2.9, 3.1])
+        # a bit with no events
+        self.assertRaises(ValueError, MlsWindowIndex, [0.1, 0.3, 2.1, 2.3, 3.1])
+        # windows that are not unique
+        self.assertRaises(ValueError, MlsWindowIndex, [0.1, 1.1, 2.1, 3.1, 3.3, 4.1, 5.1, 5.3], windowLength=1)
+
+
+    def test_correlateWithIndex(self):
+        """Correlating using the index gives the same result as searching. If the
+        observations cannot be located using the index, it falls back to searching."""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        expected = [ startSyncTime + tickRate * t for t in metadata["eventCentreTimes"] ]
+        windowIndex = MlsWindowIndex.fromMetadata(metadata)
+
+        observed = Test_DoComparison.fakeObservationData2
+        self.assertEquals(correlateWithIndex(expected, observed, windowIndex, tickRate), correlateFast(expected, observed))
+
+        # too few observations to decode a whole window of bits
+        observed = Test_DoComparison.fakeObservationData[:5]
+        self.assertEquals(correlateWithIndex(expected, observed, windowIndex, tickRate), correlateFast(expected, observed))
+
+
+    def test_pairWithNearest(self):
+        """Each observation is paired with the nearest expected time, within the tolerance, and only one observation is paired with each expected time."""
+        expected = numpy.array([ 100.0, 200.0, 300.0, 400.0 ])
+        observed = numpy.array([  88.0, 105.0, 250.0, 310.0, 395.0, 700.0 ])
+        paired = pairWithNearest(expected, observed, 5.0, 20.0)
+        self.assertEquals(list(paired), [ 0, -1, -1, 2, 3, -1 ])
+
+
+    def test_alignRobustNoGlitches(self):
+        """With no missed or spurious detections, robust alignment agrees with the correlation"""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        expected = [ startSyncTime + tickRate * t for t in metadata["eventCentreTimes"] ]
+        observed = Test_DoComparison.fakeObservationData2
+
+        index, diffsAndErrors, paired, unmatched, missed = alignRobust(expected, observed)
+        self.assertEquals(index, 10)
+        self.assertEquals(diffsAndErrors, correlateFast(expected, observed)[1])
+        self.assertEquals(paired, range(10, 10+len(observed)))
+        self.assertEquals(unmatched, [])
+        self.assertEquals(missed, [])
+
+
+    def test_alignRobustMissedAndSpurious(self):
+        """Missed and spurious detections are reported, and the rest are still paired correctly"""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        expected = [ startSyncTime + tickRate * t for t in metadata["eventCentreTimes"] ]
+        observed = list(Test_DoComparison.fakeObservationData2)
+
+        # lose observations 5 and 40, and add a spurious one between observations 20 and 21
+        spurious = ((observed[20][0] + observed[21][0]) / 2, 234.0)
+        glitched = observed[:5] + observed[6:21] + [ spurious ] + observed[21:40] + observed[41:]
+
+        index, diffsAndErrors, paired, unmatched, missed = alignRobust(expected, glitched)
+        self.assertEquals(index, 10)
+        self.assertEquals(unmatched, [20])
+        self.assertEquals(missed, [15, 50])
+        self.assertEquals(len(diffsAndErrors), len(observed) - 2)
+
+        windowIndex = MlsWindowIndex.fromMetadata(metadata)
+        self.assertEquals(alignRobust(expected, glitched, windowIndex=windowIndex, tickRate=tickRate)[3:], ([20], [15, 50]))
+
+        # more observations than expected is not a problem in itself
+        test = (glitched + glitched[-1:], metadata["eventCentreTimes"][:len(glitched)])
+        index, expectedTimes, diffsAndErrors, unmatched, missed, pairedExpected, pairedObserved = doRobustComparison(test, startSyncTime, tickRate)
+        self.assertEquals(index, 10)
+        self.assertEquals(unmatched[0], 20)
+
+        # after a missed detection, the paired indices skip that expected time rather than staying consecutive
+        self.assertEquals(len(pairedExpected), len(diffsAndErrors))
+        self.assertEquals(pairedExpected[:6], [10, 11, 12, 13, 14, 16])
+        self.assertEquals(pairedObserved[:6], [0, 1, 2, 3, 4, 5])
+        self.assertEquals(pairedObserved[19:22], [19, 21, 22])
+        for (d, err), i, j in zip(diffsAndErrors, pairedObserved, pairedExpected):
+            self.assertEquals(d, expectedTimes[j] - test[0][i][0])
+
+
+    def test_alignRobustNothingMatches(self):
+        """If nothing can be paired, the index is -1 and everything is unmatched"""
+        self.assertEquals(alignRobust([], [(1,0), (2,0)]), (-1, [], [], [0, 1], []))
+
+
+    def test_doComparison(self):
+        """doComparison returns the match index, expected times on the sync timeline and the diffs for the match"""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        test = (Test_DoComparison.fakeObservationData, metadata["eventCentreTimes"])
+        index, expected, diffsAndErrors = doComparison(test, startSyncTime, tickRate)
+
+        self.assertEquals(index, 30)
+        self.assertEquals(expected[0], startSyncTime + tickRate * 0.14)
+        self.assertEquals(len(diffsAndErrors), len(Test_DoComparison.fakeObservationData))
+
+        windowIndex = MlsWindowIndex.fromMetadata(metadata)
+        self.assertEquals(doComparison(test, startSyncTime, tickRate, windowIndex), (index, expected, diffsAndErrors))
+
+        index2, expected2, diffsAndErrors2, drift = doComparison(test, startSyncTime, tickRate, withDrift=True)
+        self.assertEquals((index2, expected2, diffsAndErrors2), (index, expected, diffsAndErrors))
+        self.assertEquals(drift, fitDrift(expected[index:index+len(diffsAndErrors)], diffsAndErrors))
+
+
+
+    def test_mergeChannels(self):
+        """Observations of the same event on different channels are merged, after removing the skew between channels"""
+        video = [ (1000.0, 2.0), (2000.0, 2.0), (3000.0, 2.0), (4000.0, 2.0) ]
+        audio = [ (2050.0, 1.0), (4052.0, 1.0) ]
+
+        merged, eventIndices, skews = mergeChannels([video, audio], 400.0)
+        self.assertEquals(skews, [0.0, 51.0])
+        self.assertEquals(eventIndices, [ [0, 1, 2, 3], [1, 3] ])
+        self.assertEquals(merged, [ (1000.0, 2.0), (1999.5, 2.0), (3000.0, 2.0), (4000.5, 2.0) ])
+
+        # observations too far apart are separate events
+        merged, eventIndices, skews = mergeChannels([video, [ (1500.0, 1.0) ]], 400.0)
+        self.assertEquals(eventIndices, [ [0, 2, 3, 4], [1] ])
+
+
+    def test_mergeChannelsLargeSkew(self):
+        """A skew larger than the gap allowed between observations of the same event is found, if it is within maxSkew"""
+        video = [ (1000.0, 2.0), (1240.0, 2.0), (2000.0, 2.0), (3000.0, 2.0), (3240.0, 2.0), (4000.0, 2.0) ]
+        audio = [ (t + 300.0, 1.0) for (t, err) in video[1:5] ]
+
+        # by default, the skew is not found
+        merged, eventIndices, skews = mergeChannels([video, audio], 100.0)
+        self.assertNotEquals(skews[1], 300.0)
+        self.assertNotEquals(merged, video)
+
+        merged, eventIndices, skews = mergeChannels([video, audio], 100.0, maxSkew=500.0)
+        self.assertEquals(skews, [0.0, 300.0])
+        self.assertEquals(eventIndices, [ [0, 1, 2, 3, 4, 5], [1, 2, 3, 4] ])
+        self.assertEquals(merged, video)
+
+    def test_mergeChannelsLargeSkewLongSequence(self):
+        """The large skew is found in a long, jittery sequence with missing observations"""
+        random = numpy.random.RandomState(1)
+        video = [ (t, 2.0) for t in numpy.cumsum(random.randint(200, 1000, size=2000)).astype(float) ]
+        audio = [ (t + 300.0 + random.uniform(-5.0, 5.0), 1.0) for (t, err) in video if random.uniform() < 0.8 ]
+
+        merged, eventIndices, skews = mergeChannels([video, audio], 100.0, maxSkew=500.0)
+        self.assertAlmostEquals(skews[1], 300.0, delta=5.0)
+        self.assertEquals(len(merged), len(video))
+
+    def test_correlateJoint(self):
+        """Channels are matched jointly, even when one of them has too few observations to be matched on its own"""
+        metadata      = Test_DoComparison.fakeMetadata
+        startSyncTime = Test_DoComparison.fakeStartSyncTime
+        tickRate      = Test_DoComparison.fakeTickRate
+
+        video = Test_DoComparison.fakeObservationData
+        index, expected, videoDiffs = doComparison((video, metadata["eventCentreTimes"]), startSyncTime, tickRate)
+
+        # audio is 20ms late, and only the first few beeps were detected
+        skew = 0.020 * tickRate
+        audio = [ (t + skew, err) for (t, err) in video[2:5] ]
+
+        # audio alone is ambiguous, so would not match in the right place
+        self.assertNotEquals(correlateFast(expected, audio)[0], index+2)
+
+        matchIndex, channelResults = correlateJoint(expected, [video, audio, []])
+        self.assertEquals(matchIndex, index)
+        self.assertEquals(channelResults[0][0], index)
+        for (d, err), (d2, err2) in zip(channelResults[0][1], videoDiffs):
+            self.assertAlmostEqual(d, d2)
+            self.assertEquals(err, err2)
+        self.assertEquals(channelResults[1][0], index+2)
+        for (d, err), (d2, err2) in zip(channelResults[1][1], videoDiffs[2:5]):
+            self.assertAlmostEqual(d, d2 - skew)
+        self.assertEquals(channelResults[2], None)
+
+        tests = [ (video, metadata["eventCentreTimes"]), (audio, metadata["eventCentreTimes"]) ]
+        self.assertEquals(doJointComparison(tests, startSyncTime, tickRate), (matchIndex, expected, channelResults[:2]))
+
+        tests[1] = (audio, metadata["eventCentreTimes"][1:])
+        self.assertRaises(ValueError, doJointComparison, tests, startSyncTime, tickRate)
+
+        self.assertEquals(correlateJoint(expected, [[], []]), (-1, [None, None]))
+
+        # audio is 300ms late, which is more than half of the smallest gap between expected times
+        skew = 0.300 * tickRate
+        audio = [ (t + skew, err) for (t, err) in video[2:12] ]
+        matchIndex, channelResults = correlateJoint(expected, [video, audio], maxSkew=0.5 * tickRate)
+        self.assertEquals(matchIndex, index)
+        self.assertEquals(channelResults[1][0], index+2)
+        for (d, err), (d2, err2) in zip(channelResults[1][1], videoDiffs[2:12]):
+            self.assertAlmostEqual(d, d2 - skew)
+        tests = [ (video, metadata["eventCentreTimes"]), (audio, metadata["eventCentreTimes"]) ]
+        self.assertEquals(doJointComparison(tests, startSyncTime, tickRate, maxSkewSecs=0.5)[2], channelResults)
+
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit-tests for reading and decoding replies from the Arduino
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import io
+import struct
+
+import arduino
+
+
+import unittest
+
+
+class Mock_Serial(object):
+    """\
+    Pretends to be the serial connection to an Arduino that has already sent a reply.
+    Every read and write (and every read of the clock) is logged.
+    """
+
+    def __init__(self, reply, log):
+        self.reply = io.BytesIO(reply)
+        self.log = log
+
+    def write(self, data):
+        self.log.append( ("write", data) )
+
+    def read(self, n):
+        self.log.append( ("read", n) )
+        return self.reply.read(n)
+
+    def readinto(self, b):
+        self.log.append( ("readinto", len(b)) )
+        return self.reply.readinto(b)
+
+
+class Mock_Clock(object):
+
+    def __init__(self, log):
+        self._ticks = 0
+        self.log = log
+
+    @property
+    def ticks(self):
+        self._ticks += 1
+        self.log.append( ("ticks", self._ticks) )
+        return self._ticks
+
+
+class Test_readFrame(unittest.TestCase):
+
+    def testWholeFrame(self):
+        """Without a clock, a reply is read in one go"""
+        log = []
+        f = Mock_Serial(struct.pack(">III", 1, 2, 0xfffffffe), log)
+        self.assertEquals(arduino.readFrame(f, arduino.CAPTURE_RESULT), (1, 2, 0xfffffffe))
+        self.assertEquals(log, [ ("read", 12) ])
+
+    def testTimedFromFirstByte(self):
+        """With a clock, the clock is read as soon as the first byte arrives, then the rest is read in one go"""
+        log = []
+        f = Mock_Serial(struct.pack(">III", 5, 2, 3000), log)
+        clock = Mock_Clock(log)
+        self.assertEquals(arduino.readFrame(f, arduino.REPLY_PREPARE_TO_CAPTURE, clock), ((5, 2, 3000), 1))
+        self.assertEquals(log, [ ("read", 1), ("ticks", 1), ("read", 11) ])
+
+    def testShortReply(self):
+        """A reply that is cut short raises IOError"""
+        f = Mock_Serial(struct.pack(">II", 5, 2), [])
+        self.assertRaises(IOError, arduino.readFrame, f, arduino.REPLY_PREPARE_TO_CAPTURE)
+        f = Mock_Serial("", [])
+        self.assertRaises(IOError, arduino.readFrame, f, arduino.REPLY_TIME, Mock_Clock([]))
+
+
+class Test_commands(unittest.TestCase):
+
+    def testPrepareToCapture(self):
+        log = []
+        f = Mock_Serial(struct.pack(">III", 1234, 2, 5000), log)
+        clock = Mock_Clock(log)
+        nActivePorts, nMilliBlocks, timeData = arduino.prepareToCapture(f, clock, 5)
+        self.assertEquals((nActivePorts, nMilliBlocks), (2, 5000))
+        self.assertEquals(timeData, [1, 1234000, 1234000, 2])
+        self.assertEquals(log, [ ("ticks", 1), ("write", arduino.CMD_PREPARE_TO_CAPTURE + chr(5)), ("read", 1), ("ticks", 2), ("read", 11) ])
+
+    def testCapture(self):
+        """The capture result is read in one go, and times are converted to nanoseconds"""
+        log = []
+        f = Mock_Serial(struct.pack(">IIIII", 1000, 1010, 2010, 1000, 2020), log)
+        clock = Mock_Clock(log)
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, clock)
+        self.assertEquals((start, finish, nMilliBlocks), (1010000, 2010000, 1000))
+        self.assertEquals(timeDataPre, [1, 1000000, 1000000, 2])
+        self.assertEquals(timeDataPost, [3, 2020000, 2020000, 4])
+        self.assertIn( ("read", 12), log )
+
+    def testCaptureClockWraps(self):
+        """Times are unwrapped if the Arduino clock wraps during a capture"""
+        f = Mock_Serial(struct.pack(">IIIII", 0xffff0000, 0xffff0010, 0x10, 1000, 0x20), [])
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, Mock_Clock([]))
+        self.assertEquals(start, 0xffff0010 * 1000)
+        self.assertEquals(finish, (0x10 + 2**32) * 1000)
+        self.assertEquals(timeDataPost[1], (0x20 + 2**32) * 1000)
+
+    def testStreamFrame(self):
+        """A frame of streamed sample data is read as its header then its millisecond blocks"""
+        f = Mock_Serial(struct.pack(">cIII", "D", 3, 2000, 2) + "abcdefgh", [])
+        kind, seq, arduinoTime, nMilliBlocks, samples = arduino.readStreamFrame(f, 2)
+        self.assertEquals((kind, seq, arduinoTime, nMilliBlocks), ("D", 3, 2000000, 2))
+        self.assertEquals(samples, bytearray("abcdefgh"))
+
+    def testStreamFrameShort(self):
+        f = Mock_Serial(struct.pack(">cIII", "D", 0, 2000, 2) + "abc", [])
+        self.assertRaises(IOError, arduino.readStreamFrame, f, 2)
+
+    def testConfigureDetection(self):
+        """The detection settings are sent with the command, in one write"""
+        log = []
+        f = Mock_Serial(struct.pack(">I", 1234), log)
+        timeData = arduino.configureDetection(f, Mock_Clock(log), 3, 120, 60, 5, 300)
+        self.assertEquals(timeData, [1, 1234000, 1234000, 2])
+        self.assertEquals(log[1], ("write", arduino.CMD_CONFIGURE_DETECTION + struct.pack(">BBBHH", 3, 120, 60, 5, 300)))
+
+    def testEventFrame(self):
+        """An event sent while detecting is read as one frame, with its times in nanoseconds"""
+        f = Mock_Serial(struct.pack(">cBII", "P", 2, 7000, 12000) + struct.pack(">cBII", "Q", 0, 0, 0), [])
+        self.assertEquals(arduino.readEventFrame(f), ("P", 2, 7000000, 12000000))
+        self.assertRaises(IOError, arduino.readEventFrame, f)
+
+    def testUnwrapTime(self):
+        """Arduino clock times are unwrapped relative to an earlier time"""
+        wrap = 1000 * 2**32
+        self.assertEquals(arduino.unwrapTime(5000, 1000), 5000)
+        self.assertEquals(arduino.unwrapTime(1000, wrap - 1000), wrap + 1000)
+        self.assertEquals(arduino.unwrapTime(5000, 3*wrap + 1000), 3*wrap + 5000)
+        self.assertEquals(arduino.unwrapTime(1000, 3*wrap + 5000), 4*wrap + 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
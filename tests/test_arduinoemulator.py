@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit-tests for the software emulator of the Arduino, driven using the functions in the arduino module
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import threading
+import time
+
+import arduino
+import detect
+from arduinoemulator import ArduinoEmulator
+from measurer import repackageSamples
+from measurer import StreamingCaptureSource
+from measurer import PulseEventCaptureSource
+
+
+import unittest
+
+
+class Mock_NanosClock(object):
+    """\
+    Pretends to be a clock that ticks in nanoseconds, using the system time.
+    """
+
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+pinMap = { "LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3 }
+
+# one 20 millisecond flash and beep, repeating every half second
+metadata = { "eventCentreTimes": [ 0.25 ],
+             "durationSecs": 0.5,
+             "approxFlashDurationSecs": 0.02,
+             "approxBeepDurationSecs": 0.02 }
+
+
+class Test_ArduinoEmulator(unittest.TestCase):
+
+    def setUp(self):
+        self.emulators = []
+        self.files = []
+        self.clock = Mock_NanosClock()
+
+    def tearDown(self):
+        for f in self.files:
+            f.close()
+        for emulator in self.emulators:
+            emulator.stop()
+
+    def connect(self, **kwargs):
+        emulator = ArduinoEmulator(metadata, seed=1, **kwargs)
+        emulator.start()
+        self.emulators.append(emulator)
+        f = arduino.connect(emulator.port)
+        self.files.append(f)
+        return f
+
+    def test_timeRoundTrip(self):
+        """The emulated Arduino replies to a command with its time, which is between the times the command was sent and the reply was received"""
+        f = self.connect(latencySecs=0.005, microsOffset=1000000000)
+        t1, t2, t3, t4 = arduino.writeCmdAndTimeRoundTrip(f, self.clock, arduino.CMD_TIMEONLY)
+        self.assertEquals(t2, t3)
+        self.assertGreaterEqual(t4 - t1, 10000000)
+        self.assertGreaterEqual(t2, 1000000000000)
+        self.assertLess(t2, 1000000000000 + (t4 - t1))
+
+    def test_prepareWithoutPins(self):
+        """Preparing to capture fails if no pins have been enabled"""
+        f = self.connect()
+        self.assertEquals(arduino.prepareToCapture(f, self.clock, 1)[:2], (0, 0))
+
+    def test_prepareTooMuch(self):
+        """Preparing to capture fails if more than 90 KB would be needed"""
+        f = self.connect()
+        for pin in range(0, 4):
+            arduino.samplePinDuringCapture(f, pin, self.clock)
+        self.assertEquals(arduino.prepareToCapture(f, self.clock, 12)[:2], (0, 0))
+
+    def test_captureAndBulkTransfer(self):
+        """A capture takes as long as requested, and its sample data contains the flashes and beeps"""
+        f = self.connect()
+        arduino.samplePinDuringCapture(f, pinMap["LIGHT_0"], self.clock)
+        arduino.samplePinDuringCapture(f, pinMap["AUDIO_0"], self.clock)
+        self.assertEquals(arduino.prepareToCapture(f, self.clock, 1)[:2], (2, 1000))
+
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, self.clock)
+        self.assertEquals(nMilliBlocks, 1000)
+        self.assertAlmostEqual(finish - start, 1000000000, delta=50000000)
+        self.assertLessEqual(timeDataPre[2], start)
+        self.assertLessEqual(finish, timeDataPost[1])
+
+        samples, numBytes, timeData = arduino.bulkTransferInto(f, self.clock)
+        self.assertEquals(numBytes, 4000)
+        light, audio = [ c for c in repackageSamples(["LIGHT_0", "AUDIO_0"], pinMap, nMilliBlocks, samples) if c is not None ]
+        # two 20 millisecond flashes and beeps
+        self.assertAlmostEqual(sum(light["min"] > 100), 40, delta=2)
+        self.assertAlmostEqual(sum(audio["max"] - audio["min"] > 100), 40, delta=2)
+
+        # the Arduino forgets which pins were enabled after a bulk transfer
+        self.assertEquals(arduino.prepareToCapture(f, self.clock, 1)[:2], (0, 0))
+
+    def test_clockWraps(self):
+        """Capture times are unwrapped if the emulated Arduino clock wraps during a capture"""
+        f = self.connect(microsOffset=2**32 - 500000)
+        arduino.samplePinDuringCapture(f, pinMap["LIGHT_1"], self.clock)
+        arduino.prepareToCapture(f, self.clock, 1)
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, self.clock)
+        self.assertAlmostEqual(finish - start, 1000000000, delta=50000000)
+        self.assertGreater(finish, 1000 * 2**32)
+
+    def test_throughputLimit(self):
+        """Sample data is sent no faster than the maximum throughput"""
+        f = self.connect(maxBytesPerSec=10000)
+        arduino.samplePinDuringCapture(f, pinMap["AUDIO_1"], self.clock)
+        arduino.prepareToCapture(f, self.clock, 1)
+        arduino.capture(f, self.clock)
+        before = time.time()
+        samples, numBytes, timeData = arduino.bulkTransferInto(f, self.clock)
+        self.assertEquals(numBytes, 2000)
+        self.assertGreaterEqual(time.time() - before, 0.18)
+
+    def chunkedTransfer(self, **kwargs):
+        """Capture 2 seconds of one light sensor, with no noise, then transfer it in chunks"""
+        f = self.connect(noise=0, **kwargs)
+        arduino.samplePinDuringCapture(f, pinMap["LIGHT_0"], self.clock)
+        arduino.prepareToCapture(f, self.clock, 2)
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, self.clock)
+        samples, numBytes, timeData, stats = arduino.chunkedBulkTransferInto(f, self.clock, chunkTimeoutSecs=0.2)
+        self.assertEquals(numBytes, 4000)
+        light = repackageSamples(["LIGHT_0"], pinMap, nMilliBlocks, samples)[0]
+        # every value is either dark or bright (none corrupted), and there are four 20 millisecond flashes
+        self.assertEquals(set(light["min"]) | set(light["max"]), set([10, 200]))
+        self.assertAlmostEqual(sum(light["min"] == 200), 80, delta=2)
+        # the Arduino forgets which pins were enabled after the transfer is ended
+        self.assertEquals(arduino.prepareToCapture(f, self.clock, 1)[:2], (0, 0))
+        return stats
+
+    def test_chunkedTransfer(self):
+        """Sample data is transferred in chunks, and the throughput is reported"""
+        stats = self.chunkedTransfer()
+        self.assertEquals(stats["numBytes"], 4000)
+        self.assertEquals(stats["numChunks"], 8)
+        self.assertEquals(stats["numResent"], 0)
+        self.assertGreater(stats["bytesPerSec"], 0)
+
+    def test_chunkedTransferCorrupted(self):
+        """Chunks that are corrupted are requested again"""
+        stats = self.chunkedTransfer(corruptChunks=[1, 7])
+        self.assertEquals(stats["numResent"], 2)
+
+    def test_chunkedTransferStalled(self):
+        """If the transfer stalls, all of the remaining chunks are requested again"""
+        stats = self.chunkedTransfer(stallAtChunk=5)
+        self.assertEquals(stats["numResent"], 3)
+
+    def test_compressedTransfer(self):
+        """Sample data transferred in the compact encoding is the same, but takes fewer bytes"""
+        f = self.connect(noise=1.0)
+        for pinName in ["LIGHT_0", "AUDIO_0", "AUDIO_1"]:
+            arduino.samplePinDuringCapture(f, pinMap[pinName], self.clock)
+        arduino.prepareToCapture(f, self.clock, 1)
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = arduino.capture(f, self.clock)
+        samples, numBytes, timeData, numEncodedBytes = arduino.compressedBulkTransferInto(f, self.clock, 3, nMilliBlocks)
+        self.assertEquals(numBytes, 6000)
+        self.assertLess(numEncodedBytes, 3600)
+        light, audio0, audio1 = [ c for c in repackageSamples(["LIGHT_0", "AUDIO_0", "AUDIO_1"], pinMap, nMilliBlocks, samples) if c is not None ]
+        self.assertAlmostEqual(sum(light["min"] > 100), 40, delta=2)
+        self.assertAlmostEqual(sum(audio1["max"] - audio1["min"] > 100), 40, delta=2)
+        self.assertEquals(arduino.prepareToCapture(f, self.clock, 1)[:2], (0, 0))
+
+    def streamingSource(self, **kwargs):
+        emulator = ArduinoEmulator(metadata, seed=1)
+        emulator.start()
+        self.emulators.append(emulator)
+        source = StreamingCaptureSource(["LIGHT_0", "AUDIO_0"], pinMap, self.clock, { "LIGHT_0": 0.02, "AUDIO_0": 0.02 }, port=emulator.port, **kwargs)
+        self.files.append(source.f)
+        return source
+
+    def test_streaming(self):
+        """Streamed sample data is received until the maximum duration, and flashes and beeps are detected as it arrives"""
+        pulses = []
+        source = self.streamingSource(maxCaptureSecs=1.1, onPulse=lambda pinName, arduinoTime : pulses.append((pinName, arduinoTime)))
+        channels, start, finish, timeDataPre, timeDataPost, samples, nMilliBlocks, transfer = source.capture()
+
+        self.assertGreaterEqual(nMilliBlocks, 1050)
+        self.assertLess(nMilliBlocks, 1150)
+        self.assertAlmostEqual(finish - start, nMilliBlocks * 1000000, delta=5000000)
+        self.assertLessEqual(timeDataPre[2], start)
+        self.assertLessEqual(finish, timeDataPost[1])
+        self.assertEquals(transfer["numBytes"], nMilliBlocks * 4)
+
+        # the same flashes and beeps are found as when detecting them in all of the sample data at once
+        light, audio = channels[pinMap["LIGHT_0"]], channels[pinMap["AUDIO_0"]]
+        minCount, holdCount = detect.detectionCounts(0.02, False)
+        flashes = detect.detectFlashes(light["min"], light["max"], minCount, holdCount)
+        minCount, holdCount = detect.detectionCounts(0.02, True)
+        beeps = detect.detectBeeps(audio["min"], audio["max"], minCount, holdCount)
+        self.assertGreaterEqual(len(flashes), 2)
+        self.assertEquals(sorted(index for pinName, index in source.pulses if pinName == "LIGHT_0"), sorted(flashes))
+        self.assertEquals(sorted(index for pinName, index in source.pulses if pinName == "AUDIO_0"), sorted(beeps))
+        self.assertEquals(len(pulses), len(source.pulses))
+        for pinName, arduinoTime in pulses:
+            self.assertTrue(start < arduinoTime < finish)
+
+        # the Arduino forgets which pins were enabled after streaming
+        self.assertEquals(arduino.prepareToCapture(source.f, self.clock, 1)[:2], (0, 0))
+
+    def test_streamingStop(self):
+        """Streaming stops when asked to, and can be started again"""
+        source = self.streamingSource()
+        timer = threading.Timer(0.6, source.stop)
+        timer.start()
+        nMilliBlocks = source.capture()[6]
+        timer.join()
+        self.assertGreaterEqual(nMilliBlocks, 550)
+        self.assertLess(nMilliBlocks, 650)
+
+        source.stop()
+        channels, start, finish, timeDataPre, timeDataPost, samples, nMilliBlocks, transfer = source.capture()
+        self.assertLess(nMilliBlocks, 10)
+        self.assertEquals(len(samples), nMilliBlocks * 4)
+
+    def test_detectOnDevice(self):
+        """Flashes and beeps are detected by the emulated Arduino, using thresholds from a calibration capture, and sent as they end"""
+        emulator = ArduinoEmulator(metadata, seed=1)
+        emulator.start()
+        self.emulators.append(emulator)
+        pulses = []
+        source = PulseEventCaptureSource(["LIGHT_1", "AUDIO_0"], pinMap, self.clock, { "LIGHT_1": 0.02, "AUDIO_0": 0.02 }, maxCaptureSecs=1.6, \
+                                         port=emulator.port, onPulse=lambda pinName, arduinoTime : pulses.append((pinName, arduinoTime)), calibrationSecs=1)
+        self.files.append(source.f)
+        channels, start, finish, timeDataPre, timeDataPost, samples, nMilliBlocks, transfer = source.capture()
+
+        self.assertAlmostEqual(finish - start, 1600000000, delta=50000000)
+        self.assertLessEqual(timeDataPre[2], start)
+        self.assertLessEqual(finish, timeDataPost[1])
+        self.assertEquals((len(samples), nMilliBlocks), (0, 0))
+        self.assertEquals(transfer["numBytes"] % arduino.EVENT_FRAME.size, 0)
+
+        # a 20 millisecond flash and beep every half second (the first is missed, as detection starts in the high state)
+        for pinName in ["LIGHT_1", "AUDIO_0"]:
+            channel = channels[pinMap[pinName]]
+            self.assertEquals(channel["min"], None)
+            self.assertGreaterEqual(len(channel["pulseEvents"]), 2)
+            for pulseStart, pulseEnd in channel["pulseEvents"]:
+                self.assertTrue(start <= pulseStart < pulseEnd <= finish)
+                self.assertAlmostEqual(pulseEnd - pulseStart, 20000000, delta=2000000)
+                self.assertAlmostEqual(((pulseStart + pulseEnd) / 2.0) % 500000000, 250000000, delta=2000000)
+        self.assertEquals(len(pulses), sum(len(channels[pinMap[pinName]]["pulseEvents"]) for pinName in ["LIGHT_1", "AUDIO_0"]))
+
+        # the thresholds are kept for the next capture, but the Arduino forgets which pins were configured
+        self.assertEquals(sorted(source.thresholds.keys()), ["AUDIO_0", "LIGHT_1"])
+        self.assertEquals(arduino.startDetecting(source.f, self.clock)[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
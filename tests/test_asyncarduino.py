@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit-tests for communicating with the Arduino from an event loop, driving the software emulator of the Arduino
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import time
+
+try:
+    import trollius
+    from trollius import From, Return
+except ImportError:
+    trollius = None
+
+from arduinoemulator import ArduinoEmulator
+from measurer import repackageSamples
+
+if trollius is not None:
+    import asyncarduino
+
+
+import unittest
+
+
+class Mock_NanosClock(object):
+    """\
+    Pretends to be a clock that ticks in nanoseconds, using the system time.
+    """
+
+    @property
+    def ticks(self):
+        return int(time.time() * 1000000000)
+
+
+pinMap = { "LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3 }
+
+# one 20 millisecond flash and beep, repeating every half second
+metadata = { "eventCentreTimes": [ 0.25 ],
+             "durationSecs": 0.5,
+             "approxFlashDurationSecs": 0.02,
+             "approxBeepDurationSecs": 0.02 }
+
+
+@unittest.skipIf(trollius is None, "Needs trollius")
+class Test_AsyncArduino(unittest.TestCase):
+
+    def setUp(self):
+        self.emulators = []
+        self.devices = []
+        self.clock = Mock_NanosClock()
+        self.loop = trollius.new_event_loop()
+
+    def tearDown(self):
+        for device in self.devices:
+            device.close()
+        for emulator in self.emulators:
+            emulator.stop()
+        self.loop.close()
+
+    def connect(self, timeout=5, **kwargs):
+        emulator = ArduinoEmulator(metadata, seed=1, **kwargs)
+        emulator.start()
+        self.emulators.append(emulator)
+        device = asyncarduino.connect(self.clock, emulator.port, timeout, self.loop)
+        self.devices.append(device)
+        return device
+
+    def runUntilComplete(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_captureAndBulkTransfer(self):
+        """A capture takes as long as requested, and its sample data contains the flashes and beeps, as when not using an event loop"""
+        device = self.connect()
+
+        @trollius.coroutine
+        def captureOnce():
+            yield From(device.samplePinDuringCapture(pinMap["LIGHT_0"]))
+            yield From(device.samplePinDuringCapture(pinMap["AUDIO_0"]))
+            prepared = yield From(device.prepareToCapture(1))
+            captured = yield From(device.capture())
+            transferred = yield From(device.bulkTransferInto())
+            raise Return((prepared, captured, transferred))
+
+        prepared, captured, transferred = self.runUntilComplete(captureOnce())
+        self.assertEquals(prepared[:2], (2, 1000))
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = captured
+        self.assertEquals(nMilliBlocks, 1000)
+        self.assertAlmostEqual(finish - start, 1000000000, delta=50000000)
+        self.assertLessEqual(timeDataPre[2], start)
+        self.assertLessEqual(finish, timeDataPost[1])
+
+        samples, numBytes, timeData = transferred
+        self.assertEquals(numBytes, 4000)
+        light, audio = [ c for c in repackageSamples(["LIGHT_0", "AUDIO_0"], pinMap, nMilliBlocks, samples) if c is not None ]
+        self.assertAlmostEqual(sum(light["min"] > 100), 40, delta=2)
+        self.assertAlmostEqual(sum(audio["max"] - audio["min"] > 100), 40, delta=2)
+
+    def test_timeRoundTrip(self):
+        """The emulated Arduino's time is between the times the command was sent and the reply was received"""
+        device = self.connect(latencySecs=0.005, microsOffset=1000000000)
+        t1, t2, t3, t4 = self.runUntilComplete(device.writeCmdAndTimeRoundTrip(asyncarduino.arduino.CMD_TIMEONLY))
+        self.assertEquals(t2, t3)
+        self.assertGreaterEqual(t4 - t1, 10000000)
+        self.assertGreaterEqual(t2, 1000000000000)
+        self.assertLess(t2, 1000000000000 + (t4 - t1))
+
+    def test_otherTasksRunDuringCapture(self):
+        """Other tasks in the event loop keep running while a capture is in progress"""
+        device = self.connect()
+        ticks = []
+
+        @trollius.coroutine
+        def ticker():
+            while True:
+                ticks.append(time.time())
+                yield From(trollius.sleep(0.01, loop=self.loop))
+
+        @trollius.coroutine
+        def captureOnce():
+            yield From(device.samplePinDuringCapture(pinMap["LIGHT_1"]))
+            yield From(device.prepareToCapture(1))
+            result = yield From(device.capture())
+            raise Return(result)
+
+        task = trollius.Task(ticker(), loop=self.loop)
+        start, finish, nMilliBlocks, timeDataPre, timeDataPost = self.runUntilComplete(captureOnce())
+        task.cancel()
+        self.assertEquals(nMilliBlocks, 1000)
+        self.assertGreater(len(ticks), 50)
+
+    def test_timeout(self):
+        """A reply that does not arrive in time raises a TimeoutError, and is discarded if it arrives later"""
+        device = self.connect(timeout=0.1, latencySecs=0.2)
+        self.assertRaises(trollius.TimeoutError, self.runUntilComplete, device.writeCmdAndTimeRoundTrip(asyncarduino.arduino.CMD_TIMEONLY))
+
+        self.runUntilComplete(device.resynchronise(quietSecs=0.5))
+        self.assertEquals(len(device.received), 0)
+        device.timeout = 5
+        t1, t2, t3, t4 = self.runUntilComplete(device.writeCmdAndTimeRoundTrip(asyncarduino.arduino.CMD_TIMEONLY))
+        self.assertGreaterEqual(t4 - t1, 400000000)
+
+    def test_staleReply(self):
+        """A command is not sent while a late reply is still buffered, so the late reply's arrival time is not mistaken for the next one's"""
+        device = self.connect(timeout=0.1, latencySecs=0.2)
+        self.assertRaises(trollius.TimeoutError, self.runUntilComplete, device.writeCmdAndTimeRoundTrip(asyncarduino.arduino.CMD_TIMEONLY))
+        self.runUntilComplete(trollius.sleep(0.5, loop=self.loop))
+        self.assertGreater(len(device.received), 0)
+        self.assertRaises(IOError, self.runUntilComplete, device.writeCmdAndTimeRoundTrip(asyncarduino.arduino.CMD_TIMEONLY))
+
+        self.runUntilComplete(device.resynchronise(quietSecs=0.1))
+        device.timeout = 5
+        t1, t2, t3, t4 = self.runUntilComplete(device.writeCmdAndTimeRoundTrip(asyncarduino.arduino.CMD_TIMEONLY))
+        self.assertGreaterEqual(t4 - t1, 400000000)
+
+    def test_cancelCapture(self):
+        """A capture can be cancelled, and the Arduino can be used again once its result has been discarded"""
+        device = self.connect()
+        self.runUntilComplete(device.samplePinDuringCapture(pinMap["AUDIO_1"]))
+        self.runUntilComplete(device.prepareToCapture(1))
+
+        task = trollius.Task(device.capture(), loop=self.loop)
+        self.loop.call_later(0.2, task.cancel)
+        self.assertRaises(trollius.CancelledError, self.runUntilComplete, task)
+
+        before = time.time()
+        self.runUntilComplete(device.resynchronise(quietSecs=0.9))
+        self.assertGreaterEqual(time.time() - before, 0.9)
+        self.assertEquals(self.runUntilComplete(device.prepareToCapture(1))[:2], (1, 1000))
+
+
+if __name__ == "__main__":
+    unittest.main()
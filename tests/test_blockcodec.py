@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit-tests for the compact encoding of sample data
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import random
+import unittest
+
+import blockcodec
+from blockcodec import encodeBlocks, decodeBlocks, TOKEN_REPEAT, TOKEN_DELTA, TOKEN_RAW
+
+
+class Test_blockcodec(unittest.TestCase):
+
+    def roundTrip(self, samples, nActivePorts):
+        nMilliBlocks = len(samples) / (nActivePorts * 2)
+        encoded = encodeBlocks(samples, nActivePorts, nMilliBlocks)
+        decoded, numBytes = decodeBlocks(encoded, nActivePorts, nMilliBlocks)
+        self.assertEquals(numBytes, len(samples))
+        self.assertEquals(decoded[:numBytes], bytearray(samples))
+        return encoded
+
+    def testTokens(self):
+        """Each kind of token is used for the blocks it suits, and the first block is relative to zeros"""
+        samples = bytearray([5, 3,   5, 3,   5, 3,   12, 0,   100, 50,   100, 50])
+        encoded = self.roundTrip(samples, 1)
+        self.assertEquals(encoded, bytearray([ TOKEN_DELTA | 0, 0x53,
+                                               TOKEN_REPEAT | 1,
+                                               TOKEN_DELTA | 0, 0x7d,
+                                               TOKEN_RAW | 0, 100, 50,
+                                               TOKEN_REPEAT | 0 ]))
+
+    def testLongRuns(self):
+        """Runs longer than 64 blocks are split"""
+        encoded = self.roundTrip(bytearray([200, 190] * 2 * 1000), 2)
+        self.assertEquals(encoded[:5], bytearray([TOKEN_RAW | 0, 200, 190, 200, 190]))
+        self.assertEquals(len(encoded), 5 + (999 + 63) / 64)
+
+    def testRandom(self):
+        """Any sample data is decoded exactly as it was before encoding"""
+        rand = random.Random(1)
+        for nActivePorts in range(1, 5):
+            samples = bytearray()
+            level = [128] * (nActivePorts * 2)
+            for i in range(0, 3000):
+                for j in range(0, len(level)):
+                    level[j] = max(0, min(255, level[j] + rand.choice([0, 0, 0, 1, -1, 3, -7, 8, -9, 100, -100])))
+                samples.extend(level)
+            self.roundTrip(samples, nActivePorts)
+
+    def testQuietIsSmaller(self):
+        """Quiet sample data with a little noise is encoded in about half the bytes"""
+        samples = blockcodec.syntheticBlocks(4, 5000, noise=1.0, seed=1)
+        encoded = self.roundTrip(samples, 4)
+        self.assertLess(len(encoded), 0.6 * len(samples))
+
+    def testIntoBuffer(self):
+        samples = blockcodec.syntheticBlocks(2, 100, seed=1)
+        buffer = bytearray(1000)
+        decoded, numBytes = decodeBlocks(str(encodeBlocks(samples, 2, 100)), 2, 100, buffer)
+        self.assertIs(decoded, buffer)
+        self.assertEquals(buffer[:numBytes], samples)
+
+    def testEmpty(self):
+        self.assertEquals(encodeBlocks(bytearray(), 2, 0), bytearray())
+        self.assertEquals(decodeBlocks(bytearray(), 2, 0)[1], 0)
+
+    def testInvalid(self):
+        """Encoded data that is truncated, too long, or contains an unrecognised token is rejected"""
+        encoded = encodeBlocks(bytearray([100, 50, 100, 50, 101, 49]), 1, 3)
+        self.assertRaises(ValueError, decodeBlocks, encoded[:-1], 1, 3)
+        self.assertRaises(ValueError, decodeBlocks, encoded, 1, 4)
+        self.assertRaises(ValueError, decodeBlocks, encoded, 1, 2)
+        self.assertRaises(ValueError, decodeBlocks, encoded + bytearray([TOKEN_REPEAT]), 1, 3)
+        self.assertRaises(ValueError, decodeBlocks, bytearray([0xc0]), 1, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
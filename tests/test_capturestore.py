@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit-tests for saving, loading and re-analysing captures, and for batch analysis of saved captures
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import unittest
+import json
+import shutil
+import tempfile
+import StringIO
+
+import capturestore
+import capturearchive
+import batchAnalyse
+import detect
+from dispersion import constantDispersionHistory
+
+
+def makeCaptureRecord(offsetSecs=0.0):
+    """\
+    Make a capture record for a light sensor observing flashes that are offsetSecs later than expected.
+    The Arduino clock and wall clock are the same, and the sync timeline counts milliseconds since wall clock time zero.
+    """
+    expectedTimes = []
+    t = 0.0
+    for gap in [1.0, 0.24, 0.76, 1.0, 0.40, 0.60, 1.0, 1.0, 0.24, 0.76, 0.40, 0.60, 1.0, 1.0, 0.24]:
+        t += gap
+        expectedTimes.append(t)
+
+    startNanos = 2500000000
+    numSamples = 9000
+    lo, hi = [], []
+    for i in range(0, numSamples):
+        sampleTime = (startNanos / 1000000 + i + 0.5) / 1000.0
+        if any(abs(sampleTime - (e + offsetSecs)) < 0.010 for e in expectedTimes):
+            lo.append(200); hi.append(200)
+        else:
+            lo.append(10); hi.append(12)
+
+    return { "role": "master",
+             "pinsToMeasure": ["LIGHT_0"],
+             "expectedTimings": { "LIGHT_0": expectedTimes },
+             "eventDurations": { "LIGHT_0": 0.020 },
+             "patternWindowLengths": {},
+             "videoStartTicks": 0,
+             "syncTimelineTickRate": 1000,
+             "wcPrecisionNanos": 1000,
+             "acPrecisionNanos": 1000,
+             "channels": [ { "pinName": "LIGHT_0", "isAudio": False, "min": lo, "max": hi, "eventDuration": 0.020 } ],
+             "dueStartTimeUsecs": startNanos,
+             "dueFinishTimeUsecs": startNanos + numSamples * 1000000,
+             "wcAcReqResp": { "pre": (1000000000, 1000000000, 1000000000, 1000000000),
+                              "post": (20000000000, 20000000000, 20000000000, 20000000000) },
+             "wcSyncTimeCorrelations": [ (0, (0, 0, 1.0)) ],
+             "dispersionHistory": constantDispersionHistory(1000) }
+
+
+def makePulseEventRecord(offsetSecs=0.0):
+    """\
+    Make the same capture record as :func:`makeCaptureRecord`, but as if the Arduino had detected the flashes itself.
+    """
+    record = makeCaptureRecord(offsetSecs)
+    channel = record["channels"][0]
+    rising, falling = detect.deviceThresholds(*detect.calcFlashThresholds(channel["min"], channel["max"]))
+    minPulseCount, holdCount = detect.detectionCounts(channel["eventDuration"], False)
+    detector = detect.DevicePulseDetector(rising, falling, minPulseCount, holdCount)
+    startNanos = record["dueStartTimeUsecs"]
+    channel["pulseEvents"] = [ (startNanos + start * 1000000, startNanos + end * 1000000) for start, end in detector.addSamples(channel["max"]) ]
+    del channel["min"]
+    del channel["max"]
+    return record
+
+
+class Test_CaptureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_saveAndLoad(self):
+        """A saved capture record is loaded back the same (except that tuples become lists)"""
+        record = makeCaptureRecord()
+        filename = os.path.join(self.tmpDir, "capture.json")
+        capturestore.saveCapture(filename, record)
+        loaded = capturestore.loadCapture(filename)
+        self.assertEquals(loaded, json.loads(json.dumps(record)))
+
+    def test_analyseCapture(self):
+        """Flashes are detected in a loaded capture and matched against the expected timings"""
+        filename = os.path.join(self.tmpDir, "capture.json")
+        capturestore.saveCapture(filename, makeCaptureRecord(offsetSecs=0.005))
+        record = capturestore.loadCapture(filename)
+
+        results = capturestore.analyseCapture(record, toleranceSecs=0.002)
+        self.assertEquals(len(results), 1)
+        result = results[0]
+        self.assertEquals(result["pinName"], "LIGHT_0")
+        self.assertEquals(result["error"], None)
+        self.assertEquals(result["numObserved"], 12)
+        self.assertEquals(result["matchIndex"], 3)
+        self.assertAlmostEqual(result["stats"]["meanOffset"], -0.005, delta=0.001)
+        self.assertEquals(result["stats"]["passed"], False)
+        self.assertAlmostEqual(result["drift"]["driftPpm"], 0.0, delta=100.0)
+
+        robustResult = capturestore.analyseCapture(record, robustMatch=True)[0]
+        self.assertEquals(robustResult["matchIndex"], 3)
+        self.assertEquals(robustResult["unmatchedObserved"], [])
+        self.assertEquals(robustResult["missedExpected"], [])
+
+    def test_analyseCaptureRealisticClocks(self):
+        """Flashes are matched when the wall clock is nanos since the epoch, the Arduino clock is offset from it, and the sync timeline is 90kHz"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        acOffset, wcOffset = 1000000000000, 1424652124816656128
+        record["dueStartTimeUsecs"] += acOffset
+        record["dueFinishTimeUsecs"] += acOffset
+        record["wcAcReqResp"] = { "pre": (1000000000 + wcOffset, 1000000000 + acOffset, 1000000000 + acOffset, 1000000000 + wcOffset),
+                                  "post": (20000000000 + wcOffset, 20000000000 + acOffset, 20000000000 + acOffset, 20000000000 + wcOffset) }
+        record["syncTimelineTickRate"] = 90000
+        record["wcSyncTimeCorrelations"] = [ (wcOffset, (wcOffset, 0, 1.0)), (wcOffset + 5000000000, (wcOffset + 5000000000, 450000, 1.0)) ]
+
+        detector = detect.BeepFlashDetector(record["wcAcReqResp"], 90000, record["wcSyncTimeCorrelations"], lambda wcTime : 1000, 1000, 1000)
+        detector.compileConversion(record["dueStartTimeUsecs"], record["dueFinishTimeUsecs"])
+
+        result = capturestore.analyseCapture(record)[0]
+        self.assertEquals(result["error"], None)
+        self.assertEquals(result["matchIndex"], 3)
+        self.assertAlmostEqual(result["stats"]["meanOffset"], -0.005, delta=0.001)
+
+    def test_analyseCaptureUncompiled(self):
+        """If the conversion cannot be compiled, the capture is still analysed using the uncompiled conversion"""
+        def failCompile(self, acStartNanos, acEndNanos, wcBreakpoints=()):
+            raise ValueError("Breakpoints are missing.")
+
+        originalCompile = detect.ArduinoToSyncTimelineTime.compile
+        detect.ArduinoToSyncTimelineTime.compile = failCompile
+        try:
+            result = capturestore.analyseCapture(makeCaptureRecord(offsetSecs=0.005))[0]
+        finally:
+            detect.ArduinoToSyncTimelineTime.compile = originalCompile
+        self.assertEquals(result["error"], None)
+        self.assertEquals(result["matchIndex"], 3)
+        self.assertAlmostEqual(result["stats"]["meanOffset"], -0.005, delta=0.001)
+
+    def test_analyseCaptureCompiledConversion(self):
+        """A compiled conversion saved in the capture record is used instead of rebuilding the conversion"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        expected = capturestore.analyseCapture(record, toleranceSecs=0.002)
+
+        record["compiledConversion"] = capturestore.compileConversion(record).toDict()
+        del record["wcAcReqResp"]
+        del record["wcSyncTimeCorrelations"]
+        self.assertEquals(capturestore.analyseCapture(json.loads(json.dumps(record)), toleranceSecs=0.002), expected)
+
+        # a record that can be compiled, but is not, is compiled when analysed
+        record = makeCaptureRecord(offsetSecs=0.005)
+        self.assertTrue(isinstance(capturestore.detectorForCapture(record).ac2st, detect.CompiledArduinoToSyncTimelineTime))
+
+    def test_analyseCaptureNoData(self):
+        """A pin where nothing is detected is reported as an error"""
+        record = makeCaptureRecord()
+        record["channels"][0]["min"] = [10] * len(record["channels"][0]["min"])
+        record["channels"][0]["max"] = [10] * len(record["channels"][0]["max"])
+        self.assertEquals(capturestore.analyseCapture(record), [ { "pinName": "LIGHT_0", "numObserved": 0, "error": "poor data or no data" } ])
+
+    def test_analyseCaptureDetectionSettings(self):
+        """The hold count and minimum pulse duration used for detection can be changed when a capture is analysed again"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        expected = capturestore.analyseCapture(record)
+        self.assertEquals(capturestore.analyseCapture(record, holdCount=10, minPulseDuration=15), expected)
+
+        # flashes last 20 samples, so none are long enough
+        self.assertEquals(capturestore.analyseCapture(record, minPulseDuration=30)[0]["error"], "poor data or no data")
+
+    def test_batchAnalyse(self):
+        """Each capture in a batch gets a result file, and failures are reported"""
+        jobs = []
+        for i in range(0, 3):
+            filename = os.path.join(self.tmpDir, "capture%d.json" % i)
+            capturestore.saveCapture(filename, makeCaptureRecord(offsetSecs=0.001*i))
+            jobs.append( (filename, batchAnalyse.resultFilenameFor(filename, None), 0.010, False, None, False, None, None) )
+        missingFilename = os.path.join(self.tmpDir, "missing.json")
+        jobs.append( (missingFilename, batchAnalyse.resultFilenameFor(missingFilename, None), 0.010, False, None, False, None, None) )
+
+        # detection settings are passed through to the workers
+        settingsFilename = os.path.join(self.tmpDir, "settings.json")
+        capturestore.saveCapture(settingsFilename, makeCaptureRecord())
+        jobs.append( (settingsFilename, batchAnalyse.resultFilenameFor(settingsFilename, None), 0.010, False, None, True, None, 30) )
+
+        progress = StringIO.StringIO()
+        failures = batchAnalyse.runBatch(jobs, 2, progress)
+        self.assertEquals([ f for f, reason in failures ], [ missingFilename ])
+        self.assertEquals(len(progress.getvalue().splitlines()), 5)
+
+        f = open(os.path.join(self.tmpDir, "settings.result.json"))
+        results = json.load(f)
+        f.close()
+        self.assertEquals(results["results"][0]["error"], "poor data or no data")
+
+        for i in range(0, 3):
+            f = open(os.path.join(self.tmpDir, "capture%d.result.json" % i))
+            results = json.load(f)
+            f.close()
+            self.assertEquals(results["results"][0]["stats"]["passed"], True)
+            self.assertAlmostEqual(results["results"][0]["stats"]["meanOffset"], -0.001*i, delta=0.001)
+
+    def writeArchive(self, filename, record):
+        """Write a capture record to an archive, interleaving the sample data as the Arduino does"""
+        samples = bytearray()
+        numBlocks = len(record["channels"][0]["min"])
+        for i in range(0, numBlocks):
+            for channel in record["channels"]:
+                samples.append(channel["max"][i])
+                samples.append(channel["min"][i])
+        capturearchive.writeArchive(filename, record, samples, numBlocks)
+
+    def test_archive(self):
+        """A capture written to an archive is read back with the same timing information and sample data"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        record["dispersionHistory"] = [ (0, 0, 1000, 1000, 0.1), (3000000000, 5, 1000, 500, 0.2) ]
+        record["bulkTransfer"] = { "numBytes": 18000, "secs": 0.5, "bytesPerSec": 36000.0, "numChunks": 36, "numResent": 1 }
+        record["compiledConversion"] = capturestore.compileConversion(record).toDict()
+        filename = os.path.join(self.tmpDir, "capture" + capturearchive.ARCHIVE_EXTENSION)
+        self.writeArchive(filename, record)
+
+        self.assertTrue(capturearchive.isArchive(filename))
+        archive = capturearchive.CaptureArchive(filename)
+        self.assertEquals(archive.nMilliBlocks, 9000)
+        loaded = archive.record()
+        for key in [ "role", "pinsToMeasure", "expectedTimings", "eventDurations", "videoStartTicks", "syncTimelineTickRate",
+                     "wcPrecisionNanos", "acPrecisionNanos", "dueStartTimeUsecs", "dueFinishTimeUsecs",
+                     "wcAcReqResp", "wcSyncTimeCorrelations", "dispersionHistory", "bulkTransfer", "compiledConversion" ]:
+            self.assertEquals(loaded[key], record[key], key)
+        self.assertEquals(list(loaded["channels"][0]["min"]), record["channels"][0]["min"])
+        self.assertEquals(list(loaded["channels"][0]["max"]), record["channels"][0]["max"])
+        self.assertEquals(archive.channel("LIGHT_0")["isAudio"], False)
+        self.assertRaises(KeyError, archive.channel, "AUDIO_0")
+
+    def test_analyseArchive(self):
+        """An archived capture gives the same results as the same capture saved as JSON"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        jsonFilename = os.path.join(self.tmpDir, "capture.json")
+        archiveFilename = os.path.join(self.tmpDir, "capture" + capturearchive.ARCHIVE_EXTENSION)
+        capturestore.saveCapture(jsonFilename, record)
+        self.writeArchive(archiveFilename, record)
+        self.assertEquals(capturestore.analyseCapture(capturestore.loadCapture(archiveFilename), toleranceSecs=0.002), \
+                          capturestore.analyseCapture(capturestore.loadCapture(jsonFilename), toleranceSecs=0.002))
+
+    def test_analysePulseEvents(self):
+        """A capture where the Arduino detected the flashes gives the same results as one with the sample data"""
+        results = capturestore.analyseCapture(makeCaptureRecord(offsetSecs=0.005), toleranceSecs=0.002)[0]
+        record = makePulseEventRecord(offsetSecs=0.005)
+        self.assertEquals(len(record["channels"][0]["pulseEvents"]), 12)
+        filename = os.path.join(self.tmpDir, "capture.json")
+        capturestore.saveCapture(filename, record)
+        pulseResults = capturestore.analyseCapture(capturestore.loadCapture(filename), toleranceSecs=0.002)[0]
+        for key in [ "numObserved", "matchIndex", "error" ]:
+            self.assertEquals(pulseResults[key], results[key], key)
+        self.assertAlmostEqual(pulseResults["stats"]["meanOffset"], results["stats"]["meanOffset"], delta=0.000001)
+
+    def test_archivePulseEvents(self):
+        """The times of flashes detected by the Arduino are archived, without any sample data"""
+        record = makePulseEventRecord()
+        filename = os.path.join(self.tmpDir, "capture" + capturearchive.ARCHIVE_EXTENSION)
+        capturearchive.writeArchive(filename, record, bytearray(), 0)
+        archive = capturearchive.CaptureArchive(filename)
+        channel = archive.channel("LIGHT_0")
+        self.assertEquals(channel["pulseEvents"], record["channels"][0]["pulseEvents"])
+        self.assertFalse("min" in channel)
+        self.assertEquals(capturestore.analyseCapture(archive.record()), capturestore.analyseCapture(record))
+
+    def test_notAnArchive(self):
+        filename = os.path.join(self.tmpDir, "capture.json")
+        capturestore.saveCapture(filename, makeCaptureRecord())
+        self.assertFalse(capturearchive.isArchive(filename))
+        self.assertRaises(ValueError, capturearchive.CaptureArchive, filename)
+
+    def test_archiveNeedsWholeNumbers(self):
+        record = makeCaptureRecord()
+        record["dueStartTimeUsecs"] = 2500000000.5
+        self.assertRaises(ValueError, self.writeArchive, os.path.join(self.tmpDir, "capture.dvbcap"), record)
+
+    def test_resultFilename(self):
+        """Result files are named after the capture file"""
+        self.assertEquals(batchAnalyse.resultFilenameFor("a/b/capture.json", None), "a/b/capture.result.json")
+        self.assertEquals(batchAnalyse.resultFilenameFor("a/b/capture.json", "c"), "c/capture.result.json")
+        self.assertEquals(batchAnalyse.resultFilenameFor("capture.dat", "c"), "c/capture.dat.result.json")
+
+
+if __name__ == "__main__":
+    unittest.main()
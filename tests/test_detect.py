@@ -32,13 +32,25 @@ from detect import TimelineReconstructor
 from detect import calcFlashThresholds
 from detect import calcBeepThresholds
 from detect import detectPulses
+from detect import detectPulsesVectorised
+from detect import StreamingPulseDetector
+from detect import DevicePulseDetector
+from detect import deviceThresholds
+from detect import detectFlashes
+from detect import detectBeeps
+from detect import slidingMax
+from detect import slidingMin
 from detect import minMaxDataToEnvelopeData
 from detect import timesForSamples
 from detect import ArduinoToSyncTimelineTime
+from detect import CompiledArduinoToSyncTimelineTime
 from detect import BeepFlashDetector
 
 
 import unittest
+import random
+import json
+import numpy
 
 class Test_ConvertAtoB(unittest.TestCase):
     def test_a2b(self):
@@ -47,6 +59,11 @@ class Test_ConvertAtoB(unittest.TestCase):
         self.assertEquals(a2b(100), 10.0)
         self.assertEquals(a2b(200), 20.0)
         self.assertEquals(a2b(133), 13.3)
+
+    def test_a2bArray(self):
+        a2b = ConvertAtoB( (100,10), (200, 20) )
+        values = numpy.array([ 150, 100, 200, 133, 250 ])
+        self.assertEquals(list(a2b(values)), [ a2b(v) for v in values.tolist() ])
         
         
 
@@ -62,6 +79,15 @@ class Test_ErrorBoundInterpolator(unittest.TestCase):
         self.assertRaises(ValueError, err, 99)
         self.assertRaises(ValueError, err, 201)
 
+    def testArray(self):
+        err = ErrorBoundInterpolator( (100, 0.5), (200, 0.7) )
+        self.assertEquals(list(err(numpy.array([ 100, 150, 200 ]))), [ err(100), err(150), err(200) ])
+        try:
+            err(numpy.array([ 99, 150, 201 ]))
+            self.fail("Expected ValueError")
+        except ValueError, e:
+            self.assertTrue("[0, 2]" in str(e))
+
  
  
 class Test_calcAcWcCorrelationAndDispersion(unittest.TestCase):
@@ -107,6 +133,37 @@ class Test_TimelineReconstructor(unittest.TestCase):
         
         # cant reconstruct at a time before the first control timestamp was logged
         self.assertRaises(ValueError, reconstructor, 110, at=99)
+
+    def testConvertArray(self):
+        history = [
+            (100, (100, 1000, 1.0)),
+            (200, (100, 1000, 1.0)),
+            (300, (100, 1005, 1.0)),
+        ]
+        reconstructor = TimelineReconstructor(history, 100, 1000, True)
+        self.assertEquals(list(reconstructor.convert([150, 200, 110, 110], at=[120, 120, 300, 250])), [1500, 2000, 1105, 1102.5])
+        self.assertEquals(list(reconstructor.convert([150, 250])), [1500, 2500.0 + 5 * 0.5])
+        self.assertRaises(ValueError, reconstructor.convert, [110, 110], at=[150, 99])
+
+    def testConvertArraySameAsScalar(self):
+        """Converting an array gives exactly the same results as converting each value, including where speed changes"""
+        rand = random.Random(4)
+        for trial in range(0, 50):
+            history = []
+            when = rand.randint(0, 1000)
+            for i in range(0, rand.randint(1, 8)):
+                when += rand.choice([0, rand.randint(1, 1000)])
+                cT = (when + rand.randint(-50, 50), rand.choice([rand.randint(0, 100000), rand.uniform(0, 100000)]), rand.choice([0.0, 1.0, 1.0, 2.0]))
+                history.append((when, cT))
+            for interpolate in [ True, False ]:
+                reconstructor = TimelineReconstructor(history, 1000, 90000, interpolate)
+                first, last = history[0][0], history[-1][0]
+                parentTimes = [ rand.choice([rand.randint(first, last+500), rand.uniform(first, last+500)]) for i in range(0, 100) ]
+                ats = [ rand.choice([rand.randint(first, last+500), rand.uniform(first, last+500)]) for i in range(0, 100) ]
+                for p, a in zip(parentTimes, ats):
+                    self.assertEquals(reconstructor.convert([p], at=[a])[0], reconstructor(p, at=a))
+                floatTimes = [ float(p) for p in parentTimes ]
+                self.assertEquals(list(reconstructor.convert(floatTimes)), [ reconstructor(p) for p in floatTimes ])
         
 
 
@@ -131,8 +188,49 @@ class Test_calcThresholds(unittest.TestCase):
 
 
 
+class Test_adaptiveThresholds(unittest.TestCase):
+
+    def testSlidingMinMax(self):
+        rand = random.Random(2)
+        for trial in range(0, 100):
+            data = [ rand.randint(0, 255) for i in range(0, rand.randint(0, 60)) ]
+            windowLength = rand.randint(0, 20)
+            half = windowLength // 2
+            expectedMax = [ max(data[max(0, i-half):i+half+1]) for i in range(0, len(data)) ]
+            expectedMin = [ min(data[max(0, i-half):i+half+1]) for i in range(0, len(data)) ]
+            self.assertEquals(slidingMax(data, windowLength).tolist(), expectedMax)
+            self.assertEquals(slidingMin(data, windowLength).tolist(), expectedMin)
+
+    def testLocalThresholds(self):
+        hiSampleData = [ 10, 40, 10, 10, 10, 100, 10, 10 ]
+        loSampleData = [  4,  4,  4,  4,  7,   7,  7,  7 ]
+        rising, falling = calcFlashThresholds(loSampleData, hiSampleData, 3)
+        self.assertEquals(rising.tolist(),  [ 28.0, 28.0, 28.0, 8.0, 68.0, 69.0, 69.0, 9.0 ])
+        self.assertEquals(falling.tolist(), [ 16.0, 16.0, 16.0, 6.0, 36.0, 38.0, 38.0, 8.0 ])
+
+        rising, falling = calcBeepThresholds(hiSampleData, 3)
+        self.assertEquals(rising.tolist(),  [ 30.0, 30.0, 30.0, 10.0, 70.0, 70.0, 70.0, 10.0 ])
+
+    def testDimmingDisplay(self):
+        # flashes every 100 samples, but the display dims to a tenth of the brightness part way through
+        loSampleData, hiSampleData = [], []
+        for i in range(0, 2000):
+            level = 1.0 if i < 1000 else 0.1
+            flash = i % 100 in range(50, 55)
+            loSampleData.append(5)
+            hiSampleData.append(5 + (200 if flash else 10) * level)
+
+        for pulseDetector in [ detectPulses, detectPulsesVectorised ]:
+            self.assertEquals(len(detectFlashes(loSampleData, hiSampleData, 3, 2, pulseDetector)), 10)
+            result = detectFlashes(loSampleData, hiSampleData, 3, 2, pulseDetector, thresholdWindow=150)
+            self.assertEquals(result, [ 52.0 + 100*i for i in range(0, 20) ])
+
+
+
 class Test_detectPulses(unittest.TestCase):
 
+    detectPulses = staticmethod(detectPulses)
+
     def testSimpleFlashScenario(self):
 
         risingThreshold = 7
@@ -143,7 +241,7 @@ class Test_detectPulses(unittest.TestCase):
         #              IGNORE-              FIRST---                SECOND----------              IGNORE
         sampleData = [ 1, 8, 8, 0, 0, 0, 3, 8, 8, 7, 4, 1, 0, 1, 0, 7, 9, 1, 7, 9, 8, 3, 0, 0, 0, 8, 9 ]
         
-        result = detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
+        result = self.detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
         self.assertEquals(result, [8.0, 17.5])
 
 
@@ -171,11 +269,11 @@ class Test_detectPulses(unittest.TestCase):
         minPulseDuration = 0
         holdCount = 0
 
-        result = detectPulses(envelope, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
+        result = self.detectPulses(envelope, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
         self.assertEquals(result, [10.5, 18.0])
 
         holdCount = 1
-        result = detectPulses(envelope, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
+        result = self.detectPulses(envelope, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
         self.assertEquals(result, [10.5, 18.0])
 
     def testNoisySamplesScenario(self):
@@ -188,11 +286,151 @@ class Test_detectPulses(unittest.TestCase):
         #              IGNORE-              FIRST---     |noise|     SECOND----------              IGNORE
         sampleData = [ 1, 8, 8, 0, 0, 0, 3, 8, 8, 7, 4, 1, 10, 1, 0, 7, 9, 1, 7, 9, 8, 3, 0, 0, 0, 8, 9 ]
         
-        result = detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
+        result = self.detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount)
         self.assertEquals(result, [8.0, 17.5])
 
 
 
+class Test_detectPulsesVectorised(Test_detectPulses):
+    """\
+    Same tests as for :func:`detectPulses`, but for :func:`detectPulsesVectorised`, plus checks that both
+    always give the same results.
+    """
+
+    detectPulses = staticmethod(detectPulsesVectorised)
+
+    def testSameAsDetectPulses(self):
+        rand = random.Random(1)
+        for trial in range(0, 300):
+            length = rand.randint(0, 200)
+            sampleData = [ rand.choice([0, 1, 2, 3, 4, 5, 6, 7, 8, 9]) for i in range(0, length) ]
+            risingThreshold = rand.randint(0, 9)
+            fallingThreshold = rand.randint(0, 9)
+            minPulseDuration = rand.randint(0, 4)
+            holdCount = rand.randint(0, 6)
+            self.assertEquals(detectPulsesVectorised(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount), \
+                              detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount))
+
+    def testSelectable(self):
+        loSampleData = [ 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10 ]
+        hiSampleData = [ 10, 12, 80, 90, 85, 11, 10, 12, 10, 90, 95, 12, 10, 10 ]
+        for pulseDetector in [ detectPulses, detectPulsesVectorised ]:
+            self.assertEquals(detectFlashes(loSampleData, hiSampleData, 1, 1, pulseDetector), [3.0, 9.5])
+            self.assertEquals(detectBeeps(loSampleData, hiSampleData, 1, 1, pulseDetector), [3.0, 9.5])
+
+
+
+class Test_StreamingPulseDetector(unittest.TestCase):
+
+    def feedInBlocks(self, detector, loSampleData, hiSampleData, rand):
+        found = []
+        i = 0
+        while i < len(hiSampleData):
+            n = rand.randint(0, 20)
+            found.extend(detector.addSamples(loSampleData[i:i+n], hiSampleData[i:i+n]))
+            i += n
+        found.extend(detector.flush())
+        return found
+
+    def testFixedThresholdsSameAsDetectPulses(self):
+        """Feeding sample data in blocks of random sizes gives the same pulses as detecting in all the data at once"""
+        rand = random.Random(2)
+        for trial in range(0, 300):
+            length = rand.randint(0, 200)
+            sampleData = [ rand.choice([0, 1, 2, 3, 4, 5, 6, 7, 8, 9]) for i in range(0, length) ]
+            risingThreshold = rand.randint(0, 9)
+            fallingThreshold = rand.randint(0, 9)
+            minPulseDuration = rand.randint(0, 4)
+            holdCount = rand.randint(0, 6)
+            detector = StreamingPulseDetector(minPulseDuration, holdCount, risingThreshold=risingThreshold, fallingThreshold=fallingThreshold)
+            self.assertEquals(self.feedInBlocks(detector, sampleData, sampleData, rand), \
+                              detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount))
+
+    def testPulsesReportedWhenTheyEnd(self):
+        """Each pulse is reported in the block in which it ends (once the hold period has elapsed)"""
+        detector = StreamingPulseDetector(1, 1, risingThreshold=50, fallingThreshold=20)
+        self.assertEquals(detector.addSamples([0]*5, [ 10, 10, 80, 90, 85 ]), [])
+        self.assertEquals(detector.addSamples([0]*3, [ 11, 10, 90 ]), [3.0])
+        self.assertEquals(detector.addSamples([0]*3, [ 95, 12, 10 ]), [7.5])
+
+    def testWarmUpSameAsDetectFlashesAndBeeps(self):
+        """With thresholds estimated after a warm-up that includes the lowest and highest values, the results match detecting in the whole capture"""
+        rand = random.Random(3)
+        loSampleData = []
+        hiSampleData = []
+        for i in range(0, 2000):
+            if i % 100 < 15:
+                loSampleData.append(rand.randint(0, 10)); hiSampleData.append(rand.randint(200, 250))
+            else:
+                loSampleData.append(rand.randint(0, 10)); hiSampleData.append(rand.randint(10, 20))
+        # lowest and highest values (and envelope values) occur during the warm-up
+        loSampleData[5], hiSampleData[5] = 0, 250
+        loSampleData[50], hiSampleData[50] = 10, 10
+        for runningThresholds in [ True, False ]:
+            detector = StreamingPulseDetector(5, 3, isAudio=False, warmUpSamples=150, runningThresholds=runningThresholds)
+            self.assertEquals(self.feedInBlocks(detector, loSampleData, hiSampleData, rand), detectFlashes(loSampleData, hiSampleData, 5, 3))
+            detector = StreamingPulseDetector(5, 3, isAudio=True, warmUpSamples=150, runningThresholds=runningThresholds)
+            self.assertEquals(self.feedInBlocks(detector, loSampleData, hiSampleData, rand), detectBeeps(loSampleData, hiSampleData, 5, 3))
+
+    def testShortCaptureFlushed(self):
+        """If the capture is shorter than the warm-up, pulses are found when it is flushed"""
+        loSampleData = [ 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10, 10 ]
+        hiSampleData = [ 10, 12, 80, 90, 85, 11, 10, 12, 10, 90, 95, 12, 10, 10 ]
+        detector = StreamingPulseDetector(1, 1)
+        self.assertEquals(detector.addSamples(loSampleData, hiSampleData), [])
+        self.assertEquals(detector.flush(), [3.0, 9.5])
+        self.assertEquals(detector.flush(), [])
+
+    def testRunningThresholdsAdapt(self):
+        """Running thresholds adapt when a later flash is brighter than any seen during the warm-up"""
+        loSampleData = [ 10 ] * 60
+        hiSampleData = [ 10 ] * 60
+        for start, level in [ (10, 40), (30, 200), (45, 40) ]:
+            hiSampleData[start:start+5] = [ level ] * 5
+        detector = StreamingPulseDetector(1, 1, warmUpSamples=20, runningThresholds=True)
+        self.assertEquals(detector.addSamples(loSampleData[:20], hiSampleData[:20]), [12.0])
+        self.assertEquals(detector.addSamples(loSampleData[20:], hiSampleData[20:]), [32.0])
+        detector = StreamingPulseDetector(1, 1, warmUpSamples=20, runningThresholds=False)
+        self.assertEquals(detector.addSamples(loSampleData[:20], hiSampleData[:20]), [12.0])
+        self.assertEquals(detector.addSamples(loSampleData[20:], hiSampleData[20:]), [32.0, 47.0])
+
+
+
+class Test_DevicePulseDetector(unittest.TestCase):
+
+    def testSameAsDetectPulses(self):
+        """Detecting one sample at a time with whole number thresholds gives the same pulses as detectPulses"""
+        rand = random.Random(4)
+        for trial in range(0, 300):
+            length = rand.randint(0, 200)
+            sampleData = [ rand.randint(0, 255) for i in range(0, length) ]
+            risingThreshold = rand.uniform(0, 255)
+            fallingThreshold = rand.uniform(0, 255)
+            minPulseDuration = rand.randint(0, 4)
+            holdCount = rand.randint(0, 6)
+            rising, falling = deviceThresholds(risingThreshold, fallingThreshold)
+            detector = DevicePulseDetector(rising, falling, minPulseDuration, holdCount)
+            pulses = []
+            for v in sampleData:
+                pulse = detector.addSample(v)
+                if pulse is not None:
+                    pulses.append((pulse[0] + (pulse[1]-1)) / 2.0)
+            self.assertEquals(pulses, detectPulses(sampleData, risingThreshold, fallingThreshold, minPulseDuration, holdCount))
+
+    def testPulseStartAndEnd(self):
+        """Each pulse is reported as its first high sample, and the sample after its last high sample, once the hold period has elapsed"""
+        detector = DevicePulseDetector(50, 20, 1, 1)
+        self.assertEquals(detector.addSamples([ 10, 10, 80, 90, 85, 11 ]), [])
+        self.assertEquals(detector.addSamples([ 10, 90, 95, 12 ]), [ (2, 5) ])
+        self.assertEquals(detector.addSamples([ 10 ]), [ (7, 9) ])
+
+    def testDeviceThresholds(self):
+        """Thresholds are rounded outwards and clipped to the range of sample values"""
+        self.assertEquals(deviceThresholds(100.2, 50.8), (101, 50))
+        self.assertEquals(deviceThresholds(100.0, 50.0), (100, 50))
+        self.assertEquals(deviceThresholds(300.0, -5.0), (255, 0))
+
+
 class Test_timesForSamples(unittest.TestCase):
 
     def test_timesForSamples(self):
@@ -216,6 +454,30 @@ class Test_timesForSamples(unittest.TestCase):
             (1780, 7),
         ])
 
+    def test_timesForSamplesIndices(self):
+        """Only the requested sample boundaries are converted, in the order requested"""
+        converted = []
+        def acToStFunc(x):
+            converted.append(x)
+            return (x*10 + 1000, 7)
+        timesAndErrors=timesForSamples(10, acToStFunc, 58, 78, indices=[4, 5, 9, 0])
+        self.assertEquals(timesAndErrors, [ (1660, 7), (1680, 7), (1760, 7), (1580, 7) ])
+        self.assertEquals(converted, [ 66, 68, 76, 58 ])
+
+    def test_timesForSamplesConvertArray(self):
+        """A converter with a convertArray method converts all the sample boundaries in one call"""
+        class Converter(object):
+            def __init__(self):
+                self.calls = 0
+            def __call__(self, x):
+                raise AssertionError("Should not be called")
+            def convertArray(self, x):
+                self.calls += 1
+                return x*10 + 1000, x*0 + 7
+        converter = Converter()
+        self.assertEquals(timesForSamples(10, converter, 58, 78, indices=[ 3, 10 ]), [ (1640, 7), (1780, 7) ])
+        self.assertEquals(converter.calls, 1)
+
 
 
 class Test_ArduinoToSyncTimelineTime(unittest.TestCase):
@@ -263,6 +525,103 @@ class Test_ArduinoToSyncTimelineTime(unittest.TestCase):
         self.assertEquals(stTime, 50090)
         self.assertEquals(stErr, 90000*(144/1000000.0 + 0.5/1000.0) + 1)
 
+        stTimes, stErrs = ac2st.convertArray([ 101000000, 111000000 ])
+        self.assertEquals(list(stTimes), [ 50090, 50990 ])
+        self.assertEquals(list(stErrs), [ 90000*(144/1000000.0 + 0.5/1000.0) + 1 ] * 2)
+
+    def makePiecewiseConversion(self):
+        """\
+        Same scenario, but a control timestamp arrives part way through (at wall clock time 206,000,000)
+        and shifts the sync timeline, and the dispersion grows then is reset when the wall clock is adjusted
+        (at wall clock time 204,000,000).
+        """
+        convAcWc  = ConvertAtoB( (100000000, 200000000), (112000000, 212024000) )
+        calcAcErr = ErrorBoundInterpolator( (100000000, 144000), (112000000, 200000) )
+        convWcSt  = TimelineReconstructor( [ (200000000, (200000000, 50000, 1.0)),
+                                             (206000000, (206000000, 50545, 1.0)) ], 1000000000, 90000, False )
+        def wcDispCalc(wcNanos):
+            if wcNanos < 204000000:
+                return 500000 + (wcNanos - 200000000) * 0.01
+            else:
+                return 400000 + (wcNanos - 204000000) * 0.02
+        return ArduinoToSyncTimelineTime(convAcWc, calcAcErr, convWcSt, wcDispCalc, 90000.0)
+
+    def test_convertArrayVectorised(self):
+        """Converting an array using ConvertAtoB, ErrorBoundInterpolator and TimelineReconstructor gives exactly the same results as one at a time"""
+        ac2st = self.makePiecewiseConversion()
+        rand = random.Random(6)
+        acTimes = [ rand.uniform(100000000, 112000000) for i in range(0, 100) ]
+        stTimes, stErrs = ac2st.convertArray(acTimes)
+        self.assertEquals(zip(stTimes.tolist(), stErrs.tolist()), [ ac2st(acTime) for acTime in acTimes ])
+
+    def test_compile(self):
+        """A compiled conversion gives the same results, in one pass, for any times in its range"""
+        ac2st = self.makePiecewiseConversion()
+        compiled = ac2st.compile(101000000, 111000000, wcBreakpoints=[ 204000000 ])
+        self.assertEquals(len(compiled.breakpoints), 4)
+
+        rand = random.Random(5)
+        acTimes = [ 101000000, 111000000 ] + [ rand.uniform(101000000, 111000000) for i in range(0, 1000) ]
+        stTimes, stErrs = compiled.convertArray(acTimes)
+        for acTime, stTime, stErr in zip(acTimes, stTimes, stErrs):
+            expectedTime, expectedErr = ac2st(acTime)
+            self.assertAlmostEqual(stTime, expectedTime, delta=0.000001)
+            self.assertAlmostEqual(stErr, expectedErr, delta=0.000001)
+
+        stTime, stErr = compiled(106000000)
+        self.assertAlmostEqual(stTime, ac2st(106000000)[0], delta=0.000001)
+        self.assertRaises(ValueError, compiled.convertArray, [ 105000000, 100999999 ])
+
+    def test_compileMissingBreakpoint(self):
+        """Compiling fails if the conversion is not a straight line between the breakpoints"""
+        ac2st = self.makePiecewiseConversion()
+        self.assertRaises(ValueError, ac2st.compile, 101000000, 111000000)
+        self.assertRaises(ValueError, ac2st.compile, 111000000, 101000000)
+
+    def test_compileMissingBreakpointNearEnd(self):
+        """Compiling fails if a breakpoint is missing near one end of a segment, not just near its middle"""
+        ac2st = self.makePiecewiseConversion()
+        wcDispCalc = ac2st.wcDispCalc
+        def wcDispCalcWithKink(wcNanos):
+            return wcDispCalc(wcNanos) + max(0, 201500000 - wcNanos) * 0.1
+        ac2st.wcDispCalc = wcDispCalcWithKink
+        self.assertRaises(ValueError, ac2st.compile, 101000000, 111000000, wcBreakpoints=[ 204000000 ])
+        ac2st.compile(101000000, 111000000, wcBreakpoints=[ 201500000, 204000000 ])
+
+    def test_compileRealisticClocks(self):
+        """Compiling succeeds despite float rounding when the wall clock is nanos since the epoch and the sync timeline is 90kHz"""
+        acBase, wcBase = 1000000000000, 1424652124816656128
+        convAcWc  = ConvertAtoB( (acBase, wcBase), (acBase + 20000000000, wcBase + 20000400000) )
+        calcAcErr = ErrorBoundInterpolator( (acBase, 144000), (acBase + 20000000000, 200000) )
+        convWcSt  = TimelineReconstructor( [ (wcBase, (wcBase, 50000, 1.0)),
+                                             (wcBase + 7000000000, (wcBase + 7000000000, 680123, 1.0)) ], 1000000000, 90000, False )
+        wcDispCalc = lambda wcNanos : 500000 + (wcNanos - wcBase) * 0.00001
+        ac2st = ArduinoToSyncTimelineTime(convAcWc, calcAcErr, convWcSt, wcDispCalc, 90000.0)
+
+        rand = random.Random(7)
+        for i in range(0, 20):
+            acStart = acBase + rand.randint(1000000000, 3000000000)
+            acEnd = acStart + rand.randint(9000000000, 12000000000)
+            compiled = ac2st.compile(acStart, acEnd)
+            acTimes = [ rand.uniform(acStart, acEnd) for j in range(0, 100) ]
+            stTimes, stErrs = compiled.convertArray(acTimes)
+            for acTime, stTime, stErr in zip(acTimes, stTimes, stErrs):
+                # wall clock times this large are only representable to the nearest 256 nanos (0.023 ticks)
+                expectedTime, expectedErr = ac2st(acTime)
+                self.assertAlmostEqual(stTime, expectedTime, delta=0.1)
+                self.assertAlmostEqual(stErr, expectedErr, delta=0.1)
+
+        # a missing breakpoint is still noticed
+        ac2st.convWcSt = lambda wcNanos : convWcSt(wcNanos) if wcNanos < wcBase + 7000000000 else convWcSt(wcNanos) + 2
+        self.assertRaises(ValueError, ac2st.compile, acBase + 2000000000, acBase + 12000000000)
+
+    def test_compiledToAndFromDict(self):
+        """A compiled conversion can be saved as JSON and recreated"""
+        compiled = self.makePiecewiseConversion().compile(101000000, 111000000, wcBreakpoints=[ 204000000 ])
+        recreated = CompiledArduinoToSyncTimelineTime.fromDict(json.loads(json.dumps(compiled.toDict())))
+        acTimes = [ 101000000, 103500000, 106000000, 111000000 ]
+        self.assertEquals(map(list, recreated.convertArray(acTimes)), map(list, compiled.convertArray(acTimes)))
+
 
     def testValuesUsedWithinRangeOnly(self):
         convAcWc  = lambda aNanos : (aNanos - 100000000) * 1.002 + 200000000
@@ -316,16 +675,9 @@ class Test_BeepFlashTimingDetector(unittest.TestCase):
     We assume arduino clock precision of 4 us
     """
 
-    def test_beeps(self):
+    def makeDetector(self):
         US = 1000   # number of nanoseconds in one microsecond
-    
-        #                            ----pulse----
-        loSamples = [ 130, 128, 116,  83,  76,  72, 124, 129, 125, 128 ]
-        hiSamples = [ 130, 135, 146, 175, 176, 170, 134, 129, 130, 128 ]
-        #            |                      |                         |
-        # index      0                     4.5                        10
-        # stTime   50090                  50495                      50990
-        
+
         wcAcReqResp = {
             "pre" : (
                 200000000 - 144*US, # t1 <wcNanos>,
@@ -352,7 +704,21 @@ class Test_BeepFlashTimingDetector(unittest.TestCase):
         wcPrecisionNanos = 1 * US
         acPrecisionNanos = 4 * US
         
-        detector = BeepFlashDetector(wcAcReqResp, syncTimelineTickRate, wcSyncTimeCorrelations, wcDispersions, wcPrecisionNanos, acPrecisionNanos)
+        return BeepFlashDetector(wcAcReqResp, syncTimelineTickRate, wcSyncTimeCorrelations, wcDispersions, wcPrecisionNanos, acPrecisionNanos)
+
+    def test_beeps(self):
+        US = 1000   # number of nanoseconds in one microsecond
+        wcPrecisionNanos = 1 * US
+        acPrecisionNanos = 4 * US
+
+        #                            ----pulse----
+        loSamples = [ 130, 128, 116,  83,  76,  72, 124, 129, 125, 128 ]
+        hiSamples = [ 130, 135, 146, 175, 176, 170, 134, 129, 130, 128 ]
+        #            |                      |                         |
+        # index      0                     4.5                        10
+        # stTime   50090                  50495                      50990
+
+        detector = self.makeDetector()
 
         acStartNanos = 101000000
         acEndNanos   = 111000000
@@ -367,6 +733,26 @@ class Test_BeepFlashTimingDetector(unittest.TestCase):
         
         # check if error is equal to 1 pts tick + wcPrecision + acPrecision + acWcHalfRoundTrip + wcDispersion
         self.assertEquals(error, 1+(wcPrecisionNanos+acPrecisionNanos+144*US+0.5*1000000+0.5*1000000)*90000/1000000000)
+
+    def test_pulseEvents(self):
+        """Pulses detected by the Arduino give the same timings as detecting them in the sample data"""
+        loSamples = [ 10, 10, 10,  10,  10,  10,  10, 10, 10, 10 ]
+        hiSamples = [ 12, 10, 11, 200, 210, 205, 200, 11, 12, 10 ]
+        acStartNanos = 101000000
+        acEndNanos   = 111000000
+
+        detector = self.makeDetector()
+        flashTimings = detector.samplesToFlashTimings(loSamples, hiSamples, acStartNanos, acEndNanos, 0.004)
+        self.assertEquals(len(flashTimings), 1)
+
+        # the flash covers samples 3 to 6
+        pulseEvents = [ (acStartNanos + 3000000, acStartNanos + 7000000) ]
+        eventTimings = self.makeDetector().pulseEventsToTimings(pulseEvents)
+        self.assertEquals(len(eventTimings), 1)
+        self.assertAlmostEqual(eventTimings[0][0], flashTimings[0][0], delta=0.0001)
+        self.assertAlmostEqual(eventTimings[0][1], flashTimings[0][1], delta=0.0001)
+
+        self.assertEquals(detector.pulseEventsToTimings([]), [])
         
 
 
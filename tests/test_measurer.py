@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+#
+# Copyright 2015 British Broadcasting Corporation
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Unit-tests for separating Arduino sample data into channels
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
+
+
+import functools
+import io
+import json
+import mmap
+import struct
+
+import arduino
+import capturestore
+from measurer import repackageSamples
+from measurer import SampleChannel
+from measurer import measurerForRecordedCapture
+from measurer import makeWindowIndices
+from measurer import pipelinedCaptures
+from dispersion import dispersionAtFromHistory
+from test_capturestore import makeCaptureRecord
+from test_capturestore import makePulseEventRecord
+
+
+import unittest
+
+
+class Mock_Clock(object):
+
+    def __init__(self):
+        self._ticks = 0
+
+    @property
+    def ticks(self):
+        self._ticks += 1
+        return self._ticks
+
+
+class Mock_Arduino(io.RawIOBase):
+    """\
+    Pretends to be the serial connection to an Arduino, that replies to a bulk transfer command
+    with the time, the number of bytes of sample data, then the sample data (in small pieces).
+    """
+
+    def __init__(self, samples, numBytes=None):
+        super(Mock_Arduino, self).__init__()
+        if numBytes is None:
+            numBytes = len(samples)
+        self.reply = io.BytesIO(struct.pack(">II", 1234, numBytes) + samples)
+
+    def readable(self):
+        return True
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, n):
+        return self.reply.read(n)
+
+    def readinto(self, b):
+        return self.reply.readinto(memoryview(b)[:3])
+
+
+pinMap = { "LIGHT_0": 0, "AUDIO_0": 1, "LIGHT_1": 2, "AUDIO_1": 3 }
+
+
+class Test_repackageSamples(unittest.TestCase):
+
+    def testTwoPins(self):
+        #                    | block 0       | block 1       | block 2       |
+        #                    | L0 hi, lo     | A1 hi, lo     | ...
+        samples = bytearray([ 10, 1, 20, 2,   11, 3, 21, 4,   12, 5, 22, 6 ])
+        channels = repackageSamples(["AUDIO_1", "LIGHT_0"], pinMap, 3, samples)
+
+        self.assertEquals(channels[1], None)
+        self.assertEquals(channels[2], None)
+        self.assertEquals(channels[0].pinName, "LIGHT_0")
+        self.assertEquals(channels[0].isAudio, False)
+        self.assertEquals(list(channels[0].max), [10, 11, 12])
+        self.assertEquals(list(channels[0].min), [1, 3, 5])
+        self.assertEquals(channels[3].pinName, "AUDIO_1")
+        self.assertEquals(channels[3].isAudio, True)
+        self.assertEquals(list(channels[3]["max"]), [20, 21, 22])
+        self.assertEquals(list(channels[3]["min"]), [2, 4, 6])
+
+    def testViewsNotCopies(self):
+        """The channel data are views onto the sample data buffer"""
+        samples = bytearray([ 10, 1, 11, 3, 12, 5 ])
+        channels = repackageSamples(["LIGHT_1"], pinMap, 3, samples)
+        samples[2] = 99
+        self.assertEquals(list(channels[2].max), [10, 99, 12])
+
+    def testFromString(self):
+        channels = repackageSamples(["LIGHT_0"], pinMap, 2, "\x0a\x01\x0b\x02")
+        self.assertEquals(list(channels[0].max), [10, 11])
+        self.assertEquals(list(channels[0].min), [1, 2])
+
+
+class Test_SampleChannel(unittest.TestCase):
+
+    def testIndexing(self):
+        channel = SampleChannel("AUDIO_0", True, [1, 2], [3, 4])
+        self.assertEquals(channel["pinName"], "AUDIO_0")
+        self.assertEquals(channel["eventDuration"], None)
+        channel["eventDuration"] = 0.02
+        self.assertEquals(channel.eventDuration, 0.02)
+        self.assertRaises(KeyError, channel.__getitem__, "wibble")
+        self.assertRaises(AttributeError, setattr, channel, "wibble", 1)
+
+    def testToDict(self):
+        samples = bytearray([ 10, 1, 11, 3 ])
+        channel = repackageSamples(["LIGHT_0"], pinMap, 2, samples)[0]
+        self.assertEquals(channel.toDict(), { "pinName": "LIGHT_0", "isAudio": False, "min": [1, 3], "max": [10, 11], "eventDuration": None })
+
+    def testToDictPulseEvents(self):
+        """A channel of flashes or beeps detected by the Arduino has no sample data"""
+        channel = SampleChannel("AUDIO_1", True, None, None, pulseEvents=[ (1000000, 21000000) ])
+        self.assertEquals(channel["pulseEvents"], [ (1000000, 21000000) ])
+        self.assertEquals(channel.toDict(), { "pinName": "AUDIO_1", "isAudio": True, "eventDuration": None, "pulseEvents": [ (1000000, 21000000) ] })
+
+
+class Test_bulkTransferInto(unittest.TestCase):
+
+    def testReadInto(self):
+        samples = "".join(chr(i) for i in range(0, 20))
+        buffer, numBytes, timeData = arduino.bulkTransferInto(Mock_Arduino(samples), Mock_Clock())
+        self.assertEquals(numBytes, 20)
+        self.assertEquals(str(buffer[:numBytes]), samples)
+        self.assertEquals(timeData, [1, 1234000, 1234000, 2])
+
+    def testReuseBuffer(self):
+        samples = "".join(chr(i) for i in range(0, 20))
+        buffer = bytearray(100)
+        result, numBytes, timeData = arduino.bulkTransferInto(Mock_Arduino(samples), Mock_Clock(), buffer)
+        self.assertTrue(result is buffer)
+        self.assertEquals(str(buffer[:numBytes]), samples)
+
+    def testIncomplete(self):
+        self.assertRaises(IOError, arduino.bulkTransferInto, Mock_Arduino("\x00" * 10, 20), Mock_Clock())
+
+
+class Test_makeWindowIndices(unittest.TestCase):
+
+    def setUp(self):
+        bits = [ int(b) for b in "1001011001111100011011101010000" ]   # 5 bit MLS
+        bits.append(1)
+        self.times = []
+        for n in range(0, len(bits)):
+            self.times.append(n + 0.14)
+            if bits[n]:
+                self.times.append(n + 0.38)
+
+    def testPatternWindowLength(self):
+        """The window length from the metadata is used when given, otherwise the shortest unique one"""
+        indices = makeWindowIndices({ "LIGHT_0": self.times, "AUDIO_0": self.times }, { "LIGHT_0": 6 })
+        self.assertEquals(indices["LIGHT_0"].windowLength, 6)
+        self.assertEquals(indices["AUDIO_0"].windowLength, 5)
+
+    def testUnsuitableWindowLength(self):
+        """A pin whose windows of the given length are not unique has no index"""
+        self.assertEquals(makeWindowIndices({ "LIGHT_0": self.times }, { "LIGHT_0": 2 }), {})
+
+
+class Test_RecordedCaptureSource(unittest.TestCase):
+
+    def testReplay(self):
+        """A recorded capture is detected and compared in the same way as when it was captured"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        measurer = measurerForRecordedCapture(record)
+        measurer.capture()
+
+        self.assertEquals(list(measurer.channels[0].max), record["channels"][0]["max"])
+        self.assertEquals(measurer.channels[1:], [None, None, None])
+        self.assertEquals(measurer.wcSyncTimeCorrelations, [ (0, (0, 0, 1.0)) ])
+
+        measurer.detectBeepsAndFlashes(lambda wcTime : dispersionAtFromHistory(record["dispersionHistory"], wcTime))
+        channel = measurer.getComparisonChannels()[0]
+        index, expected, timeDifferencesAndErrors, drift = measurer.doComparison(channel, withDrift=True)
+        self.assertEquals(measurer.doComparison(channel, detrend=True)[0], index)
+
+        result = capturestore.analyseCapture(record)[0]
+        self.assertEquals(index, result["matchIndex"])
+        self.assertEquals(len(timeDifferencesAndErrors), result["numObserved"])
+        self.assertAlmostEqual(sum(d for d, e in timeDifferencesAndErrors) / len(timeDifferencesAndErrors), result["stats"]["meanOffset"], delta=0.000001)
+
+    def testRecordAgain(self):
+        """A replayed capture gives the same capture record as the original"""
+        record = json.loads(json.dumps(makeCaptureRecord()))
+        measurer = measurerForRecordedCapture(record)
+        measurer.capture()
+        replayed = json.loads(json.dumps(measurer.getCaptureRecord(record["dispersionHistory"])))
+        self.assertEquals(replayed.pop("compiledConversion"), json.loads(json.dumps(capturestore.compileConversion(record).toDict())))
+        self.assertEquals(replayed, record)
+
+    def testReleaseSamples(self):
+        """Memory mapped sample data is closed when released, and when the next capture is taken"""
+        record = makeCaptureRecord()
+        measurer = measurerForRecordedCapture(record)
+        measurer.capture()
+        measurer.samples = mmap.mmap(-1, 16)
+        mapping = measurer.samples
+        measurer.capture()
+        self.assertRaises(ValueError, mapping.read, 1)
+
+        mapping = measurer.samples = mmap.mmap(-1, 16)
+        measurer.releaseSamples()
+        self.assertRaises(ValueError, mapping.read, 1)
+        self.assertEquals((measurer.samples, measurer.channels), (None, None))
+
+    def testReplayPulseEvents(self):
+        """A recorded capture of flashes detected by the Arduino is replayed, and gives the same capture record"""
+        record = json.loads(json.dumps(makePulseEventRecord(offsetSecs=0.005)))
+        measurer = measurerForRecordedCapture(record)
+        measurer.capture()
+        self.assertEquals(measurer.nMilliBlocks, 0)
+        replayed = json.loads(json.dumps(measurer.getCaptureRecord(record["dispersionHistory"])))
+        self.assertEquals(replayed.pop("compiledConversion"), json.loads(json.dumps(capturestore.compileConversion(record).toDict())))
+        self.assertEquals(replayed, record)
+
+        measurer.detectBeepsAndFlashes(lambda wcTime : dispersionAtFromHistory(record["dispersionHistory"], wcTime))
+        channel = measurer.getComparisonChannels()[0]
+        self.assertEquals(len(channel["observed"]), 12)
+        self.assertEquals(measurer.doComparison(channel)[0], capturestore.analyseCapture(record)[0]["matchIndex"])
+
+
+class Test_pipelinedCaptures(unittest.TestCase):
+
+    def testResultsInOrder(self):
+        """Every capture is analysed, and the results are yielded in the order the captures were taken"""
+        record = makeCaptureRecord(offsetSecs=0.005)
+        measurer = measurerForRecordedCapture(record)
+        captured = []
+        analyseFunc = functools.partial(capturestore.analyseCapture, toleranceSecs=0.002)
+
+        results = list(pipelinedCaptures(measurer, 3, lambda : record["dispersionHistory"], analyseFunc, \
+                                         onCapture=lambda index, record : captured.append(index)))
+
+        self.assertEquals(captured, [0, 1, 2])
+        self.assertEquals([ index for index, record, result in results ], [0, 1, 2])
+        expected = capturestore.analyseCapture(record, toleranceSecs=0.002)
+        for index, capturedRecord, result in results:
+            self.assertEquals(result, expected)
+            self.assertEquals(list(capturedRecord["channels"][0]["min"]), record["channels"][0]["min"])
+
+    def testWorkerProcess(self):
+        """Captures can be analysed in a worker process"""
+        record = makeCaptureRecord()
+        measurer = measurerForRecordedCapture(record)
+        results = list(pipelinedCaptures(measurer, 2, lambda : record["dispersionHistory"], capturestore.analyseCapture, useProcess=True))
+        self.assertEquals([ result for index, capturedRecord, result in results ], [ capturestore.analyseCapture(record) ] * 2)
+
+    def testCheckCapture(self):
+        """A capture that fails the check is not analysed, but is still yielded in order"""
+        record = makeCaptureRecord()
+        measurer = measurerForRecordedCapture(record)
+        checks = iter([True, False, True])
+        analysed = []
+        def analyseFunc(record):
+            analysed.append(record)
+            return "results"
+
+        results = list(pipelinedCaptures(measurer, 3, lambda : record["dispersionHistory"], analyseFunc, checkCapture=lambda : next(checks)))
+        self.assertEquals([ (index, result) for index, capturedRecord, result in results ], [ (0, "results"), (1, None), (2, "results") ])
+        self.assertEquals(len(analysed), 2)
+
+    def testAnalysisFails(self):
+        """An exception raised when analysing a capture is raised again when its results would have been yielded"""
+        record = makeCaptureRecord()
+        measurer = measurerForRecordedCapture(record)
+        def analyseFunc(record):
+            raise ValueError("analysis failed")
+        captures = pipelinedCaptures(measurer, 2, lambda : record["dispersionHistory"], analyseFunc)
+        self.assertRaises(ValueError, list, captures)
+
+
+if __name__ == "__main__":
+    unittest.main()
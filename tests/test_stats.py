@@ -23,11 +23,13 @@ import unittest
 
 import sys
 import os
+import StringIO
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+"/../src")
 
 
 from stats import determineWithinTolerance
 from stats import gapBetweenRanges
+from stats import calcAndPrintStats
 
 
 class Test_determineWithinTolerance(unittest.TestCase):
@@ -71,7 +73,32 @@ class Test_gapBetweenRanges(unittest.TestCase):
         self.assertEquals(-5, gapBetweenRanges((0,10),(15,25)))
         self.assertEquals( 0, gapBetweenRanges((0,10),(9,20)))
         self.assertEquals( 2, gapBetweenRanges((20,30),(10,18)))
-        
+
+
+class Test_calcAndPrintStats(unittest.TestCase):
+
+    def printed(self, *args):
+        saved = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            calcAndPrintStats(*args)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved
+
+    def test_numberingAfterMissedEvent(self):
+        """Observations outside tolerance are numbered by the observation and expected time they were paired with"""
+        allExpectedTimes = [ 1.0, 2.0, 3.0, 4.0, 5.0, 6.0 ]
+        # the event expected at 3.0 was missed, so the third diff is for observation 3 against 4.0
+        diffsAndErrors = [ (0.0, 0.001), (0.0, 0.001), (0.5, 0.001), (0.0, 0.001) ]
+
+        output = self.printed(0, allExpectedTimes, diffsAndErrors, 0.01, [0, 1, 3, 4], [0, 1, 2, 3])
+        self.assertTrue("Observation 3 (expected at 4.000 seconds) was outside" in output)
+
+        # without the paired indices, they are assumed to be consecutive
+        output = self.printed(0, allExpectedTimes, diffsAndErrors, 0.01)
+        self.assertTrue("Observation 3 (expected at 3.000 seconds) was outside" in output)
+
 
 if __name__ == "__main__":
 